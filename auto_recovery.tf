@@ -254,7 +254,7 @@ resource "aws_cloudwatch_dashboard" "pmm_monitoring" {
   dashboard_name = "${local.service_name_uid}-monitoring"
 
   dashboard_body = jsonencode({
-    widgets = [
+    widgets = concat([
       {
         type = "metric"
         properties = {
@@ -313,6 +313,23 @@ resource "aws_cloudwatch_dashboard" "pmm_monitoring" {
           view   = "timeSeries"
         }
       }
-    ]
+    ], var.enable_self_monitoring ? [
+      {
+        type = "metric"
+        properties = {
+          title = "PMM Ingest Load"
+          metrics = [
+            [local.self_monitoring_namespace, "IngestionRate", "InstanceId", aws_instance.pmm_server.id, { stat = "Average", label = "Samples/s" }],
+            [".", "ActiveSeries", ".", ".", { stat = "Average", label = "Active Series", yAxis = "right" }],
+            [".", "ScrapeDurationMax", ".", ".", { stat = "Maximum", label = "Slowest Scrape (s)" }],
+            [".", "QANInsertLag", ".", ".", { stat = "Maximum", label = "QAN Lag (s)" }]
+          ]
+          period = 300
+          stat   = "Average"
+          region = data.aws_region.current.name
+          view   = "timeSeries"
+        }
+      }
+    ] : [])
   })
 }
\ No newline at end of file
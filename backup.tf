@@ -16,27 +16,34 @@ resource "aws_backup_vault" "pmm" {
   )
 }
 
-# Backup plan with daily schedule
+# Backup plan with daily schedule.
+# With backup_quiesce the PMM instance takes the daily snapshot itself
+# (scripts/pmm_consistent_snapshot.py), so the plan keeps only the weekly
+# rule, and is not created at all without one.
 resource "aws_backup_plan" "pmm" {
-  name = "${local.service_name_uid}-backup-plan"
+  count = local.backup_plan_enabled ? 1 : 0
+  name  = "${local.service_name_uid}-backup-plan"
 
-  rule {
-    rule_name         = "daily_backup"
-    target_vault_name = aws_backup_vault.pmm.name
-    schedule          = var.backup_schedule # Default: "cron(0 5 ? * * *)" - Daily at 5 AM UTC
-    start_window      = 60                  # 60 minutes to start backup
-    completion_window = 120                 # 120 minutes to complete backup
-
-    lifecycle {
-      delete_after = var.backup_retention_days
-    }
+  dynamic "rule" {
+    for_each = var.backup_quiesce.enabled ? [] : [1]
+    content {
+      rule_name         = "daily_backup"
+      target_vault_name = aws_backup_vault.pmm.name
+      schedule          = var.backup_schedule # Default: "cron(0 5 ? * * *)" - Daily at 5 AM UTC
+      start_window      = 60                  # 60 minutes to start backup
+      completion_window = 120                 # 120 minutes to complete backup
 
-    recovery_point_tags = merge(
-      local.common_tags,
-      {
-        Type = "daily-backup"
+      lifecycle {
+        delete_after = var.backup_retention_days
       }
-    )
+
+      recovery_point_tags = merge(
+        local.common_tags,
+        {
+          Type = "daily-backup"
+        }
+      )
+    }
   }
 
   # Optional: Add weekly backup for longer retention
@@ -104,8 +111,9 @@ resource "aws_iam_role_policy_attachment" "backup_restore" {
 
 # Backup selection - which resources to backup
 resource "aws_backup_selection" "pmm" {
+  count        = local.backup_plan_enabled ? 1 : 0
   name         = "${local.service_name_uid}-backup-selection"
-  plan_id      = aws_backup_plan.pmm.id
+  plan_id      = aws_backup_plan.pmm[0].id
   iam_role_arn = aws_iam_role.backup.arn
 
   resources = [
@@ -123,6 +131,16 @@ resource "aws_backup_selection" "pmm" {
   }
 }
 
+moved {
+  from = aws_backup_plan.pmm
+  to   = aws_backup_plan.pmm[0]
+}
+
+moved {
+  from = aws_backup_selection.pmm
+  to   = aws_backup_selection.pmm[0]
+}
+
 # CloudWatch alarm for backup failures
 resource "aws_cloudwatch_metric_alarm" "backup_failed" {
   count = var.enable_backup_alarms ? 1 : 0
@@ -150,4 +168,36 @@ resource "aws_cloudwatch_metric_alarm" "backup_failed" {
       Type = "backup-monitoring"
     }
   )
+}
+
+# CloudWatch alarm for failed or missing consistent snapshots. The snapshot
+# runs on the instance, outside AWS Backup, so backup_failed does not see it.
+# The timer runs daily; 26 hours leave room for a late run.
+resource "aws_cloudwatch_metric_alarm" "backup_quiesce_failed" {
+  count = var.backup_quiesce.enabled && var.enable_backup_alarms ? 1 : 0
+
+  alarm_name          = "${local.service_name_uid}-backup-quiesce-failed"
+  alarm_description   = "Alert when the consistent PMM snapshot fails or does not run"
+  namespace           = "PMM/Backup"
+  metric_name         = "QuiesceSnapshotSuccess"
+  statistic           = "Minimum"
+  period              = 26 * 3600
+  evaluation_periods  = 1
+  threshold           = 1
+  comparison_operator = "LessThanThreshold"
+  treat_missing_data  = "breaching"
+
+  dimensions = {
+    VolumeId = aws_ebs_volume.pmm_data.id
+  }
+
+  alarm_actions = local.all_alarm_targets
+
+  tags = merge(
+    local.common_tags,
+    {
+      Name = "${local.service_name}-backup-quiesce-alarm"
+      Type = "backup-monitoring"
+    }
+  )
 }
\ No newline at end of file
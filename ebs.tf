@@ -88,6 +88,101 @@ resource "aws_cloudwatch_metric_alarm" "ebs_high_iops" {
   tags = local.common_tags
 }
 
+# PMM self-monitoring alarms (metrics published by scripts/pmm_self_monitor.py).
+# Unlike the EBS alarms above, these fire before the volume or instance is
+# saturated, while PMM is still ingesting everything.
+resource "aws_cloudwatch_metric_alarm" "pmm_ingestion_rate" {
+  count = var.enable_self_monitoring ? 1 : 0
+
+  alarm_name          = "${local.service_name_uid}-ingestion-rate"
+  alarm_description   = "Alert when PMM ingests samples close to the instance's capacity (consider a larger instance_type)"
+  namespace           = local.self_monitoring_namespace
+  metric_name         = "IngestionRate"
+  statistic           = "Average"
+  period              = 300
+  evaluation_periods  = 3
+  threshold           = var.self_monitoring_thresholds.ingestion_rate
+  comparison_operator = "GreaterThanThreshold"
+  treat_missing_data  = "notBreaching"
+
+  dimensions = {
+    InstanceId = aws_instance.pmm_server.id
+  }
+
+  alarm_actions = local.all_alarm_targets
+
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_metric_alarm" "pmm_active_series" {
+  count = var.enable_self_monitoring ? 1 : 0
+
+  alarm_name          = "${local.service_name_uid}-active-series"
+  alarm_description   = "Alert when the number of active time series in PMM is high (consider a larger instance_type)"
+  namespace           = local.self_monitoring_namespace
+  metric_name         = "ActiveSeries"
+  statistic           = "Average"
+  period              = 300
+  evaluation_periods  = 3
+  threshold           = var.self_monitoring_thresholds.active_series
+  comparison_operator = "GreaterThanThreshold"
+  treat_missing_data  = "notBreaching"
+
+  dimensions = {
+    InstanceId = aws_instance.pmm_server.id
+  }
+
+  alarm_actions = local.all_alarm_targets
+
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_metric_alarm" "pmm_scrape_duration" {
+  count = var.enable_self_monitoring ? 1 : 0
+
+  alarm_name          = "${local.service_name_uid}-scrape-duration"
+  alarm_description   = "Alert when exporter scrapes take too long (PMM or the monitored hosts are overloaded)"
+  namespace           = local.self_monitoring_namespace
+  metric_name         = "ScrapeDurationMax"
+  statistic           = "Average"
+  period              = 300
+  evaluation_periods  = 3
+  threshold           = var.self_monitoring_thresholds.scrape_duration_seconds
+  comparison_operator = "GreaterThanThreshold"
+  treat_missing_data  = "notBreaching"
+
+  dimensions = {
+    InstanceId = aws_instance.pmm_server.id
+  }
+
+  alarm_actions = local.all_alarm_targets
+
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_metric_alarm" "pmm_qan_insert_lag" {
+  count = var.enable_self_monitoring ? 1 : 0
+
+  alarm_name          = "${local.service_name_uid}-qan-insert-lag"
+  alarm_description   = "Alert when Query Analytics data falls behind (ClickHouse cannot keep up)"
+  namespace           = local.self_monitoring_namespace
+  metric_name         = "QANInsertLag"
+  statistic           = "Average"
+  period              = 300
+  evaluation_periods  = 3
+  threshold           = var.self_monitoring_thresholds.qan_insert_lag_seconds
+  comparison_operator = "GreaterThanThreshold"
+  treat_missing_data  = "notBreaching"
+
+  dimensions = {
+    InstanceId = aws_instance.pmm_server.id
+  }
+
+  alarm_actions = local.all_alarm_targets
+
+  tags = local.common_tags
+}
+
 # EBS snapshot for initial backup (optional)
 resource "aws_ebs_snapshot" "pmm_data_initial" {
   count = var.create_initial_snapshot ? 1 : 0
@@ -1,9 +1,13 @@
 # Lambda-based ASG-to-PMM reconciler
 # Periodically syncs ASG membership with PMM monitored services.
-# Only created when var.monitored_asgs is non-empty.
+# Only created when var.monitored_asgs or var.monitored_rds is non-empty.
 
 locals {
-  create_reconciler = length(var.monitored_asgs) > 0
+  create_reconciler = length(var.monitored_asgs) > 0 || length(var.monitored_rds) > 0
+  create_upgrade    = local.create_reconciler && var.pmm_client_rolling_upgrade
+  create_inventory  = local.create_reconciler && var.reconciler_inventory_snapshots.enabled
+  create_gc         = local.create_reconciler && var.reconciler_gc.enabled
+  create_history    = local.create_reconciler && var.reconciler_history.enabled
 }
 
 module "pmm_reconciler" {
@@ -22,7 +26,22 @@ module "pmm_reconciler" {
     PMM_HOST              = aws_instance.pmm_server.private_ip
     PMM_ADMIN_SECRET_ARN  = module.admin_password_secret.secret_arn
     MONITORED_ASGS_CONFIG = jsonencode(var.monitored_asgs)
+    MONITORED_RDS_CONFIG  = jsonencode(var.monitored_rds)
     PMM_AWS_REGION        = data.aws_region.current.name
+
+    PMM_CLIENT_UPGRADE_ENABLED         = tostring(local.create_upgrade)
+    PMM_CLIENT_TARGET_VERSION          = var.pmm_client_target_version != null ? var.pmm_client_target_version : ""
+    PMM_CLIENT_UPGRADE_BATCH_SIZE      = tostring(var.pmm_client_upgrade_batch_size)
+    PMM_CLIENT_UPGRADE_MAX_UNAVAILABLE = tostring(var.pmm_client_upgrade_max_unavailable)
+    UPGRADE_STATE_PARAMETER            = local.create_upgrade ? aws_ssm_parameter.reconciler_upgrade_state[0].name : ""
+    INVENTORY_BUCKET                   = local.create_inventory ? module.inventory_snapshots_bucket[0].bucket_name : ""
+    GC_ENABLED                         = tostring(local.create_gc)
+    GC_STATE_PARAMETER                 = local.create_gc ? aws_ssm_parameter.reconciler_gc_state[0].name : ""
+    GC_MIN_AGE_SECONDS                 = tostring(var.reconciler_gc.min_age_minutes * 60)
+    GC_MAX_DELETIONS                   = tostring(var.reconciler_gc.max_deletions)
+    HISTORY_BUCKET                     = local.create_history ? module.reconciler_history_bucket[0].bucket_name : ""
+    SETUP_DOCUMENT                     = length(var.monitored_asgs) > 0 ? aws_ssm_document.pmm_setup[0].name : ""
+    SETUP_DOCUMENT_VERSION             = length(var.monitored_asgs) > 0 ? aws_ssm_document.pmm_setup[0].latest_version : ""
   }
 
   lambda_subnet_ids         = var.private_subnet_ids
@@ -36,6 +55,87 @@ module "pmm_reconciler" {
   tags = local.common_tags
 }
 
+# pmm-client setup script, stored once as a versioned SSM document. The
+# reconciler runs it by reference with a small per-instance config instead
+# of shipping the script inline in every SendCommand.
+resource "aws_ssm_document" "pmm_setup" {
+  count = length(var.monitored_asgs) > 0 ? 1 : 0
+
+  name            = "${local.service_name_uid}-pmm-client-setup"
+  document_type   = "Command"
+  document_format = "JSON"
+  content = jsonencode({
+    schemaVersion = "2.2"
+    description   = "Install pmm-client and add MySQL monitoring (lambda/pmm_reconciler/pmm_setup.sh)"
+    parameters = {
+      config = {
+        type           = "String"
+        description    = "Base64-encoded JSON settings of the instances"
+        allowedPattern = "^[A-Za-z0-9+/=]+$"
+      }
+      executionTimeout = {
+        type           = "String"
+        description    = "Seconds the script may run"
+        default        = "300"
+        allowedPattern = "^[0-9]{1,5}$"
+      }
+    }
+    mainSteps = [
+      {
+        action = "aws:runShellScript"
+        name   = "setup"
+        inputs = {
+          timeoutSeconds = "{{ executionTimeout }}"
+          runCommand = concat(
+            ["umask 077", "cat > /tmp/pmm-setup.sh <<'PMM_SETUP_EOF'"],
+            split("\n", chomp(file("${path.module}/lambda/pmm_reconciler/pmm_setup.sh"))),
+            [
+              "PMM_SETUP_EOF",
+              "PMM_SETUP_CONFIG='{{ config }}' bash /tmp/pmm-setup.sh; rc=$?; rm -f /tmp/pmm-setup.sh; exit $rc",
+            ],
+          )
+        }
+      }
+    ]
+  })
+
+  tags = local.common_tags
+}
+
+# Rolling pmm-client upgrade progress, shared between reconciler runs.
+# The Lambda owns the value; Terraform only creates the parameter.
+resource "aws_ssm_parameter" "reconciler_upgrade_state" {
+  count = local.create_upgrade ? 1 : 0
+
+  name        = "/${local.service_name_uid}/reconciler/upgrade-state"
+  description = "Rolling pmm-client upgrade progress of the PMM ASG reconciler"
+  type        = "SecureString"
+  value       = "{}"
+
+  tags = local.common_tags
+
+  lifecycle {
+    ignore_changes = [value]
+  }
+}
+
+# When orphaned PMM nodes were first seen, shared between reconciler runs.
+# The Lambda owns the value; Terraform only creates the parameter.
+resource "aws_ssm_parameter" "reconciler_gc_state" {
+  count = local.create_gc ? 1 : 0
+
+  name        = "/${local.service_name_uid}/reconciler/gc-state"
+  description = "Orphaned PMM nodes found by the PMM ASG reconciler"
+  type        = "String"
+  value       = "{}"
+
+  tags = local.common_tags
+
+  lifecycle {
+    ignore_changes = [value]
+  }
+}
+
 # Security group for Lambda reconciler
 resource "aws_security_group" "reconciler_lambda" {
   count = local.create_reconciler ? 1 : 0
@@ -139,31 +239,157 @@ data "aws_iam_policy_document" "reconciler" {
     ]
   }
 
-  statement {
-    effect = "Allow"
-    actions = [
-      "ssm:SendCommand",
-    ]
-    resources = [
-      "arn:aws:ec2:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:instance/*",
-    ]
-    condition {
-      test     = "StringEquals"
-      variable = "ssm:resourceTag/aws:autoscaling:groupName"
-      values   = [for asg in var.monitored_asgs : asg.asg_name]
+  dynamic "statement" {
+    for_each = length(var.monitored_asgs) > 0 ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "ssm:SendCommand",
+      ]
+      resources = [
+        "arn:aws:ec2:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:instance/*",
+      ]
+      condition {
+        test     = "StringEquals"
+        variable = "ssm:resourceTag/aws:autoscaling:groupName"
+        values   = [for asg in var.monitored_asgs : asg.asg_name]
+      }
     }
   }
 
-  # ssm:GetCommandInvocation does not support resource-level permissions.
-  # AWS requires resource = "*". See:
+  dynamic "statement" {
+    for_each = length(var.monitored_asgs) > 0 ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "ssm:SendCommand",
+      ]
+      resources = [
+        aws_ssm_document.pmm_setup[0].arn,
+      ]
+    }
+  }
+
+  # ssm:GetCommandInvocation and ssm:ListCommandInvocations do not support
+  # resource-level permissions. AWS requires resource = "*". See:
   # https://docs.aws.amazon.com/service-authorization/latest/reference/list_awssystemsmanager.html
   statement {
     effect = "Allow"
     actions = [
       "ssm:GetCommandInvocation",
+      "ssm:ListCommandInvocations",
     ]
     resources = ["*"]
   }
+
+  # RDS discovery: DescribeDBInstances returns the tags of every instance.
+  dynamic "statement" {
+    for_each = length(var.monitored_rds) > 0 ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "rds:DescribeDBInstances",
+      ]
+      resources = ["*"]
+    }
+  }
+
+  dynamic "statement" {
+    for_each = length(var.monitored_rds) > 0 ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "secretsmanager:GetSecretValue",
+      ]
+      resources = distinct([for selector in var.monitored_rds : selector.credentials_secret_arn])
+    }
+  }
+
+  dynamic "statement" {
+    for_each = local.create_upgrade ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "ssm:GetParameter",
+        "ssm:PutParameter",
+      ]
+      resources = [
+        aws_ssm_parameter.reconciler_upgrade_state[0].arn,
+      ]
+    }
+  }
+
+  dynamic "statement" {
+    for_each = local.create_gc ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "ssm:GetParameter",
+        "ssm:PutParameter",
+      ]
+      resources = [
+        aws_ssm_parameter.reconciler_gc_state[0].arn,
+      ]
+    }
+  }
+
+  dynamic "statement" {
+    for_each = local.create_inventory ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "s3:GetObject",
+        "s3:PutObject",
+      ]
+      resources = [
+        "${module.inventory_snapshots_bucket[0].bucket_arn}/*",
+      ]
+    }
+  }
+
+  # Without s3:ListBucket, a missing latest snapshot is AccessDenied, not NoSuchKey.
+  dynamic "statement" {
+    for_each = local.create_inventory ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "s3:ListBucket",
+      ]
+      resources = [
+        module.inventory_snapshots_bucket[0].bucket_arn,
+      ]
+    }
+  }
+
+  dynamic "statement" {
+    for_each = local.create_history ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "s3:PutObject",
+      ]
+      resources = [
+        "${module.reconciler_history_bucket[0].bucket_arn}/*",
+      ]
+    }
+  }
+
+  # cloudwatch:PutMetricData does not support resource-level permissions.
+  dynamic "statement" {
+    for_each = local.create_history ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "cloudwatch:PutMetricData",
+      ]
+      resources = ["*"]
+      condition {
+        test     = "StringEquals"
+        variable = "cloudwatch:namespace"
+        values   = ["PMM/Reconciler"]
+      }
+    }
+  }
 }
 
 resource "aws_iam_policy" "reconciler" {
@@ -203,3 +429,34 @@ resource "aws_lambda_permission" "reconciler_eventbridge" {
   principal     = "events.amazonaws.com"
   source_arn    = aws_cloudwatch_event_rule.reconciler[0].arn
 }
+
+# Alert when reconciler runs approach the Lambda timeout, e.g. as the
+# monitored fleet grows (metrics published with reconciler_history).
+resource "aws_cloudwatch_metric_alarm" "reconciler_timeout_usage" {
+  count = local.create_history ? 1 : 0
+
+  alarm_name          = "${local.service_name_uid}-reconciler-timeout-usage"
+  alarm_description   = "PMM reconciler runs use more than ${var.reconciler_history.timeout_alarm_percent}% of the Lambda timeout"
+  namespace           = "PMM/Reconciler"
+  metric_name         = "TimeoutUsage"
+  statistic           = "Maximum"
+  period              = 900
+  evaluation_periods  = 4
+  threshold           = var.reconciler_history.timeout_alarm_percent
+  comparison_operator = "GreaterThanThreshold"
+  treat_missing_data  = "notBreaching"
+
+  dimensions = {
+    Reconciler = "${local.service_name_uid}-asg-reconciler"
+  }
+
+  alarm_actions = local.all_alarm_targets
+
+  tags = merge(
+    local.common_tags,
+    {
+      Name = "${local.service_name}-reconciler-timeout-usage"
+      Type = "monitoring"
+    }
+  )
+}
@@ -0,0 +1,59 @@
+"""
+S3 objects partitioned by day, and the times that select them.
+
+The reconciler's run history and inventory snapshots, the ALB access logs
+and the metrics archive all store their objects under one key prefix per
+UTC day. :func:`day_keys` lists the days of a time range, so a query
+never lists a whole bucket, and :func:`parse_time` reads the range
+bounds given on the command line of the ``pmm_tools`` that query them.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterator
+
+
+def day_keys(
+    s3_client,
+    bucket: str,
+    start: datetime,
+    end: datetime,
+    keep: Callable[[str], bool],
+    prefix: str = "",
+    day_format: str = "%Y/%m/%d/",
+) -> Iterator[str]:
+    """
+    Keys under the day prefixes of a time range, day by day in key order.
+
+    :param s3_client: boto3 S3 client.
+    :param bucket: Bucket name.
+    :param start: First day of the range, timezone-aware.
+    :param end: Last day of the range, timezone-aware.
+    :param keep: Whether a key belongs to the range; days hold whole UTC
+        days, so the first and last one usually have keys outside it.
+    :param prefix: Key prefix before the day, e.g. ``archive/``.
+    :param day_format: ``strftime`` format of the day part of the prefix.
+    """
+    paginator = s3_client.get_paginator("list_objects_v2")
+    day = start.astimezone(timezone.utc).date()
+    while day <= end.astimezone(timezone.utc).date():
+        keys = [
+            item["Key"]
+            for page in paginator.paginate(
+                Bucket=bucket, Prefix=f"{prefix}{day.strftime(day_format)}"
+            )
+            for item in page.get("Contents", [])
+            if keep(item["Key"])
+        ]
+        yield from sorted(keys)
+        day += timedelta(days=1)
+
+
+def parse_time(value: str) -> datetime:
+    """
+    Read an ISO 8601 time.
+
+    :param value: E.g. ``2026-05-01T12:00`` or ``2026-05-01T12:00+02:00``.
+    :return: Timezone-aware time; UTC if ``value`` has no offset.
+    """
+    moment = datetime.fromisoformat(value)
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
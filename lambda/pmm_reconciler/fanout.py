@@ -0,0 +1,266 @@
+"""
+Run one shell command on many SSM-managed instances concurrently.
+
+``ASGInstance.execute_command()`` sends one command per instance and
+enforces its timeout with ``SIGALRM``, which only works in the main
+thread, so it cannot be fanned out with threads. Instead, the command is
+sent with one multi-target ``SendCommand`` call per
+:data:`SSM_MAX_TARGETS` instances and all results are collected with
+``ListCommandInvocations``. SSM rejects a whole call with
+``InvalidInstanceId`` if one of its instances is not registered yet (e.g.
+still booting during a scale-out), so such a batch is split and sent
+again, down to single instances. Any other ``SendCommand`` error, such as
+throttling or missing permissions, is raised: splitting would only
+multiply the calls. :func:`run_documents` runs any document this way on
+groups of instances that share parameters, e.g. the pmm-client setup of
+one ASG, so the number of calls grows with the number of groups and
+batches, not with the number of instances.
+"""
+
+from logging import getLogger
+from time import monotonic, sleep
+from typing import Dict, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+from infrahouse_core.aws.asg_instance import ASGInstance
+
+from pmm_client import RequestStats
+
+LOG = getLogger(__name__)
+
+# SendCommand accepts at most 50 instance IDs per call.
+SSM_MAX_TARGETS = 50
+
+# Invocation statuses that mean the command has not finished yet.
+_SSM_PENDING_STATUSES = ("Pending", "InProgress", "Delayed", "Cancelling")
+
+
+def run_on_instances(
+    instances: List[ASGInstance],
+    command: str,
+    execution_timeout: int,
+    stats: Optional[RequestStats] = None,
+    operation: str = "run_command",
+) -> Dict[str, Optional[Tuple[int, str]]]:
+    """
+    Run ``command`` on all ``instances`` in parallel and wait for results.
+
+    :param instances: Instances to run the command on. They must share
+        a region; the SSM client of the first instance is used.
+    :param command: Shell command for the ``AWS-RunShellScript`` document.
+    :param execution_timeout: Overall deadline in seconds for all results.
+        Also passed to SSM as the per-instance execution timeout.
+    :param stats: If given, the time from ``SendCommand`` to each
+        instance's result is recorded in it as ``operation``. Commands
+        that cannot be sent, fail or do not finish in time count as errors.
+    :param operation: Operation name for ``stats``.
+    :return: Map of instance ID to ``(exit_code, output)``. Instances that
+        did not finish in time or could not be reached map to ``None``.
+        SSM truncates ``output`` to 2500 characters, so keep it short.
+    """
+    return run_documents(
+        [(instances, {"commands": [command]})],
+        execution_timeout,
+        stats=stats,
+        operation=operation,
+    )
+
+
+def run_documents(
+    groups: List[Tuple[List[ASGInstance], Dict[str, List[str]]]],
+    execution_timeout: int,
+    document: str = "AWS-RunShellScript",
+    document_version: Optional[str] = None,
+    stats: Optional[RequestStats] = None,
+    operation: str = "run_command",
+) -> Dict[str, Optional[Tuple[int, str]]]:
+    """
+    Run an SSM document on groups of instances, with one set of
+    parameters per group, and wait for all results together.
+
+    Every group is sent like in :func:`run_on_instances`: one multi-target
+    ``SendCommand`` per :data:`SSM_MAX_TARGETS` instances, and one
+    ``ListCommandInvocations`` per command and polling round.
+
+    :param groups: ``(instances, parameters)`` pairs; ``parameters`` are
+        the document parameters without ``executionTimeout``. All
+        instances must share a region; the SSM client of the first one is
+        used.
+    :param execution_timeout: Overall deadline in seconds for all results.
+        Also passed to SSM as the per-instance execution timeout.
+    :param document: SSM document name.
+    :param document_version: Document version; the default version if ``None``.
+    :param stats: If given, the time from ``SendCommand`` to each
+        instance's result is recorded in it as ``operation``. Commands
+        that cannot be sent, fail or do not finish in time count as errors.
+    :param operation: Operation name for ``stats``.
+    :return: Map of instance ID to ``(exit_code, output)``. Instances that
+        did not finish in time or could not be reached map to ``None``.
+    """
+    results: Dict[str, Optional[Tuple[int, str]]] = {
+        inst.instance_id: None for instances, _ in groups for inst in instances
+    }
+    if not results:
+        return results
+
+    ssm = next(instances[0].ssm_client for instances, _ in groups if instances)
+    pending: Dict[str, set] = {}
+    sent: Dict[str, float] = {}
+    for instances, parameters in groups:
+        instance_ids = [inst.instance_id for inst in instances]
+        for start in range(0, len(instance_ids), SSM_MAX_TARGETS):
+            batch = instance_ids[start : start + SSM_MAX_TARGETS]
+            for command_id, sent_ids in _send_split(
+                ssm,
+                batch,
+                document,
+                parameters,
+                execution_timeout,
+                document_version,
+                stats,
+                operation,
+            ):
+                pending[command_id] = set(sent_ids)
+                sent.update(dict.fromkeys(sent_ids, monotonic()))
+
+    _collect(ssm, pending, sent, results, execution_timeout, stats, operation)
+    return results
+
+
+def _send_split(
+    ssm,
+    instance_ids: List[str],
+    document: str,
+    parameters: Dict[str, List[str]],
+    execution_timeout: int,
+    document_version: Optional[str],
+    stats: Optional[RequestStats],
+    operation: str,
+) -> List[Tuple[str, List[str]]]:
+    """
+    ``SendCommand`` to a batch; if SSM rejects one of its instances, send
+    each half again.
+
+    Instances that cannot be sent to even on their own are left out and,
+    with ``stats``, recorded as failed.
+
+    :return: ``(command_id, instance_ids)`` of every command sent.
+    """
+    command_id = _send(
+        ssm, instance_ids, document, parameters, execution_timeout, document_version
+    )
+    if command_id is not None:
+        return [(command_id, instance_ids)]
+    if len(instance_ids) == 1:
+        if stats is not None:
+            stats.record(operation, 0.0, failed=True)
+        return []
+    middle = len(instance_ids) // 2
+    return [
+        command
+        for half in (instance_ids[:middle], instance_ids[middle:])
+        for command in _send_split(
+            ssm,
+            half,
+            document,
+            parameters,
+            execution_timeout,
+            document_version,
+            stats,
+            operation,
+        )
+    ]
+
+
+def _send(
+    ssm,
+    instance_ids: List[str],
+    document: str,
+    parameters: Dict[str, List[str]],
+    execution_timeout: int,
+    document_version: Optional[str] = None,
+) -> Optional[str]:
+    """
+    ``SendCommand``; returns the command ID, or ``None`` if SSM does not
+    know one of the instances.
+
+    :raise ClientError: On any other error, e.g. ``ThrottlingException``
+        (after botocore's own retries) or ``AccessDeniedException``.
+    """
+    kwargs = {"DocumentVersion": document_version} if document_version else {}
+    try:
+        response = ssm.send_command(
+            InstanceIds=instance_ids,
+            DocumentName=document,
+            Parameters={**parameters, "executionTimeout": [str(execution_timeout)]},
+            **kwargs,
+        )
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] != "InvalidInstanceId":
+            raise
+        # An instance is still booting or already gone. Leave the
+        # instances as unknown; the next run tries again.
+        LOG.warning("SendCommand failed for %s: %s", instance_ids, exc)
+        return None
+    return response["Command"]["CommandId"]
+
+
+def _collect(
+    ssm,
+    pending: Dict[str, set],
+    sent: Dict[str, float],
+    results: Dict[str, Optional[Tuple[int, str]]],
+    execution_timeout: int,
+    stats: Optional[RequestStats],
+    operation: str,
+) -> None:
+    """Poll ``pending`` commands into ``results`` until done or timed out."""
+    paginator = ssm.get_paginator("list_command_invocations")
+    deadline = monotonic() + execution_timeout
+    delay = 1
+    while pending and monotonic() < deadline:
+        sleep(delay)
+        delay = min(delay * 2, 5)
+        for command_id in list(pending):
+            try:
+                invocations = [
+                    invocation
+                    for page in paginator.paginate(CommandId=command_id, Details=True)
+                    for invocation in page.get("CommandInvocations", [])
+                ]
+            except ClientError as exc:
+                LOG.warning("Cannot list results for %s: %s", command_id, exc)
+                invocations = []
+            for invocation in invocations:
+                instance_id = invocation["InstanceId"]
+                if (
+                    instance_id not in pending[command_id]
+                    or invocation["Status"] in _SSM_PENDING_STATUSES
+                ):
+                    continue
+                pending[command_id].discard(instance_id)
+                plugins = invocation.get("CommandPlugins", [])
+                output = "".join(plugin.get("Output", "") for plugin in plugins)
+                exit_code = plugins[0].get("ResponseCode", -1) if plugins else -1
+                if invocation["Status"] != "Success":
+                    LOG.warning(
+                        "Command %s on %s finished with status %s",
+                        command_id,
+                        instance_id,
+                        invocation["Status"],
+                    )
+                results[instance_id] = (exit_code, output)
+                if stats is not None:
+                    stats.record(
+                        operation,
+                        monotonic() - sent[instance_id],
+                        failed=invocation["Status"] != "Success",
+                    )
+            if not pending[command_id]:
+                del pending[command_id]
+
+    for instance_ids_left in pending.values():
+        for instance_id in instance_ids_left:
+            LOG.warning("Command on %s did not finish in time", instance_id)
+            if stats is not None:
+                stats.record(operation, monotonic() - sent[instance_id], failed=True)
@@ -0,0 +1,356 @@
+"""
+History of reconciler runs and the trends derived from it.
+
+Every run of ``lambda_handler()`` produces a compact record: when it
+started, its duration and the Lambda timeout, the seconds spent in each
+phase (setup, every ASG, RDS, orphan collection, inventory), the
+instances checked and the services added, removed and skipped, the
+failures, and SSM and PMM API latency percentiles (see
+:class:`pmm_client.RequestStats`). Records are appended to a store,
+:class:`S3HistoryStore` in the Lambda or :class:`FileHistoryStore` for
+tests and local runs, and published as CloudWatch metrics
+(:func:`metric_data`).
+
+:func:`trends` and :func:`forecast` read the records back. The forecast
+fits the run duration to the number of instances checked, which tells
+how many instances the reconciler can handle before it hits the Lambda
+timeout, well before a growing fleet gets there.
+"""
+
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Dict, List, Optional
+
+from daykeys import day_keys
+
+VERSION = 1
+
+# CloudWatch namespace of the metrics.
+NAMESPACE = "PMM/Reconciler"
+
+# Records downloaded in parallel by S3HistoryStore.query().
+MAX_WORKERS = 16
+
+_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class PhaseTimer:
+    """
+    Wall time of the phases of a run.
+
+    Phases are laps: :meth:`lap` charges the time since the previous lap
+    (or since the timer was created) to a phase.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self._start = perf_counter()
+        self._last = self._start
+        self.phases: Dict[str, float] = OrderedDict()
+
+    def lap(self, phase: str) -> float:
+        """
+        End a phase.
+
+        :param phase: Phase name, e.g. ``asg:db`` or ``gc``. Laps of the
+            same name add up.
+        :return: Seconds of this lap.
+        """
+        now = perf_counter()
+        seconds = now - self._last
+        self._last = now
+        self.phases[phase] = round(self.phases.get(phase, 0.0) + seconds, 3)
+        return seconds
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the timer was created."""
+        return perf_counter() - self._start
+
+
+def make_record(
+    timer: PhaseTimer,
+    timeout: float,
+    counts: Dict[str, int],
+    errors: List[str],
+    ssm: Dict[str, Dict],
+    pmm_api: Dict[str, Dict],
+) -> Dict:
+    """
+    History record of a run.
+
+    :param timer: Phases of the run.
+    :param timeout: Lambda timeout in seconds.
+    :param counts: Instances checked and services added, removed, etc.
+    :param errors: Failures of the run.
+    :param ssm: SSM command latency summary.
+    :param pmm_api: PMM API latency summary.
+    :return: Record, JSON serializable.
+    """
+    return {
+        "version": VERSION,
+        "started_at": timer.started_at.strftime(_TIME_FORMAT),
+        "duration": round(timer.elapsed, 3),
+        "timeout": timeout,
+        "phases": dict(timer.phases),
+        "counts": dict(counts),
+        "failures": len(errors),
+        "ssm": ssm,
+        "pmm_api": pmm_api,
+    }
+
+
+def _started(record: Dict) -> datetime:
+    return datetime.strptime(record["started_at"], _TIME_FORMAT).replace(
+        tzinfo=timezone.utc
+    )
+
+
+def _check_version(record: Dict) -> Dict:
+    if record.get("version") != VERSION:
+        raise ValueError(
+            f"Unsupported history record version {record.get('version')}, "
+            f"expected {VERSION}"
+        )
+    return record
+
+
+class FileHistoryStore:
+    """
+    History in a local JSON Lines file, one record per line.
+
+    :param path: File path; created on the first append.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+
+    def append(self, record: Dict) -> str:
+        """
+        Append a record.
+
+        :return: File path.
+        """
+        with open(self._path, "a", encoding="utf-8") as fp:
+            fp.write(json.dumps(record, separators=(",", ":")) + "\n")
+        return self._path
+
+    def query(self, start: datetime, end: datetime) -> List[Dict]:
+        """
+        Records of the runs started in a time range, oldest first.
+
+        :param start: Start of the range, timezone-aware.
+        :param end: End of the range, timezone-aware.
+        """
+        if not os.path.exists(self._path):
+            return []
+        with open(self._path, encoding="utf-8") as fp:
+            records = [_check_version(json.loads(line)) for line in fp if line.strip()]
+        return sorted(
+            (record for record in records if start <= _started(record) <= end),
+            key=lambda record: record["started_at"],
+        )
+
+
+class S3HistoryStore:
+    """
+    History in an S3 bucket, one object per run under
+    ``YYYY/MM/DD/<started_at>.json``.
+
+    :param s3_client: boto3 S3 client.
+    :param bucket: History bucket.
+    :param workers: Parallel downloads in :meth:`query`.
+    """
+
+    def __init__(self, s3_client, bucket: str, workers: int = MAX_WORKERS):
+        self._s3 = s3_client
+        self._bucket = bucket
+        self._workers = workers
+
+    @staticmethod
+    def key(record: Dict) -> str:
+        """Object key of a record."""
+        return f"{_started(record):%Y/%m/%d}/{record['started_at']}.json"
+
+    def append(self, record: Dict) -> str:
+        """
+        Store a record.
+
+        :return: Object key.
+        """
+        key = self.key(record)
+        self._s3.put_object(
+            Bucket=self._bucket,
+            Key=key,
+            Body=json.dumps(record, separators=(",", ":")).encode(),
+            ContentType="application/json",
+        )
+        return key
+
+    def _keys(self, start: datetime, end: datetime) -> List[str]:
+        low = start.astimezone(timezone.utc).strftime(_TIME_FORMAT)
+        high = end.astimezone(timezone.utc).strftime(_TIME_FORMAT)
+        return list(
+            day_keys(
+                self._s3,
+                self._bucket,
+                start,
+                end,
+                lambda key: low <= os.path.basename(key)[: -len(".json")] <= high,
+            )
+        )
+
+    def _get(self, key: str) -> Dict:
+        body = self._s3.get_object(Bucket=self._bucket, Key=key)["Body"].read()
+        return _check_version(json.loads(body))
+
+    def query(self, start: datetime, end: datetime) -> List[Dict]:
+        """
+        Records of the runs started in a time range, oldest first.
+
+        :param start: Start of the range, timezone-aware.
+        :param end: End of the range, timezone-aware.
+        """
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            return list(executor.map(self._get, self._keys(start, end)))
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))]
+
+
+def _ssm_p95_ms(record: Dict) -> Optional[float]:
+    values = [entry["p95_ms"] for entry in record.get("ssm", {}).values()]
+    return max(values) if values else None
+
+
+def trends(records: List[Dict], period: int = 86400) -> List[Dict]:
+    """
+    Per-period statistics of a history.
+
+    :param records: Records, oldest first.
+    :param period: Period length in seconds, e.g. 3600 or 86400.
+    :return: One row per period with runs: ``start``, ``runs``,
+        ``failures``, ``duration_p50``, ``duration_p95``, ``duration_max``,
+        ``timeout_usage`` (max duration over timeout, in percent),
+        ``instances`` (max checked) and ``ssm_p95_ms`` (max over runs of
+        the slowest SSM operation's p95, ``None`` without SSM commands).
+    """
+    buckets: Dict[int, List[Dict]] = OrderedDict()
+    for record in records:
+        slot = int(_started(record).timestamp()) // period * period
+        buckets.setdefault(slot, []).append(record)
+    rows = []
+    for slot, runs in buckets.items():
+        durations = [run["duration"] for run in runs]
+        ssm = [value for value in map(_ssm_p95_ms, runs) if value is not None]
+        rows.append(
+            {
+                "start": datetime.fromtimestamp(slot, timezone.utc).strftime(
+                    _TIME_FORMAT
+                ),
+                "runs": len(runs),
+                "failures": sum(run["failures"] for run in runs),
+                "duration_p50": _percentile(durations, 0.5),
+                "duration_p95": _percentile(durations, 0.95),
+                "duration_max": max(durations),
+                "timeout_usage": round(
+                    100 * max(run["duration"] / run["timeout"] for run in runs), 1
+                ),
+                "instances": max(run["counts"].get("checked", 0) for run in runs),
+                "ssm_p95_ms": max(ssm) if ssm else None,
+            }
+        )
+    return rows
+
+
+def forecast(records: List[Dict], headroom: float = 0.8) -> Optional[Dict]:
+    """
+    Fleet size at which runs outgrow the Lambda timeout.
+
+    Fits ``duration = base + per_instance * checked`` by least squares.
+
+    :param records: Records, e.g. of the last weeks.
+    :param headroom: Fraction of the timeout a run may use.
+    :return: ``base_seconds``, ``seconds_per_instance``, ``instances``
+        (checked by the latest run) and ``max_instances`` (where the fit
+        reaches ``headroom`` of the timeout); ``None`` if the history
+        does not cover at least two fleet sizes or the duration does not
+        grow with them.
+    """
+    points = [(run["counts"].get("checked", 0), run["duration"]) for run in records]
+    if len({x for x, _ in points}) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / sum(
+        (x - mean_x) ** 2 for x, _ in points
+    )
+    if slope <= 0:
+        return None
+    base = mean_y - slope * mean_x
+    return {
+        "base_seconds": round(base, 3),
+        "seconds_per_instance": round(slope, 4),
+        "instances": points[-1][0],
+        "max_instances": int((headroom * records[-1]["timeout"] - base) / slope),
+    }
+
+
+def metric_data(record: Dict, function_name: str) -> List[Dict]:
+    """
+    CloudWatch ``MetricData`` of a run.
+
+    :param record: Record of the run.
+    :param function_name: Reconciler function, the ``Reconciler`` dimension.
+    :return: ``Duration``, ``TimeoutUsage``, ``InstancesChecked``,
+        ``ServicesAdded``, ``ServicesRemoved`` and ``Failures``; ``PhaseDuration``
+        per ``Phase`` and ``SSMLatencyP95`` per SSM ``Operation``. The
+        ``asg:<name>`` phases add up to one ``asg`` phase, so the metrics do
+        not follow the ASGs; the record keeps them apart.
+    """
+    dimensions = [{"Name": "Reconciler", "Value": function_name}]
+    counts = record["counts"]
+    metrics = [
+        {"MetricName": name, "Value": value, "Unit": unit, "Dimensions": dimensions}
+        for name, value, unit in (
+            ("Duration", record["duration"], "Seconds"),
+            (
+                "TimeoutUsage",
+                round(100 * record["duration"] / record["timeout"], 1),
+                "Percent",
+            ),
+            ("InstancesChecked", counts.get("checked", 0), "Count"),
+            ("ServicesAdded", counts.get("added", 0), "Count"),
+            ("ServicesRemoved", counts.get("removed", 0), "Count"),
+            ("Failures", record["failures"], "Count"),
+        )
+    ]
+    phases: Dict[str, float] = OrderedDict()
+    for phase, seconds in record["phases"].items():
+        phase = phase.split(":", 1)[0]
+        phases[phase] = round(phases.get(phase, 0.0) + seconds, 3)
+    for phase, seconds in phases.items():
+        metrics.append(
+            {
+                "MetricName": "PhaseDuration",
+                "Value": seconds,
+                "Unit": "Seconds",
+                "Dimensions": dimensions + [{"Name": "Phase", "Value": phase}],
+            }
+        )
+    for operation, summary in record["ssm"].items():
+        metrics.append(
+            {
+                "MetricName": "SSMLatencyP95",
+                "Value": summary["p95_ms"],
+                "Unit": "Milliseconds",
+                "Dimensions": dimensions + [{"Name": "Operation", "Value": operation}],
+            }
+        )
+    return metrics
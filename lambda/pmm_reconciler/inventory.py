@@ -0,0 +1,274 @@
+"""
+Snapshots of the PMM inventory and ASG membership, and diffs between them.
+
+The reconciler takes one snapshot per run: the PMM services, nodes and
+agents it planned with, plus the instances of every monitored ASG. It is
+stored as compact gzipped JSON in S3 next to a ``latest`` copy, and the
+differences from the previous run are logged. ``pmm_tools.churn`` reads
+the same files offline to audit changes over time.
+
+A snapshot is a dict::
+
+    {
+        "version": 1,
+        "taken_at": "2026-05-01T12:00:00Z",
+        "services": {service_id: {"name": ..., "type": ..., ...}},
+        "nodes": {node_id: {"name": ..., "type": ..., ...}},
+        "agents": {agent_id: {"type": ..., "service_id": ..., ...}},
+        "asgs": {asg_name: {instance_id: hostname}},
+    }
+
+Entities are keyed by ID, so :func:`diff` is linear in the number of
+entities. Services and nodes are also matched by name, so one that was
+deleted and registered again shows up as ``replaced``.
+"""
+
+import gzip
+import json
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+SNAPSHOT_VERSION = 1
+
+KINDS = ("services", "nodes", "agents")
+
+# Attributes kept per entity, as (snapshot field, PMM API field).
+SERVICE_FIELDS = (
+    ("name", "service_name"),
+    ("type", "service_type"),
+    ("node_id", "node_id"),
+    ("address", "address"),
+    ("port", "port"),
+    ("cluster", "cluster"),
+)
+NODE_FIELDS = (
+    ("name", "node_name"),
+    ("type", "node_type"),
+    ("address", "address"),
+)
+AGENT_FIELDS = (
+    ("service_id", "service_id"),
+    ("node_id", "node_id"),
+    ("pmm_agent_id", "pmm_agent_id"),
+    ("status", "status"),
+    ("disabled", "disabled"),
+)
+
+LATEST_KEY = "latest.json.gz"
+
+
+def _compact(entity: Dict, fields) -> Dict:
+    return {
+        name: entity[source]
+        for name, source in fields
+        if entity.get(source) not in (None, "")
+    }
+
+
+def take_snapshot(
+    services: List[Dict],
+    nodes: List[Dict],
+    agents: Dict[str, List[Dict]],
+    asgs: Dict[str, Dict[str, str]],
+    taken_at: Optional[datetime] = None,
+) -> Dict:
+    """
+    Build a snapshot from PMM API responses.
+
+    :param services: :attr:`PMMClient.services`.
+    :param nodes: :attr:`PMMClient.nodes`.
+    :param agents: :attr:`PMMClient.agents`, grouped by agent type.
+    :param asgs: Instance ID to hostname of each ASG.
+    :param taken_at: Snapshot time; now by default.
+    :return: Snapshot dict.
+    """
+    taken_at = taken_at or datetime.now(timezone.utc)
+    return {
+        "version": SNAPSHOT_VERSION,
+        "taken_at": taken_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "services": {
+            svc["service_id"]: _compact(svc, SERVICE_FIELDS) for svc in services
+        },
+        "nodes": {node["node_id"]: _compact(node, NODE_FIELDS) for node in nodes},
+        "agents": {
+            agent["agent_id"]: {"type": agent_type, **_compact(agent, AGENT_FIELDS)}
+            for agent_type, entries in agents.items()
+            for agent in entries
+            if agent.get("agent_id")
+        },
+        "asgs": {name: dict(members) for name, members in asgs.items()},
+    }
+
+
+def _diff_kind(old: Dict[str, Dict], new: Dict[str, Dict]) -> Dict[str, List]:
+    added = [{"id": key, **new[key]} for key in new.keys() - old.keys()]
+    removed = [{"id": key, **old[key]} for key in old.keys() - new.keys()]
+    changed = []
+    for key in old.keys() & new.keys():
+        if old[key] != new[key]:
+            changes = {
+                field: [old[key].get(field), new[key].get(field)]
+                for field in old[key].keys() | new[key].keys()
+                if old[key].get(field) != new[key].get(field)
+            }
+            changed.append({"id": key, "changes": changes})
+
+    # A name both removed and added was registered again under a new ID.
+    removed_by_name = {entity["name"]: entity for entity in removed if "name" in entity}
+    replaced = []
+    for entity in added:
+        previous = removed_by_name.pop(entity.get("name"), None)
+        if previous is not None:
+            replaced.append(
+                {
+                    "name": entity["name"],
+                    "old_id": previous["id"],
+                    "new_id": entity["id"],
+                }
+            )
+    replaced_ids = {item["old_id"] for item in replaced} | {
+        item["new_id"] for item in replaced
+    }
+
+    def ordered(items: Iterable[Dict]) -> List[Dict]:
+        return sorted(items, key=lambda item: (item.get("name", ""), item["id"]))
+
+    return {
+        "added": ordered(item for item in added if item["id"] not in replaced_ids),
+        "removed": ordered(item for item in removed if item["id"] not in replaced_ids),
+        "changed": sorted(changed, key=lambda item: item["id"]),
+        "replaced": sorted(replaced, key=lambda item: item["name"]),
+    }
+
+
+def diff(old: Dict, new: Dict) -> Dict:
+    """
+    Changes from one snapshot to another.
+
+    :param old: Earlier snapshot.
+    :param new: Later snapshot.
+    :return: For each of ``services``, ``nodes`` and ``agents``: lists of
+        ``added``, ``removed``, ``changed`` (ID and ``{field: [old, new]}``)
+        and ``replaced`` (name, old and new ID) entities. ``asgs`` maps
+        every ASG whose membership changed to its ``launched`` and
+        ``terminated`` instance IDs.
+    """
+    result = {kind: _diff_kind(old.get(kind, {}), new.get(kind, {})) for kind in KINDS}
+    asgs = {}
+    old_asgs, new_asgs = old.get("asgs", {}), new.get("asgs", {})
+    for name in sorted(old_asgs.keys() | new_asgs.keys()):
+        before, after = old_asgs.get(name, {}), new_asgs.get(name, {})
+        launched = sorted(after.keys() - before.keys())
+        terminated = sorted(before.keys() - after.keys())
+        if launched or terminated:
+            asgs[name] = {"launched": launched, "terminated": terminated}
+    result["asgs"] = asgs
+    return result
+
+
+def summarize(changes: Dict) -> Dict[str, int]:
+    """
+    Counts of a :func:`diff`, e.g. ``{"services_added": 2, ...}``.
+
+    :param changes: Result of :func:`diff`.
+    :return: Non-zero counts only.
+    """
+    counts = {
+        f"{kind}_{change}": len(items)
+        for kind in KINDS
+        for change, items in changes[kind].items()
+    }
+    counts["instances_launched"] = sum(
+        len(asg["launched"]) for asg in changes["asgs"].values()
+    )
+    counts["instances_terminated"] = sum(
+        len(asg["terminated"]) for asg in changes["asgs"].values()
+    )
+    return {key: value for key, value in counts.items() if value}
+
+
+def group_by_asg(
+    services: List[Dict], asg_names: Iterable[str]
+) -> Dict[str, List[Dict]]:
+    """
+    Services of each ASG, found by their ``{asg_name}/`` name prefix.
+
+    One pass over the services, instead of one per ASG.
+
+    :param services: PMM services.
+    :param asg_names: Monitored ASG names.
+    :return: ASG name to its services; every ASG is present.
+    """
+    groups: Dict[str, List[Dict]] = {name: [] for name in asg_names}
+    for svc in services:
+        # Hostnames have no "/", ASG names may.
+        asg_name, separator, _ = svc.get("service_name", "").rpartition("/")
+        if separator and asg_name in groups:
+            groups[asg_name].append(svc)
+    return groups
+
+
+def dumps(snapshot: Dict) -> bytes:
+    """Serialize a snapshot to compact gzipped JSON."""
+    return gzip.compress(
+        json.dumps(snapshot, separators=(",", ":"), sort_keys=True).encode(),
+        mtime=0,
+    )
+
+
+def loads(data: bytes) -> Dict:
+    """
+    Parse a snapshot written by :func:`dumps`.
+
+    :raise ValueError: If the snapshot has an unknown version.
+    """
+    snapshot = json.loads(gzip.decompress(data))
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {snapshot.get('version')}")
+    return snapshot
+
+
+def snapshot_key(snapshot: Dict) -> str:
+    """
+    S3 key of a snapshot, e.g. ``2026/05/01/2026-05-01T12:00:00Z.json.gz``.
+
+    Keys sort in time order.
+    """
+    taken_at = snapshot["taken_at"]
+    return f"{taken_at[:4]}/{taken_at[5:7]}/{taken_at[8:10]}/{taken_at}.json.gz"
+
+
+def load_latest(s3_client, bucket: str) -> Optional[Dict]:
+    """
+    Snapshot of the previous run.
+
+    :param s3_client: boto3 S3 client.
+    :param bucket: Snapshot bucket.
+    :return: Snapshot, or ``None`` if there is none yet.
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=LATEST_KEY)
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return loads(response["Body"].read())
+
+
+def save(s3_client, bucket: str, snapshot: Dict) -> str:
+    """
+    Store a snapshot under its dated key and as the latest one.
+
+    :param s3_client: boto3 S3 client.
+    :param bucket: Snapshot bucket.
+    :param snapshot: Snapshot to store.
+    :return: Dated key.
+    """
+    body = dumps(snapshot)
+    key = snapshot_key(snapshot)
+    for target in (key, LATEST_KEY):
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=target,
+            Body=body,
+            ContentType="application/gzip",
+        )
+    return key
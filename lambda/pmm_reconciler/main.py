@@ -1,24 +1,53 @@
 """
 Lambda function to reconcile ASG membership with PMM monitored services.
 
-Installs pmm-client on new ASG instances via SSM, configures them to
-connect to the PMM server, and adds MySQL monitoring. Removes services
-for terminated instances via the PMM HTTP API.
+Each run probes all ASG instances in parallel with a lightweight SSM
+command, then installs and configures pmm-client (and adds MySQL
+monitoring) only on the instances that need it, running the setup
+script stored as an SSM document (see :mod:`setup_script`). Registered services
+whose Query Analytics settings drifted from ``monitored_asgs`` are re-added.
+Removes services for terminated instances via the PMM HTTP API.
+
+RDS and Aurora databases selected by tags in ``monitored_rds`` are
+registered and deregistered as remote services (see :mod:`rds`).
+Nodes and agents left behind by terminated hosts are garbage collected
+when ``reconciler_gc`` is enabled (see :mod:`orphans`).
+Every run is recorded in the run history when ``reconciler_history`` is
+enabled (see :mod:`history`).
 """
 
 import json
 import os
-from base64 import b64encode
-from logging import getLogger
+from logging import ERROR, INFO, WARNING, getLogger
 from textwrap import dedent
-from typing import Dict, List, Tuple
+from time import monotonic
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
 
+import boto3
 import requests
+from botocore.exceptions import BotoCoreError, ClientError
 from infrahouse_core.aws.asg import ASG
 from infrahouse_core.logging import setup_logging
 from infrahouse_core.aws.asg_instance import ASGInstance
 from infrahouse_core.aws.secretsmanager import Secret
 
+from fanout import run_on_instances
+from history import NAMESPACE, PhaseTimer, S3HistoryStore, make_record, metric_data
+from inventory import diff, group_by_asg, load_latest, save, summarize, take_snapshot
+from orphans import OrphanCollector
+from pmm_client import PMMClient, RequestStats
+from qan import (
+    agents_by_service,
+    qan_drift,
+    qan_flags,
+    rate_limit_drift,
+    slow_log_rate_limit_sql,
+)
+from rds import reconcile_rds, unconfigured
+from scrape import collectors_drift, resolution_drift, scrape_flags
+from setup_script import SetupRunner, encode_config
+from upgrade import RollingUpgrade
+
 LOG = getLogger(__name__)
 
 setup_logging(LOG)
@@ -27,292 +56,472 @@ setup_logging(LOG)
 PMM_HOST = os.environ.get("PMM_HOST", "")
 PMM_ADMIN_SECRET_ARN = os.environ.get("PMM_ADMIN_SECRET_ARN", "")
 MONITORED_ASGS_CONFIG = os.environ.get("MONITORED_ASGS_CONFIG", "[]")
+MONITORED_RDS_CONFIG = os.environ.get("MONITORED_RDS_CONFIG", "[]")
 AWS_REGION = os.environ.get("PMM_AWS_REGION", "us-east-1")
 
+# Rolling pmm-client upgrade settings (see upgrade.py).
+PMM_CLIENT_UPGRADE_ENABLED = (
+    os.environ.get("PMM_CLIENT_UPGRADE_ENABLED", "false").lower() == "true"
+)
+PMM_CLIENT_TARGET_VERSION = os.environ.get("PMM_CLIENT_TARGET_VERSION", "")
+PMM_CLIENT_UPGRADE_BATCH_SIZE = int(
+    os.environ.get("PMM_CLIENT_UPGRADE_BATCH_SIZE", "1")
+)
+PMM_CLIENT_UPGRADE_MAX_UNAVAILABLE = int(
+    os.environ.get("PMM_CLIENT_UPGRADE_MAX_UNAVAILABLE", "1")
+)
+UPGRADE_STATE_PARAMETER = os.environ.get("UPGRADE_STATE_PARAMETER", "")
+
+# Orphaned node and agent garbage collection (see orphans.py).
+GC_ENABLED = os.environ.get("GC_ENABLED", "false").lower() == "true"
+GC_STATE_PARAMETER = os.environ.get("GC_STATE_PARAMETER", "")
+GC_MIN_AGE_SECONDS = int(os.environ.get("GC_MIN_AGE_SECONDS", "3600"))
+GC_MAX_DELETIONS = int(os.environ.get("GC_MAX_DELETIONS", "50"))
+
+# S3 bucket for inventory snapshots (see inventory.py); empty to disable.
+INVENTORY_BUCKET = os.environ.get("INVENTORY_BUCKET", "")
+
+# Run history (reconciler_history); empty to disable.
+HISTORY_BUCKET = os.environ.get("HISTORY_BUCKET", "")
+
+# Versioned SSM document of the setup script; empty to ship it inline.
+SETUP_DOCUMENT = os.environ.get("SETUP_DOCUMENT", "")
+SETUP_DOCUMENT_VERSION = os.environ.get("SETUP_DOCUMENT_VERSION", "")
+
+# The probe finishes in well under a second on a healthy instance,
+# so a short timeout keeps the steady-state cycle fast.
+PROBE_TIMEOUT = 30
 
-def _shell_escape(value: str) -> str:
+# Seconds the setup script may run on an instance.
+SETUP_TIMEOUT = 300
+
+# Setups are not started with less time than this left before the
+# deadline: installing pmm-client alone can take a minute, and a setup
+# cut short by SSM leaves the instance half-configured until the next run.
+SETUP_MIN_SECONDS = 120
+
+# Seconds kept at the end of the Lambda timeout to record the run history.
+HISTORY_SECONDS = 10
+
+# Seconds kept for each phase that runs after the setups and upgrades (RDS,
+# orphan collection, inventory snapshot). A phase that would get less is
+# skipped, so the run still ends with its history record.
+TAIL_PHASE_SECONDS = 20
+
+# Exporter that must be running for a service type to count as healthy.
+SERVICE_EXPORTERS = {
+    "mysql": "mysqld_exporter",
+}
+
+# Lightweight status probe. Prints a single JSON line describing the
+# pmm-client state on the instance and the log_slow_rate_limit persisted
+# by the setup script (null if none, or if it cannot be read). It needs
+# nothing beyond coreutils, sed and dpkg, e.g.:
+# {"installed": true, "connected": true, "version": "3.1.0-1.noble",
+#  "agents": {"node_exporter": "Running", "mysqld_exporter": "Running"},
+#  "slow_log_rate_limit": 100}
+PROBE_SCRIPT = dedent(
+    """\
+    export PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin
+    installed=false
+    connected=false
+    version=""
+    agents=""
+    if dpkg-query -W -f='${Status}' pmm-client 2>/dev/null | grep -q "install ok installed"; then
+        installed=true
+        version=$(dpkg-query -W -f='${Version}' pmm-client)
+        status=$(timeout 10 pmm-admin status 2>/dev/null || true)
+        if echo "$status" | grep -q "Connected.*true"; then
+            connected=true
+        fi
+        agents=$(echo "$status" | grep -oE '[a-z_]+_(exporter|agent) +[A-Za-z_]+' || true)
+    fi
+    # SET PERSIST stores the value in mysqld-auto.cnf in the data directory,
+    # which root can read without database credentials.
+    datadir=$(my_print_defaults mysqld 2>/dev/null | sed -n 's/^--datadir=//p' | tail -1)
+    rate_limit=$(sed -n \
+        's/.*"log_slow_rate_limit" *: *{ *"Value" *: *"\\([0-9][0-9]*\\)".*/\\1/p' \
+        "${datadir:-/var/lib/mysql}/mysqld-auto.cnf" 2>/dev/null | head -1)
+    # Version and agent names hold no characters that need JSON escaping.
+    agents=$(echo "$agents" \
+        | sed -n 's/^\\([a-z_][a-z_]*\\)  *\\([A-Za-z_][A-Za-z_]*\\)$/"\\1": "\\2"/p' \
+        | paste -sd, -)
+    printf '{"installed": %s, "connected": %s, "version": "%s", "agents": {%s}, ' \
+        "$installed" "$connected" "$version" "$agents"
+    printf '"slow_log_rate_limit": %s}\\n' "${rate_limit:-null}"
     """
-    Escape a string for safe embedding inside single-quoted shell strings.
+)
 
-    Replaces each single quote with the sequence ``'\\''`` which ends the
-    current single-quoted string, adds an escaped literal quote, and
-    reopens a new single-quoted string.
 
-    :param value: Raw string to escape.
-    :return: Escaped string safe for single-quoted shell contexts.
+def _parse_probe_output(stdout: str) -> Optional[Dict]:
     """
-    return value.replace("'", "'\\''")
+    Extract the JSON status document from probe output.
 
+    The probe prints exactly one JSON line, but SSM may prepend
+    warnings, so the last line that parses as a JSON object wins.
 
-class PMMClient:
+    :param stdout: Standard output of the probe command.
+    :return: Parsed status dict, or ``None`` if no JSON line was found.
     """
-    Client for the Percona Monitoring and Management (PMM) HTTP API.
+    for line in reversed((stdout or "").strip().split("\n")):
+        try:
+            status = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(status, dict):
+            return status
+    return None
 
-    Used only for listing existing services and removing services
-    for terminated instances.
 
-    :param base_url: PMM server base URL (e.g., ``http://10.0.1.5``).
-    :type base_url: str
-    :param username: PMM admin username.
-    :type username: str
-    :param password: PMM admin password.
-    :type password: str
-    :param timeout: HTTP request timeout in seconds.
-    :type timeout: int
+def probe_instances(
+    instances: List[ASGInstance],
+    execution_timeout: int = PROBE_TIMEOUT,
+    stats: Optional[RequestStats] = None,
+) -> Dict[str, Optional[Dict]]:
     """
+    Probe pmm-client state on many instances in parallel.
 
-    def __init__(
-        self,
-        base_url: str,
-        username: str,
-        password: str,
-        timeout: int = 30,
-    ):
-        self._base_url = base_url.rstrip("/")
-        self._timeout = timeout
-        encoded = b64encode(f"{username}:{password}".encode()).decode()
-        self._headers = {
-            "Authorization": f"Basic {encoded}",
-            "Content-Type": "application/json",
-        }
+    Runs :data:`PROBE_SCRIPT` on all instances at once (see
+    :func:`fanout.run_on_instances`), so the whole fleet is probed in
+    roughly the time of the slowest instance.
 
-    @property
-    def services(self) -> List[Dict]:
-        """
-        List all services registered in PMM.
-
-        :return: List of service dicts from the PMM API.
-        """
-        url = f"{self._base_url}/v1/management/services"
-        response = requests.get(
-            url,
-            headers=self._headers,
-            timeout=self._timeout,
-        )
-        response.raise_for_status()
-        return response.json().get("services", [])
-
-    def remove_service(self, service_id: str) -> None:
-        """
-        Remove a service from PMM inventory.
-
-        :param service_id: PMM service ID to remove.
-        """
-        url = f"{self._base_url}/v1/inventory/services/{service_id}"
-        response = requests.delete(
-            url,
-            headers=self._headers,
-            params={"force": "true"},
-            timeout=self._timeout,
-        )
-        response.raise_for_status()
+    :param instances: Instances to probe.
+    :param execution_timeout: Overall deadline in seconds for all results.
+    :param stats: If given, the SSM latency of every instance is recorded
+        in it as ``probe``.
+    :return: Map of instance ID to the parsed probe status. Instances that
+        did not answer in time, are not SSM-managed, or never ran the probe
+        (SSM reports exit code -1, e.g. ``Undeliverable``) map to ``None``.
+        Instances that ran the probe, but whose probe failed or printed no
+        status, map to an empty dict, which :func:`needs_configure` sends
+        to the setup script.
+    """
+    results = run_on_instances(
+        instances, PROBE_SCRIPT, execution_timeout, stats=stats, operation="probe"
+    )
+    statuses: Dict[str, Optional[Dict]] = {}
+    for instance_id, result in results.items():
+        if result is None or result[0] < 0:
+            statuses[instance_id] = None
+            continue
+        exit_code, output = result
+        status = _parse_probe_output(output) if exit_code == 0 else None
+        if status is None:
+            LOG.warning(
+                "Probe failed on %s (exit_code=%d), running the setup script",
+                instance_id,
+                exit_code,
+            )
+            _log_output(instance_id, output, level=WARNING)
+            status = {}
+        statuses[instance_id] = status
+    return statuses
 
 
-def ensure_pmm_client(
-    instance: ASGInstance,
-    pmm: PMMClient,
+def needs_configure(status: Optional[Dict], exporter: str) -> bool:
+    """
+    Decide whether an instance needs the full install/configure script.
+
+    :param status: Probe status from :func:`probe_instances` or ``None``.
+    :param exporter: Exporter that must be running, e.g. ``mysqld_exporter``.
+    :return: ``True`` unless pmm-client is installed, connected to the
+        PMM server, and the exporter is running.
+    """
+    if not status:
+        return True
+    if not status.get("installed") or not status.get("connected"):
+        return True
+    exporter_status = status.get("agents", {}).get(exporter, "")
+    return not exporter_status.lower().endswith("running")
+
+
+def setup_config(
     pmm_host: str,
     pmm_password: str,
     db_username: str,
     port: int,
-    service_name: str,
-    existing_service_id: str = None,
-) -> None:
+    asg_name: str,
+    qan: Optional[Dict] = None,
+    reregister: bool = False,
+    metrics: Optional[Dict] = None,
+) -> str:
     """
-    Install and configure pmm-client on a Percona instance via SSM.
+    Config of the setup script for the instances of an ASG.
 
-    Runs an idempotent bash script that:
+    It is the same for all instances set up with the same ``reregister``,
+    so they share one ``SendCommand`` (see :meth:`SetupRunner.run`).
 
-    1. Installs pmm-client if not already present (via percona-release).
-    2. Configures the PMM server connection if not already connected.
-       Connects directly to the PMM instance on port 443 (HTTPS with
-       self-signed cert) because pmm-agent uses gRPC which is not
-       supported by ALB.
-    3. Reads DB credentials from the instance's own Puppet facts and
-       Secrets Manager (via ``ih-secrets get``).
-    4. Adds MySQL monitoring if not already registered locally.
-
-    If the service already exists on the PMM server (e.g., from a
-    previous remote-node registration) but not locally, it is removed
-    via the PMM API before running ``pmm-admin add mysql``.
-
-    :param instance: ASGInstance object with ``execute_command()`` method.
-    :param pmm: PMMClient for removing stale services.
     :param pmm_host: PMM server private IP address.
     :param pmm_password: PMM admin password.
     :param db_username: Key in the credentials JSON for password lookup.
     :param port: MySQL port number.
-    :param service_name: Service name for PMM (e.g., ``asg-name/hostname``).
-    :param existing_service_id: PMM service ID if already registered on server.
+    :param asg_name: ASG name; the script names each service
+        ``{asg_name}/{hostname}``.
+    :param qan: QAN settings of the ASG (see :mod:`qan`).
+    :param reregister: Re-add MySQL monitoring even if it is registered.
+    :param metrics: Metrics settings of the ASG (see :mod:`scrape`).
+    :return: Output of :func:`setup_script.encode_config`.
     """
-    # The PMM admin password is embedded in the script via f-string.
+    qan = qan or {}
+
+    # The PMM admin password is passed in the script's config.
     # Alternatives (SSM env vars, Secrets Manager on instance) were
     # considered but either are not supported by SSM SendCommand or
     # would grant every ASG instance access to the PMM admin secret.
-    # Current mitigations: base64-encoded, umask 077, immediate cleanup.
-    # The password does appear in SSM command history, which is an
-    # inherent trade-off of any SSM-based approach.
-    script = dedent(
-        f"""\
-        #!/bin/bash
-        set -euo pipefail
-        export PATH=/opt/puppetlabs/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin
-
-        # Step 1: Install pmm-client if not present
-        if ! dpkg -l pmm-client 2>/dev/null | grep -q "^ii"; then
-            echo 'Installing pmm-client...'
-            percona-release enable pmm3-client
-            DEBIAN_FRONTEND=noninteractive apt-get update -qq
-            DEBIAN_FRONTEND=noninteractive apt-get install -y -qq pmm-client
-            echo 'pmm-client installed'
-        fi
+    # The config is a plain SSM command parameter: with the setup
+    # document it is the "config" parameter, inline it is part of the
+    # command text. Either way anyone allowed ssm:ListCommands or
+    # ssm:GetCommandInvocation can read it from the command history, and
+    # base64 is an encoding, not a protection. The SSM agent also keeps
+    # the rendered command in its orchestration directory on the
+    # instance. Only the inline path's own copies are limited, by umask
+    # 077 and removal after the run.
+    return encode_config(
+        pmm_host=pmm_host,
+        pmm_password=pmm_password,
+        db_username=db_username,
+        port=port,
+        asg_name=asg_name,
+        add_args=qan_flags(qan) + scrape_flags(metrics or {}),
+        rate_limit_sql=slow_log_rate_limit_sql(qan),
+        reregister=reregister,
+    )
 
-        # Step 2: Configure PMM server connection if not connected
-        if ! pmm-admin status 2>/dev/null | grep -q "Connected.*true"; then
-            echo 'Configuring PMM server connection...'
-            pmm-admin config \
-                --server-insecure-tls \
-                --server-url='https://admin:{_shell_escape(pmm_password)}@{_shell_escape(pmm_host)}' \
-                --force
-            systemctl restart pmm-agent
-            echo 'Waiting for pmm-agent to connect...'
-            for i in $(seq 1 30); do
-                if pmm-admin status 2>/dev/null | grep -q "Connected.*true"; then
-                    echo 'pmm-agent connected'
-                    break
-                fi
-                sleep 2
-            done
-            echo 'PMM server configured'
-        fi
 
-        # Step 3: Add MySQL monitoring if mysqld_exporter is not running
-        if ! pmm-admin status 2>/dev/null | grep -q "mysqld_exporter"; then
-            echo 'Reading DB credentials from Puppet facts...'
-            CREDS_SECRET=$(facter -p percona.credentials_secret)
-            DB_PASSWORD=$(ih-secrets get "$CREDS_SECRET" | jq -r '.{_shell_escape(db_username)}')
-            echo 'Adding MySQL monitoring...'
-            ADD_OUTPUT=$(pmm-admin add mysql \
-                --username='{_shell_escape(db_username)}' \
-                --password="$DB_PASSWORD" \
-                --host=127.0.0.1 \
-                --port={port} \
-                --query-source=perfschema \
-                --service-name='{_shell_escape(service_name)}' 2>&1) || {{
-                if echo "$ADD_OUTPUT" | grep -q "already exists"; then
-                    echo 'MySQL monitoring already registered'
-                else
-                    echo "$ADD_OUTPUT"
-                    exit 1
-                fi
-            }}
-            echo 'MySQL monitoring added'
-        fi
+def setup_timeout(deadline: Optional[float]) -> int:
+    """
+    Seconds a setup started now may run.
 
-        echo 'pmm-client setup complete'
-        """
-    )
+    :param deadline: ``monotonic()`` time by which setups must finish,
+        or ``None`` for no deadline.
+    :return: :data:`SETUP_TIMEOUT`, or less if the deadline is closer.
+    """
+    if deadline is None:
+        return SETUP_TIMEOUT
+    return max(0, min(SETUP_TIMEOUT, int(deadline - monotonic())))
 
-    script_b64 = b64encode(script.encode()).decode()
-    wrapper = (
-        f"umask 077"
-        f" && echo {script_b64} | base64 -d > /tmp/pmm-setup.sh"
-        f" && chmod 700 /tmp/pmm-setup.sh"
-        f" && sudo /tmp/pmm-setup.sh"
-        f"; rc=$?; rm -f /tmp/pmm-setup.sh; exit $rc"
-    )
 
-    LOG.info(
-        "Running pmm-client setup on %s (service: %s)",
-        instance.instance_id,
-        service_name,
-    )
+def tail_phase_skipped(phase: str, end: float, errors: List[str]) -> bool:
+    """
+    Check whether a phase after the setups still has time to run.
 
-    exit_code, stdout, stderr = instance.execute_command(
-        wrapper,
-        execution_timeout=300,
+    :param phase: Phase name, e.g. ``rds``.
+    :param end: ``monotonic()`` time at which the Lambda times out.
+    :param errors: The skipped phase is appended to it as an error.
+    :return: ``True`` if less than :data:`TAIL_PHASE_SECONDS` plus
+        :data:`HISTORY_SECONDS` are left and the phase must be skipped.
+    """
+    left = end - monotonic()
+    if left >= TAIL_PHASE_SECONDS + HISTORY_SECONDS:
+        return False
+    LOG.error("Skipping %s: %.0f seconds left before the Lambda timeout", phase, left)
+    errors.append(
+        f"{phase}: skipped, {left:.0f} seconds left before the Lambda timeout"
     )
+    return True
 
-    if stdout:
-        for line in stdout.strip().split("\n"):
-            LOG.info("  [%s] %s", instance.instance_id, line)
+
+def _log_output(instance_id: str, output: str, level: int = INFO) -> None:
+    for line in (output or "").strip().splitlines():
+        LOG.log(level, "  [%s] %s", instance_id, line)
+
+
+def ensure_pmm_clients(
+    groups: Dict[str, List[ASGInstance]],
+    pmm: PMMClient,
+    existing_service_ids: Optional[Dict[str, str]] = None,
+    setup: Optional[SetupRunner] = None,
+    deadline: Optional[float] = None,
+    stats: Optional[RequestStats] = None,
+) -> Dict[str, Optional[str]]:
+    """
+    Install and configure pmm-client on Percona instances via SSM.
+
+    Runs the idempotent ``pmm_setup.sh`` script (see :mod:`setup_script`)
+    on all instances in parallel, one multi-target command per config.
+    The script:
+
+    1. Installs pmm-client if not already present (via percona-release).
+    2. Configures the PMM server connection if not already connected.
+       Connects directly to the PMM instance on port 443 (HTTPS with
+       self-signed cert) because pmm-agent uses gRPC which is not
+       supported by ALB.
+    3. Reads DB credentials from the instance's own Puppet facts and
+       Secrets Manager (via ``ih-secrets get``) and sets the slow log
+       rate limit, if one is configured.
+    4. Adds MySQL monitoring with the requested QAN settings and disabled
+       collectors if not already registered locally. With ``reregister``,
+       the local service is removed and added again so changed settings
+       take effect.
+
+    If the service already exists on the PMM server (e.g., from a
+    previous remote-node registration) but not locally, it is removed
+    via the PMM API and the script runs again on that instance.
+
+    :param groups: Map of a config (see :func:`setup_config`) to the
+        instances to set up with it.
+    :param pmm: PMMClient for removing stale services.
+    :param existing_service_ids: Map of instance ID to its PMM service ID,
+        for instances whose service is already registered on the server.
+    :param setup: Runs the script; ships it inline by default.
+    :param deadline: ``monotonic()`` time by which the setups must finish
+        (see :func:`setup_timeout`).
+    :param stats: If given, the latency of every setup is recorded in it
+        as ``setup``.
+    :return: Map of instance ID to ``None`` if the setup succeeded, or
+        the reason it failed.
+    """
+    setup = setup or SetupRunner()
+    existing_service_ids = existing_service_ids or {}
+
+    LOG.info(
+        "Running pmm-client setup on %d instances",
+        sum(len(instances) for instances in groups.values()),
+    )
+    results = setup.run(groups, setup_timeout(deadline), stats=stats)
+    for instance_id, result in results.items():
+        if result is not None:
+            _log_output(instance_id, result[1])
 
     # If pmm-admin add mysql failed because the service already exists
     # on the PMM server (e.g., from a previous remote-node registration),
     # remove the stale service via API and retry.
-    if exit_code != 0 and existing_service_id:
-        combined = (stdout or "") + (stderr or "")
-        if "already exists" in combined:
+    stale = {
+        config: [
+            inst
+            for inst in instances
+            if results[inst.instance_id] is not None
+            and results[inst.instance_id][0] != 0
+            and inst.instance_id in existing_service_ids
+            and "already exists" in results[inst.instance_id][1]
+        ]
+        for config, instances in groups.items()
+    }
+    stale = {config: instances for config, instances in stale.items() if instances}
+    if stale and setup_timeout(deadline) >= SETUP_MIN_SECONDS:
+        for inst in [inst for instances in stale.values() for inst in instances]:
             LOG.info(
-                "Service %s exists on server but not locally, "
+                "Service of %s exists on server but not locally, "
                 "removing stale service (id=%s) and retrying",
-                service_name,
-                existing_service_id,
-            )
-            pmm.remove_service(existing_service_id)
-            exit_code, stdout, stderr = instance.execute_command(
-                wrapper,
-                execution_timeout=300,
+                inst.instance_id,
+                existing_service_ids[inst.instance_id],
             )
-            if stdout:
-                for line in stdout.strip().split("\n"):
-                    LOG.info("  [%s] %s", instance.instance_id, line)
+            pmm.remove_service(existing_service_ids[inst.instance_id])
+        retried = setup.run(stale, setup_timeout(deadline), stats=stats)
+        for instance_id, result in retried.items():
+            if result is not None:
+                _log_output(instance_id, result[1])
+        results.update(retried)
 
-    if exit_code != 0:
+    failures: Dict[str, Optional[str]] = {}
+    for instance_id, result in results.items():
+        if result is None:
+            failures[instance_id] = "no result (not reachable or timed out)"
+        elif result[0] != 0:
+            failures[instance_id] = f"exit_code={result[0]}"
+        else:
+            failures[instance_id] = None
+            continue
         LOG.error(
-            "pmm-client setup failed on %s (exit_code=%d)",
-            instance.instance_id,
-            exit_code,
+            "pmm-client setup failed on %s: %s", instance_id, failures[instance_id]
         )
-        if stderr:
-            for line in stderr.strip().split("\n"):
-                LOG.error("  [%s] %s", instance.instance_id, line)
-        raise RuntimeError(
-            f"pmm-client setup failed on {instance.instance_id}: "
-            f"exit_code={exit_code}"
+        if result is not None:
+            _log_output(instance_id, result[1], ERROR)
+    return failures
+
+
+def apply_resolutions(pmm: PMMClient, metrics: Dict, service_names: List[str]) -> None:
+    """
+    Set the resolution preset on services that were just (re-)added.
+
+    ``pmm-admin add mysql`` registers the ``mysqld_exporter`` with the
+    server-wide resolutions, so the preset is applied through the PMM
+    inventory API right after the setup instead of waiting for the next
+    run to find the drift.
+
+    :param pmm: PMM client.
+    :param metrics: Metrics settings of the ASG.
+    :param service_names: Names of the services set up in this run.
+    """
+    if not metrics.get("resolution") or not service_names:
+        return
+    # The services and agents fetched at planning time predate the setup.
+    service_ids = {
+        svc.get("service_name"): svc.get("service_id") for svc in pmm.services
+    }
+    service_agents = agents_by_service(pmm.agents)
+    for svc_name in service_names:
+        agents = service_agents.get(service_ids.get(svc_name), {})
+        resolutions = resolution_drift(metrics, agents)
+        if resolutions is None:
+            continue
+        LOG.info("Setting metrics resolutions of %s: %s", svc_name, resolutions)
+        pmm.change_agent(
+            agents["mysqld_exporter"][0]["agent_id"],
+            "mysqld_exporter",
+            {"metrics_resolutions": resolutions},
         )
 
 
-def reconcile_asg(
+class ASGPlan(NamedTuple):
+    """
+    What a reconciliation run does with one ASG (see :func:`plan_asg`).
+
+    :param asg_config: ASG configuration dict (see :func:`reconcile_asg`).
+    :param instance_map: InService instances by expected service name.
+    :param existing_map: Service ID by name of the ASG's PMM services.
+    :param statuses: Probe statuses keyed by instance ID.
+    :param to_configure: Instances to set up by service name, with
+        whether their service is re-added.
+    :param retuning: Names of the services set up because their settings
+        drifted.
+    :param counts: ``skipped``, ``retuned`` and ``unreachable`` counts so
+        far.
+    """
+
+    asg_config: Dict
+    instance_map: Dict[str, ASGInstance]
+    existing_map: Dict[str, str]
+    statuses: Dict[str, Optional[Dict]]
+    to_configure: Dict[str, Tuple[ASGInstance, bool]]
+    retuning: Set[str]
+    counts: Dict[str, int]
+
+
+def plan_asg(
     asg_config: Dict,
     pmm: PMMClient,
-    pmm_host: str,
-    pmm_password: str,
     existing_services: List[Dict],
-) -> Tuple[int, int]:
+    service_agents: Optional[Dict[str, Dict[str, List[Dict]]]] = None,
+    members: Optional[Dict[str, Dict[str, str]]] = None,
+    ssm_stats: Optional[RequestStats] = None,
+    instances: Optional[List[ASGInstance]] = None,
+    statuses: Optional[Dict[str, Optional[Dict]]] = None,
+) -> ASGPlan:
     """
-    Reconcile a single ASG's instances with PMM services.
-
-    For NEW instances: installs pmm-client via SSM and configures monitoring.
-    For TERMINATED instances: removes the service via PMM HTTP API.
-    For EXISTING instances: skips (already configured).
+    Find the instances of an ASG that need the setup script.
 
-    Services are named ``{asg_name}/{hostname}`` where hostname is the
-    instance's private DNS short name (e.g., ``ip-10-0-1-42``).
-
-    :param asg_config: ASG configuration dict with keys: asg_name,
-        service_type, port, username.
-    :param pmm: PMMClient instance (for listing/removing services).
-    :param pmm_host: PMM server private IP for pmm-client config.
-    :param pmm_password: PMM admin password for pmm-client config.
-    :param existing_services: List of existing PMM service dicts.
-    :return: Tuple of (added_count, removed_count).
+    Metrics resolutions of healthy services are changed in place right
+    away. See :func:`reconcile_asg` for the parameters.
     """
     asg_name = asg_config["asg_name"]
     service_type = asg_config["service_type"]
-    port = asg_config["port"]
-    username = asg_config["username"]
+    qan = asg_config.get("qan") or {}
+    metrics = asg_config.get("metrics") or {}
 
     LOG.info("Reconciling ASG: %s (type=%s)", asg_name, service_type)
 
     # Get InService instances from ASG -- store ASGInstance objects
-    asg = ASG(asg_name, region=AWS_REGION)
-    instances = asg.instances
+    if instances is None:
+        instances = ASG(asg_name, region=AWS_REGION).instances
     instance_map: Dict[str, ASGInstance] = {}
     for inst in instances:
         expected_name = f"{asg_name}/{inst.hostname}"
         instance_map[expected_name] = inst
 
+    if members is not None:
+        members[asg_name] = {inst.instance_id: inst.hostname for inst in instances}
+
     LOG.info(
         "ASG %s has %d InService instances",
         asg_name,
@@ -333,50 +542,406 @@ def reconcile_asg(
         asg_name,
     )
 
-    # Ensure pmm-client is installed on all current instances.
-    # The script is idempotent -- it skips steps already done.
-    added = 0
+    # Phase 1: probe all instances in parallel with a short timeout.
+    if statuses is None:
+        statuses = probe_instances(list(instance_map.values()), stats=ssm_stats)
+    exporter = SERVICE_EXPORTERS[service_type]
+
+    # Phase 2: run the full (idempotent) setup script only where the
+    # probe found something missing.
+    skipped = 0
+    retuned = 0
+    unreachable = 0
+    to_configure: Dict[str, Tuple[ASGInstance, bool]] = {}
+    retuning = set()
     for svc_name, inst in instance_map.items():
+        status = statuses.get(inst.instance_id)
+        if status is None:
+            # Running the setup on an instance that cannot even answer
+            # the probe would only wait for its timeout.
+            LOG.warning(
+                "Skipping %s: %s did not answer the probe",
+                svc_name,
+                inst.instance_id,
+            )
+            unreachable += 1
+            continue
+        drift = []
+        server_drift = []
+        agents = {}
+        if svc_name in existing_map and service_agents is not None:
+            agents = service_agents.get(existing_map[svc_name], {})
+            drift = qan_drift(qan, agents) + collectors_drift(metrics, agents)
+        if svc_name in existing_map and status:
+            # Applied by the setup script itself; no need to re-add.
+            server_drift = rate_limit_drift(qan, status)
+        if drift or server_drift:
+            LOG.info(
+                "Settings of %s drifted: %s", svc_name, "; ".join(drift + server_drift)
+            )
+        if (
+            svc_name in existing_map
+            and not drift
+            and not server_drift
+            and not needs_configure(status, exporter)
+        ):
+            LOG.info(
+                "Skipping %s: pmm-client %s healthy",
+                svc_name,
+                status.get("version"),
+            )
+            skipped += 1
+            resolutions = resolution_drift(metrics, agents)
+            if resolutions is not None:
+                LOG.info("Setting metrics resolutions of %s: %s", svc_name, resolutions)
+                pmm.change_agent(
+                    agents["mysqld_exporter"][0]["agent_id"],
+                    "mysqld_exporter",
+                    {"metrics_resolutions": resolutions},
+                )
+                retuned += 1
+            continue
+
         LOG.info(
             "Ensuring pmm-client: %s (%s)",
             svc_name,
             inst.private_ip,
         )
         if service_type == "mysql":
-            ensure_pmm_client(
-                instance=inst,
-                pmm=pmm,
+            to_configure[svc_name] = (inst, bool(drift))
+            if drift or server_drift:
+                retuning.add(svc_name)
+
+    return ASGPlan(
+        asg_config=asg_config,
+        instance_map=instance_map,
+        existing_map=existing_map,
+        statuses=statuses,
+        to_configure=to_configure,
+        retuning=retuning,
+        counts={"skipped": skipped, "retuned": retuned, "unreachable": unreachable},
+    )
+
+
+def configure_asgs(
+    plans: List[ASGPlan],
+    pmm: PMMClient,
+    pmm_host: str,
+    pmm_password: str,
+    setup: Optional[SetupRunner] = None,
+    deadline: Optional[float] = None,
+    ssm_stats: Optional[RequestStats] = None,
+) -> Dict[str, Optional[str]]:
+    """
+    Run the setup script on the instances of all planned ASGs at once.
+
+    The instances of one ASG that are set up the same way share a config
+    (see :func:`setup_config`), so every ASG costs one or two multi-target
+    commands, and the setups of all ASGs run in parallel.
+
+    :param plans: Plans of the ASGs (see :func:`plan_asg`).
+    :param pmm: PMMClient for removing stale services.
+    :param pmm_host: PMM server private IP for pmm-client config.
+    :param pmm_password: PMM admin password for pmm-client config.
+    :param setup: Runs the setup script (see :func:`ensure_pmm_clients`).
+    :param deadline: ``monotonic()`` time by which setups must finish.
+        If it would not leave :data:`SETUP_MIN_SECONDS`, no setup is
+        started and all of them are deferred to the next run.
+    :param ssm_stats: If given, the latency of every setup is recorded in
+        it as ``setup``.
+    :return: Map of instance ID to ``None`` if its setup succeeded, or the
+        reason it failed. Deferred instances are not in it.
+    """
+    to_configure = [plan for plan in plans if plan.to_configure]
+    if not to_configure:
+        return {}
+    if setup_timeout(deadline) < SETUP_MIN_SECONDS:
+        for plan in to_configure:
+            LOG.warning(
+                "Deferring pmm-client setup of %d instances in %s to the next "
+                "run: %d seconds left",
+                len(plan.to_configure),
+                plan.asg_config["asg_name"],
+                setup_timeout(deadline),
+            )
+        return {}
+
+    # Instances set up the same way share a config, and so a command.
+    groups: Dict[str, List[ASGInstance]] = {}
+    existing_service_ids: Dict[str, str] = {}
+    for plan in to_configure:
+        asg_config = plan.asg_config
+        for svc_name, (inst, reregister) in plan.to_configure.items():
+            config = setup_config(
                 pmm_host=pmm_host,
                 pmm_password=pmm_password,
-                db_username=username,
-                port=port,
-                service_name=svc_name,
-                existing_service_id=existing_map.get(svc_name),
+                db_username=asg_config["username"],
+                port=asg_config["port"],
+                asg_name=asg_config["asg_name"],
+                qan=asg_config.get("qan") or {},
+                reregister=reregister,
+                metrics=asg_config.get("metrics") or {},
             )
-            if svc_name not in existing_map:
-                added += 1
+            groups.setdefault(config, []).append(inst)
+            if svc_name in plan.existing_map:
+                existing_service_ids[inst.instance_id] = plan.existing_map[svc_name]
+    return ensure_pmm_clients(
+        groups=groups,
+        pmm=pmm,
+        existing_service_ids=existing_service_ids,
+        setup=setup,
+        deadline=deadline,
+        stats=ssm_stats,
+    )
+
+
+def finish_asg(
+    plan: ASGPlan,
+    failures: Dict[str, Optional[str]],
+    pmm: PMMClient,
+    upgrade: Optional[RollingUpgrade] = None,
+    errors: Optional[List[str]] = None,
+) -> Dict[str, int]:
+    """
+    Count the setups of an ASG, remove its terminated instances and
+    advance its upgrade.
+
+    :param plan: Plan of the ASG (see :func:`plan_asg`).
+    :param failures: Setup results (see :func:`configure_asgs`).
+    :param pmm: PMMClient instance.
+    :param upgrade: Optional rolling upgrade to advance for this ASG.
+    :param errors: If given, setup failures are appended to it; otherwise
+        they are raised as :class:`RuntimeError` once the ASG is done.
+    :return: Counts, see :func:`reconcile_asg`.
+    """
+    asg_name = plan.asg_config["asg_name"]
+    metrics = plan.asg_config.get("metrics") or {}
+    existing_map = plan.existing_map
+    instance_map = plan.instance_map
+    retuned = plan.counts["retuned"]
+
+    added = 0
+    deferred = 0
+    setup_failures = []
+    for svc_name, (inst, _) in plan.to_configure.items():
+        if inst.instance_id not in failures:
+            deferred += 1
+        elif failures[inst.instance_id] is not None:
+            setup_failures.append(
+                f"{asg_name}: pmm-client setup failed on {inst.instance_id}: "
+                f"{failures[inst.instance_id]}"
+            )
+        elif svc_name not in existing_map:
+            added += 1
+        elif svc_name in plan.retuning:
+            retuned += 1
+    apply_resolutions(
+        pmm,
+        metrics,
+        [
+            svc_name
+            for svc_name, (inst, _) in plan.to_configure.items()
+            if inst.instance_id in failures and failures[inst.instance_id] is None
+        ],
+    )
 
     # Remove terminated instances via PMM API
-    removed = 0
-    to_remove = set(existing_map.keys()) - set(instance_map.keys())
+    to_remove = sorted(set(existing_map.keys()) - set(instance_map.keys()))
     for svc_name in to_remove:
-        service_id = existing_map[svc_name]
-        LOG.info("Removing service: %s (id=%s)", svc_name, service_id)
-        pmm.remove_service(service_id)
-        removed += 1
+        LOG.info("Removing service: %s (id=%s)", svc_name, existing_map[svc_name])
+    remove_failures = []
+    if to_remove:
+        remove_failures = [
+            (svc_name, error)
+            for svc_name, error in zip(
+                to_remove,
+                pmm.remove_services([existing_map[svc_name] for svc_name in to_remove]),
+            )
+            if error is not None
+        ]
+    removed = len(to_remove) - len(remove_failures)
+    if remove_failures:
+        svc_name, error = remove_failures[0]
+        LOG.error(
+            "Failed to remove %d services, first %s", len(remove_failures), svc_name
+        )
+        raise error
+
+    upgraded = 0
+    if upgrade is not None:
+        upgraded = upgrade.run(asg_name, list(instance_map.values()), plan.statuses)
 
     LOG.info(
-        "ASG %s: added %d, removed %d services",
+        "ASG %s: added %d, removed %d, retuned %d services, %d healthy skipped, "
+        "%d unreachable, %d deferred",
         asg_name,
         added,
         removed,
+        retuned,
+        plan.counts["skipped"],
+        plan.counts["unreachable"],
+        deferred,
+    )
+    if setup_failures:
+        if errors is None:
+            raise RuntimeError("; ".join(setup_failures))
+        errors.extend(setup_failures)
+    return {
+        "added": added,
+        "removed": removed,
+        "skipped": plan.counts["skipped"],
+        "retuned": retuned,
+        "upgraded": upgraded,
+        "unreachable": plan.counts["unreachable"],
+        "deferred": deferred,
+    }
+
+
+def reconcile_asg(
+    asg_config: Dict,
+    pmm: PMMClient,
+    pmm_host: str,
+    pmm_password: str,
+    existing_services: List[Dict],
+    upgrade: Optional[RollingUpgrade] = None,
+    service_agents: Optional[Dict[str, Dict[str, List[Dict]]]] = None,
+    members: Optional[Dict[str, Dict[str, str]]] = None,
+    ssm_stats: Optional[RequestStats] = None,
+    setup: Optional[SetupRunner] = None,
+    instances: Optional[List[ASGInstance]] = None,
+    statuses: Optional[Dict[str, Optional[Dict]]] = None,
+    deadline: Optional[float] = None,
+    errors: Optional[List[str]] = None,
+) -> Dict[str, int]:
+    """
+    Reconcile a single ASG's instances with PMM services.
+
+    Runs :func:`plan_asg`, :func:`configure_asgs` and :func:`finish_asg`
+    for one ASG; the Lambda handler runs the setups of all ASGs together.
+
+    All instances are probed first in parallel (see :func:`probe_instances`),
+    unless the caller already did.
+
+    For NEW or UNHEALTHY instances: installs pmm-client via SSM and
+    configures monitoring, on all of them in parallel (see
+    :func:`ensure_pmm_clients`).
+    For UNREACHABLE instances, which did not answer the probe: nothing is
+    run; they are reported and checked again by the next run.
+    For TERMINATED instances: removes the service via PMM HTTP API.
+    For EXISTING healthy instances: skips without running the setup script,
+    unless the service's QAN agents or disabled collectors no longer match
+    the ASG's ``qan`` and ``metrics`` settings, in which case the service
+    is re-added (see :func:`qan.qan_drift`, :func:`scrape.collectors_drift`).
+    If only the probed ``log_slow_rate_limit`` differs, the setup script
+    runs again without re-adding the service (see
+    :func:`qan.rate_limit_drift`). Metrics resolutions of healthy services
+    are changed in place through the PMM API (see
+    :func:`scrape.resolution_drift`).
+    If ``upgrade`` is given, outdated pmm-clients are then upgraded in
+    rolling batches (see :class:`upgrade.RollingUpgrade`).
+
+    Services are named ``{asg_name}/{hostname}`` where hostname is the
+    instance's private DNS short name (e.g., ``ip-10-0-1-42``).
+
+    :param asg_config: ASG configuration dict with keys: asg_name,
+        service_type, port, username and optionally qan and metrics.
+    :param pmm: PMMClient instance (for listing/removing services).
+    :param pmm_host: PMM server private IP for pmm-client config.
+    :param pmm_password: PMM admin password for pmm-client config.
+    :param existing_services: List of existing PMM service dicts.
+    :param upgrade: Optional rolling upgrade to advance for this ASG.
+    :param service_agents: PMM agents indexed by service ID (see
+        :func:`qan.agents_by_service`). Without it, QAN and metrics drift
+        are not checked.
+    :param members: If given, the ASG's instances are recorded in it as
+        ``{asg_name: {instance_id: hostname}}`` for the inventory snapshot.
+    :param ssm_stats: If given, the latency of the SSM probe (``probe``)
+        and setup commands (``setup``) is recorded in it.
+    :param setup: Runs the setup script (see :func:`ensure_pmm_clients`).
+    :param instances: InService instances of the ASG; listed if ``None``.
+    :param statuses: Probe statuses of ``instances``; probed if ``None``.
+    :param deadline: ``monotonic()`` time by which setups must finish.
+        Setups that would not get :data:`SETUP_MIN_SECONDS` are deferred
+        to the next run.
+    :param errors: If given, setup failures are appended to it; otherwise
+        they are raised as :class:`RuntimeError` once the ASG is done.
+    :return: Dict with ``added``, ``removed``, ``skipped``, ``retuned``,
+        ``upgraded``, ``unreachable`` and ``deferred`` counts.
+    """
+    ssm_stats = ssm_stats if ssm_stats is not None else RequestStats()
+    plan = plan_asg(
+        asg_config,
+        pmm,
+        existing_services,
+        service_agents=service_agents,
+        members=members,
+        ssm_stats=ssm_stats,
+        instances=instances,
+        statuses=statuses,
+    )
+    failures = configure_asgs(
+        [plan],
+        pmm,
+        pmm_host=pmm_host,
+        pmm_password=pmm_password,
+        setup=setup,
+        deadline=deadline,
+        ssm_stats=ssm_stats,
+    )
+    return finish_asg(plan, failures, pmm, upgrade=upgrade, errors=errors)
+
+
+def record_inventory(
+    services: List[Dict],
+    nodes: List[Dict],
+    agents: Dict[str, List[Dict]],
+    members: Dict[str, Dict[str, str]],
+) -> Dict[str, int]:
+    """
+    Store this run's inventory snapshot and log the changes since the last.
+
+    :param services: Services the run planned with.
+    :param nodes: Nodes the run planned with.
+    :param agents: Agents the run planned with, grouped by type.
+    :param members: Instances of each ASG.
+    :return: Change counts (see :func:`inventory.summarize`); empty for
+        the first snapshot.
+    """
+    s3_client = boto3.client("s3", region_name=AWS_REGION)
+    snapshot = take_snapshot(services, nodes, agents, members)
+    previous = load_latest(s3_client, INVENTORY_BUCKET)
+    key = save(s3_client, INVENTORY_BUCKET, snapshot)
+    LOG.info("Inventory snapshot saved to s3://%s/%s", INVENTORY_BUCKET, key)
+    if previous is None:
+        return {}
+    changes = diff(previous, snapshot)
+    counts = summarize(changes)
+    LOG.info("Inventory changes since %s: %s", previous["taken_at"], json.dumps(counts))
+    for kind in ("services", "asgs"):
+        if any(changes[kind].values()):
+            LOG.info("%s changes: %s", kind.capitalize(), json.dumps(changes[kind]))
+    return counts
+
+
+def record_history(record: Dict, function_name: str) -> None:
+    """
+    Append this run to the run history and publish its metrics.
+
+    :param record: Record of the run (see :func:`history.make_record`).
+    :param function_name: Reconciler function name, the metrics dimension.
+    """
+    store = S3HistoryStore(boto3.client("s3", region_name=AWS_REGION), HISTORY_BUCKET)
+    key = store.append(record)
+    LOG.info("Run history saved to s3://%s/%s", HISTORY_BUCKET, key)
+    boto3.client("cloudwatch", region_name=AWS_REGION).put_metric_data(
+        Namespace=NAMESPACE, MetricData=metric_data(record, function_name)
     )
-    return added, removed
 
 
 def lambda_handler(event: Dict, context: object) -> Dict:
     """
-    Lambda entry point. Reconciles all configured ASGs with PMM.
+    Lambda entry point. Reconciles all configured ASGs and RDS selectors
+    with PMM.
 
     :param event: Lambda event (from EventBridge schedule).
     :param context: Lambda context object.
@@ -384,58 +949,246 @@ def lambda_handler(event: Dict, context: object) -> Dict:
     """
     LOG.info("Starting PMM ASG reconciliation")
     LOG.info("PMM host: %s", PMM_HOST)
-
-    asg_configs = json.loads(MONITORED_ASGS_CONFIG)
-    if not asg_configs:
-        LOG.info("No ASGs configured, nothing to do")
-        return {"status": "ok", "message": "No ASGs configured"}
-
-    # Get PMM admin password and create client
-    pmm_password = Secret(PMM_ADMIN_SECRET_ARN, region=AWS_REGION).value
-    pmm = PMMClient(
-        base_url=f"http://{PMM_HOST}",
-        username="admin",
-        password=pmm_password,
+    timer = PhaseTimer()
+    # The remaining time at the start is the function's timeout.
+    timeout = (
+        context.get_remaining_time_in_millis() / 1000
+        if hasattr(context, "get_remaining_time_in_millis")
+        else 300
     )
+    end = monotonic() + timeout - timer.elapsed
 
-    # Get all existing services once
-    existing_services = pmm.services
+    asg_configs = json.loads(MONITORED_ASGS_CONFIG)
+    rds_configs = json.loads(MONITORED_RDS_CONFIG)
+    if not asg_configs and not rds_configs:
+        LOG.info("No ASGs or RDS selectors configured, nothing to do")
+        return {"status": "ok", "message": "No ASGs or RDS selectors configured"}
 
-    total_added = 0
-    total_removed = 0
+    totals = {
+        "checked": 0,
+        "added": 0,
+        "removed": 0,
+        "skipped": 0,
+        "retuned": 0,
+        "upgraded": 0,
+        "unreachable": 0,
+        "deferred": 0,
+        "rds_added": 0,
+        "rds_removed": 0,
+    }
     errors = []
+    ssm_stats = RequestStats()
+    pmm = None
+    try:
+        # Get PMM admin password and create client
+        pmm_password = Secret(PMM_ADMIN_SECRET_ARN, region=AWS_REGION).value
+        pmm = PMMClient(
+            base_url=f"http://{PMM_HOST}",
+            username="admin",
+            password=pmm_password,
+        )
 
-    for asg_config in asg_configs:
-        try:
-            added, removed = reconcile_asg(
-                asg_config,
-                pmm,
-                pmm_host=PMM_HOST,
-                pmm_password=pmm_password,
-                existing_services=existing_services,
+        # Get all existing services and their agents once, and the nodes for
+        # the inventory snapshot, before the run changes any of them
+        existing_services = pmm.services
+        agents = pmm.agents
+        nodes = pmm.nodes if INVENTORY_BUCKET else []
+        service_agents = agents_by_service(agents)
+        asg_services = group_by_asg(
+            existing_services, [asg_config["asg_name"] for asg_config in asg_configs]
+        )
+        members: Dict[str, Dict[str, str]] = {}
+        setup = SetupRunner(SETUP_DOCUMENT or None, SETUP_DOCUMENT_VERSION or None)
+
+        # Leave enough of the Lambda timeout for the last setup or upgrade
+        # batch to finish, and for the phases after them and the history.
+        run_rds = bool(rds_configs or unconfigured(rds_configs, existing_services))
+        tail_phases = run_rds + GC_ENABLED + bool(INVENTORY_BUCKET)
+        deadline = end - HISTORY_SECONDS - TAIL_PHASE_SECONDS * tail_phases
+        upgrade = None
+        if PMM_CLIENT_UPGRADE_ENABLED:
+            upgrade = RollingUpgrade(
+                pmm=pmm,
+                target_version=PMM_CLIENT_TARGET_VERSION or pmm.server_version,
+                batch_size=PMM_CLIENT_UPGRADE_BATCH_SIZE,
+                max_unavailable=PMM_CLIENT_UPGRADE_MAX_UNAVAILABLE,
+                parameter_name=UPGRADE_STATE_PARAMETER,
+                region=AWS_REGION,
+                deadline=deadline,
             )
-            total_added += added
-            total_removed += removed
-        except (requests.exceptions.RequestException, TimeoutError) as exc:
-            LOG.error(
-                "Failed to reconcile ASG %s: %s",
-                asg_config["asg_name"],
-                exc,
+            upgrade.load()
+            LOG.info("Rolling pmm-client upgrade to %s enabled", upgrade.target_version)
+        timer.lap("setup")
+
+        try:
+            # Probe the instances of all ASGs at once, so the probe timeout
+            # is paid once per run rather than once per ASG.
+            asg_instances = {
+                asg_config["asg_name"]: ASG(
+                    asg_config["asg_name"], region=AWS_REGION
+                ).instances
+                for asg_config in asg_configs
+            }
+            statuses = probe_instances(
+                [inst for instances in asg_instances.values() for inst in instances],
+                stats=ssm_stats,
             )
-            errors.append(f"{asg_config['asg_name']}: {str(exc)}")
+            timer.lap("probe")
+            plans: List[ASGPlan] = []
+            for asg_config in asg_configs:
+                try:
+                    plans.append(
+                        plan_asg(
+                            asg_config,
+                            pmm,
+                            existing_services=asg_services[asg_config["asg_name"]],
+                            service_agents=service_agents,
+                            members=members,
+                            ssm_stats=ssm_stats,
+                            instances=asg_instances[asg_config["asg_name"]],
+                            statuses=statuses,
+                        )
+                    )
+                except (requests.exceptions.RequestException, TimeoutError) as exc:
+                    LOG.error(
+                        "Failed to reconcile ASG %s: %s",
+                        asg_config["asg_name"],
+                        exc,
+                    )
+                    errors.append(f"{asg_config['asg_name']}: {str(exc)}")
+                timer.lap(f"asg:{asg_config['asg_name']}")
 
-    result = {
-        "status": "error" if errors else "ok",
-        "added": total_added,
-        "removed": total_removed,
-        "errors": errors,
-    }
-    LOG.info("Reconciliation complete: %s", json.dumps(result))
+            # Set up the instances of all ASGs together, so a cold start or
+            # a mass scale-out is not deferred ASG by ASG.
+            failures: Dict[str, Optional[str]] = {}
+            try:
+                failures = configure_asgs(
+                    plans,
+                    pmm,
+                    pmm_host=PMM_HOST,
+                    pmm_password=pmm_password,
+                    setup=setup,
+                    deadline=deadline,
+                    ssm_stats=ssm_stats,
+                )
+            except (requests.exceptions.RequestException, TimeoutError) as exc:
+                LOG.error("Failed to set up pmm-clients: %s", exc)
+                errors.append(f"setup: {str(exc)}")
+            timer.lap("configure")
+
+            for plan in plans:
+                asg_name = plan.asg_config["asg_name"]
+                try:
+                    counts = finish_asg(
+                        plan, failures, pmm, upgrade=upgrade, errors=errors
+                    )
+                    for key, value in counts.items():
+                        totals[key] += value
+                except (requests.exceptions.RequestException, TimeoutError) as exc:
+                    LOG.error("Failed to reconcile ASG %s: %s", asg_name, exc)
+                    errors.append(f"{asg_name}: {str(exc)}")
+                timer.lap(f"asg:{asg_name}")
+            totals["checked"] = sum(len(instances) for instances in members.values())
+
+            # Also run without selectors to remove the services they left.
+            if run_rds and not tail_phase_skipped("rds", end, errors):
+                try:
+                    counts, rds_errors = reconcile_rds(
+                        rds_configs,
+                        pmm,
+                        rds_client=boto3.client("rds", region_name=AWS_REGION),
+                        existing_services=existing_services,
+                        get_credentials=lambda arn: Secret(
+                            arn, region=AWS_REGION
+                        ).value,
+                        region=AWS_REGION,
+                    )
+                    for key, value in counts.items():
+                        totals[key] += value
+                    errors.extend(rds_errors)
+                except (requests.exceptions.RequestException, ClientError) as exc:
+                    LOG.error("Failed to reconcile RDS databases: %s", exc)
+                    errors.append(f"rds: {str(exc)}")
+                timer.lap("rds")
+            if GC_ENABLED and not tail_phase_skipped("gc", end, errors):
+                collector = OrphanCollector(
+                    pmm,
+                    parameter_name=GC_STATE_PARAMETER,
+                    region=AWS_REGION,
+                    min_age=GC_MIN_AGE_SECONDS,
+                    max_deletions=GC_MAX_DELETIONS,
+                )
+                try:
+                    collector.load()
+                    gc_report = collector.run(
+                        [asg_config["asg_name"] for asg_config in asg_configs]
+                    )
+                    collector.save()
+                    LOG.info("Orphan collection: %s", json.dumps(gc_report))
+                    totals["gc_nodes_removed"] = gc_report["nodes_removed"]
+                    totals["gc_agents_removed"] = gc_report["agents_removed"]
+                    totals["gc_scrape_targets_removed"] = gc_report[
+                        "scrape_targets_removed"
+                    ]
+                except (requests.exceptions.RequestException, ClientError) as exc:
+                    LOG.error("Failed to collect orphaned nodes: %s", exc)
+                    errors.append(f"gc: {str(exc)}")
+                timer.lap("gc")
+        finally:
+            if upgrade is not None:
+                upgrade.save()
+
+        inventory_changes = {}
+        if INVENTORY_BUCKET and not tail_phase_skipped("inventory", end, errors):
+            try:
+                inventory_changes = record_inventory(
+                    existing_services, nodes, agents, members
+                )
+            except (
+                requests.exceptions.RequestException,
+                ClientError,
+                ValueError,
+            ) as exc:
+                # Auditing only; the reconciliation itself succeeded.
+                LOG.warning("Failed to record the inventory snapshot: %s", exc)
+            timer.lap("inventory")
+
+        result = {
+            "status": "error" if errors else "ok",
+            **totals,
+            "inventory_changes": inventory_changes,
+            "errors": errors,
+        }
+        LOG.info("Reconciliation complete: %s", json.dumps(result))
+        LOG.info("PMM API latency: %s", json.dumps(pmm.stats.summary()))
+    except Exception as exc:
+        # Count it in the run history before it fails the invocation.
+        errors.append(f"{type(exc).__name__}: {exc}")
+        raise
+    finally:
+        record = make_record(
+            timer,
+            timeout,
+            totals,
+            errors,
+            ssm_stats.summary(),
+            pmm.stats.summary() if pmm is not None else {},
+        )
+        LOG.info("SSM latency: %s", json.dumps(record["ssm"]))
+        LOG.info("Phase durations: %s", json.dumps(record["phases"]))
+        if HISTORY_BUCKET:
+            try:
+                record_history(
+                    record, getattr(context, "function_name", "pmm-reconciler")
+                )
+            except (BotoCoreError, ClientError) as exc:
+                # Trend data only; the reconciliation itself is done, and
+                # an error raised here would replace the one propagating.
+                LOG.warning("Failed to record the run history: %s", exc)
 
     if errors:
         raise RuntimeError(
-            f"Reconciliation failed for {len(errors)} ASG(s): "
-            + "; ".join(errors)
+            f"Reconciliation failed with {len(errors)} error(s): " + "; ".join(errors)
         )
 
     return result
@@ -0,0 +1,381 @@
+"""
+Garbage collection of orphaned PMM nodes and agents.
+
+``reconcile_asg()`` removes the services of terminated instances, but
+their nodes and pmm-agents stay in the PMM inventory. Over months of ASG
+churn they bloat every inventory call and the VictoriaMetrics series
+count. After each reconciliation, a node is an orphan when:
+
+- nothing uses it: no service runs on it and no connected pmm-agent
+  runs on it (``unused``), or
+- it carries services of a monitored ASG, but no EC2 instance (pending,
+  running, stopping or stopped) has its address any more
+  (``instance-gone``).
+
+pmm-agents whose node no longer exists are orphans too (``node-gone``).
+An orphan is deleted (``force=true``, with everything on it) only after
+it was found orphaned for ``min_age`` seconds. When an orphan was first
+seen is kept in an SSM parameter between runs, keyed by node ID or by
+``agent:`` and the agent ID. At most ``max_deletions`` orphans are
+deleted per run, concurrently over the client's connection pool.
+"""
+
+import json
+import time
+from logging import getLogger
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple
+
+import boto3
+from botocore.exceptions import ClientError
+
+from inventory import group_by_asg
+from pmm_client import PMMClient
+
+LOG = getLogger(__name__)
+
+SERVER_NODE_ID = "pmm-server"
+
+# Instance states in which a node's host may come back.
+LIVE_INSTANCE_STATES = ["pending", "running", "stopping", "stopped"]
+
+# Prefix of the orphan keys of dangling pmm-agents, see agent_orphans().
+AGENT_KEY_PREFIX = "agent:"
+
+# Candidates remembered between runs; keeps the state within the 4 KB
+# of a standard SSM parameter.
+MAX_TRACKED = 60
+
+
+class Orphan(NamedTuple):
+    """
+    A node, or a dangling pmm-agent, found orphaned.
+
+    For a pmm-agent ``node_id`` is its key (see :func:`agent_orphans`)
+    and ``node_name`` the agent ID.
+    """
+
+    node_id: str
+    node_name: str
+    reason: str
+
+
+def connected_nodes(agents: Dict[str, List[Dict]]) -> Set[str]:
+    """IDs of the nodes a connected pmm-agent runs on."""
+    return {
+        agent["runs_on_node_id"]
+        for agent in agents.get("pmm_agent", [])
+        if agent.get("connected") and agent.get("runs_on_node_id")
+    }
+
+
+def managed_nodes(services: List[Dict], asg_names: Iterable[str]) -> Set[str]:
+    """IDs of the nodes running services of the monitored ASGs."""
+    return {
+        svc["node_id"]
+        for asg_services in group_by_asg(services, asg_names).values()
+        for svc in asg_services
+        if svc.get("node_id")
+    }
+
+
+def live_addresses(ec2_client, addresses: Iterable[str]) -> Set[str]:
+    """
+    Private IP addresses that belong to an EC2 instance that may still run.
+
+    :param ec2_client: boto3 EC2 client.
+    :param addresses: Addresses to look up.
+    :return: The addresses that do.
+    """
+    addresses = sorted(set(addresses))
+    found: Set[str] = set()
+    paginator = ec2_client.get_paginator("describe_instances")
+    # DescribeInstances accepts up to 200 values per filter.
+    for start in range(0, len(addresses), 200):
+        for page in paginator.paginate(
+            Filters=[
+                {
+                    "Name": "private-ip-address",
+                    "Values": addresses[start : start + 200],
+                },
+                {"Name": "instance-state-name", "Values": LIVE_INSTANCE_STATES},
+            ]
+        ):
+            for reservation in page["Reservations"]:
+                for instance in reservation["Instances"]:
+                    found.add(instance.get("PrivateIpAddress"))
+    return found
+
+
+def find_orphans(
+    nodes: List[Dict],
+    agents: Dict[str, List[Dict]],
+    services: List[Dict],
+    managed: Set[str],
+    live: Set[str],
+) -> List[Orphan]:
+    """
+    Orphaned nodes of an inventory.
+
+    :param nodes: :attr:`PMMClient.nodes`.
+    :param agents: :attr:`PMMClient.agents`, grouped by type.
+    :param services: :attr:`PMMClient.services`.
+    :param managed: Nodes of monitored ASGs (see :func:`managed_nodes`).
+    :param live: Addresses of existing instances (see :func:`live_addresses`).
+    :return: Orphans, in node order.
+    """
+    used = {svc["node_id"] for svc in services if svc.get("node_id")}
+    connected = connected_nodes(agents)
+    orphans = []
+    for node in nodes:
+        node_id = node["node_id"]
+        if node_id == SERVER_NODE_ID:
+            continue
+        if node_id not in used and node_id not in connected:
+            reason = "unused"
+        elif node_id in managed and node.get("address") not in live:
+            reason = "instance-gone"
+        else:
+            continue
+        orphans.append(Orphan(node_id, node.get("node_name", ""), reason))
+    return orphans
+
+
+def dangling_agents(nodes: List[Dict], agents: Dict[str, List[Dict]]) -> List[str]:
+    """IDs of the pmm-agents whose node no longer exists."""
+    node_ids = {node["node_id"] for node in nodes}
+    return sorted(
+        agent["agent_id"]
+        for agent in agents.get("pmm_agent", [])
+        if agent.get("runs_on_node_id") not in node_ids
+    )
+
+
+def agent_orphans(agent_ids: Iterable[str]) -> List[Orphan]:
+    """Orphans of dangling pmm-agents, to select them like nodes."""
+    return [
+        Orphan(f"{AGENT_KEY_PREFIX}{agent_id}", agent_id, "node-gone")
+        for agent_id in agent_ids
+    ]
+
+
+def agents_on(
+    agents: Dict[str, List[Dict]], services: List[Dict], node_ids: Set[str]
+) -> List[Tuple[str, Dict]]:
+    """
+    Agents removed together with some nodes.
+
+    :param agents: Agents grouped by type.
+    :param services: Services.
+    :param node_ids: Nodes.
+    :return: ``(agent_type, agent)`` of the pmm-agents running on the
+        nodes, and of the agents of those pmm-agents, nodes or their
+        services.
+    """
+    service_ids = {
+        svc["service_id"] for svc in services if svc.get("node_id") in node_ids
+    }
+    pmm_agent_ids = {
+        agent["agent_id"]
+        for agent in agents.get("pmm_agent", [])
+        if agent.get("runs_on_node_id") in node_ids
+    }
+    return [
+        (agent_type, agent)
+        for agent_type, entries in agents.items()
+        for agent in entries
+        if agent.get("agent_id") in pmm_agent_ids
+        or agent.get("pmm_agent_id") in pmm_agent_ids
+        or agent.get("node_id") in node_ids
+        or agent.get("service_id") in service_ids
+    ]
+
+
+def scrape_targets(agents: List[Tuple[str, Dict]]) -> int:
+    """Number of exporters, each a target PMM scrapes, among some agents."""
+    return sum(1 for agent_type, _ in agents if agent_type.endswith("_exporter"))
+
+
+def select_due(
+    orphans: List[Orphan],
+    first_seen: Dict[str, float],
+    now: float,
+    min_age: float,
+    max_deletions: int,
+) -> Tuple[List[Orphan], Dict[str, float]]:
+    """
+    Orphans old enough to delete.
+
+    :param orphans: Orphans found in this run.
+    :param first_seen: When each orphan was first found.
+    :param now: Current Unix time.
+    :param min_age: Seconds an orphan must stay orphaned.
+    :param max_deletions: Max orphans returned.
+    :return: The due orphans, oldest first, and the updated
+        ``first_seen`` (orphans no longer found are forgotten).
+    """
+    seen = {orphan.node_id: first_seen.get(orphan.node_id, now) for orphan in orphans}
+    # Remember the oldest candidates if there are too many.
+    seen = dict(sorted(seen.items(), key=lambda item: item[1])[:MAX_TRACKED])
+    due = sorted(
+        (
+            orphan
+            for orphan in orphans
+            if orphan.node_id in seen and now - seen[orphan.node_id] >= min_age
+        ),
+        key=lambda orphan: seen[orphan.node_id],
+    )
+    return due[:max_deletions], seen
+
+
+class OrphanCollector:
+    """
+    Finds and deletes orphaned PMM nodes and agents.
+
+    :param pmm: PMM client.
+    :param parameter_name: SSM parameter that stores when orphans were
+        first found.
+    :param region: AWS region of the parameter and the instances.
+    :param min_age: Seconds an orphan must stay orphaned before deletion.
+    :param max_deletions: Max nodes and pmm-agents deleted per run.
+    """
+
+    def __init__(
+        self,
+        pmm: PMMClient,
+        parameter_name: str,
+        region: str,
+        min_age: float,
+        max_deletions: int,
+    ):
+        self._pmm = pmm
+        self._parameter_name = parameter_name
+        self._ssm = boto3.client("ssm", region_name=region)
+        self._ec2 = boto3.client("ec2", region_name=region)
+        self._min_age = min_age
+        self._max_deletions = max(max_deletions, 0)
+        self._first_seen: Dict[str, float] = {}
+
+    def load(self) -> None:
+        """Read the orphans found by previous runs."""
+        try:
+            response = self._ssm.get_parameter(Name=self._parameter_name)
+            self._first_seen = json.loads(response["Parameter"]["Value"] or "{}")
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] != "ParameterNotFound":
+                raise
+            self._first_seen = {}
+
+    def save(self) -> None:
+        """Persist the orphans for the next run."""
+        self._ssm.put_parameter(
+            Name=self._parameter_name,
+            Value=json.dumps(self._first_seen, separators=(",", ":")),
+            Type="String",
+            Overwrite=True,
+        )
+
+    def run(self, asg_names: List[str]) -> Dict:
+        """
+        Collect orphans, reading the current inventory.
+
+        :param asg_names: Monitored ASGs.
+        :return: Report: ``orphans`` found, ``nodes_removed``,
+            ``agents_removed``, ``scrape_targets_removed``, ``failed``,
+            and inventory sizes ``before`` and ``after``.
+        """
+        # Nodes last: an agent or service registered meanwhile cannot
+        # point to a node missing from the list.
+        agents = self._pmm.agents
+        services = self._pmm.services
+        nodes = self._pmm.nodes
+        managed = managed_nodes(services, asg_names)
+        addresses = [
+            node["address"]
+            for node in nodes
+            if node["node_id"] in managed and node.get("address")
+        ]
+        live = live_addresses(self._ec2, addresses) if addresses else set()
+
+        node_orphans = find_orphans(nodes, agents, services, managed, live)
+        dangling = agent_orphans(dangling_agents(nodes, agents))
+        due, self._first_seen = select_due(
+            node_orphans + dangling,
+            {key: float(value) for key, value in self._first_seen.items()},
+            time.time(),
+            self._min_age,
+            self._max_deletions,
+        )
+        due_agents = [
+            orphan for orphan in due if orphan.node_id.startswith(AGENT_KEY_PREFIX)
+        ]
+        due_nodes = [orphan for orphan in due if orphan not in due_agents]
+        LOG.info(
+            "Orphans: %d nodes, %d dangling pmm-agents (%d due for deletion)",
+            len(node_orphans),
+            len(dangling),
+            len(due),
+        )
+
+        removed: Set[str] = set()
+        failed = 0
+        results = self._pmm.remove_nodes([orphan.node_id for orphan in due_nodes])
+        for orphan, error in zip(due_nodes, results):
+            if error is not None:
+                LOG.error("Failed to remove node %s: %s", orphan.node_name, error)
+                failed += 1
+                continue
+            LOG.info(
+                "Removed orphaned node %s (%s, %s)",
+                orphan.node_name,
+                orphan.node_id,
+                orphan.reason,
+            )
+            removed.add(orphan.node_id)
+            self._first_seen.pop(orphan.node_id, None)
+
+        removed_agents: Set[str] = set()
+        agent_ids = [orphan.node_name for orphan in due_agents]
+        results = self._pmm.remove_agents(agent_ids)
+        for orphan, error in zip(due_agents, results):
+            if error is not None:
+                LOG.error("Failed to remove pmm-agent %s: %s", orphan.node_name, error)
+                failed += 1
+                continue
+            LOG.info("Removed dangling pmm-agent %s", orphan.node_name)
+            removed_agents.add(orphan.node_name)
+            self._first_seen.pop(orphan.node_id, None)
+
+        # Removing a node or agent with force=true removes what runs on it.
+        all_agents = [
+            (agent_type, agent)
+            for agent_type, entries in agents.items()
+            for agent in entries
+        ]
+        gone_agents = agents_on(agents, services, removed) + [
+            (agent_type, agent)
+            for agent_type, agent in all_agents
+            if agent.get("agent_id") in removed_agents
+            or agent.get("pmm_agent_id") in removed_agents
+        ]
+        gone_services = sum(1 for svc in services if svc.get("node_id") in removed)
+        report = {
+            "orphans": len(node_orphans) + len(dangling),
+            "nodes_removed": len(removed),
+            "agents_removed": len(gone_agents),
+            "scrape_targets_removed": scrape_targets(gone_agents),
+            "failed": failed,
+            "before": {
+                "nodes": len(nodes),
+                "agents": len(all_agents),
+                "services": len(services),
+                "scrape_targets": scrape_targets(all_agents),
+            },
+        }
+        report["after"] = {
+            "nodes": len(nodes) - len(removed),
+            "agents": len(all_agents) - report["agents_removed"],
+            "services": len(services) - gone_services,
+            "scrape_targets": scrape_targets(all_agents)
+            - report["scrape_targets_removed"],
+        }
+        return report
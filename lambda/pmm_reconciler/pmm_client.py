@@ -0,0 +1,526 @@
+"""
+Client for the Percona Monitoring and Management (PMM) HTTP API.
+
+One module shared by the reconciler Lambda, the tools in ``pmm_tools``
+and the integration tests. :class:`PMMClient` keeps a pool of keep-alive
+connections and is safe to use from many threads; its bulk helpers run
+requests concurrently over that pool. :class:`AsyncPMMClient` offers the
+same operations as coroutines for asyncio callers. Both record the
+latency of every request in :class:`RequestStats`.
+"""
+
+import asyncio
+import threading
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class RequestStats:
+    """
+    Latency of PMM API requests, per operation. Thread safe.
+    """
+
+    def __init__(self):
+        self._latencies: Dict[str, List[float]] = {}
+        self._errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, seconds: float, failed: bool = False) -> None:
+        """
+        Record one request.
+
+        :param operation: Operation name, e.g. ``add_service``.
+        :param seconds: Request duration.
+        :param failed: Whether the request failed.
+        """
+        with self._lock:
+            self._latencies.setdefault(operation, []).append(seconds)
+            self._errors[operation] = self._errors.get(operation, 0) + int(failed)
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        Latency summary.
+
+        :return: Dict of operation to ``count``, ``errors``, ``mean_ms``,
+            ``p95_ms`` and ``max_ms``.
+        """
+        with self._lock:
+            latencies = {
+                name: sorted(values) for name, values in self._latencies.items()
+            }
+            errors = dict(self._errors)
+        return {
+            name: {
+                "count": len(values),
+                "errors": errors[name],
+                "mean_ms": round(1000 * sum(values) / len(values), 1),
+                "p95_ms": round(1000 * values[int(0.95 * (len(values) - 1))], 1),
+                "max_ms": round(1000 * values[-1], 1),
+            }
+            for name, values in sorted(latencies.items())
+        }
+
+
+class PMMClient:
+    """
+    Client for the Percona Monitoring and Management (PMM) HTTP API.
+
+    Used for listing services, agents and nodes, adding remote services,
+    removing services for terminated instances and deleted databases,
+    reading the server version, and querying and exporting PMM's metrics.
+
+    :param base_url: PMM server base URL (e.g., ``http://10.0.1.5``).
+    :type base_url: str
+    :param username: PMM admin username.
+    :type username: str
+    :param password: PMM admin password.
+    :type password: str
+    :param timeout: HTTP request timeout in seconds.
+    :type timeout: int
+    :param pool_size: Connections kept open to the server. Requests share
+        them, so set it to the number of threads using the client.
+    :type pool_size: int
+    :param verify: Verify the server's TLS certificate.
+    :type verify: bool
+    :param stats: Latency statistics to record requests in; a new one by
+        default. Available as :attr:`stats`.
+    :type stats: RequestStats
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        username: str,
+        password: str,
+        timeout: int = 30,
+        pool_size: int = 10,
+        verify: bool = True,
+        stats: Optional[RequestStats] = None,
+    ):
+        self._base_url = base_url.rstrip("/")
+        self._timeout = timeout
+        encoded = b64encode(f"{username}:{password}".encode()).decode()
+        self._headers = {
+            "Authorization": f"Basic {encoded}",
+            "Content-Type": "application/json",
+        }
+        self._session = requests.Session()
+        self._session.verify = verify
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self.pool_size = pool_size
+        self.stats = stats or RequestStats()
+
+    def _request(
+        self, operation: str, method: str, path: str, **kwargs
+    ) -> requests.Response:
+        """
+        Send a request to the PMM API and record its latency.
+
+        :param operation: Operation name for :attr:`stats`.
+        :param method: HTTP method.
+        :param path: URL path, e.g. ``/v1/management/services``.
+        :param kwargs: Passed to :meth:`requests.Session.request`; the
+            client's ``timeout`` unless one is given.
+        :return: Successful response.
+        :raise requests.exceptions.RequestException: If the request
+            failed or PMM returned an error status.
+        """
+        started = perf_counter()
+        failed = True
+        try:
+            response = self._session.request(
+                method,
+                f"{self._base_url}{path}",
+                headers=self._headers,
+                **{"timeout": self._timeout, **kwargs},
+            )
+            response.raise_for_status()
+            failed = False
+            return response
+        finally:
+            self.stats.record(operation, perf_counter() - started, failed)
+
+    @property
+    def services(self) -> List[Dict]:
+        """
+        List all services registered in PMM.
+
+        :return: List of service dicts from the PMM API.
+        """
+        response = self._request("list_services", "GET", "/v1/management/services")
+        return response.json().get("services", [])
+
+    @property
+    def pmm_agents(self) -> List[Dict]:
+        """
+        List all pmm-agent entries from the PMM agents inventory.
+
+        :return: List of pmm-agent dicts (``agent_id``, ``runs_on_node_id``,
+            ``connected``, ...).
+        """
+        response = self._request(
+            "list_pmm_agents",
+            "GET",
+            "/v1/inventory/agents",
+            params={"agent_type": "AGENT_TYPE_PMM_AGENT"},
+        )
+        return response.json().get("pmm_agent", [])
+
+    @property
+    def agents(self) -> Dict[str, List[Dict]]:
+        """
+        List all agents from the PMM inventory, grouped by agent type.
+
+        :return: Dict of agent type (``mysqld_exporter``,
+            ``qan_mysql_perfschema_agent``, ...) to a list of agent dicts.
+        """
+        response = self._request("list_agents", "GET", "/v1/inventory/agents")
+        return {
+            agent_type: agents
+            for agent_type, agents in response.json().items()
+            if isinstance(agents, list)
+        }
+
+    @property
+    def nodes(self) -> List[Dict]:
+        """
+        List all nodes from the PMM inventory, regardless of node type.
+
+        :return: List of node dicts (``node_id``, ``node_name``, ...).
+        """
+        response = self._request("list_nodes", "GET", "/v1/inventory/nodes")
+        # The response groups nodes by type: {"generic": [...], "remote": [...]}
+        return [
+            node
+            for nodes in response.json().values()
+            if isinstance(nodes, list)
+            for node in nodes
+        ]
+
+    @property
+    def server_version(self) -> str:
+        """
+        PMM server version, e.g. ``3.1.0``.
+
+        :return: Version string reported by the server.
+        """
+        response = self._request("server_version", "GET", "/v1/server/version")
+        return response.json().get("version", "")
+
+    def query(self, query: str) -> List[Dict]:
+        """
+        Evaluate a PromQL instant query in PMM's VictoriaMetrics.
+
+        :param query: PromQL expression, e.g.
+            ``sum(rate(vm_rows_inserted_total[5m]))``.
+        :return: Result vector: dicts with ``metric`` and ``value``
+            (``[timestamp, "value"]``).
+        """
+        response = self._request(
+            "query", "GET", "/prometheus/api/v1/query", params={"query": query}
+        )
+        return response.json().get("data", {}).get("result", [])
+
+    def export(
+        self,
+        matches: Sequence[str],
+        start: str,
+        end: str,
+        timeout: Optional[float] = None,
+    ) -> requests.Response:
+        """
+        Stream raw samples from VictoriaMetrics' export API.
+
+        :param matches: Series selectors, e.g. ``{__name__=~"node_.*"}``.
+        :param start: Start, Unix time or RFC 3339, inclusive.
+        :param end: End, Unix time or RFC 3339, inclusive.
+        :param timeout: HTTP timeout in seconds; the client's by default.
+        :return: Streamed response with one JSON series per line, see
+            :meth:`requests.Response.iter_lines`. Close it when done.
+        """
+        return self._request(
+            "export",
+            "GET",
+            "/prometheus/api/v1/export",
+            params={"match[]": list(matches), "start": start, "end": end},
+            stream=True,
+            timeout=timeout or self._timeout,
+        )
+
+    def remove_service(self, service_id: str) -> None:
+        """
+        Remove a service from PMM inventory.
+
+        :param service_id: PMM service ID to remove.
+        """
+        self._request(
+            "remove_service",
+            "DELETE",
+            f"/v1/inventory/services/{service_id}",
+            params={"force": "true"},
+        )
+
+    def add_service(self, payload: Dict) -> Dict:
+        """
+        Add a service through the PMM management API.
+
+        :param payload: Request body keyed by service type, e.g.
+            ``{"postgresql": {"service_name": ..., "add_node": {...}}}``.
+        :return: Response with the created service and agents.
+        """
+        response = self._request(
+            "add_service",
+            "POST",
+            "/v1/management/services",
+            json=payload,
+        )
+        return response.json()
+
+    def remove_node(self, node_id: str) -> None:
+        """
+        Remove a node, and anything still running on it, from PMM inventory.
+
+        :param node_id: PMM node ID to remove.
+        """
+        self._request(
+            "remove_node",
+            "DELETE",
+            f"/v1/inventory/nodes/{node_id}",
+            params={"force": "true"},
+        )
+
+    def remove_agent(self, agent_id: str) -> None:
+        """
+        Remove an agent, and the agents it runs, from PMM inventory.
+
+        :param agent_id: PMM agent ID to remove.
+        """
+        self._request(
+            "remove_agent",
+            "DELETE",
+            f"/v1/inventory/agents/{agent_id}",
+            params={"force": "true"},
+        )
+
+    def change_agent(self, agent_id: str, agent_type: str, changes: Dict) -> Dict:
+        """
+        Change attributes of an agent in PMM inventory.
+
+        :param agent_id: PMM agent ID.
+        :param agent_type: Agent type key of the request, e.g.
+            ``mysqld_exporter``.
+        :param changes: Attributes to change, e.g.
+            ``{"metrics_resolutions": {"hr": "15s"}}``.
+        :return: Response with the changed agent.
+        """
+        response = self._request(
+            "change_agent",
+            "PUT",
+            f"/v1/inventory/agents/{agent_id}",
+            json={agent_type: changes},
+        )
+        return response.json()
+
+    def add_services(
+        self, payloads: Sequence[Dict], max_workers: Optional[int] = None
+    ) -> List[Union[Dict, requests.exceptions.RequestException]]:
+        """
+        Add services concurrently.
+
+        :param payloads: Request bodies, as for :meth:`add_service`.
+        :param max_workers: Concurrent requests; the pool size by default.
+        :return: One result per payload, in order: the response, or the
+            exception if adding that service failed.
+        """
+        return self._bulk(self.add_service, payloads, max_workers)
+
+    def remove_services(
+        self, service_ids: Sequence[str], max_workers: Optional[int] = None
+    ) -> List[Optional[requests.exceptions.RequestException]]:
+        """
+        Remove services concurrently.
+
+        :param service_ids: PMM service IDs to remove.
+        :param max_workers: Concurrent requests; the pool size by default.
+        :return: One result per service, in order: ``None``, or the
+            exception if removing that service failed.
+        """
+        return self._bulk(self.remove_service, service_ids, max_workers)
+
+    def remove_nodes(
+        self, node_ids: Sequence[str], max_workers: Optional[int] = None
+    ) -> List[Optional[requests.exceptions.RequestException]]:
+        """
+        Remove nodes concurrently, with everything running on them.
+
+        :param node_ids: PMM node IDs to remove.
+        :param max_workers: Concurrent requests; the pool size by default.
+        :return: One result per node, in order: ``None``, or the
+            exception if removing that node failed.
+        """
+        return self._bulk(self.remove_node, node_ids, max_workers)
+
+    def remove_agents(
+        self, agent_ids: Sequence[str], max_workers: Optional[int] = None
+    ) -> List[Optional[requests.exceptions.RequestException]]:
+        """
+        Remove agents concurrently.
+
+        :param agent_ids: PMM agent IDs to remove.
+        :param max_workers: Concurrent requests; the pool size by default.
+        :return: One result per agent, in order: ``None``, or the
+            exception if removing that agent failed.
+        """
+        return self._bulk(self.remove_agent, agent_ids, max_workers)
+
+    def _bulk(self, action, arguments: Sequence, max_workers: Optional[int]) -> List:
+        """Call ``action`` for every argument in a thread pool."""
+
+        def call(argument):
+            try:
+                return action(argument)
+            except requests.exceptions.RequestException as exc:
+                return exc
+
+        if not arguments:
+            return []
+        workers = min(max_workers or self.pool_size, len(arguments))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(call, arguments))
+
+
+class AsyncPMMClient:
+    """
+    asyncio interface to :class:`PMMClient`.
+
+    Every coroutine runs the blocking request in a worker thread, so the
+    coroutines share the keep-alive connection pool and the statistics of
+    the wrapped client. At most ``pool_size`` requests are in flight;
+    more wait for a free connection instead of opening new ones.
+
+    :param client: Client to send the requests with.
+    :type client: PMMClient
+    """
+
+    def __init__(self, client: PMMClient):
+        self.client = client
+        self.stats = client.stats
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def _call(self, function, *args):
+        # Created on first use, inside the running event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.client.pool_size)
+        async with self._semaphore:
+            return await asyncio.to_thread(function, *args)
+
+    async def services(self) -> List[Dict]:
+        """See :attr:`PMMClient.services`."""
+        return await self._call(lambda: self.client.services)
+
+    async def pmm_agents(self) -> List[Dict]:
+        """See :attr:`PMMClient.pmm_agents`."""
+        return await self._call(lambda: self.client.pmm_agents)
+
+    async def agents(self) -> Dict[str, List[Dict]]:
+        """See :attr:`PMMClient.agents`."""
+        return await self._call(lambda: self.client.agents)
+
+    async def nodes(self) -> List[Dict]:
+        """See :attr:`PMMClient.nodes`."""
+        return await self._call(lambda: self.client.nodes)
+
+    async def server_version(self) -> str:
+        """See :attr:`PMMClient.server_version`."""
+        return await self._call(lambda: self.client.server_version)
+
+    async def query(self, query: str) -> List[Dict]:
+        """See :meth:`PMMClient.query`."""
+        return await self._call(self.client.query, query)
+
+    async def add_service(self, payload: Dict) -> Dict:
+        """See :meth:`PMMClient.add_service`."""
+        return await self._call(self.client.add_service, payload)
+
+    async def remove_service(self, service_id: str) -> None:
+        """See :meth:`PMMClient.remove_service`."""
+        await self._call(self.client.remove_service, service_id)
+
+    async def remove_node(self, node_id: str) -> None:
+        """See :meth:`PMMClient.remove_node`."""
+        await self._call(self.client.remove_node, node_id)
+
+    async def remove_agent(self, agent_id: str) -> None:
+        """See :meth:`PMMClient.remove_agent`."""
+        await self._call(self.client.remove_agent, agent_id)
+
+    async def change_agent(self, agent_id: str, agent_type: str, changes: Dict) -> Dict:
+        """See :meth:`PMMClient.change_agent`."""
+        return await self._call(self.client.change_agent, agent_id, agent_type, changes)
+
+    async def add_services(
+        self, payloads: Sequence[Dict]
+    ) -> List[Union[Dict, BaseException]]:
+        """
+        Add services concurrently.
+
+        :param payloads: Request bodies, as for :meth:`PMMClient.add_service`.
+        :return: One result per payload, in order: the response, or the
+            exception if adding that service failed.
+        """
+        return await asyncio.gather(
+            *(self.add_service(payload) for payload in payloads),
+            return_exceptions=True,
+        )
+
+    async def remove_services(
+        self, service_ids: Sequence[str]
+    ) -> List[Optional[BaseException]]:
+        """
+        Remove services concurrently.
+
+        :param service_ids: PMM service IDs to remove.
+        :return: One result per service, in order: ``None``, or the
+            exception if removing that service failed.
+        """
+        return await asyncio.gather(
+            *(self.remove_service(service_id) for service_id in service_ids),
+            return_exceptions=True,
+        )
+
+    async def remove_nodes(
+        self, node_ids: Sequence[str]
+    ) -> List[Optional[BaseException]]:
+        """
+        Remove nodes concurrently, with everything running on them.
+
+        :param node_ids: PMM node IDs to remove.
+        :return: One result per node, in order: ``None``, or the
+            exception if removing that node failed.
+        """
+        return await asyncio.gather(
+            *(self.remove_node(node_id) for node_id in node_ids),
+            return_exceptions=True,
+        )
+
+    async def remove_agents(
+        self, agent_ids: Sequence[str]
+    ) -> List[Optional[BaseException]]:
+        """
+        Remove agents concurrently.
+
+        :param agent_ids: PMM agent IDs to remove.
+        :return: One result per agent, in order: ``None``, or the
+            exception if removing that agent failed.
+        """
+        return await asyncio.gather(
+            *(self.remove_agent(agent_id) for agent_id in agent_ids),
+            return_exceptions=True,
+        )
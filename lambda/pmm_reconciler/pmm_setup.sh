@@ -0,0 +1,108 @@
+#!/bin/bash
+# Install pmm-client, connect it to the PMM server and add MySQL monitoring.
+# Idempotent: every step checks whether it is needed.
+#
+# Settings come as base64-encoded JSON (see setup_script.py) in
+# $PMM_SETUP_CONFIG or in the file given as the first argument:
+#   pmm_host, pmm_password, db_username, port, asg_name,
+#   add_args (extra pmm-admin add mysql flags), rate_limit_sql, reregister
+# The config is shared by the instances of an ASG; the service name
+# <asg_name>/<hostname> is built here.
+set -euo pipefail
+export PATH=/opt/puppetlabs/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin
+
+CONFIG=$(printf '%s' "${PMM_SETUP_CONFIG:-$(cat "${1:?config file}")}" | base64 -d)
+cfg() {
+    printf '%s' "$CONFIG" | jq -r ".$1"
+}
+PMM_HOST=$(cfg pmm_host)
+DB_USERNAME=$(cfg db_username)
+DB_PORT=$(cfg port)
+# The short private DNS name, as the reconciler derives it from
+# PrivateDnsName, even if the OS hostname was changed.
+IMDS_TOKEN=$(curl -sf -X PUT http://169.254.169.254/latest/api/token \
+    -H "X-aws-ec2-metadata-token-ttl-seconds: 60")
+LOCAL_HOSTNAME=$(curl -sf -H "X-aws-ec2-metadata-token: $IMDS_TOKEN" \
+    http://169.254.169.254/latest/meta-data/local-hostname)
+SERVICE_NAME="$(cfg asg_name)/${LOCAL_HOSTNAME%%.*}"
+RATE_LIMIT_SQL=$(cfg rate_limit_sql)
+REREGISTER=$(cfg reregister)
+mapfile -t ADD_ARGS < <(printf '%s' "$CONFIG" | jq -r '.add_args[]')
+
+# Step 1: Install pmm-client if not present
+if ! dpkg -l pmm-client 2>/dev/null | grep -q "^ii"; then
+    echo 'Installing pmm-client...'
+    percona-release enable pmm3-client
+    DEBIAN_FRONTEND=noninteractive apt-get update -qq
+    DEBIAN_FRONTEND=noninteractive apt-get install -y -qq pmm-client
+    echo 'pmm-client installed'
+fi
+
+# Step 2: Configure PMM server connection if not connected
+if ! pmm-admin status 2>/dev/null | grep -q "Connected.*true"; then
+    echo 'Configuring PMM server connection...'
+    pmm-admin config \
+        --server-insecure-tls \
+        --server-url="https://admin:$(cfg pmm_password)@${PMM_HOST}" \
+        --force
+    systemctl restart pmm-agent
+    echo 'Waiting for pmm-agent to connect...'
+    for i in $(seq 1 30); do
+        if pmm-admin status 2>/dev/null | grep -q "Connected.*true"; then
+            echo 'pmm-agent connected'
+            break
+        fi
+        sleep 2
+    done
+    echo 'PMM server configured'
+fi
+
+DB_PASSWORD=""
+read_db_password() {
+    if [ -z "$DB_PASSWORD" ]; then
+        echo 'Reading DB credentials from Puppet facts...'
+        CREDS_SECRET=$(facter -p percona.credentials_secret)
+        DB_PASSWORD=$(ih-secrets get "$CREDS_SECRET" | jq -r --arg key "$DB_USERNAME" '.[$key]')
+    fi
+}
+
+# Step 3: Set the slow log rate limit on every run, so a changed limit
+# reaches servers that are already registered
+if [ -n "$RATE_LIMIT_SQL" ]; then
+    read_db_password
+    echo 'Setting slow log rate limit...'
+    MYSQL_PWD="$DB_PASSWORD" mysql \
+        --user="$DB_USERNAME" \
+        --host=127.0.0.1 \
+        --port="$DB_PORT" \
+        -e "$RATE_LIMIT_SQL" \
+        || echo 'WARNING: cannot set log_slow_rate_limit (needs SYSTEM_VARIABLES_ADMIN)'
+fi
+
+# Step 4: Add MySQL monitoring if mysqld_exporter is not running
+# (or re-add it when the QAN or collector settings drifted)
+if $REREGISTER || ! pmm-admin status 2>/dev/null | grep -q "mysqld_exporter"; then
+    read_db_password
+    if $REREGISTER; then
+        echo 'Re-registering MySQL monitoring with new settings...'
+        pmm-admin remove mysql "$SERVICE_NAME" || true
+    fi
+    echo 'Adding MySQL monitoring...'
+    ADD_OUTPUT=$(pmm-admin add mysql \
+        --username="$DB_USERNAME" \
+        --password="$DB_PASSWORD" \
+        --host=127.0.0.1 \
+        --port="$DB_PORT" \
+        ${ADD_ARGS[@]+"${ADD_ARGS[@]}"} \
+        --service-name="$SERVICE_NAME" 2>&1) || {
+        if echo "$ADD_OUTPUT" | grep -q "already exists"; then
+            echo 'MySQL monitoring already registered'
+        else
+            echo "$ADD_OUTPUT"
+            exit 1
+        fi
+    }
+    echo 'MySQL monitoring added'
+fi
+
+echo 'pmm-client setup complete'
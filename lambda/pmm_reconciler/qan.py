@@ -0,0 +1,161 @@
+"""
+Query Analytics (QAN) tuning for MySQL services added by the reconciler.
+
+Each ``monitored_asgs`` entry carries a ``qan`` dict:
+
+- ``query_source``: ``perfschema`` (default), ``slowlog`` or ``none``.
+- ``slow_log_rate_limit``: log 1 of every N queries to the slow log
+  (Percona Server ``log_slow_rate_limit``).
+- ``slow_log_max_size_mb``: slow log size at which pmm-agent rotates it.
+- ``disable_tablestats_limit``: disable table statistics when the server
+  has more tables than this.
+- ``max_query_length``: truncate query texts to this many characters.
+- ``disable_query_examples``: do not collect query examples.
+
+Unset (``None``) options keep the PMM defaults and are not checked for
+drift. ``slow_log_rate_limit`` is a server variable rather than an agent
+setting: its drift is found from the probe status and fixed by running
+the setup script again, without re-adding the service.
+"""
+
+from typing import Dict, List, Optional
+
+QAN_AGENT_TYPES = {
+    "perfschema": "qan_mysql_perfschema_agent",
+    "slowlog": "qan_mysql_slowlog_agent",
+}
+
+
+def qan_flags(qan: Dict) -> List[str]:
+    """
+    ``pmm-admin add mysql`` flags for the QAN settings.
+
+    :param qan: QAN settings of the ASG.
+    :return: List of command line flags.
+    """
+    flags = [f"--query-source={qan.get('query_source') or 'perfschema'}"]
+    if qan.get("slow_log_max_size_mb") is not None:
+        flags.append(f"--size-slow-logs={int(qan['slow_log_max_size_mb'])}MiB")
+    if qan.get("disable_tablestats_limit") is not None:
+        flags.append(
+            f"--disable-tablestats-limit={int(qan['disable_tablestats_limit'])}"
+        )
+    if qan.get("max_query_length") is not None:
+        flags.append(f"--max-query-length={int(qan['max_query_length'])}")
+    if qan.get("disable_query_examples"):
+        flags.append("--disable-queryexamples")
+    return flags
+
+
+def slow_log_rate_limit_sql(qan: Dict) -> str:
+    """
+    SQL that applies ``slow_log_rate_limit`` on the monitored server.
+
+    The setting is persisted with ``SET PERSIST`` and needs the
+    ``SYSTEM_VARIABLES_ADMIN`` privilege.
+
+    :param qan: QAN settings of the ASG.
+    :return: SQL statements, or an empty string if no rate limit is set.
+    """
+    if qan.get("slow_log_rate_limit") is None:
+        return ""
+    return (
+        "SET PERSIST log_slow_rate_type='query'; "
+        f"SET PERSIST log_slow_rate_limit={int(qan['slow_log_rate_limit'])};"
+    )
+
+
+def rate_limit_drift(qan: Dict, status: Optional[Dict]) -> List[str]:
+    """
+    Compare the probed ``log_slow_rate_limit`` with the desired one.
+
+    :param qan: QAN settings of the ASG.
+    :param status: Probe status of the instance; its ``slow_log_rate_limit``
+        is the value persisted on the server, or ``None`` if none is.
+    :return: Human-readable difference; empty if the limit matches or is
+        not configured.
+    """
+    if qan.get("slow_log_rate_limit") is None or status is None:
+        return []
+    current = status.get("slow_log_rate_limit")
+    if current is not None and int(current) == int(qan["slow_log_rate_limit"]):
+        return []
+    return [f"slow log rate limit is {current}, want {qan['slow_log_rate_limit']}"]
+
+
+def agents_by_service(agents: Dict[str, List[Dict]]) -> Dict[str, Dict[str, List]]:
+    """
+    Index the PMM agents inventory by service.
+
+    :param agents: ``/v1/inventory/agents`` response, grouped by agent type.
+    :return: ``{service_id: {agent_type: [agent, ...]}}``.
+    """
+    index: Dict[str, Dict[str, List]] = {}
+    for agent_type, entries in agents.items():
+        if not isinstance(entries, list):
+            continue
+        for agent in entries:
+            service_id = agent.get("service_id")
+            if service_id:
+                index.setdefault(service_id, {}).setdefault(agent_type, []).append(
+                    agent
+                )
+    return index
+
+
+def qan_drift(qan: Dict, service_agents: Dict[str, List[Dict]]) -> List[str]:
+    """
+    Compare a registered service's agents with the desired QAN settings.
+
+    :param qan: QAN settings of the ASG.
+    :param service_agents: Agents of one service, grouped by agent type.
+    :return: Human-readable differences; empty if the service matches.
+        Services whose ``mysqld_exporter`` is not in the inventory are
+        reported as matching, so an incomplete inventory never triggers
+        re-registration.
+    """
+    if not service_agents.get("mysqld_exporter"):
+        return []
+
+    reasons = []
+    source = qan.get("query_source") or "perfschema"
+    expected = {QAN_AGENT_TYPES[source]} if source in QAN_AGENT_TYPES else set()
+    present = {
+        agent_type
+        for agent_type in QAN_AGENT_TYPES.values()
+        if service_agents.get(agent_type)
+    }
+    if present != expected:
+        reasons.append(f"query source is {sorted(present) or 'none'}, want {source}")
+
+    for agent_type in expected & present:
+        agent = service_agents[agent_type][0]
+        if qan.get("max_query_length") is not None and int(
+            agent.get("max_query_length") or 0
+        ) != int(qan["max_query_length"]):
+            reasons.append(
+                f"max_query_length is {agent.get('max_query_length')}, "
+                f"want {qan['max_query_length']}"
+            )
+        if bool(agent.get("query_examples_disabled")) != bool(
+            qan.get("disable_query_examples")
+        ):
+            reasons.append("query examples setting differs")
+        if (
+            agent_type == QAN_AGENT_TYPES["slowlog"]
+            and qan.get("slow_log_max_size_mb") is not None
+            and int(agent.get("max_slowlog_file_size") or 0)
+            != int(qan["slow_log_max_size_mb"]) * 1024 * 1024
+        ):
+            reasons.append("slow log rotation size differs")
+
+    if qan.get("disable_tablestats_limit") is not None:
+        exporter = service_agents["mysqld_exporter"][0]
+        if int(exporter.get("tablestats_group_table_limit") or 0) != int(
+            qan["disable_tablestats_limit"]
+        ):
+            reasons.append(
+                f"tablestats limit is {exporter.get('tablestats_group_table_limit')}, "
+                f"want {qan['disable_tablestats_limit']}"
+            )
+    return reasons
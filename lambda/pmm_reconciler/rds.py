@@ -0,0 +1,386 @@
+"""
+Auto-discovery of RDS and Aurora databases as PMM remote services.
+
+Each ``monitored_rds`` entry is a selector:
+
+- ``name``: short name; services are called ``rds/{name}/{db_instance_id}``.
+- ``engine``: ``postgresql`` or ``mysql`` (Aurora and MariaDB included).
+- ``tags``: tags a DB instance must have, all of them, to be monitored.
+- ``credentials_secret_arn``: Secrets Manager secret with ``username`` and
+  ``password`` keys (the format of RDS-managed master user secrets).
+- ``database``: PostgreSQL database to connect to.
+- ``query_analytics``: enable the QAN agent (``pg_stat_statements`` or
+  ``performance_schema``).
+
+All DB instances, including Aurora cluster members, are listed with one
+paginated ``DescribeDBInstances`` call per run. The wanted services are
+compared with those registered in PMM, and the additions and removals
+are applied concurrently through the PMM management API. Services of
+selectors that were removed from ``monitored_rds`` are removed as well. The PMM
+server's own pmm-agent monitors the databases, so the PMM instance must
+be able to reach them (see ``rds_security_group_ids``).
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pmm_client import PMMClient
+
+LOG = getLogger(__name__)
+
+# Prefix of the names of services the reconciler manages for RDS.
+RDS_SERVICE_PREFIX = "rds"
+
+# RDS engine -> PMM service type.
+ENGINES = {
+    "postgres": "postgresql",
+    "aurora-postgresql": "postgresql",
+    "mysql": "mysql",
+    "mariadb": "mysql",
+    "aurora-mysql": "mysql",
+}
+
+# Instances in these states are gone or going; their services are removed.
+_GONE_STATUSES = ("deleting", "deleted", "failed")
+
+# Concurrent PMM API calls. Each addition makes PMM connect to the
+# database, so more would mostly queue up on the server.
+MAX_WORKERS = 10
+
+
+def service_name(selector: Dict, db_instance_id: str) -> str:
+    """
+    PMM service name of a discovered DB instance.
+
+    :param selector: ``monitored_rds`` entry.
+    :param db_instance_id: RDS DB instance identifier.
+    :return: E.g. ``rds/orders/orders-db-1``.
+    """
+    return f"{RDS_SERVICE_PREFIX}/{selector['name']}/{db_instance_id}"
+
+
+def matches(selector: Dict, db_instance: Dict) -> bool:
+    """
+    Check whether a DB instance is selected.
+
+    :param selector: ``monitored_rds`` entry.
+    :param db_instance: Entry of ``DescribeDBInstances``.
+    :return: ``True`` if the engine matches and the instance has all
+        tags of the selector.
+    """
+    if ENGINES.get(db_instance.get("Engine")) != selector["engine"]:
+        return False
+    tags = {tag["Key"]: tag["Value"] for tag in db_instance.get("TagList", [])}
+    return all(tags.get(key) == value for key, value in selector["tags"].items())
+
+
+def discover(rds_client, selectors: List[Dict]) -> Dict[str, Dict[str, Dict]]:
+    """
+    Find the DB instances of all selectors with one paginated describe.
+
+    :param rds_client: boto3 RDS client.
+    :param selectors: ``monitored_rds`` entries.
+    :return: ``{selector name: {service name: DB instance}}``. Instances
+        that are being deleted are left out.
+    """
+    found: Dict[str, Dict[str, Dict]] = {selector["name"]: {} for selector in selectors}
+    paginator = rds_client.get_paginator("describe_db_instances")
+    for page in paginator.paginate():
+        for db_instance in page.get("DBInstances", []):
+            if db_instance.get("DBInstanceStatus") in _GONE_STATUSES:
+                continue
+            for selector in selectors:
+                if matches(selector, db_instance):
+                    name = service_name(selector, db_instance["DBInstanceIdentifier"])
+                    found[selector["name"]][name] = db_instance
+    return found
+
+
+def plan(
+    selector: Dict, discovered: Dict[str, Dict], existing_services: List[Dict]
+) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Diff discovered DB instances against registered PMM services.
+
+    :param selector: ``monitored_rds`` entry.
+    :param discovered: Service name to DB instance, from :func:`discover`.
+    :param existing_services: Services registered in PMM.
+    :return: DB instances to add and PMM services to remove. Instances
+        that are not ``available`` yet (no endpoint) are added later.
+    """
+    prefix = service_name(selector, "")
+    registered = {
+        svc["service_name"]: svc
+        for svc in existing_services
+        if svc.get("service_name", "").startswith(prefix)
+    }
+    to_add = [
+        db_instance
+        for name, db_instance in discovered.items()
+        if name not in registered
+        and db_instance.get("DBInstanceStatus") == "available"
+        and db_instance.get("Endpoint")
+    ]
+    to_remove = [svc for name, svc in registered.items() if name not in discovered]
+    return to_add, to_remove
+
+
+def unconfigured(selectors: List[Dict], existing_services: List[Dict]) -> List[Dict]:
+    """
+    Find the RDS services of selectors that are no longer configured.
+
+    :param selectors: ``monitored_rds`` entries.
+    :param existing_services: Services registered in PMM.
+    :return: Services named ``rds/{name}/...`` where no selector is
+        called ``name``.
+    """
+    names = {selector["name"] for selector in selectors}
+    return [
+        svc
+        for svc in existing_services
+        if svc.get("service_name", "").startswith(f"{RDS_SERVICE_PREFIX}/")
+        and svc["service_name"].split("/")[1] not in names
+    ]
+
+
+def read_credentials(get_credentials: Callable[[str], Dict], arn: str) -> Dict:
+    """
+    Read and check the database credentials of a selector.
+
+    :param get_credentials: Returns the value of a secret ARN.
+    :param arn: ``credentials_secret_arn`` of the selector.
+    :return: Dict with ``username`` and ``password``.
+    :raise ValueError: If the secret is not a JSON object with both keys.
+    """
+    credentials = get_credentials(arn)
+    if not isinstance(credentials, dict) or not {"username", "password"}.issubset(
+        credentials
+    ):
+        raise ValueError(
+            f"secret {arn} must be a JSON object with username and password"
+        )
+    return credentials
+
+
+def remote_service_payload(
+    engine: str,
+    name: str,
+    address: str,
+    port: int,
+    credentials: Dict,
+    pmm_agent_id: str,
+    database: Optional[str] = None,
+    query_analytics: bool = True,
+    cluster: Optional[str] = None,
+    node: Optional[Dict] = None,
+) -> Dict:
+    """
+    Request body of ``POST /v1/management/services`` for a remote database.
+
+    The service gets its own remote node named like the service, and is
+    connected to with TLS without certificate verification, as RDS needs.
+
+    :param engine: ``postgresql`` or ``mysql``.
+    :param name: Service (and node) name.
+    :param address: Database hostname.
+    :param port: Database port.
+    :param credentials: Dict with ``username`` and ``password``.
+    :param pmm_agent_id: pmm-agent that runs the exporters (the server's).
+    :param database: PostgreSQL database to connect to.
+    :param query_analytics: Enable the QAN agent.
+    :param cluster: Cluster name, e.g. the Aurora cluster identifier.
+    :param node: Extra ``add_node`` fields (``region``, ``az``, ...).
+    :return: Payload for :meth:`PMMClient.add_service`.
+    """
+    service = {
+        "service_name": name,
+        "address": address,
+        "port": int(port),
+        "username": credentials["username"],
+        "password": credentials["password"],
+        "pmm_agent_id": pmm_agent_id,
+        "tls": True,
+        "tls_skip_verify": True,
+        "add_node": {
+            "node_type": "NODE_TYPE_REMOTE_NODE",
+            "node_name": name,
+            **(node or {}),
+        },
+    }
+    if cluster:
+        service["cluster"] = cluster
+    if engine == "postgresql":
+        service["database"] = database or "postgres"
+        service["qan_postgresql_pgstatements_agent"] = query_analytics
+    else:
+        service["qan_mysql_perfschema"] = query_analytics
+    return {engine: service}
+
+
+def service_payload(
+    selector: Dict,
+    db_instance: Dict,
+    credentials: Dict,
+    pmm_agent_id: str,
+    region: str,
+) -> Dict:
+    """
+    Request body of ``POST /v1/management/services`` for a DB instance.
+
+    Aurora members are grouped by their cluster identifier.
+
+    :param selector: ``monitored_rds`` entry.
+    :param db_instance: Entry of ``DescribeDBInstances``.
+    :param credentials: Dict with ``username`` and ``password``.
+    :param pmm_agent_id: pmm-agent that runs the exporters (the server's).
+    :param region: AWS region, recorded on the node.
+    :return: Payload for :meth:`PMMClient.add_service`.
+    """
+    return remote_service_payload(
+        engine=selector["engine"],
+        name=service_name(selector, db_instance["DBInstanceIdentifier"]),
+        address=db_instance["Endpoint"]["Address"],
+        port=db_instance["Endpoint"]["Port"],
+        credentials=credentials,
+        pmm_agent_id=pmm_agent_id,
+        database=selector.get("database"),
+        query_analytics=selector.get("query_analytics", True),
+        cluster=db_instance.get("DBClusterIdentifier"),
+        node={
+            "node_model": db_instance.get("DBInstanceClass", ""),
+            "region": region,
+            "az": db_instance.get("AvailabilityZone", ""),
+        },
+    )
+
+
+def server_agent_id(pmm: PMMClient) -> str:
+    """
+    ID of the pmm-agent running inside the PMM server.
+
+    :param pmm: PMM client.
+    :return: Agent ID; ``pmm-server`` if the inventory does not show it.
+    """
+    for agent in pmm.pmm_agents:
+        if agent.get("runs_on_node_id") == "pmm-server":
+            return agent["agent_id"]
+    return "pmm-server"
+
+
+def reconcile_rds(
+    selectors: List[Dict],
+    pmm: PMMClient,
+    rds_client,
+    existing_services: List[Dict],
+    get_credentials: Callable[[str], Dict],
+    region: str,
+    max_workers: int = MAX_WORKERS,
+) -> Tuple[Dict[str, int], List[str]]:
+    """
+    Register and deregister RDS/Aurora databases matching the selectors.
+
+    :param selectors: ``monitored_rds`` entries.
+    :param pmm: PMM client.
+    :param rds_client: boto3 RDS client.
+    :param existing_services: Services registered in PMM.
+    :param get_credentials: Returns the credentials dict of a secret ARN.
+        Called once per secret of the selectors that have databases to add.
+    :param region: AWS region.
+    :param max_workers: Concurrent PMM API calls.
+    :return: ``rds_added`` and ``rds_removed`` counts, and errors of the
+        changes that failed and of the selectors whose secret could not
+        be read (they are retried on the next run).
+    """
+    # Without selectors only the services of removed ones are left to clean
+    # up, which needs no describe call (nor its IAM permission).
+    discovered = discover(rds_client, selectors) if selectors else {}
+
+    errors: List[str] = []
+    additions: List[Tuple[Dict, Dict]] = []
+    removals = unconfigured(selectors, existing_services)
+    credentials: Dict[str, Dict] = {}
+    secret_errors: Dict[str, str] = {}
+    for selector in selectors:
+        to_add, to_remove = plan(
+            selector, discovered[selector["name"]], existing_services
+        )
+        LOG.info(
+            "RDS selector %s: %d databases, %d to add, %d to remove",
+            selector["name"],
+            len(discovered[selector["name"]]),
+            len(to_add),
+            len(to_remove),
+        )
+        removals.extend(to_remove)
+        if not to_add:
+            continue
+        arn = selector["credentials_secret_arn"]
+        if arn not in credentials and arn not in secret_errors:
+            try:
+                credentials[arn] = read_credentials(get_credentials, arn)
+            except Exception as exc:  # pylint: disable=broad-except
+                secret_errors[arn] = f"{type(exc).__name__}: {exc}"
+        if arn in secret_errors:
+            LOG.error(
+                "RDS selector %s: cannot read credentials: %s",
+                selector["name"],
+                secret_errors[arn],
+            )
+            errors.append(
+                f"{service_name(selector, '')}*: cannot read credentials: "
+                f"{secret_errors[arn]}"
+            )
+            continue
+        additions.extend((selector, db_instance) for db_instance in to_add)
+
+    pmm_agent_id = server_agent_id(pmm) if additions else None
+
+    def add(selector: Dict, db_instance: Dict) -> None:
+        pmm.add_service(
+            service_payload(
+                selector,
+                db_instance,
+                credentials[selector["credentials_secret_arn"]],
+                pmm_agent_id,
+                region,
+            )
+        )
+
+    def remove(svc: Dict) -> None:
+        # Removing the node force-removes its service too. Removing the
+        # service first would orphan the node if the second call failed.
+        if svc.get("node_id"):
+            pmm.remove_node(svc["node_id"])
+        else:
+            pmm.remove_service(svc["service_id"])
+
+    counts = {"rds_added": 0, "rds_removed": 0}
+    changes = [
+        (
+            "rds_added",
+            service_name(selector, db_instance["DBInstanceIdentifier"]),
+            add,
+            (selector, db_instance),
+        )
+        for selector, db_instance in additions
+    ] + [("rds_removed", svc["service_name"], remove, (svc,)) for svc in removals]
+    if not changes:
+        return counts, errors
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(changes))) as executor:
+        futures = [
+            (key, name, executor.submit(action, *args))
+            for key, name, action, args in changes
+        ]
+        for key, name, future in futures:
+            action = "add" if key == "rds_added" else "remove"
+            try:
+                future.result()
+            except Exception as exc:  # pylint: disable=broad-except
+                LOG.error("Failed to %s RDS service %s: %s", action, name, exc)
+                errors.append(f"{name}: {action} failed: {exc}")
+                continue
+            LOG.info("RDS service %s: %s done", name, action)
+            counts[key] += 1
+    return counts, errors
@@ -0,0 +1,84 @@
+"""
+Metrics resolution and exporter collector tuning per monitored ASG.
+
+Each ``monitored_asgs`` entry carries a ``metrics`` dict:
+
+- ``resolution``: preset of the ``mysqld_exporter`` scrape intervals
+  (:data:`RESOLUTION_PRESETS`); unset keeps the server-wide resolution.
+- ``disable_collectors``: ``mysqld_exporter`` collectors to turn off,
+  e.g. ``info_schema.tables`` or ``perf_schema.eventsstatements``.
+
+Disabled collectors are a ``pmm-admin add mysql`` flag, so services whose
+collectors differ are re-added, like QAN drift (see :mod:`qan`). The
+resolution is an exporter attribute changed in place through the PMM
+inventory API, without touching the instance.
+"""
+
+from typing import Dict, List, Optional
+
+# High, medium and low resolution scrape intervals of each preset.
+# "standard" is the PMM default.
+RESOLUTION_PRESETS = {
+    "standard": {"hr": "5s", "mr": "10s", "lr": "60s"},
+    "reduced": {"hr": "15s", "mr": "30s", "lr": "120s"},
+    "minimal": {"hr": "60s", "mr": "120s", "lr": "300s"},
+}
+
+
+def scrape_flags(metrics: Dict) -> List[str]:
+    """
+    ``pmm-admin add mysql`` flags for the collector settings.
+
+    :param metrics: Metrics settings of the ASG.
+    :return: List of command line flags.
+    """
+    collectors = sorted(set(metrics.get("disable_collectors") or []))
+    return [f"--disable-collectors={','.join(collectors)}"] if collectors else []
+
+
+def collectors_drift(metrics: Dict, service_agents: Dict[str, List[Dict]]) -> List[str]:
+    """
+    Compare a registered service's disabled collectors with the desired ones.
+
+    :param metrics: Metrics settings of the ASG.
+    :param service_agents: Agents of one service, grouped by agent type.
+    :return: Human-readable differences; empty if the service matches or
+        its ``mysqld_exporter`` is not in the inventory.
+    """
+    if not service_agents.get("mysqld_exporter"):
+        return []
+    exporter = service_agents["mysqld_exporter"][0]
+    present = sorted(set(exporter.get("disabled_collectors") or []))
+    wanted = sorted(set(metrics.get("disable_collectors") or []))
+    if present == wanted:
+        return []
+    return [f"disabled collectors are {present or 'none'}, want {wanted or 'none'}"]
+
+
+def _seconds(duration: Optional[str]) -> Optional[float]:
+    """Seconds of a protobuf JSON duration such as ``"5s"``."""
+    if not duration:
+        return None
+    return float(str(duration).rstrip("s"))
+
+
+def resolution_drift(
+    metrics: Dict, service_agents: Dict[str, List[Dict]]
+) -> Optional[Dict[str, str]]:
+    """
+    Resolutions to set on a registered service's ``mysqld_exporter``.
+
+    :param metrics: Metrics settings of the ASG.
+    :param service_agents: Agents of one service, grouped by agent type.
+    :return: The preset's ``{"hr", "mr", "lr"}`` if the exporter's
+        resolutions differ from it; ``None`` if they match, no preset is
+        set, or the exporter is not in the inventory.
+    """
+    preset = metrics.get("resolution")
+    if not preset or not service_agents.get("mysqld_exporter"):
+        return None
+    wanted = RESOLUTION_PRESETS[preset]
+    present = service_agents["mysqld_exporter"][0].get("metrics_resolutions") or {}
+    if all(_seconds(present.get(key)) == _seconds(wanted[key]) for key in wanted):
+        return None
+    return dict(wanted)
@@ -0,0 +1,153 @@
+"""
+Run the pmm-client setup script on instances.
+
+The script (``pmm_setup.sh``) is the same for every instance; the settings
+(PMM host and password, ASG name, ``pmm-admin add mysql`` flags) are
+passed as a small base64-encoded JSON config. The config is the same for
+all instances of an ASG that are set up the same way: the script builds
+the service name ``<asg_name>/<hostname>`` on the instance itself. When the module's versioned
+SSM document is configured (``SETUP_DOCUMENT``), the command references
+the document and carries only the config, so the script is stored once,
+does not count against the ``SendCommand`` request size, and can grow
+freely. Without it, the script is shipped inline with
+``AWS-RunShellScript``, as the document-less fallback for tests and
+callers outside the module. Either way, instances that share a config
+get one multi-target command (see :func:`fanout.run_documents`).
+"""
+
+import json
+from base64 import b64encode
+from functools import lru_cache
+from os import path as osp
+from typing import Dict, List, Optional, Tuple
+
+from infrahouse_core.aws.asg_instance import ASGInstance
+
+from fanout import run_documents
+from pmm_client import RequestStats
+
+SCRIPT_PATH = osp.join(osp.dirname(osp.abspath(__file__)), "pmm_setup.sh")
+
+
+@lru_cache(maxsize=1)
+def load_script() -> str:
+    """Text of ``pmm_setup.sh``."""
+    with open(SCRIPT_PATH, encoding="utf-8") as fp:
+        return fp.read()
+
+
+def encode_config(
+    pmm_host: str,
+    pmm_password: str,
+    db_username: str,
+    port: int,
+    asg_name: str,
+    add_args: List[str],
+    rate_limit_sql: str = "",
+    reregister: bool = False,
+) -> str:
+    """
+    Settings of a setup run, as the script reads them.
+
+    :param pmm_host: PMM server private IP address.
+    :param pmm_password: PMM admin password.
+    :param db_username: Key in the credentials JSON for password lookup.
+    :param port: MySQL port number.
+    :param asg_name: ASG of the instances; the script names the service
+        ``<asg_name>/<hostname>``.
+    :param add_args: Extra ``pmm-admin add mysql`` flags.
+    :param rate_limit_sql: SQL to run on every setup, if any.
+    :param reregister: Re-add MySQL monitoring even if it is registered.
+    :return: Base64-encoded JSON.
+    """
+    config = {
+        "pmm_host": pmm_host,
+        "pmm_password": pmm_password,
+        "db_username": db_username,
+        "port": port,
+        "asg_name": asg_name,
+        "add_args": add_args,
+        "rate_limit_sql": rate_limit_sql,
+        "reregister": reregister,
+    }
+    return b64encode(json.dumps(config, separators=(",", ":")).encode()).decode()
+
+
+def inline_command(config: str) -> str:
+    """
+    ``AWS-RunShellScript`` command that ships the script and its config.
+
+    Both are written to files readable by root only and removed after
+    the run, so the config does not show up in the process list.
+
+    :param config: Output of :func:`encode_config`.
+    """
+    script_b64 = b64encode(load_script().encode()).decode()
+    return (
+        f"umask 077"
+        f" && echo {script_b64} | base64 -d > /tmp/pmm-setup.sh"
+        f" && echo {config} > /tmp/pmm-setup.conf"
+        f" && chmod 700 /tmp/pmm-setup.sh"
+        f" && sudo /tmp/pmm-setup.sh /tmp/pmm-setup.conf"
+        f"; rc=$?; rm -f /tmp/pmm-setup.sh /tmp/pmm-setup.conf; exit $rc"
+    )
+
+
+class SetupRunner:
+    """
+    Runs the setup script, by reference to an SSM document if given.
+
+    :param document: Name of the setup SSM document; ``None`` to ship
+        the script inline.
+    :param document_version: Document version to run; the default
+        version if ``None``.
+    """
+
+    def __init__(
+        self,
+        document: Optional[str] = None,
+        document_version: Optional[str] = None,
+    ):
+        self._document = document
+        self._document_version = document_version
+
+    def parameters(self, config: str) -> Dict[str, List[str]]:
+        """
+        Command parameters of a setup run.
+
+        :param config: Output of :func:`encode_config`.
+        """
+        if self._document is None:
+            return {"commands": [inline_command(config)]}
+        return {"config": [config]}
+
+    def run(
+        self,
+        groups: Dict[str, List[ASGInstance]],
+        execution_timeout: int = 300,
+        stats: Optional[RequestStats] = None,
+    ) -> Dict[str, Optional[Tuple[int, str]]]:
+        """
+        Run the script on instances in parallel and wait for them.
+
+        :param groups: Map of a config (output of :func:`encode_config`)
+            to the instances to set up with it. Each config is sent as
+            one multi-target command per 50 instances.
+        :param execution_timeout: Seconds the script may run, and the
+            overall deadline for all results.
+        :param stats: If given, the latency of every setup is recorded in
+            it as ``setup``.
+        :return: Map of instance ID to ``(exit_code, output)``, or ``None``
+            if the command could not be sent or did not finish in time.
+        """
+        return run_documents(
+            [
+                (instances, self.parameters(config))
+                for config, instances in groups.items()
+            ],
+            execution_timeout,
+            document=self._document or "AWS-RunShellScript",
+            document_version=self._document_version if self._document else None,
+            stats=stats,
+            operation="setup",
+        )
@@ -0,0 +1,378 @@
+"""
+Rolling pmm-client upgrades for monitored ASG instances.
+
+Instances whose pmm-agent is older than the target version are upgraded
+in batches. A batch starts only while fewer than ``max_unavailable``
+upgraded agents are still unverified, and the next batch waits until
+every agent of the previous one has reconnected to the PMM server.
+
+Progress (in-flight upgrades, failure counters) is persisted in an SSM
+parameter, so a rollout that does not fit into one Lambda run continues
+on the next one.
+"""
+
+import json
+import re
+import time
+from logging import getLogger
+from textwrap import dedent
+from time import monotonic, sleep
+from typing import Dict, List, Optional, Tuple
+
+import boto3
+from botocore.exceptions import ClientError
+from infrahouse_core.aws.asg_instance import ASGInstance
+
+from fanout import run_on_instances
+from pmm_client import PMMClient
+
+LOG = getLogger(__name__)
+
+# apt-get update + install + agent restart on one batch.
+UPGRADE_TIMEOUT = 120
+# How long to wait for upgraded agents to show up as connected in PMM.
+RECONNECT_TIMEOUT = 45
+# An upgrade still unverified after this many seconds counts as failed.
+STALE_UPGRADE_SECONDS = 1800
+# Instances that failed this many times are left alone until the target
+# version changes.
+MAX_UPGRADE_ATTEMPTS = 3
+
+_VERSION_PATTERN = re.compile(r"^[0-9][0-9A-Za-z.+~-]*$")
+
+
+def version_tuple(version: Optional[str]) -> Tuple[int, ...]:
+    """
+    Numeric prefix of a version string.
+
+    :param version: Version such as ``3.1.0``, ``3`` or ``3.1.0-7.noble``.
+    :return: Tuple of integers, e.g. ``(3, 1, 0)``; empty if unparsable.
+    """
+    match = re.match(r"\d+(\.\d+)*", version or "")
+    if not match:
+        return ()
+    return tuple(int(part) for part in match.group(0).split("."))
+
+
+def is_older(installed: Optional[str], target: str) -> bool:
+    """
+    Check whether an installed version is older than the target.
+
+    Only as many components as the target has are compared, so target
+    ``3`` accepts any 3.x agent and target ``3.2`` accepts any 3.2.x.
+
+    :param installed: Installed pmm-client version.
+    :param target: Target version.
+    :return: ``True`` if ``installed`` is known and older than ``target``.
+    """
+    installed_tuple = version_tuple(installed)
+    target_tuple = version_tuple(target)
+    if not installed_tuple or not target_tuple:
+        return False
+    return installed_tuple[: len(target_tuple)] < target_tuple
+
+
+def upgrade_script(target_version: str) -> str:
+    """
+    Build the shell script that upgrades pmm-client on one instance.
+
+    The script installs the newest repository version that equals
+    ``target_version`` or continues it with a new component (``3.1``
+    matches ``3.1.2`` and ``3.1-1.noble``, not ``3.10.0``), restarts
+    pmm-agent, waits until it reports ``Connected: true`` and prints the
+    installed version.
+
+    :param target_version: Version prefix to install, e.g. ``3.1.0``.
+    :return: Shell script.
+    :raise ValueError: If the version contains unexpected characters.
+    """
+    if not _VERSION_PATTERN.match(target_version):
+        raise ValueError(f"Invalid pmm-client target version: {target_version!r}")
+    return dedent(
+        f"""\
+        set -euo pipefail
+        export PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin
+        export DEBIAN_FRONTEND=noninteractive
+        apt-get update -qq
+        candidate=$(apt-cache madison pmm-client | awk -v t='{target_version}' '
+            $3 == t || index($3, t ".") == 1 || index($3, t "-") == 1 {{print $3; exit}}
+        ')
+        if [ -z "$candidate" ]; then
+            echo 'pmm-client {target_version} is not available' >&2
+            exit 1
+        fi
+        apt-get install -y -qq --only-upgrade "pmm-client=$candidate"
+        systemctl restart pmm-agent
+        for i in $(seq 1 20); do
+            if pmm-admin status 2>/dev/null | grep -q "Connected.*true"; then
+                dpkg-query -W -f='${{Version}}' pmm-client
+                exit 0
+            fi
+            sleep 2
+        done
+        echo 'pmm-agent did not reconnect after upgrade' >&2
+        exit 1
+        """
+    )
+
+
+class RollingUpgrade:
+    """
+    Fleet-wide rolling upgrade of pmm-client to a target version.
+
+    :param pmm: PMMClient used to read the agents inventory.
+    :param target_version: Version agents should run, e.g. ``3.1.0``.
+    :param batch_size: Max number of instances upgraded at once.
+    :param max_unavailable: Max number of agents that may be mid-upgrade
+        (upgraded but not yet verified) at any time, across runs.
+    :param parameter_name: SSM parameter that stores progress.
+    :param region: AWS region of the SSM parameter.
+    :param deadline: ``time.monotonic()`` value after which no new batch
+        is started in this run.
+    """
+
+    def __init__(
+        self,
+        pmm: PMMClient,
+        target_version: str,
+        batch_size: int,
+        max_unavailable: int,
+        parameter_name: str,
+        region: str,
+        deadline: float,
+    ):
+        self._pmm = pmm
+        self._target_version = target_version
+        self._batch_size = max(batch_size, 1)
+        self._max_unavailable = max(max_unavailable, 1)
+        self._parameter_name = parameter_name
+        self._ssm = boto3.client("ssm", region_name=region)
+        self._deadline = deadline
+        self._progress: Dict = {}
+
+    @property
+    def target_version(self) -> str:
+        """Version agents are upgraded to."""
+        return self._target_version
+
+    def load(self) -> None:
+        """
+        Read upgrade progress saved by previous runs.
+
+        Progress recorded for a different target version is discarded.
+        """
+        try:
+            response = self._ssm.get_parameter(
+                Name=self._parameter_name, WithDecryption=True
+            )
+            progress = json.loads(response["Parameter"]["Value"] or "{}")
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] != "ParameterNotFound":
+                raise
+            progress = {}
+        if progress.get("target_version") != self._target_version:
+            progress = {"target_version": self._target_version, "asgs": {}}
+        self._progress = progress
+
+    def save(self) -> None:
+        """Persist upgrade progress for the next run."""
+        self._ssm.put_parameter(
+            Name=self._parameter_name,
+            Value=json.dumps(self._progress, separators=(",", ":")),
+            Type="SecureString",
+            Overwrite=True,
+        )
+
+    def run(
+        self,
+        asg_name: str,
+        instances: List[ASGInstance],
+        statuses: Dict[str, Optional[Dict]],
+    ) -> int:
+        """
+        Advance the rolling upgrade for one ASG.
+
+        :param asg_name: ASG name (progress is tracked per ASG).
+        :param instances: Current InService instances of the ASG.
+        :param statuses: Probe statuses keyed by instance ID.
+        :return: Number of instances whose upgrade was verified in this run.
+        """
+        progress = self._progress.setdefault("asgs", {}).setdefault(
+            asg_name, {"upgraded": 0, "in_progress": {}, "failures": {}}
+        )
+        in_progress: Dict[str, float] = progress["in_progress"]
+        failures: Dict[str, int] = progress["failures"]
+        by_id = {inst.instance_id: inst for inst in instances}
+        agents = self._agents_by_address()
+        verified = 0
+
+        # Settle upgrades started by previous runs.
+        for instance_id, started in list(in_progress.items()):
+            inst = by_id.get(instance_id)
+            if inst is None:
+                del in_progress[instance_id]
+            elif self._is_current(inst, statuses, agents):
+                del in_progress[instance_id]
+                verified += 1
+            elif time.time() - started > STALE_UPGRADE_SECONDS:
+                LOG.warning("Upgrade of %s was never verified", instance_id)
+                del in_progress[instance_id]
+                failures[instance_id] = failures.get(instance_id, 0) + 1
+
+        candidates = [
+            inst
+            for inst in instances
+            if inst.instance_id not in in_progress
+            and failures.get(inst.instance_id, 0) < MAX_UPGRADE_ATTEMPTS
+            and is_older(self._version(inst, statuses, agents), self._target_version)
+        ]
+        if candidates:
+            LOG.info(
+                "ASG %s: %d pmm-client(s) older than %s",
+                asg_name,
+                len(candidates),
+                self._target_version,
+            )
+
+        while candidates:
+            room = self._max_unavailable - len(in_progress)
+            if room <= 0:
+                LOG.info(
+                    "ASG %s: %d upgrade(s) still unverified, waiting",
+                    asg_name,
+                    len(in_progress),
+                )
+                break
+            if monotonic() + UPGRADE_TIMEOUT + RECONNECT_TIMEOUT > self._deadline:
+                LOG.info("ASG %s: no time left for another upgrade batch", asg_name)
+                break
+
+            batch = candidates[: min(self._batch_size, room)]
+            candidates = candidates[len(batch) :]
+            LOG.info(
+                "Upgrading pmm-client to %s on %s",
+                self._target_version,
+                [inst.instance_id for inst in batch],
+            )
+            for inst in batch:
+                in_progress[inst.instance_id] = time.time()
+
+            results = run_on_instances(
+                batch, upgrade_script(self._target_version), UPGRADE_TIMEOUT
+            )
+            upgraded = []
+            reported: Dict[str, Optional[Dict]] = {}
+            for inst in batch:
+                result = results.get(inst.instance_id)
+                if result is not None and result[0] == 0:
+                    upgraded.append(inst)
+                    # The script prints the installed version last.
+                    lines = result[1].strip().splitlines()
+                    reported[inst.instance_id] = {
+                        "version": lines[-1] if lines else None
+                    }
+                    continue
+                LOG.error(
+                    "pmm-client upgrade failed on %s: %s",
+                    inst.instance_id,
+                    result[1].strip() if result else "no result",
+                )
+                del in_progress[inst.instance_id]
+                failures[inst.instance_id] = failures.get(inst.instance_id, 0) + 1
+
+            reconnected = self._wait_for_reconnect(upgraded, reported)
+            for inst in reconnected:
+                del in_progress[inst.instance_id]
+                verified += 1
+            if len(reconnected) < len(batch):
+                # Do not move on while part of the batch is not healthy.
+                break
+
+        progress["upgraded"] += verified
+        LOG.info(
+            "ASG %s: %d pmm-client upgrade(s) verified, %d in progress, "
+            "%d total to %s",
+            asg_name,
+            verified,
+            len(in_progress),
+            progress["upgraded"],
+            self._target_version,
+        )
+        return verified
+
+    def _agents_by_address(self) -> Dict[str, Dict]:
+        """
+        Map PMM node addresses to their pmm-agent inventory entries.
+
+        Instances are matched by private IP rather than by node name:
+        ``pmm-admin config`` registers the OS hostname, which may differ
+        from the PrivateDnsName the instance's ``hostname`` comes from.
+        """
+        addresses = {node["node_id"]: node.get("address") for node in self._pmm.nodes}
+        return {
+            addresses[agent["runs_on_node_id"]]: agent
+            for agent in self._pmm.pmm_agents
+            if agent.get("runs_on_node_id") in addresses
+        }
+
+    @staticmethod
+    def _version(
+        inst: ASGInstance,
+        statuses: Dict[str, Optional[Dict]],
+        agents: Dict[str, Dict],
+    ) -> Optional[str]:
+        """
+        Installed pmm-client version of an instance.
+
+        Prefers the version reported by the agents inventory and falls back
+        to the package version from the probe.
+        """
+        agent = agents.get(inst.private_ip) or {}
+        status = statuses.get(inst.instance_id) or {}
+        return agent.get("version") or status.get("version")
+
+    def _is_current(
+        self,
+        inst: ASGInstance,
+        statuses: Dict[str, Optional[Dict]],
+        agents: Dict[str, Dict],
+    ) -> bool:
+        """Whether an instance runs the target version and its agent is connected."""
+        agent = agents.get(inst.private_ip) or {}
+        version = self._version(inst, statuses, agents)
+        return bool(
+            agent.get("connected")
+            and version
+            and not is_older(version, self._target_version)
+        )
+
+    def _wait_for_reconnect(
+        self, instances: List[ASGInstance], reported: Dict[str, Optional[Dict]]
+    ) -> List[ASGInstance]:
+        """
+        Wait until upgraded agents show up in PMM as connected and on the
+        target version.
+
+        :param instances: Instances whose upgrade command succeeded.
+        :param reported: Versions printed by the upgrade command, keyed by
+            instance ID like probe statuses (see :meth:`_version`).
+        :return: Instances whose pmm-agent is connected and current.
+        """
+        deadline = monotonic() + RECONNECT_TIMEOUT
+        waiting = {inst.instance_id: inst for inst in instances}
+        connected = []
+        while waiting:
+            agents = self._agents_by_address()
+            for instance_id, inst in list(waiting.items()):
+                if self._is_current(inst, reported, agents):
+                    connected.append(waiting.pop(instance_id))
+            if not waiting or monotonic() > deadline:
+                break
+            sleep(5)
+        for instance_id in waiting:
+            LOG.warning(
+                "pmm-agent on %s has not reconnected with %s yet",
+                instance_id,
+                self._target_version,
+            )
+        return connected
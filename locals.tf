@@ -75,6 +75,110 @@ locals {
     }] : []
   )
 
+  # Readiness-driven startup of Docker, the CloudWatch agent and PMM
+  # (scripts/pmm_bootstrap.py), run by start-services.sh.tftpl.
+  parallel_bootstrap_files = var.enable_parallel_bootstrap ? [
+    {
+      path        = "/usr/local/bin/pmm-bootstrap"
+      permissions = "0755"
+      content     = file("${path.module}/scripts/pmm_bootstrap.py")
+    }
+  ] : []
+
+  # PMM self-monitoring collector (scripts/pmm_self_monitor.py) and its
+  # systemd timer. Metrics are alarmed on in ebs.tf. The boot profiler
+  # (scripts/pmm_boot_profile.py) runs once after the bootstrap and reads
+  # the markers the user data scripts write through pmm-boot-phase.
+  self_monitoring_namespace = "PMM/SelfMonitoring"
+  boot_profile_namespace    = "PMM/Boot"
+  self_monitoring_files = var.enable_self_monitoring ? [
+    {
+      path        = "/usr/local/bin/pmm-self-monitor"
+      permissions = "0755"
+      content     = file("${path.module}/scripts/pmm_self_monitor.py")
+    },
+    {
+      path        = "/etc/systemd/system/pmm-self-monitor.service"
+      permissions = "0644"
+      content = templatefile("${path.module}/templates/pmm-self-monitor.service.tftpl", {
+        aws_region = data.aws_region.current.name
+        namespace  = local.self_monitoring_namespace
+      })
+    },
+    {
+      path        = "/etc/systemd/system/pmm-self-monitor.timer"
+      permissions = "0644"
+      content     = file("${path.module}/templates/pmm-self-monitor.timer.tftpl")
+    },
+    {
+      path        = "/usr/local/bin/pmm-boot-phase"
+      permissions = "0755"
+      content     = file("${path.module}/templates/pmm-boot-phase.sh.tftpl")
+    },
+    {
+      path        = "/usr/local/bin/pmm-boot-profile"
+      permissions = "0755"
+      content     = file("${path.module}/scripts/pmm_boot_profile.py")
+    },
+    {
+      path        = "/etc/systemd/system/pmm-boot-profile.service"
+      permissions = "0644"
+      content = templatefile("${path.module}/templates/pmm-boot-profile.service.tftpl", {
+        aws_region  = data.aws_region.current.name
+        pmm_version = var.pmm_version
+        namespace   = local.boot_profile_namespace
+      })
+    }
+  ] : []
+
+  # Application-consistent daily backup (scripts/pmm_consistent_snapshot.py)
+  # and its systemd timer. The backup plan in backup.tf then has no daily rule.
+  backup_plan_enabled = !var.backup_quiesce.enabled || var.enable_weekly_backup
+  backup_quiesce_files = var.backup_quiesce.enabled ? [
+    {
+      path        = "/usr/local/bin/pmm-consistent-snapshot"
+      permissions = "0755"
+      content     = file("${path.module}/scripts/pmm_consistent_snapshot.py")
+    },
+    {
+      path        = "/etc/systemd/system/pmm-consistent-snapshot.service"
+      permissions = "0644"
+      content = templatefile("${path.module}/templates/pmm-consistent-snapshot.service.tftpl", {
+        aws_region     = data.aws_region.current.name
+        volume_id      = aws_ebs_volume.pmm_data.id
+        retention_days = var.backup_retention_days
+        max_pause      = var.backup_quiesce.max_pause_seconds
+      })
+    },
+    {
+      path        = "/etc/systemd/system/pmm-consistent-snapshot.timer"
+      permissions = "0644"
+      content = templatefile("${path.module}/templates/pmm-consistent-snapshot.timer.tftpl", {
+        schedule = var.backup_quiesce.schedule
+      })
+    }
+  ] : []
+
+  # Pre-warm of a data volume restored from a snapshot (scripts/pmm_prewarm.py),
+  # started by start-services.sh.tftpl.
+  ebs_prewarm_files = var.ebs_prewarm.enabled ? [
+    {
+      path        = "/usr/local/bin/pmm-prewarm"
+      permissions = "0755"
+      content     = file("${path.module}/scripts/pmm_prewarm.py")
+    },
+    {
+      path        = "/etc/systemd/system/pmm-prewarm.service"
+      permissions = "0644"
+      content = templatefile("${path.module}/templates/pmm-prewarm.service.tftpl", {
+        device     = "/dev/${local.data_device_name}"
+        aws_region = data.aws_region.current.name
+        max_mbps   = var.ebs_prewarm.max_mbps
+        workers    = var.ebs_prewarm.workers
+      })
+    }
+  ] : []
+
   # Docker volume mount arguments for custom query files
   custom_query_volume_mounts = join(" ", concat(
     var.postgresql_custom_queries_high_resolution != null ? [
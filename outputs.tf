@@ -38,6 +38,21 @@ output "alb_logs_bucket_name" {
   value       = module.alb_logs_bucket.bucket_name
 }
 
+output "metrics_archive_bucket_name" {
+  description = "Name of the S3 bucket for archived PMM metrics (null if metrics_archive is disabled)"
+  value       = var.metrics_archive.enabled ? module.metrics_archive_bucket[0].bucket_name : null
+}
+
+output "inventory_snapshots_bucket_name" {
+  description = "Name of the S3 bucket for reconciler inventory snapshots (null if reconciler_inventory_snapshots is disabled)"
+  value       = local.create_inventory ? module.inventory_snapshots_bucket[0].bucket_name : null
+}
+
+output "reconciler_history_bucket_name" {
+  description = "Name of the S3 bucket for the reconciler run history (null if reconciler_history is disabled)"
+  value       = local.create_history ? module.reconciler_history_bucket[0].bucket_name : null
+}
+
 output "sns_topic_arn" {
   description = "ARN of the SNS topic for alarm notifications (null if no emails configured)"
   value       = length(var.alarm_emails) > 0 ? aws_sns_topic.alarms[0].arn : null
@@ -0,0 +1,18 @@
+"""
+Operator tooling for PMM deployments created by this module.
+
+These tools run on a workstation or in CI, not on the PMM instance or in
+the reconciler Lambda. Several of them reuse the reconciler's modules
+(``pmm_client``, ``rds``, ``inventory``, ``history``), which are imported
+as top-level modules from ``lambda/pmm_reconciler``.
+"""
+
+import sys
+from os import path as osp
+
+# The reconciler Lambda is not a package ("lambda" is a Python keyword).
+RECONCILER_DIR = osp.normpath(
+    osp.join(osp.dirname(osp.abspath(__file__)), "..", "lambda", "pmm_reconciler")
+)
+if RECONCILER_DIR not in sys.path:
+    sys.path.insert(0, RECONCILER_DIR)
@@ -0,0 +1,399 @@
+"""
+Latency breakdown of the PMM UI and API from ALB access logs.
+
+The ALB writes gzipped access logs to the ``alb_logs_bucket_name`` bucket
+under ``<service_name>/AWSLogs/<account>/elasticloadbalancing/<region>/
+YYYY/MM/DD/``, one object per load balancer node and five minutes. This
+tool reads the objects of a time range (or local log files), and reports
+the ``target_processing_time`` percentiles (time PMM took to answer) per
+path group and ELB status code.
+
+Everything is streamed: objects are downloaded a few at a time in
+background threads and decompressed, parsed and aggregated line by line.
+Percentiles come from log-scale histograms with 1% relative error, so
+memory does not grow with the number of requests.
+
+Path groups are matched by longest prefix (:data:`PATH_GROUPS`, or
+``--group``); other paths are reported as ``other``.
+
+Usage::
+
+    python -m pmm_tools.alb_logs --bucket "$(terraform output -raw alb_logs_bucket_name)" \\
+        --prefix pmm-server --start 2026-10-19T08:00 --end 2026-10-19T12:00
+    python -m pmm_tools.alb_logs ./logs/        # downloaded .log.gz files
+"""
+
+import argparse
+import gzip
+import io
+import json
+import math
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import boto3
+
+from daykeys import day_keys, parse_time
+
+# Longest matching prefix wins.
+PATH_GROUPS = (
+    "/graph/api/ds/query",
+    "/graph/api/",
+    "/graph/",
+    "/v1/qan",
+    "/v0/qan",
+    "/v1/",
+    "/prometheus/",
+)
+
+# Objects downloaded in parallel.
+MAX_WORKERS = 8
+
+# ALB writes a log object every 5 minutes, named after the interval end.
+LOG_INTERVAL = timedelta(minutes=5)
+
+# First 13 fields of an ALB log entry, up to the quoted request line.
+LINE_RE = re.compile(
+    r"^(?P<type>\S+) (?P<time>\S+) \S+ \S+ \S+ (?P<request_time>\S+) "
+    r"(?P<target_time>\S+) (?P<response_time>\S+) (?P<elb_status>\S+) \S+ \S+ \S+ "
+    r'"(?P<request>[^"]*)"'
+)
+KEY_TIME_RE = re.compile(r"_(\d{8}T\d{4}Z)_")
+
+
+@dataclass
+class Request:
+    """One ALB log entry."""
+
+    time: datetime
+    path: str
+    elb_status: str
+    target_time: Optional[float]
+
+
+class Histogram:
+    """
+    Log-scale latency histogram.
+
+    Bucket ``i`` holds values up to ``MIN * GROWTH ** i``; a percentile is
+    reported as its bucket's upper bound, at most 1% above the real value.
+    """
+
+    MIN = 0.0001
+    GROWTH = 1.01
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        # Also counts requests without a latency, see :func:`aggregate`.
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        """Record a value in seconds."""
+        index = 0
+        if value > self.MIN:
+            index = math.ceil(math.log(value / self.MIN) / math.log(self.GROWTH))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """
+        Value below which ``fraction`` of the recorded values are.
+
+        :param fraction: E.g. ``0.95``.
+        :return: Seconds, or ``None`` if nothing was recorded.
+        """
+        if not self.counts:
+            return None
+        rank = math.ceil(fraction * sum(self.counts.values()))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.MIN * self.GROWTH**index, self.max)
+        return self.max
+
+
+def parse_lines(lines: Iterable[str]) -> Iterator[Request]:
+    """
+    Parse ALB log lines; lines that do not parse are skipped.
+
+    :param lines: Log lines.
+    :return: Requests. ``target_time`` is ``None`` when the request was not
+        sent to PMM (ALB reports -1).
+    """
+    for line in lines:
+        match = LINE_RE.match(line)
+        if not match:
+            continue
+        parts = match["request"].split(" ")
+        path = urlsplit(parts[1]).path if len(parts) > 1 else ""
+        target_time = float(match["target_time"])
+        yield Request(
+            time=datetime.fromisoformat(match["time"].replace("Z", "+00:00")),
+            path=path or "/",
+            elb_status=match["elb_status"],
+            target_time=None if target_time < 0 else target_time,
+        )
+
+
+def path_group(path: str, groups: Iterable[str] = PATH_GROUPS) -> str:
+    """
+    Group of a request path.
+
+    :param path: URL path.
+    :param groups: Path prefixes.
+    :return: Longest matching prefix, or ``other``.
+    """
+    matches = [prefix for prefix in groups if path.startswith(prefix)]
+    return max(matches, key=len) if matches else "other"
+
+
+def aggregate(
+    requests: Iterable[Request],
+    groups: Iterable[str] = PATH_GROUPS,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> Dict[Tuple[str, str], Histogram]:
+    """
+    Latency histograms per path group and ELB status code.
+
+    :param requests: From :func:`parse_lines`.
+    :param groups: Path prefixes.
+    :param start: Ignore requests before it.
+    :param end: Ignore requests at or after it.
+    :return: ``{(group, status): histogram}``; requests not sent to PMM
+        are counted (``count``) but have no latency.
+    """
+    groups = tuple(groups)
+    result: Dict[Tuple[str, str], Histogram] = {}
+    for request in requests:
+        if (start and request.time < start) or (end and request.time >= end):
+            continue
+        key = (path_group(request.path, groups), request.elb_status)
+        histogram = result.setdefault(key, Histogram())
+        if request.target_time is None:
+            histogram.count += 1
+        else:
+            histogram.add(request.target_time)
+    return result
+
+
+def report(histograms: Dict[Tuple[str, str], Histogram]) -> List[Dict]:
+    """
+    Rows of the report, slowest p99 first.
+
+    :param histograms: From :func:`aggregate`.
+    :return: ``group``, ``status``, ``count`` and ``p50``/``p95``/``p99``/``max``
+        in seconds.
+    """
+    rows = [
+        {
+            "group": group,
+            "status": status,
+            "count": histogram.count,
+            "p50": histogram.percentile(0.5),
+            "p95": histogram.percentile(0.95),
+            "p99": histogram.percentile(0.99),
+            "max": histogram.max if histogram.counts else None,
+        }
+        for (group, status), histogram in histograms.items()
+    ]
+    return sorted(rows, key=lambda row: (-(row["p99"] or 0), row["group"]))
+
+
+def format_report(rows: List[Dict]) -> str:
+    """
+    Plain-text table of the report.
+
+    :param rows: From :func:`report`.
+    :return: Table with latencies in milliseconds.
+    """
+    header = ("GROUP", "STATUS", "COUNT", "P50 ms", "P95 ms", "P99 ms", "MAX ms")
+    lines = [header] + [
+        (row["group"], row["status"], str(row["count"]))
+        + tuple(
+            "-" if row[key] is None else f"{row[key] * 1000:.1f}"
+            for key in ("p50", "p95", "p99", "max")
+        )
+        for row in rows
+    ]
+    widths = [max(len(line[column]) for line in lines) for column in range(7)]
+    return "\n".join(
+        "  ".join(
+            cell.ljust(width) if column < 2 else cell.rjust(width)
+            for column, (cell, width) in enumerate(zip(line, widths))
+        )
+        for line in lines
+    )
+
+
+def read_lines(data: bytes) -> Iterator[str]:
+    """
+    Lines of a log object, gunzipped while reading if needed.
+
+    :param data: Object contents.
+    :return: Lines without the newline.
+    """
+    raw = io.BytesIO(data)
+    stream = gzip.GzipFile(fileobj=raw) if data[:2] == b"\x1f\x8b" else raw
+    for line in io.TextIOWrapper(stream, encoding="utf-8", errors="replace"):
+        yield line.rstrip("\n")
+
+
+def local_lines(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Lines of local log files; directories are read recursively.
+
+    :param paths: Files or directories.
+    :return: Lines, file by file.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in names
+                if name.endswith((".log", ".log.gz"))
+            )
+        else:
+            files = [path]
+        for name in files:
+            opener = gzip.open if name.endswith(".gz") else open
+            with opener(name, "rt", encoding="utf-8", errors="replace") as fp:
+                for line in fp:
+                    yield line.rstrip("\n")
+
+
+def log_keys(
+    s3_client,
+    bucket: str,
+    prefix: str,
+    account_id: str,
+    region: str,
+    start: datetime,
+    end: datetime,
+) -> Iterator[str]:
+    """
+    Keys of the log objects that can hold requests of a time range.
+
+    :param s3_client: boto3 S3 client.
+    :param bucket: ALB logs bucket.
+    :param prefix: Access log prefix (the module's ``service_name``).
+    :param account_id: AWS account of the load balancer.
+    :param region: Region of the load balancer.
+    :param start: Start of the range, timezone-aware.
+    :param end: End of the range, timezone-aware.
+    :return: Keys, oldest first.
+    """
+
+    def in_range(key: str) -> bool:
+        match = KEY_TIME_RE.search(key)
+        if not match:
+            return False
+        written = datetime.strptime(match[1], "%Y%m%dT%H%MZ").replace(
+            tzinfo=timezone.utc
+        )
+        return start < written <= end + LOG_INTERVAL
+
+    # Objects are named after the end of their interval, so the last one
+    # can carry the next day's date.
+    return day_keys(
+        s3_client,
+        bucket,
+        start,
+        end + LOG_INTERVAL,
+        in_range,
+        prefix=f"{prefix}/AWSLogs/{account_id}/elasticloadbalancing/{region}/",
+    )
+
+
+def s3_lines(
+    s3_client, bucket: str, keys: Iterable[str], max_workers: int = MAX_WORKERS
+) -> Iterator[str]:
+    """
+    Lines of S3 log objects, downloaded concurrently.
+
+    At most ``max_workers`` objects are downloaded ahead of the one being
+    read, so memory is bounded by a few compressed objects.
+
+    :param s3_client: boto3 S3 client.
+    :param bucket: ALB logs bucket.
+    :param keys: Object keys.
+    :param max_workers: Parallel downloads.
+    :return: Lines, object by object in key order.
+    """
+
+    def download(key: str) -> bytes:
+        return s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending: deque = deque()
+        for key in keys:
+            pending.append(executor.submit(download, key))
+            if len(pending) > max_workers:
+                yield from read_lines(pending.popleft().result())
+        while pending:
+            yield from read_lines(pending.popleft().result())
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(
+        description="PMM latency per path group and status from ALB access logs"
+    )
+    parser.add_argument("paths", nargs="*", help="Local log files or directories")
+    parser.add_argument("--bucket", help="alb_logs_bucket_name output")
+    parser.add_argument("--prefix", default="pmm-server", help="service_name")
+    parser.add_argument("--account-id", help="Defaults to the caller's account")
+    parser.add_argument("--region", help="Region of the load balancer")
+    parser.add_argument("--start", help="ISO time, UTC by default")
+    parser.add_argument("--end", help="ISO time, UTC by default; default now")
+    parser.add_argument(
+        "--group", action="append", help="Path prefix to report; repeatable"
+    )
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args(argv)
+
+    start = parse_time(args.start) if args.start else None
+    end = parse_time(args.end) if args.end else None
+    if args.bucket:
+        if not start:
+            parser.error("--start is required with --bucket")
+        end = end or datetime.now(timezone.utc)
+        session = boto3.session.Session(region_name=args.region)
+        s3_client = session.client("s3")
+        account_id = (
+            args.account_id or session.client("sts").get_caller_identity()["Account"]
+        )
+        keys = log_keys(
+            s3_client,
+            args.bucket,
+            args.prefix,
+            account_id,
+            session.region_name,
+            start,
+            end,
+        )
+        lines = s3_lines(s3_client, args.bucket, keys, args.workers)
+    elif args.paths:
+        lines = local_lines(args.paths)
+    else:
+        parser.error("give log files or --bucket")
+
+    rows = report(aggregate(parse_lines(lines), args.group or PATH_GROUPS, start, end))
+    print(json.dumps(rows, indent=2) if args.json else format_report(rows))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,406 @@
+"""
+On-demand backup of the PMM data volume, with an optional test restore.
+
+Starts AWS Backup jobs for the given EBS volumes (the module's
+``ebs_volume_id``, plus the root volume if ``backup_root_volume`` is on)
+in the module's vault, all at once, and polls them together with
+exponential backoff. With ``--test-restore`` each new recovery point is
+restored into a scratch volume, which is checked and deleted again.
+
+Reported per volume, and published to CloudWatch with ``--publish``
+(dimension ``VolumeId``):
+
+- ``RecoveryPointAge``: age of the newest recovery point before this run,
+  the data lost if the volume failed just now (RPO),
+- ``BackupDuration`` and ``BackupSize`` of the new recovery point,
+- ``RestoreDuration``: time to get a volume back from it (RTO, minus the
+  instance rebuild; blocks are still loaded lazily from S3 afterwards).
+
+Durations come from AWS Backup's job timestamps, not from the polling.
+The role is the module's ``backup_role_arn`` output, so the caller needs
+``iam:PassRole`` on it.
+
+Usage::
+
+    python -m pmm_tools.backup \\
+        --vault "$(terraform output -raw backup_vault_name)" \\
+        --role-arn "$(terraform output -raw backup_role_arn)" \\
+        --volume-id "$(terraform output -raw ebs_volume_id)" \\
+        --test-restore --publish
+"""
+
+import argparse
+import json
+import logging
+import sys
+import uuid
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from time import monotonic, sleep
+from typing import Callable, Dict, Iterable, List, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+LOG = logging.getLogger(__name__)
+
+BACKUP_DONE = ("COMPLETED", "FAILED", "ABORTED", "EXPIRED", "PARTIAL")
+RESTORE_DONE = ("COMPLETED", "FAILED", "ABORTED")
+
+# Polling backoff, seconds. EBS backups take minutes to hours.
+INITIAL_DELAY = 10
+MAX_DELAY = 120
+
+BACKUP_TIMEOUT = 4 * 3600
+RESTORE_TIMEOUT = 2 * 3600
+
+
+@dataclass
+class VolumeBackup:
+    """Backup (and test restore) of one volume."""
+
+    volume_id: str
+    backup_job_id: str
+    backup_state: str = "CREATED"
+    recovery_point_arn: Optional[str] = None
+    recovery_point_age: Optional[float] = None
+    backup_seconds: Optional[float] = None
+    backup_size: Optional[int] = None
+    restore_job_id: Optional[str] = None
+    restore_state: Optional[str] = None
+    restore_seconds: Optional[float] = None
+    restored_volume_id: Optional[str] = None
+    message: str = ""
+
+    @property
+    def ok(self) -> bool:
+        """The backup, and the restore if one was made, completed."""
+        return self.backup_state == "COMPLETED" and self.restore_state in (
+            None,
+            "COMPLETED",
+        )
+
+
+def wait_for_jobs(
+    describe: Callable[[str], Dict],
+    job_ids: Iterable[str],
+    state_key: str,
+    done_states: Iterable[str],
+    timeout: float,
+    initial_delay: float = INITIAL_DELAY,
+    max_delay: float = MAX_DELAY,
+) -> Dict[str, Dict]:
+    """
+    Poll jobs until all are finished or the timeout expires.
+
+    :param describe: Returns the description of a job ID.
+    :param job_ids: Jobs to wait for.
+    :param state_key: Key of the job state in the description.
+    :param done_states: States in which a job is finished.
+    :param timeout: Seconds to wait for all jobs together.
+    :param initial_delay: First delay between polls; doubles every round.
+    :param max_delay: Longest delay between polls.
+    :return: Last description of every job. Jobs still running at the
+        deadline are returned in their running state.
+    """
+    deadline = monotonic() + timeout
+    pending = set(job_ids)
+    jobs: Dict[str, Dict] = {}
+    delay = initial_delay
+    while pending:
+        for job_id in sorted(pending):
+            jobs[job_id] = describe(job_id)
+            if jobs[job_id].get(state_key) in done_states:
+                LOG.info("Job %s: %s", job_id, jobs[job_id][state_key])
+                pending.discard(job_id)
+        remaining = deadline - monotonic()
+        if not pending or remaining <= 0:
+            break
+        LOG.info("%d jobs running, next check in %.0f s", len(pending), delay)
+        sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+    return jobs
+
+
+def _seconds(job: Dict, start_key: str, end_key: str) -> Optional[float]:
+    if job.get(start_key) and job.get(end_key):
+        return (job[end_key] - job[start_key]).total_seconds()
+    return None
+
+
+def recovery_point_age(
+    backup_client, resource_arn: str, now: datetime
+) -> Optional[float]:
+    """
+    Age of the newest completed recovery point of a resource.
+
+    :param backup_client: boto3 Backup client.
+    :param resource_arn: ARN of the backed-up resource.
+    :param now: Current time, timezone-aware.
+    :return: Seconds, or ``None`` if the resource has no recovery point.
+    """
+    newest = None
+    paginator = backup_client.get_paginator("list_recovery_points_by_resource")
+    for page in paginator.paginate(ResourceArn=resource_arn):
+        for point in page.get("RecoveryPoints", []):
+            if point.get("Status") == "COMPLETED" and (
+                newest is None or point["CreationDate"] > newest
+            ):
+                newest = point["CreationDate"]
+    return (now - newest).total_seconds() if newest else None
+
+
+def back_up(
+    backup_client,
+    vault: str,
+    role_arn: str,
+    volume_ids: List[str],
+    region: str,
+    timeout: float = BACKUP_TIMEOUT,
+) -> List[VolumeBackup]:
+    """
+    Back up volumes concurrently and wait for the jobs.
+
+    :param backup_client: boto3 Backup client.
+    :param vault: Backup vault name (``backup_vault_name`` output).
+    :param role_arn: Role AWS Backup assumes (``backup_role_arn`` output).
+    :param volume_ids: EBS volumes to back up.
+    :param region: AWS region of the volumes.
+    :param timeout: Seconds to wait for all jobs.
+    :return: One result per volume.
+    """
+    account_id = role_arn.split(":")[4]
+    now = datetime.now(timezone.utc)
+    results = []
+    for volume_id in volume_ids:
+        resource_arn = f"arn:aws:ec2:{region}:{account_id}:volume/{volume_id}"
+        age = recovery_point_age(backup_client, resource_arn, now)
+        response = backup_client.start_backup_job(
+            BackupVaultName=vault,
+            ResourceArn=resource_arn,
+            IamRoleArn=role_arn,
+            IdempotencyToken=str(uuid.uuid4()),
+        )
+        LOG.info("Backup of %s started: %s", volume_id, response["BackupJobId"])
+        results.append(
+            VolumeBackup(volume_id, response["BackupJobId"], recovery_point_age=age)
+        )
+
+    jobs = wait_for_jobs(
+        lambda job_id: backup_client.describe_backup_job(BackupJobId=job_id),
+        [result.backup_job_id for result in results],
+        "State",
+        BACKUP_DONE,
+        timeout,
+    )
+    for result in results:
+        job = jobs[result.backup_job_id]
+        result.backup_state = job["State"]
+        result.recovery_point_arn = job.get("RecoveryPointArn")
+        result.backup_seconds = _seconds(job, "CreationDate", "CompletionDate")
+        result.backup_size = job.get("BackupSizeInBytes")
+        result.message = job.get("StatusMessage", "")
+        if result.backup_state not in BACKUP_DONE:
+            result.message = f"not finished after {timeout:.0f} s"
+    return results
+
+
+def verify_restore(
+    backup_client,
+    ec2_client,
+    vault: str,
+    role_arn: str,
+    results: List[VolumeBackup],
+    availability_zone: Optional[str] = None,
+    keep: bool = False,
+    timeout: float = RESTORE_TIMEOUT,
+) -> None:
+    """
+    Restore completed backups into scratch volumes, concurrently.
+
+    Updates ``results`` in place. A restored volume must become
+    ``available`` with the size of the original, then it is deleted.
+
+    :param backup_client: boto3 Backup client.
+    :param ec2_client: boto3 EC2 client.
+    :param vault: Backup vault name.
+    :param role_arn: Role AWS Backup assumes.
+    :param results: Results of :func:`back_up`.
+    :param availability_zone: Zone of the scratch volumes; defaults to the
+        zone recorded in the recovery point.
+    :param keep: Keep the scratch volumes.
+    :param timeout: Seconds to wait for all restores.
+    """
+    restoring = [r for r in results if r.backup_state == "COMPLETED"]
+    for result in restoring:
+        metadata = backup_client.get_recovery_point_restore_metadata(
+            BackupVaultName=vault, RecoveryPointArn=result.recovery_point_arn
+        )["RestoreMetadata"]
+        if availability_zone:
+            metadata["availabilityZone"] = availability_zone
+        result.restore_job_id = backup_client.start_restore_job(
+            RecoveryPointArn=result.recovery_point_arn,
+            Metadata=metadata,
+            IamRoleArn=role_arn,
+            ResourceType="EBS",
+            IdempotencyToken=str(uuid.uuid4()),
+        )["RestoreJobId"]
+        LOG.info("Restore of %s started: %s", result.volume_id, result.restore_job_id)
+    if not restoring:
+        return
+
+    jobs = wait_for_jobs(
+        lambda job_id: backup_client.describe_restore_job(RestoreJobId=job_id),
+        [result.restore_job_id for result in restoring],
+        "Status",
+        RESTORE_DONE,
+        timeout,
+    )
+    for result in restoring:
+        job = jobs[result.restore_job_id]
+        result.restore_state = job["Status"]
+        result.restore_seconds = _seconds(job, "CreationDate", "CompletionDate")
+        if job.get("CreatedResourceArn"):
+            result.restored_volume_id = job["CreatedResourceArn"].rsplit("/", 1)[-1]
+        if result.restore_state not in RESTORE_DONE:
+            result.message = f"restore not finished after {timeout:.0f} s"
+        elif result.restore_state != "COMPLETED":
+            result.message = job.get("StatusMessage", "")
+    _check_restored(ec2_client, restoring, keep)
+
+
+def _check_restored(ec2_client, results: List[VolumeBackup], keep: bool) -> None:
+    restored = {r.restored_volume_id: r for r in results if r.restored_volume_id}
+    if not restored:
+        return
+    try:
+        originals = {
+            volume["VolumeId"]: volume
+            for volume in ec2_client.describe_volumes(
+                VolumeIds=[r.volume_id for r in restored.values()]
+            )["Volumes"]
+        }
+        ec2_client.get_waiter("volume_available").wait(VolumeIds=list(restored))
+        for volume in ec2_client.describe_volumes(VolumeIds=list(restored))["Volumes"]:
+            result = restored[volume["VolumeId"]]
+            expected = originals[result.volume_id]["Size"]
+            if volume["Size"] != expected:
+                result.restore_state = "FAILED"
+                result.message = (
+                    f"restored {volume['VolumeId']} is {volume['Size']} GiB, "
+                    f"{result.volume_id} is {expected} GiB"
+                )
+    finally:
+        # Scratch volumes cost money; delete them even if the check failed.
+        for volume_id in restored:
+            if keep:
+                LOG.info("Keeping scratch volume %s", volume_id)
+                continue
+            try:
+                ec2_client.delete_volume(VolumeId=volume_id)
+                LOG.info("Deleted scratch volume %s", volume_id)
+            except ClientError as exc:
+                LOG.error("Cannot delete scratch volume %s: %s", volume_id, exc)
+
+
+def metric_data(results: List[VolumeBackup]) -> List[Dict]:
+    """
+    CloudWatch ``MetricData`` of the results.
+
+    :param results: Results of :func:`back_up` and :func:`verify_restore`.
+    :return: Metrics with the ``VolumeId`` dimension; unknown values are
+        left out.
+    """
+    metrics = []
+    for result in results:
+        for name, value, unit in (
+            ("RecoveryPointAge", result.recovery_point_age, "Seconds"),
+            ("BackupDuration", result.backup_seconds, "Seconds"),
+            ("BackupSize", result.backup_size, "Bytes"),
+            ("RestoreDuration", result.restore_seconds, "Seconds"),
+        ):
+            if value is not None:
+                metrics.append(
+                    {
+                        "MetricName": name,
+                        "Value": value,
+                        "Unit": unit,
+                        "Dimensions": [{"Name": "VolumeId", "Value": result.volume_id}],
+                    }
+                )
+    return metrics
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point. Exits with 1 if a backup or restore failed."""
+    parser = argparse.ArgumentParser(
+        description="Back up the PMM data volume and time a test restore"
+    )
+    parser.add_argument("--vault", required=True, help="backup_vault_name output")
+    parser.add_argument("--role-arn", required=True, help="backup_role_arn output")
+    parser.add_argument(
+        "--volume-id",
+        action="append",
+        required=True,
+        help="EBS volume to back up (ebs_volume_id output); repeatable",
+    )
+    parser.add_argument("--region", help="AWS region")
+    parser.add_argument(
+        "--test-restore", action="store_true", help="Restore into scratch volumes"
+    )
+    parser.add_argument("--availability-zone", help="Zone of the scratch volumes")
+    parser.add_argument(
+        "--keep-restored", action="store_true", help="Do not delete scratch volumes"
+    )
+    parser.add_argument(
+        "--publish", action="store_true", help="Publish the timings to CloudWatch"
+    )
+    parser.add_argument("--namespace", default="PMM/Backup")
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=BACKUP_TIMEOUT,
+        help="Seconds to wait for the backups",
+    )
+    parser.add_argument(
+        "--restore-timeout",
+        type=float,
+        default=RESTORE_TIMEOUT,
+        help="Seconds to wait for the test restores",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    session = boto3.session.Session(region_name=args.region)
+    backup_client = session.client("backup")
+    results = back_up(
+        backup_client,
+        args.vault,
+        args.role_arn,
+        args.volume_id,
+        session.region_name,
+        timeout=args.timeout,
+    )
+    if args.test_restore:
+        verify_restore(
+            backup_client,
+            session.client("ec2"),
+            args.vault,
+            args.role_arn,
+            results,
+            availability_zone=args.availability_zone,
+            keep=args.keep_restored,
+            timeout=args.restore_timeout,
+        )
+
+    metrics = metric_data(results)
+    if args.publish and metrics:
+        session.client("cloudwatch").put_metric_data(
+            Namespace=args.namespace, MetricData=metrics
+        )
+    print(json.dumps([asdict(result) for result in results], indent=2))
+    return 0 if all(result.ok for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
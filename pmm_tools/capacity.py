@@ -0,0 +1,376 @@
+"""
+Capacity planning for the PMM server: instance type and EBS sizing.
+
+Takes a fleet description and estimates the load it puts on PMM:
+
+- active time series and samples per second written to VictoriaMetrics,
+- Query Analytics (QAN) rows per second written to ClickHouse,
+- storage growth per day and for the retention period,
+
+then recommends ``instance_type``, ``ebs_volume_size``, ``ebs_iops`` and
+``ebs_throughput``.
+
+The fleet description is a YAML (or JSON) file::
+
+    monitored_asgs:            # entries as in the Terraform variable, plus:
+      - asg_name: percona
+        service_type: mysql
+        instances: 3           # number of instances in the ASG
+        tables: 400            # tables per server (table statistics)
+        qan: {query_source: slowlog, disable_tablestats_limit: 1000}
+    rds_instances:
+      - engine: postgres       # or mysql
+        count: 4
+        databases: 3           # PostgreSQL only
+        enhanced_monitoring: true
+    custom_queries:            # files passed to postgresql_custom_queries_*
+      high: queries/pg-high-res.yml
+      medium: queries/pg-med-res.yml
+      low: queries/pg-low-res.yml
+      rows_per_query: 20       # expected result rows per query
+    resolutions: {high: 5, medium: 10, low: 60}   # PMM metrics resolutions, s
+    retention_days: 30         # PMM data retention
+    qan_fingerprints: 100      # distinct queries per service per minute
+
+Per-exporter series counts and per-sample storage costs are rules of
+thumb for PMM 3 defaults. Check them against a running PMM with
+``--validate-url`` (see :func:`validate`) and adjust when they drift.
+
+Usage::
+
+    python -m pmm_tools.capacity fleet.yaml
+    PMM_ADMIN_PASSWORD=... python -m pmm_tools.capacity fleet.yaml \\
+        --validate-url http://127.0.0.1
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+from dataclasses import asdict, dataclass, field
+from os import path as osp
+from typing import Dict, List, Optional
+
+import boto3
+import yaml
+
+from pmm_tools.custom_queries import load_custom_queries, value_columns
+
+from pmm_client import PMMClient
+
+RESOLUTIONS = ("high", "medium", "low")
+DEFAULT_RESOLUTIONS = {"high": 5, "medium": 10, "low": 60}
+
+# Series per exporter and resolution with PMM 3 default collectors.
+EXPORTER_SERIES = {
+    "node": {"high": 150, "medium": 300, "low": 250},
+    "mysql": {"high": 250, "medium": 500, "low": 350},
+    "postgresql": {"high": 100, "medium": 150, "low": 150},
+    "rds": {"high": 0, "medium": 0, "low": 120},
+    "rds_enhanced": {"high": 0, "medium": 200, "low": 0},
+}
+# Extra low-resolution series per MySQL table (table statistics) and per
+# PostgreSQL database.
+SERIES_PER_MYSQL_TABLE = 12
+SERIES_PER_PG_DATABASE = 25
+
+# On-disk cost after compression, including indexes.
+BYTES_PER_SAMPLE = 1.0
+BYTES_PER_QAN_ROW = 1000
+BYTES_PER_QAN_ROW_WITHOUT_EXAMPLES = 300
+# Space kept free on the data volume, plus OS/PMM overhead.
+STORAGE_HEADROOM = 0.3
+STORAGE_BASE_GB = 10
+
+# What one PMM server handles comfortably, per instance type. These are
+# also the default self_monitoring_thresholds for m5.large.
+INSTANCE_CAPACITY = [
+    {"instance_type": "m5.large", "series": 1_000_000, "samples": 50_000, "qan": 500},
+    {
+        "instance_type": "m5.xlarge",
+        "series": 2_000_000,
+        "samples": 100_000,
+        "qan": 1000,
+    },
+    {
+        "instance_type": "m5.2xlarge",
+        "series": 4_000_000,
+        "samples": 200_000,
+        "qan": 2000,
+    },
+]
+# Keep the chosen instance below this share of its capacity.
+TARGET_UTILIZATION = 0.7
+
+
+@dataclass
+class Estimate:
+    """Estimated PMM load for a fleet."""
+
+    series: Dict[str, int] = field(
+        default_factory=lambda: {resolution: 0 for resolution in RESOLUTIONS}
+    )
+    samples_per_second: float = 0.0
+    qan_rows_per_second: float = 0.0
+    storage_gb_per_day: float = 0.0
+    storage_gb: float = 0.0
+    services: int = 0
+
+    @property
+    def active_series(self) -> int:
+        """Active series across all resolutions."""
+        return sum(self.series.values())
+
+
+@dataclass
+class Recommendation:
+    """Recommended module settings for an :class:`Estimate`."""
+
+    instance_type: str
+    ebs_volume_size: int
+    ebs_iops: int
+    ebs_throughput: int
+    warnings: List[str] = field(default_factory=list)
+
+
+def _add(series: Dict[str, int], per_resolution: Dict[str, int], count: int) -> None:
+    for resolution in RESOLUTIONS:
+        series[resolution] += per_resolution.get(resolution, 0) * count
+
+
+def custom_query_series(custom_queries: Dict, base_dir: str = ".") -> Dict[str, int]:
+    """
+    Series produced by the custom query files for one PostgreSQL service.
+
+    :param custom_queries: ``custom_queries`` section of the fleet.
+    :param base_dir: Directory that relative file paths are resolved against.
+    :return: Series per resolution.
+    """
+    rows = int(custom_queries.get("rows_per_query", 10))
+    series = {resolution: 0 for resolution in RESOLUTIONS}
+    for resolution in RESOLUTIONS:
+        path = custom_queries.get(resolution)
+        if not path:
+            continue
+        queries = load_custom_queries(osp.join(base_dir, path))
+        series[resolution] = sum(
+            len(value_columns(query)) * rows for query in queries.values()
+        )
+    return series
+
+
+def estimate(fleet: Dict, base_dir: str = ".") -> Estimate:
+    """
+    Estimate the PMM load of a fleet.
+
+    :param fleet: Fleet description (see the module docstring).
+    :param base_dir: Directory that custom query paths are relative to.
+    :return: Load estimate.
+    """
+    resolutions = {**DEFAULT_RESOLUTIONS, **fleet.get("resolutions", {})}
+    retention_days = fleet.get("retention_days", 30)
+    fingerprints = fleet.get("qan_fingerprints", 100)
+    result = Estimate()
+    qan_bytes_per_day = 0.0
+
+    def add_qan(count: int, qan: Dict) -> None:
+        nonlocal qan_bytes_per_day
+        if (qan.get("query_source") or "perfschema") == "none":
+            return
+        rows = count * fingerprints / 60
+        result.qan_rows_per_second += rows
+        row_bytes = (
+            BYTES_PER_QAN_ROW_WITHOUT_EXAMPLES
+            if qan.get("disable_query_examples")
+            else BYTES_PER_QAN_ROW
+        )
+        qan_bytes_per_day += rows * 86400 * row_bytes
+
+    for asg in fleet.get("monitored_asgs", []):
+        count = int(asg.get("instances", 1))
+        qan = asg.get("qan") or {}
+        result.services += count
+        _add(result.series, EXPORTER_SERIES["node"], count)
+        _add(result.series, EXPORTER_SERIES[asg.get("service_type", "mysql")], count)
+        tables = int(asg.get("tables", 0))
+        limit = qan.get("disable_tablestats_limit")
+        if limit is None or tables <= limit:
+            result.series["low"] += tables * SERIES_PER_MYSQL_TABLE * count
+        add_qan(count, qan)
+
+    pg_services = 0
+    for rds in fleet.get("rds_instances", []):
+        count = int(rds.get("count", 1))
+        engine = rds.get("engine", "postgres")
+        result.services += count
+        _add(result.series, EXPORTER_SERIES["rds"], count)
+        if rds.get("enhanced_monitoring"):
+            _add(result.series, EXPORTER_SERIES["rds_enhanced"], count)
+        if engine == "mysql":
+            _add(result.series, EXPORTER_SERIES["mysql"], count)
+            result.series["low"] += (
+                int(rds.get("tables", 0)) * SERIES_PER_MYSQL_TABLE * count
+            )
+        else:
+            _add(result.series, EXPORTER_SERIES["postgresql"], count)
+            result.series["low"] += (
+                int(rds.get("databases", 1)) * SERIES_PER_PG_DATABASE * count
+            )
+            pg_services += count
+        add_qan(count, rds.get("qan") or {})
+
+    if pg_services and fleet.get("custom_queries"):
+        _add(
+            result.series,
+            custom_query_series(fleet["custom_queries"], base_dir),
+            pg_services,
+        )
+
+    result.samples_per_second = sum(
+        result.series[resolution] / resolutions[resolution]
+        for resolution in RESOLUTIONS
+    )
+    metrics_bytes_per_day = result.samples_per_second * 86400 * BYTES_PER_SAMPLE
+    result.storage_gb_per_day = (metrics_bytes_per_day + qan_bytes_per_day) / 1e9
+    result.storage_gb = result.storage_gb_per_day * retention_days
+    return result
+
+
+def recommend(load: Estimate) -> Recommendation:
+    """
+    Recommend module settings for an estimated load.
+
+    :param load: Estimate from :func:`estimate`.
+    :return: Recommended ``instance_type`` and EBS settings.
+    """
+    warnings = []
+    for capacity in INSTANCE_CAPACITY:
+        if (
+            load.active_series <= capacity["series"] * TARGET_UTILIZATION
+            and load.samples_per_second <= capacity["samples"] * TARGET_UTILIZATION
+            and load.qan_rows_per_second <= capacity["qan"] * TARGET_UTILIZATION
+        ):
+            instance_type = capacity["instance_type"]
+            break
+    else:
+        instance_type = INSTANCE_CAPACITY[-1]["instance_type"]
+        warnings.append(
+            f"Load exceeds what {instance_type} handles comfortably; reduce "
+            "resolution or cardinality, or split the fleet across PMM servers"
+        )
+
+    size = (load.storage_gb + STORAGE_BASE_GB) / (1 - STORAGE_HEADROOM)
+    ebs_volume_size = max(100, int(math.ceil(size / 50) * 50))
+    # gp3 baseline (3000 IOPS, 125 MB/s) covers roughly 50k samples/s.
+    iops = 3000 * max(1.0, load.samples_per_second / 50_000)
+    iops += load.qan_rows_per_second * 2
+    ebs_iops = min(16000, int(math.ceil(iops / 500) * 500))
+    ebs_throughput = min(1000, max(125, int(math.ceil(ebs_iops / 24 / 25) * 25)))
+    if ebs_volume_size > 16384:
+        warnings.append("Storage exceeds the 16 TiB EBS limit; shorten retention")
+        ebs_volume_size = 16384
+    return Recommendation(
+        instance_type=instance_type,
+        ebs_volume_size=ebs_volume_size,
+        ebs_iops=ebs_iops,
+        ebs_throughput=ebs_throughput,
+        warnings=warnings,
+    )
+
+
+def measure(pmm: PMMClient) -> Dict[str, float]:
+    """
+    Read the actual load from a running PMM server.
+
+    Uses the same queries as the on-instance self-monitoring collector.
+
+    :param pmm: Client of the PMM server.
+    :return: ``active_series`` and ``samples_per_second``.
+    """
+    queries = {
+        "active_series": 'sum(vm_cache_entries{type="storage/hour_metric_ids"})',
+        "samples_per_second": "sum(rate(vm_rows_inserted_total[5m]))",
+    }
+    measured = {}
+    for name, query in queries.items():
+        result = pmm.query(query)
+        measured[name] = float(result[0]["value"][1]) if result else 0.0
+    return measured
+
+
+def validate(
+    load: Estimate, measured: Dict[str, float], tolerance: float = 0.5
+) -> Dict[str, Dict[str, float]]:
+    """
+    Compare an estimate with measured values.
+
+    :param load: Estimate for the fleet the PMM server actually monitors.
+    :param measured: Values from :func:`measure`.
+    :param tolerance: Accepted relative error, e.g. ``0.5`` for ±50%.
+    :return: Per metric: ``estimated``, ``measured``, relative ``error`` and
+        ``ok`` (1.0 if within tolerance, else 0.0).
+    """
+    estimated = {
+        "active_series": float(load.active_series),
+        "samples_per_second": load.samples_per_second,
+    }
+    report = {}
+    for name, value in estimated.items():
+        actual = measured.get(name, 0.0)
+        error = abs(value - actual) / actual if actual else math.inf
+        report[name] = {
+            "estimated": value,
+            "measured": actual,
+            "error": error,
+            "ok": float(error <= tolerance),
+        }
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(
+        description="Estimate PMM load for a fleet and recommend instance/EBS sizing"
+    )
+    parser.add_argument("fleet", help="Fleet description (YAML or JSON)")
+    parser.add_argument(
+        "--validate-url",
+        help="PMM URL to compare the estimate with (e.g. a local PMM container)",
+    )
+    parser.add_argument(
+        "--admin-secret",
+        help="Secret with the PMM admin password (admin_password_secret_arn); "
+        "defaults to the PMM_ADMIN_PASSWORD environment variable",
+    )
+    parser.add_argument("--region", help="AWS region of the secret")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args(argv)
+
+    with open(args.fleet, encoding="utf-8") as fp:
+        fleet = yaml.safe_load(fp) or {}
+    load = estimate(fleet, base_dir=osp.dirname(osp.abspath(args.fleet)))
+    output = {
+        "estimate": {**asdict(load), "active_series": load.active_series},
+        "recommendation": asdict(recommend(load)),
+    }
+    status = 0
+    if args.validate_url:
+        if args.admin_secret:
+            password = boto3.client(
+                "secretsmanager", region_name=args.region
+            ).get_secret_value(SecretId=args.admin_secret)["SecretString"]
+        elif os.environ.get("PMM_ADMIN_PASSWORD"):
+            password = os.environ["PMM_ADMIN_PASSWORD"]
+        else:
+            parser.error("--admin-secret or PMM_ADMIN_PASSWORD is required")
+        pmm = PMMClient(args.validate_url, "admin", password, timeout=10)
+        report = validate(load, measure(pmm), args.tolerance)
+        output["validation"] = report
+        status = 0 if all(item["ok"] for item in report.values()) else 1
+    print(json.dumps(output, indent=2))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
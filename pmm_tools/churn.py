@@ -0,0 +1,215 @@
+"""
+Audit PMM inventory churn from the reconciler's inventory snapshots.
+
+With ``reconciler_inventory_snapshots`` enabled, every reconciler run
+stores a snapshot of the PMM services, nodes and agents and of the ASG
+membership in the bucket of output ``inventory_snapshots_bucket_name``
+(see ``lambda/pmm_reconciler/inventory.py``). This tool reads them
+offline.
+
+``diff`` compares two snapshots, local files or ``s3://`` URLs, and
+prints every added, removed, changed and replaced entity as JSON.
+
+``history`` diffs every pair of consecutive snapshots of a time range and
+prints one row of change counts per run that changed something, the
+totals, and the services added, removed or registered again most often:
+flapping instances or pmm-clients that keep losing their registration.
+
+Usage::
+
+    python -m pmm_tools.churn diff old.json.gz s3://<bucket>/latest.json.gz
+    python -m pmm_tools.churn history \\
+        --bucket "$(terraform output -raw inventory_snapshots_bucket_name)" \\
+        --start 2026-10-01 --end 2026-10-19
+"""
+
+import argparse
+import json
+import sys
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from os import path as osp
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import boto3
+
+from daykeys import day_keys, parse_time
+from inventory import LATEST_KEY, diff, loads, summarize
+
+# Snapshots downloaded in parallel.
+MAX_WORKERS = 16
+
+
+def load(location: str, s3_client=None) -> Dict:
+    """
+    Read a snapshot.
+
+    :param location: Local path or ``s3://bucket/key``.
+    :param s3_client: boto3 S3 client, for S3 locations.
+    :return: Snapshot.
+    """
+    if location.startswith("s3://"):
+        bucket, _, key = location[len("s3://") :].partition("/")
+        s3_client = s3_client or boto3.client("s3")
+        return loads(s3_client.get_object(Bucket=bucket, Key=key)["Body"].read())
+    with open(location, "rb") as fp:
+        return loads(fp.read())
+
+
+def snapshot_keys(
+    s3_client, bucket: str, start: datetime, end: datetime
+) -> Iterator[str]:
+    """
+    Keys of the snapshots taken in a time range, oldest first.
+
+    :param s3_client: boto3 S3 client.
+    :param bucket: Snapshot bucket.
+    :param start: Start of the range, timezone-aware.
+    :param end: End of the range, timezone-aware.
+    """
+    low = f"{start.astimezone(timezone.utc):%Y-%m-%dT%H:%M:%SZ}"
+    high = f"{end.astimezone(timezone.utc):%Y-%m-%dT%H:%M:%SZ}"
+    return day_keys(
+        s3_client,
+        bucket,
+        start,
+        end,
+        lambda key: key != LATEST_KEY
+        and low <= osp.basename(key).split(".", 1)[0] <= high,
+    )
+
+
+def s3_snapshots(
+    s3_client, bucket: str, keys: Iterator[str], workers: int = MAX_WORKERS
+) -> Iterator[Dict]:
+    """
+    Download snapshots in parallel, yielding them in key order.
+
+    At most ``2 * workers`` snapshots are held in memory.
+
+    :param s3_client: boto3 S3 client.
+    :param bucket: Snapshot bucket.
+    :param keys: Snapshot keys, oldest first.
+    :param workers: Parallel downloads.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: deque = deque()
+        for key in keys:
+            pending.append(executor.submit(load, f"s3://{bucket}/{key}", s3_client))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def history(
+    snapshots: Iterator[Dict],
+) -> Tuple[List[Tuple[str, Dict[str, int]]], Counter]:
+    """
+    Changes between consecutive snapshots.
+
+    :param snapshots: Snapshots, oldest first.
+    :return: ``(taken_at, counts)`` of every snapshot that differs from
+        the one before (see :func:`inventory.summarize`), and how often
+        each service name was added, removed or replaced.
+    """
+    rows = []
+    services: Counter = Counter()
+    previous = None
+    for snapshot in snapshots:
+        if previous is not None:
+            changes = diff(previous, snapshot)
+            counts = summarize(changes)
+            if counts:
+                rows.append((snapshot["taken_at"], counts))
+            for change in ("added", "removed", "replaced"):
+                services.update(
+                    item["name"]
+                    for item in changes["services"][change]
+                    if "name" in item
+                )
+        previous = snapshot
+    return rows, services
+
+
+def format_history(
+    rows: List[Tuple[str, Dict[str, int]]], services: Counter, top: int = 10
+) -> str:
+    """
+    Plain-text report of :func:`history`.
+
+    :param rows: Change counts per snapshot.
+    :param services: Changes per service name.
+    :param top: Service names to list.
+    """
+    totals: Counter = Counter()
+    lines = []
+    for taken_at, counts in rows:
+        totals.update(counts)
+        lines.append(
+            f"{taken_at}  "
+            + ", ".join(f"{key}={value}" for key, value in sorted(counts.items()))
+        )
+    lines.append("")
+    lines.append(
+        "TOTAL  "
+        + (
+            ", ".join(f"{key}={value}" for key, value in sorted(totals.items()))
+            or "no changes"
+        )
+    )
+    if services:
+        lines.append("")
+        lines.append("Most changed services:")
+        lines.extend(
+            f"  {count:6d}  {name}" for name, count in services.most_common(top)
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(
+        description="Audit PMM inventory churn from reconciler snapshots"
+    )
+    parser.add_argument("--region", help="AWS region of the bucket")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    diff_parser = commands.add_parser("diff", help="Compare two snapshots")
+    diff_parser.add_argument("old", help="Earlier snapshot: file or s3://bucket/key")
+    diff_parser.add_argument("new", help="Later snapshot: file or s3://bucket/key")
+
+    history_parser = commands.add_parser(
+        "history", help="Changes between consecutive snapshots of a time range"
+    )
+    history_parser.add_argument(
+        "--bucket", required=True, help="inventory_snapshots_bucket_name"
+    )
+    history_parser.add_argument(
+        "--start", required=True, help="ISO time, UTC by default"
+    )
+    history_parser.add_argument("--end", help="ISO time, UTC by default; now if unset")
+    history_parser.add_argument(
+        "--top", type=int, default=10, help="Most changed services to list"
+    )
+    history_parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args(argv)
+
+    s3_client = boto3.client("s3", region_name=args.region)
+    if args.command == "diff":
+        changes = diff(load(args.old, s3_client), load(args.new, s3_client))
+        print(json.dumps(changes, indent=2))
+        return 0
+
+    end = parse_time(args.end) if args.end else datetime.now(timezone.utc)
+    keys = snapshot_keys(s3_client, args.bucket, parse_time(args.start), end)
+    rows, services = history(
+        s3_snapshots(s3_client, args.bucket, keys, workers=args.workers)
+    )
+    print(format_history(rows, services, args.top))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Parsing of PMM PostgreSQL custom query files.
+
+The files passed to the ``postgresql_custom_queries_*_resolution``
+variables map a query name to its SQL and a list of columns, each marked
+``LABEL`` (becomes a series label) or ``GAUGE``/``COUNTER`` (becomes a
+series). See ``test_data/test_basic/queries/`` for examples.
+"""
+
+from typing import Dict, List
+
+import yaml
+
+# Column usages that produce a time series.
+VALUE_USAGES = ("GAUGE", "COUNTER")
+
+
+def load_custom_queries(path: str) -> Dict[str, Dict]:
+    """
+    Load a custom query file.
+
+    :param path: Path to the YAML file.
+    :return: Map of query name to its definition (``query``, ``metrics``,
+        ``master``, ...). Empty for an empty file.
+    :raise ValueError: If the file is not a mapping of query definitions.
+    """
+    with open(path, encoding="utf-8") as fp:
+        queries = yaml.safe_load(fp) or {}
+    if not isinstance(queries, dict) or not all(
+        isinstance(query, dict) and "query" in query for query in queries.values()
+    ):
+        raise ValueError(f"{path} is not a PMM custom query file")
+    return queries
+
+
+def columns(query: Dict) -> Dict[str, str]:
+    """
+    Column usages of a query definition.
+
+    :param query: One query definition from :func:`load_custom_queries`.
+    :return: Map of column name to its upper-cased usage, in file order.
+    """
+    result = {}
+    for metric in query.get("metrics", []):
+        for name, spec in metric.items():
+            result[name] = str((spec or {}).get("usage", "")).upper()
+    return result
+
+
+def label_columns(query: Dict) -> List[str]:
+    """
+    Names of the ``LABEL`` columns of a query.
+
+    :param query: One query definition.
+    :return: Label column names.
+    """
+    return [name for name, usage in columns(query).items() if usage == "LABEL"]
+
+
+def value_columns(query: Dict) -> List[str]:
+    """
+    Names of the ``GAUGE`` and ``COUNTER`` columns of a query.
+
+    Each of them is one time series per result row.
+
+    :param query: One query definition.
+    :return: Value column names.
+    """
+    return [name for name, usage in columns(query).items() if usage in VALUE_USAGES]
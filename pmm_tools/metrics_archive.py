@@ -0,0 +1,428 @@
+"""
+Incremental export of PMM metrics to S3 as Parquet, and a reader for it.
+
+Keeping months of metrics in PMM's VictoriaMetrics means a large
+``ebs_volume_size`` and slower dashboards. This tool moves the long tail
+to the bucket created with ``metrics_archive`` (output
+``metrics_archive_bucket_name``), so PMM can keep a short retention.
+
+``export`` pulls samples from VictoriaMetrics' export API through the PMM
+URL, one time shard (an hour by default) per request, and writes every
+shard as a zstd-compressed Parquet file::
+
+    s3://<bucket>/<prefix>/date=2026-10-19/130000-3600s.parquet
+
+with one row per sample: ``metric`` (name), ``labels`` (map of the other
+labels), ``timestamp`` (UTC, milliseconds) and ``value``. Shards end
+``--lag-minutes`` before now, so late samples are not missed. The end of
+the last exported shard is stored as a watermark
+(``<prefix>/_watermark.json``) after each shard; the next run continues
+from there. A shard that was written but not recorded is simply written
+again, so an interrupted run loses nothing.
+
+``read`` (and :func:`read_archive`) loads the shards overlapping a time
+range into one Arrow table, optionally for some metrics only, and writes
+it to a local Parquet file for pandas, DuckDB or Spark.
+
+Usage::
+
+    python -m pmm_tools.metrics_archive export --pmm-url https://pmm.example.com \\
+        --admin-secret "$(terraform output -raw admin_password_secret_arn)" \\
+        --bucket "$(terraform output -raw metrics_archive_bucket_name)"
+    python -m pmm_tools.metrics_archive read --bucket ... \\
+        --start 2026-09-01 --end 2026-10-01 --metric node_load1 --output load.parquet
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import boto3
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+
+from daykeys import day_keys, parse_time
+from pmm_client import PMMClient
+
+DEFAULT_PREFIX = "metrics"
+DEFAULT_MATCH = '{__name__!=""}'
+SHARD_SECONDS = 3600
+# Series per Parquet record batch in fetch_shard().
+BATCH_SERIES = 1000
+LAG_SECONDS = 300
+# First run without a watermark: how far back to start.
+INITIAL_LOOKBACK_SECONDS = 24 * 3600
+
+SCHEMA = pa.schema(
+    [
+        ("metric", pa.dictionary(pa.int32(), pa.string())),
+        ("labels", pa.map_(pa.string(), pa.string())),
+        ("timestamp", pa.timestamp("ms", tz="UTC")),
+        ("value", pa.float64()),
+    ]
+)
+
+
+def shards(
+    start: int, end: int, shard_seconds: int = SHARD_SECONDS
+) -> List[Tuple[int, int]]:
+    """
+    Complete, aligned time shards between two times.
+
+    :param start: Unix time; rounded down to a shard boundary.
+    :param end: Unix time; the last shard ends at or before it.
+    :param shard_seconds: Shard length.
+    :return: ``(start, end)`` of every shard, oldest first.
+    """
+    first = start - start % shard_seconds
+    return [
+        (shard_start, shard_start + shard_seconds)
+        for shard_start in range(first, end - shard_seconds + 1, shard_seconds)
+    ]
+
+
+def shard_key(prefix: str, start: int, shard_seconds: int) -> str:
+    """
+    S3 key of a shard.
+
+    :param prefix: Key prefix.
+    :param start: Unix time the shard starts at.
+    :param shard_seconds: Shard length.
+    :return: E.g. ``metrics/date=2026-10-19/130000-3600s.parquet``.
+    """
+    moment = datetime.fromtimestamp(start, timezone.utc)
+    return f"{prefix}/date={moment:%Y-%m-%d}/{moment:%H%M%S}-{shard_seconds}s.parquet"
+
+
+def parse_shard_key(key: str) -> Tuple[int, int]:
+    """
+    Time range of a shard from its key.
+
+    :param key: Key from :func:`shard_key`.
+    :return: ``(start, end)`` Unix times.
+    """
+    *_, day, name = key.split("/")
+    clock, length = name[: -len(".parquet")].split("-")
+    start = datetime.strptime(f"{day[len('date='):]} {clock}", "%Y-%m-%d %H%M%S")
+    start_ts = int(start.replace(tzinfo=timezone.utc).timestamp())
+    return start_ts, start_ts + int(length.rstrip("s"))
+
+
+def _batch(
+    metrics: List[str],
+    labels: List[List[Tuple[str, str]]],
+    timestamps: List[int],
+    values: List[float],
+) -> pa.RecordBatch:
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array(metrics, pa.string()).dictionary_encode(),
+            pa.array(labels, SCHEMA.field("labels").type),
+            pa.array(timestamps, SCHEMA.field("timestamp").type),
+            pa.array(values, pa.float64()),
+        ],
+        schema=SCHEMA,
+    )
+
+
+def fetch_shard(
+    pmm: PMMClient,
+    matches: Iterable[str],
+    start: int,
+    end: int,
+    sink,
+    timeout: int = 300,
+    batch_series: int = BATCH_SERIES,
+) -> int:
+    """
+    Export the samples of one time shard from PMM's VictoriaMetrics.
+
+    The response is streamed line by line (one series per line) into a
+    zstd-compressed Parquet file; every ``batch_series`` series are
+    written as a record batch, so only one batch of samples is held in
+    memory.
+
+    :param pmm: PMM client.
+    :param matches: Series selectors, e.g. ``{__name__=~"node_.*"}``.
+    :param start: Unix time, inclusive.
+    :param end: Unix time, exclusive.
+    :param sink: Path or binary file object the Parquet file (with
+        :data:`SCHEMA`) is written to.
+    :param timeout: HTTP timeout in seconds.
+    :param batch_series: Series per record batch.
+    :return: Number of rows written.
+    """
+    response = pmm.export(
+        matches,
+        str(start),
+        # The export API includes the end; the next shard starts there.
+        f"{end - 0.001:.3f}",
+        timeout=timeout,
+    )
+    rows = 0
+    with response, pq.ParquetWriter(sink, SCHEMA, compression="zstd") as writer:
+        metrics: List[str] = []
+        labels: List[List[Tuple[str, str]]] = []
+        timestamps: List[int] = []
+        values: List[float] = []
+        series_count = 0
+        for line in response.iter_lines():
+            if not line:
+                continue
+            series = json.loads(line)
+            series_labels = dict(series["metric"])
+            name = series_labels.pop("__name__", "")
+            items = sorted(series_labels.items())
+            count = len(series["timestamps"])
+            metrics.extend([name] * count)
+            labels.extend([items] * count)
+            timestamps.extend(series["timestamps"])
+            values.extend(float(value) for value in series["values"])
+            series_count += 1
+            if series_count == batch_series:
+                writer.write_batch(_batch(metrics, labels, timestamps, values))
+                rows += len(values)
+                metrics, labels, timestamps, values = [], [], [], []
+                series_count = 0
+        if values or not rows:
+            # An empty shard still gets a valid, empty file.
+            writer.write_batch(_batch(metrics, labels, timestamps, values))
+            rows += len(values)
+    return rows
+
+
+def read_watermark(s3_client, bucket: str, prefix: str) -> Optional[int]:
+    """
+    End of the last exported shard.
+
+    :param s3_client: boto3 S3 client.
+    :param bucket: Archive bucket.
+    :param prefix: Key prefix.
+    :return: Unix time, or ``None`` before the first export.
+    """
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=f"{prefix}/_watermark.json")
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return int(json.loads(body["Body"].read())["exported_until"])
+
+
+def write_watermark(s3_client, bucket: str, prefix: str, exported_until: int) -> None:
+    """
+    Record the end of the last exported shard.
+
+    :param s3_client: boto3 S3 client.
+    :param bucket: Archive bucket.
+    :param prefix: Key prefix.
+    :param exported_until: Unix time.
+    """
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=f"{prefix}/_watermark.json",
+        Body=json.dumps({"exported_until": exported_until}).encode(),
+        ContentType="application/json",
+    )
+
+
+def export(
+    pmm: PMMClient,
+    s3_client,
+    bucket: str,
+    prefix: str = DEFAULT_PREFIX,
+    matches: Iterable[str] = (DEFAULT_MATCH,),
+    now: Optional[int] = None,
+    shard_seconds: int = SHARD_SECONDS,
+    lag: int = LAG_SECONDS,
+    initial_lookback: int = INITIAL_LOOKBACK_SECONDS,
+) -> List[Dict]:
+    """
+    Export the shards completed since the watermark.
+
+    :param pmm: PMM client.
+    :param s3_client: boto3 S3 client.
+    :param bucket: Archive bucket.
+    :param prefix: Key prefix.
+    :param matches: Series selectors.
+    :param now: Current Unix time.
+    :param shard_seconds: Shard length.
+    :param lag: Seconds before now the last shard must end.
+    :param initial_lookback: Seconds to export on the first run.
+    :return: Per shard: ``key``, ``rows``, ``bytes`` and ``seconds``.
+    """
+    now = int(datetime.now(timezone.utc).timestamp()) if now is None else now
+    matches = list(matches)
+    watermark = read_watermark(s3_client, bucket, prefix)
+    start = now - initial_lookback if watermark is None else watermark
+    exported = []
+    with tempfile.TemporaryDirectory(prefix="pmm-metrics-") as workdir:
+        path = os.path.join(workdir, "shard.parquet")
+        for shard_start, shard_end in shards(start, now - lag, shard_seconds):
+            started = perf_counter()
+            # Shards go through a local file rather than memory: a shard of
+            # every series is large, and upload_file() sends it in parts.
+            rows = fetch_shard(pmm, matches, shard_start, shard_end, path)
+            key = shard_key(prefix, shard_start, shard_seconds)
+            s3_client.upload_file(path, bucket, key)
+            write_watermark(s3_client, bucket, prefix, shard_end)
+            exported.append(
+                {
+                    "key": key,
+                    "rows": rows,
+                    "bytes": os.path.getsize(path),
+                    "seconds": round(perf_counter() - started, 3),
+                }
+            )
+    return exported
+
+
+def read_archive(
+    s3_client,
+    bucket: str,
+    start: datetime,
+    end: datetime,
+    prefix: str = DEFAULT_PREFIX,
+    metrics: Optional[Iterable[str]] = None,
+) -> pa.Table:
+    """
+    Load archived samples of a time range.
+
+    Only the shards overlapping the range are downloaded; they are found
+    by listing the ``date=`` partitions of the days in it.
+
+    :param s3_client: boto3 S3 client.
+    :param bucket: Archive bucket.
+    :param start: Start of the range, inclusive, timezone-aware.
+    :param end: End of the range, exclusive, timezone-aware.
+    :param prefix: Key prefix.
+    :param metrics: Metric names to keep; all if ``None``.
+    :return: Table with :data:`SCHEMA`.
+    """
+    start_ts, end_ts = int(start.timestamp()), int(end.timestamp())
+
+    def overlaps(key: str) -> bool:
+        shard_start, shard_end = parse_shard_key(key)
+        return shard_start < end_ts and shard_end > start_ts
+
+    # A shard that started the day before can reach into the range.
+    keys = day_keys(
+        s3_client,
+        bucket,
+        start - timedelta(days=1),
+        end,
+        overlaps,
+        prefix=f"{prefix}/",
+        day_format="date=%Y-%m-%d/",
+    )
+
+    ts_type = SCHEMA.field("timestamp").type
+    tables = []
+    for key in keys:
+        body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+        table = pq.read_table(io.BytesIO(body))
+        mask = pc.and_(
+            pc.greater_equal(table["timestamp"], pa.scalar(start_ts * 1000, ts_type)),
+            pc.less(table["timestamp"], pa.scalar(end_ts * 1000, ts_type)),
+        )
+        if metrics is not None:
+            mask = pc.and_(
+                mask,
+                pc.is_in(
+                    pc.cast(table["metric"], pa.string()), pa.array(list(metrics))
+                ),
+            )
+        tables.append(table.filter(mask))
+    if not tables:
+        return SCHEMA.empty_table()
+    return pa.concat_tables(tables)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(
+        description="Export PMM metrics to S3 as Parquet, or read them back"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Export new shards")
+    export_parser.add_argument("--pmm-url", required=True)
+    export_parser.add_argument(
+        "--admin-secret",
+        help="Secret with the PMM admin password (admin_password_secret_arn); "
+        "defaults to the PMM_ADMIN_PASSWORD environment variable",
+    )
+    export_parser.add_argument(
+        "--match",
+        action="append",
+        help=f"Series selector; repeatable (default: {DEFAULT_MATCH}, all series)",
+    )
+    export_parser.add_argument("--shard-minutes", type=int, default=SHARD_SECONDS // 60)
+    export_parser.add_argument("--lag-minutes", type=int, default=LAG_SECONDS // 60)
+    export_parser.add_argument(
+        "--since-hours",
+        type=int,
+        default=INITIAL_LOOKBACK_SECONDS // 3600,
+        help="How far back the first export starts",
+    )
+
+    read_parser = commands.add_parser("read", help="Read a time range to a local file")
+    read_parser.add_argument("--start", required=True, help="ISO time, UTC by default")
+    read_parser.add_argument("--end", required=True, help="ISO time, UTC by default")
+    read_parser.add_argument(
+        "--metric", action="append", help="Metric name; repeatable"
+    )
+    read_parser.add_argument("--output", required=True, help="Local Parquet file")
+
+    for sub in (export_parser, read_parser):
+        sub.add_argument("--bucket", required=True, help="metrics_archive_bucket_name")
+        sub.add_argument("--prefix", default=DEFAULT_PREFIX)
+        sub.add_argument("--region", help="AWS region of the bucket")
+    args = parser.parse_args(argv)
+
+    s3_client = boto3.client("s3", region_name=args.region)
+    if args.command == "export":
+        if args.admin_secret:
+            password = boto3.client(
+                "secretsmanager", region_name=args.region
+            ).get_secret_value(SecretId=args.admin_secret)["SecretString"]
+        elif os.environ.get("PMM_ADMIN_PASSWORD"):
+            password = os.environ["PMM_ADMIN_PASSWORD"]
+        else:
+            export_parser.error("--admin-secret or PMM_ADMIN_PASSWORD is required")
+        exported = export(
+            PMMClient(args.pmm_url, "admin", password),
+            s3_client,
+            args.bucket,
+            prefix=args.prefix,
+            matches=args.match or [DEFAULT_MATCH],
+            shard_seconds=args.shard_minutes * 60,
+            lag=args.lag_minutes * 60,
+            initial_lookback=args.since_hours * 3600,
+        )
+        print(json.dumps({"shards": exported}, indent=2))
+        return 0
+
+    table = read_archive(
+        s3_client,
+        args.bucket,
+        parse_time(args.start),
+        parse_time(args.end),
+        prefix=args.prefix,
+        metrics=args.metric,
+    )
+    pq.write_table(table, args.output, compression="zstd")
+    print(json.dumps({"rows": table.num_rows, "output": args.output}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
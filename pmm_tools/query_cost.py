@@ -0,0 +1,304 @@
+"""
+Cardinality and cost analysis of PostgreSQL custom query files.
+
+For every query in the files passed to ``postgresql_custom_queries_*``:
+
+- counts ``LABEL`` and ``GAUGE``/``COUNTER`` columns,
+- optionally runs it against a PostgreSQL database (``EXPLAIN`` plan cost,
+  execution time, result rows),
+- projects the series it produces (rows × value columns) and the
+  samples/s and database time it costs at its resolution,
+- flags queries whose tier they cannot afford (see :data:`TIER_BUDGETS`).
+
+Without a database the row count is unknown; ``--rows`` is assumed, and
+labels that usually identify individual objects (tables, indexes, queries)
+are reported as high-cardinality.
+
+Usage::
+
+    python -m pmm_tools.query_cost --low queries/pg-low-res.yml \\
+        --medium queries/pg-med-res.yml --dsn postgresql://postgres@localhost/app
+
+Connecting needs ``psycopg2`` (``pip install psycopg2-binary``).
+"""
+
+import argparse
+import json
+import statistics
+import sys
+from dataclasses import asdict, dataclass, field
+from time import perf_counter
+from typing import Dict, List, Optional
+
+from pmm_tools.capacity import DEFAULT_RESOLUTIONS, RESOLUTIONS
+from pmm_tools.custom_queries import label_columns, load_custom_queries, value_columns
+
+# What one custom query may cost per tier: series it produces and time it
+# runs per scrape. Faster tiers get tighter budgets.
+TIER_BUDGETS = {
+    "high": {"series": 100, "exec_ms": 50},
+    "medium": {"series": 1000, "exec_ms": 500},
+    "low": {"series": 10000, "exec_ms": 5000},
+}
+
+# Label names that usually have one value per object rather than a few.
+HIGH_CARDINALITY_LABELS = (
+    "relname",
+    "tablename",
+    "indexname",
+    "indexrelname",
+    "queryid",
+    "query",
+    "pid",
+    "usename",
+    "client_addr",
+)
+
+# Abort a query that runs longer than this while measuring.
+STATEMENT_TIMEOUT_MS = 30000
+# SQLSTATE of a statement cancelled by statement_timeout (query_canceled).
+QUERY_CANCELED = "57014"
+
+
+@dataclass
+class QueryCost:
+    """Cardinality and cost of one custom query."""
+
+    name: str
+    tier: str
+    labels: List[str]
+    values: List[str]
+    rows: Optional[int] = None
+    exec_ms: Optional[float] = None
+    plan_cost: Optional[float] = None
+    measured: bool = False
+    error: Optional[str] = None
+    problems: List[str] = field(default_factory=list)
+
+    @property
+    def series(self) -> int:
+        """Series produced per scrape: one per row and value column."""
+        return (self.rows or 0) * len(self.values)
+
+    def samples_per_second(self, interval: float) -> float:
+        """
+        Samples per second this query adds at a scrape interval.
+
+        :param interval: Scrape interval in seconds.
+        """
+        return self.series / interval
+
+    def db_load(self, interval: float) -> float:
+        """
+        Share of one database backend spent running this query.
+
+        :param interval: Scrape interval in seconds.
+        :return: Execution time divided by the interval, e.g. ``0.01`` = 1%.
+        """
+        return (self.exec_ms or 0.0) / 1000 / interval
+
+
+def connect(dsn: str):
+    """
+    Open a read-only connection to PostgreSQL.
+
+    :param dsn: libpq connection string or URL.
+    :return: psycopg2 connection.
+    :raise RuntimeError: If psycopg2 is not installed.
+    """
+    try:
+        import psycopg2  # pylint: disable=import-outside-toplevel
+    except ImportError as exc:
+        raise RuntimeError(
+            "Measuring queries needs psycopg2: pip install psycopg2-binary"
+        ) from exc
+    conn = psycopg2.connect(dsn)
+    conn.set_session(readonly=True, autocommit=True)
+    return conn
+
+
+def measure(conn, sql: str, repeats: int = 3) -> Dict[str, float]:
+    """
+    Run a query and measure it.
+
+    :param conn: DB-API connection.
+    :param sql: Query text.
+    :param repeats: How many times to run it; the median time is reported.
+    :return: ``plan_cost`` (total cost of the ``EXPLAIN`` plan), ``exec_ms``
+        (median wall time including fetching rows) and ``rows``.
+    """
+    sql = sql.strip().rstrip(";")
+    with conn.cursor() as cursor:
+        cursor.execute(f"SET statement_timeout = {STATEMENT_TIMEOUT_MS}")
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        plan_cost = float(plan[0]["Plan"]["Total Cost"])
+
+        timings = []
+        rows = 0
+        for _ in range(max(repeats, 1)):
+            started = perf_counter()
+            cursor.execute(sql)
+            rows = len(cursor.fetchall())
+            timings.append((perf_counter() - started) * 1000)
+    return {"plan_cost": plan_cost, "exec_ms": statistics.median(timings), "rows": rows}
+
+
+def check(cost: QueryCost) -> List[str]:
+    """
+    Problems of a query in its tier.
+
+    :param cost: Query with rows and, if measured, execution time.
+    :return: Human-readable problems; empty if the query fits its tier.
+    """
+    budget = TIER_BUDGETS[cost.tier]
+    problems = [cost.error] if cost.error else []
+    if cost.series > budget["series"]:
+        problems.append(
+            f"{cost.series} series exceed the {cost.tier} tier budget of "
+            f"{budget['series']}"
+        )
+    if cost.exec_ms is not None and cost.exec_ms > budget["exec_ms"]:
+        problems.append(
+            f"{cost.exec_ms:.0f} ms exceeds the {cost.tier} tier budget of "
+            f"{budget['exec_ms']} ms"
+        )
+    if not cost.measured:
+        risky = [label for label in cost.labels if label in HIGH_CARDINALITY_LABELS]
+        if risky and cost.tier != "low":
+            problems.append(
+                f"labels {', '.join(risky)} usually have one value per object; "
+                "measure the query or move it to the low tier"
+            )
+    return problems
+
+
+def affordable_tier(cost: QueryCost) -> Optional[str]:
+    """
+    Fastest tier whose budget a query fits.
+
+    :param cost: Query with rows and, if measured, execution time.
+    :return: ``high``, ``medium`` or ``low``; ``None`` if it fits none.
+    """
+    for tier in RESOLUTIONS:
+        budget = TIER_BUDGETS[tier]
+        if cost.series <= budget["series"] and (cost.exec_ms or 0) <= budget["exec_ms"]:
+            return tier
+    return None
+
+
+def cost_of(
+    name: str,
+    query: Dict,
+    tier: str,
+    conn=None,
+    default_rows: int = 10,
+    repeats: int = 3,
+) -> QueryCost:
+    """
+    Cardinality and, with a connection, measured cost of one query.
+
+    :param name: Query name.
+    :param query: Query definition from a custom query file.
+    :param tier: Tier the query is (or would be) in.
+    :param conn: Optional DB-API connection to measure the query on.
+    :param default_rows: Rows assumed if the query is not measured.
+    :param repeats: Runs when measuring.
+    :return: Query cost; ``problems`` is not filled in. If the query
+        fails on the database, ``measured`` is false and ``error`` says
+        why; a query cancelled by the statement timeout gets the timeout
+        as ``exec_ms``.
+    """
+    cost = QueryCost(
+        name=name,
+        tier=tier,
+        labels=label_columns(query),
+        values=value_columns(query),
+        rows=default_rows,
+    )
+    if conn is not None:
+        # DB-API drivers expose their exception base class on the connection.
+        try:
+            measured = measure(conn, query["query"], repeats)
+        except getattr(conn, "Error", Exception) as exc:
+            if getattr(exc, "pgcode", None) == QUERY_CANCELED:
+                cost.exec_ms = float(STATEMENT_TIMEOUT_MS)
+                cost.error = (
+                    f"exceeded {STATEMENT_TIMEOUT_MS // 1000} s statement timeout"
+                )
+            else:
+                cost.error = f"failed on the database: {str(exc).strip()}"
+            return cost
+        cost.rows = measured["rows"]
+        cost.exec_ms = measured["exec_ms"]
+        cost.plan_cost = measured["plan_cost"]
+        cost.measured = True
+    return cost
+
+
+def analyze(
+    files: Dict[str, str],
+    conn=None,
+    default_rows: int = 10,
+    repeats: int = 3,
+) -> List[QueryCost]:
+    """
+    Analyze custom query files.
+
+    :param files: Map of tier (``high``/``medium``/``low``) to file path.
+    :param conn: Optional DB-API connection to measure the queries on.
+    :param default_rows: Rows assumed for queries that are not measured.
+    :param repeats: Runs per query when measuring.
+    :return: One :class:`QueryCost` per query, with ``problems`` filled in.
+    """
+    results = []
+    for tier in RESOLUTIONS:
+        if not files.get(tier):
+            continue
+        for name, query in load_custom_queries(files[tier]).items():
+            cost = cost_of(name, query, tier, conn, default_rows, repeats)
+            cost.problems = check(cost)
+            results.append(cost)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point. Exits with 1 if any query is flagged."""
+    parser = argparse.ArgumentParser(
+        description="Cardinality and cost analysis of PMM PostgreSQL custom queries"
+    )
+    for tier in RESOLUTIONS:
+        parser.add_argument(f"--{tier}", help=f"{tier}-resolution query file")
+    parser.add_argument("--dsn", help="PostgreSQL to measure the queries on")
+    parser.add_argument("--rows", type=int, default=10, help="rows if not measured")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    files = {tier: getattr(args, tier) for tier in RESOLUTIONS}
+    conn = connect(args.dsn) if args.dsn else None
+    try:
+        results = analyze(files, conn, default_rows=args.rows, repeats=args.repeats)
+    finally:
+        if conn is not None:
+            conn.close()
+
+    report = []
+    for cost in results:
+        interval = DEFAULT_RESOLUTIONS[cost.tier]
+        report.append(
+            {
+                **asdict(cost),
+                "series": cost.series,
+                "samples_per_second": cost.samples_per_second(interval),
+                "db_load": cost.db_load(interval),
+                "affordable_tier": affordable_tier(cost),
+            }
+        )
+    print(json.dumps(report, indent=2))
+    return 1 if any(cost.problems for cost in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+Automatic resolution-tier placement of PostgreSQL custom queries.
+
+Takes a pool of custom query definitions (any number of files in the PMM
+custom query format, regardless of the tier they were written for),
+measures each query on a sample database, and writes high, medium and
+low resolution files for the ``postgresql_custom_queries_*`` variables.
+
+Each query goes to the fastest tier that
+
+1. it fits on its own (per-query budget, see
+   :data:`pmm_tools.query_cost.TIER_BUDGETS`), and
+2. still has room in the tier's total series and execution-time budget
+   (:data:`TIER_TOTAL_BUDGETS`).
+
+Cheaper queries are placed first, so the high tier holds as many cheap
+queries as fit. Queries that fit no tier are reported and left out.
+
+Usage::
+
+    python -m pmm_tools.query_tiers queries/*.yml \\
+        --dsn postgresql://postgres@localhost/sample --output-dir queries/tiered
+
+Without ``--dsn`` every query is assumed to return ``--rows`` rows and to
+take no time, which only balances series counts.
+"""
+
+import argparse
+import json
+import sys
+from os import path as osp
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+from pmm_tools.capacity import RESOLUTIONS
+from pmm_tools.custom_queries import load_custom_queries
+from pmm_tools.query_cost import TIER_BUDGETS, QueryCost, connect, cost_of
+
+# Total budget per tier across all its queries. Execution time is per
+# scrape, so the high tier (every 5 s) may spend at most 10% of a backend.
+TIER_TOTAL_BUDGETS = {
+    "high": {"series": 1000, "exec_ms": 500},
+    "medium": {"series": 10000, "exec_ms": 2000},
+    "low": {"series": 100000, "exec_ms": 30000},
+}
+
+# File names written for each tier.
+TIER_FILES = {tier: f"{tier}-resolution.yml" for tier in RESOLUTIONS}
+
+
+class _LiteralDumper(yaml.SafeDumper):
+    """Dump multi-line strings (the SQL) as ``|`` blocks, like hand-written files."""
+
+
+def _represent_str(dumper, value):
+    style = "|" if "\n" in value else None
+    return dumper.represent_scalar("tag:yaml.org,2002:str", value, style=style)
+
+
+_LiteralDumper.add_representer(str, _represent_str)
+
+
+def load_pool(paths: List[str]) -> Dict[str, Dict]:
+    """
+    Merge query definitions from several files.
+
+    :param paths: Custom query files.
+    :return: Map of query name to definition.
+    :raise ValueError: If the same query name appears twice.
+    """
+    pool: Dict[str, Dict] = {}
+    for path in paths:
+        for name, query in load_custom_queries(path).items():
+            if name in pool:
+                raise ValueError(f"Query {name} is defined more than once ({path})")
+            pool[name] = query
+    return pool
+
+
+def place(
+    costs: List[QueryCost],
+    total_budgets: Optional[Dict[str, Dict[str, float]]] = None,
+) -> Tuple[Dict[str, List[str]], List[str]]:
+    """
+    Assign queries to tiers.
+
+    :param costs: Measured queries (``tier`` is ignored). Queries that failed
+        on the database are never placed.
+    :param total_budgets: Per-tier totals; defaults to :data:`TIER_TOTAL_BUDGETS`.
+    :return: Query names per tier, and names of queries that fit no tier.
+    """
+    total_budgets = total_budgets or TIER_TOTAL_BUDGETS
+    placement: Dict[str, List[str]] = {tier: [] for tier in RESOLUTIONS}
+    used = {tier: {"series": 0, "exec_ms": 0.0} for tier in RESOLUTIONS}
+    unplaced = []
+    for cost in sorted(costs, key=lambda c: (c.series, c.exec_ms or 0.0, c.name)):
+        if cost.error:
+            unplaced.append(cost.name)
+            continue
+        for tier in RESOLUTIONS:
+            budget = TIER_BUDGETS[tier]
+            total = total_budgets[tier]
+            exec_ms = cost.exec_ms or 0.0
+            if (
+                cost.series <= budget["series"]
+                and exec_ms <= budget["exec_ms"]
+                and used[tier]["series"] + cost.series <= total["series"]
+                and used[tier]["exec_ms"] + exec_ms <= total["exec_ms"]
+            ):
+                placement[tier].append(cost.name)
+                used[tier]["series"] += cost.series
+                used[tier]["exec_ms"] += exec_ms
+                break
+        else:
+            unplaced.append(cost.name)
+    return placement, unplaced
+
+
+def write_tiers(
+    pool: Dict[str, Dict], placement: Dict[str, List[str]], output_dir: str
+) -> Dict[str, str]:
+    """
+    Write one custom query file per tier.
+
+    A tier that received no queries gets an empty file (``---``), so a
+    file left by an earlier run does not keep queries that moved to
+    another tier, and Terraform configurations that ``file()`` all three
+    files keep working.
+
+    :param pool: Query definitions from :func:`load_pool`.
+    :param placement: Query names per tier from :func:`place`.
+    :param output_dir: Directory to write the files to.
+    :return: Map of tier to written file path.
+    """
+    written = {}
+    for tier, names in placement.items():
+        path = osp.join(output_dir, TIER_FILES[tier])
+        with open(path, "w", encoding="utf-8") as fp:
+            fp.write("---\n")
+            fp.write(
+                f"# {tier.capitalize()} resolution queries (pmm_tools.query_tiers)\n"
+            )
+            if not names:
+                fp.write("# No queries placed in this tier.\n")
+            else:
+                fp.write("\n")
+                yaml.dump(
+                    {name: pool[name] for name in names},
+                    fp,
+                    Dumper=_LiteralDumper,
+                    sort_keys=False,
+                    default_flow_style=False,
+                )
+        written[tier] = path
+    return written
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point. Exits with 1 if a query fits no tier."""
+    parser = argparse.ArgumentParser(
+        description="Place PMM PostgreSQL custom queries into resolution tiers"
+    )
+    parser.add_argument("files", nargs="+", help="Custom query files (the pool)")
+    parser.add_argument("--dsn", help="Sample PostgreSQL database to measure on")
+    parser.add_argument("--rows", type=int, default=10, help="rows if not measured")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output-dir", default=".")
+    args = parser.parse_args(argv)
+
+    pool = load_pool(args.files)
+    conn = connect(args.dsn) if args.dsn else None
+    try:
+        costs = [
+            cost_of(name, query, "low", conn, args.rows, args.repeats)
+            for name, query in pool.items()
+        ]
+    finally:
+        if conn is not None:
+            conn.close()
+
+    placement, unplaced = place(costs)
+    written = write_tiers(pool, placement, args.output_dir)
+    print(
+        json.dumps(
+            {"placement": placement, "unplaced": unplaced, "files": written},
+            indent=2,
+        )
+    )
+    return 1 if unplaced else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Report reconciliation cost trends from the reconciler's run history.
+
+With ``reconciler_history`` enabled, every reconciler run stores a record
+of its duration, phase timings, instance counts, failures and SSM
+latency in the bucket of output ``reconciler_history_bucket_name`` (see
+``lambda/pmm_reconciler/history.py``). This tool prints one row per hour
+or day of a time range and a forecast of the fleet size at which runs
+reach 80% of the Lambda timeout.
+
+Usage::
+
+    python -m pmm_tools.reconciler_history \\
+        --bucket "$(terraform output -raw reconciler_history_bucket_name)" \\
+        --start 2026-09-19 --period day
+    python -m pmm_tools.reconciler_history --file history.jsonl --start 2026-10-18
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import boto3
+
+from daykeys import parse_time
+from history import (
+    FileHistoryStore,
+    S3HistoryStore,
+    forecast,
+    trends,
+)
+
+PERIODS = {"hour": 3600, "day": 86400}
+
+
+def format_report(rows: List[Dict], prediction: Optional[Dict]) -> str:
+    """
+    Plain-text report of :func:`history.trends` and :func:`history.forecast`.
+
+    :param rows: Per-period statistics.
+    :param prediction: Timeout forecast, or ``None``.
+    """
+    lines = [
+        f"{'period':20}  {'runs':>5}  {'fail':>4}  {'p50 s':>7}  {'p95 s':>7}  "
+        f"{'max s':>7}  {'timeout%':>8}  {'instances':>9}  {'ssm p95 ms':>10}"
+    ]
+    for row in rows:
+        ssm = "-" if row["ssm_p95_ms"] is None else f"{row['ssm_p95_ms']:.0f}"
+        lines.append(
+            f"{row['start']:20}  {row['runs']:5d}  {row['failures']:4d}  "
+            f"{row['duration_p50']:7.1f}  {row['duration_p95']:7.1f}  "
+            f"{row['duration_max']:7.1f}  {row['timeout_usage']:8.1f}  "
+            f"{row['instances']:9d}  {ssm:>10}"
+        )
+    lines.append("")
+    if prediction is None:
+        lines.append("Forecast: not enough fleet size variation in the range")
+    else:
+        lines.append(
+            f"Forecast: {prediction['base_seconds']:.1f} s + "
+            f"{prediction['seconds_per_instance']:.3f} s per instance; "
+            f"{prediction['instances']} instances now, "
+            f"80% of the timeout at {prediction['max_instances']} instances"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(
+        description="Report reconciliation cost trends from the run history"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--bucket", help="reconciler_history_bucket_name")
+    source.add_argument("--file", help="Local JSON Lines history")
+    parser.add_argument("--region", help="AWS region of the bucket")
+    parser.add_argument("--start", required=True, help="ISO time, UTC by default")
+    parser.add_argument("--end", help="ISO time, UTC by default; now if unset")
+    parser.add_argument("--period", choices=sorted(PERIODS), default="day")
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args(argv)
+
+    if args.bucket:
+        store = S3HistoryStore(boto3.client("s3", region_name=args.region), args.bucket)
+    else:
+        store = FileHistoryStore(args.file)
+    end = parse_time(args.end) if args.end else datetime.now(timezone.utc)
+    records = store.query(parse_time(args.start), end)
+    rows = trends(records, PERIODS[args.period])
+    prediction = forecast(records)
+    if args.json:
+        print(json.dumps({"trends": rows, "forecast": prediction}, indent=2))
+    else:
+        print(format_report(rows, prediction))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+"""
+Register many RDS/Aurora endpoints with PMM in one run.
+
+Reads a manifest (YAML or JSON; a file, or ``-`` for stdin) listing the
+endpoints::
+
+    - address: orders.abc123.us-west-2.rds.amazonaws.com
+      engine: postgresql        # or mysql; default postgresql
+      port: 5432                # default 5432 (postgresql) / 3306 (mysql)
+      database: orders          # PostgreSQL only; default postgres
+      credentials_secret: arn:aws:secretsmanager:us-west-2:123:secret:pmm-orders
+      service_name: orders-db   # default <engine>-<address>
+      cluster: orders           # optional
+      query_analytics: true     # default true
+
+Database credentials come from the Secrets Manager secret of each endpoint
+(``username`` and ``password`` keys), each secret read once. Endpoints
+whose service name or address and port are already registered are skipped.
+The others are added concurrently through the PMM management API over one
+pooled connection, and a summary with per-endpoint latency and the
+latency of each PMM API operation is printed.
+
+Usage::
+
+    python -m pmm_tools.register_rds endpoints.yml \\
+        --pmm-url https://pmm.example.com \\
+        --admin-secret "$(terraform output -raw admin_password_secret_arn)"
+
+To keep a changing fleet registered without a manifest, select the
+databases by tags with the module's ``monitored_rds`` variable instead.
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, TextIO
+
+import boto3
+import requests
+import yaml
+
+from pmm_client import PMMClient
+from rds import read_credentials, remote_service_payload, server_agent_id
+
+DEFAULT_PORTS = {"postgresql": 5432, "mysql": 3306}
+
+# Concurrent registrations; PMM connects to every database it adds.
+MAX_WORKERS = 10
+
+
+@dataclass
+class Result:
+    """Outcome of registering one endpoint."""
+
+    endpoint: str
+    service_name: str
+    status: str
+    latency_ms: Optional[float] = None
+    detail: str = ""
+
+
+def load_manifest(stream: TextIO) -> List[Dict]:
+    """
+    Read and validate endpoints.
+
+    :param stream: Manifest: a YAML/JSON list, or a mapping with an
+        ``endpoints`` list.
+    :return: Endpoints with defaults filled in.
+    :raise ValueError: If an entry is invalid.
+    """
+    document = yaml.safe_load(stream) or []
+    if isinstance(document, dict):
+        document = document.get("endpoints")
+    if not isinstance(document, list):
+        raise ValueError("Manifest must be a list of endpoints")
+
+    endpoints = []
+    for number, entry in enumerate(document, start=1):
+        if not isinstance(entry, dict) or not entry.get("address"):
+            raise ValueError(f"Endpoint {number}: address is required")
+        engine = entry.get("engine", "postgresql")
+        if engine not in DEFAULT_PORTS:
+            raise ValueError(
+                f"Endpoint {number}: engine must be one of "
+                f"{', '.join(DEFAULT_PORTS)}, not {engine}"
+            )
+        if not entry.get("credentials_secret"):
+            raise ValueError(f"Endpoint {number}: credentials_secret is required")
+        endpoints.append(
+            {
+                **entry,
+                "engine": engine,
+                "port": int(entry.get("port") or DEFAULT_PORTS[engine]),
+                "service_name": entry.get("service_name")
+                or f"{engine}-{entry['address']}",
+                "query_analytics": entry.get("query_analytics", True),
+            }
+        )
+    return endpoints
+
+
+def is_registered(endpoint: Dict, services: List[Dict]) -> bool:
+    """
+    Check whether an endpoint is already monitored.
+
+    :param endpoint: Endpoint from :func:`load_manifest`.
+    :param services: Services registered in PMM.
+    :return: ``True`` if a service has its name, or its address and port.
+    """
+    return any(
+        svc.get("service_name") == endpoint["service_name"]
+        or (
+            svc.get("address") == endpoint["address"]
+            and int(svc.get("port") or 0) == endpoint["port"]
+        )
+        for svc in services
+    )
+
+
+def register(
+    pmm: PMMClient,
+    endpoints: List[Dict],
+    get_credentials: Callable[[str], Dict],
+    max_workers: int = MAX_WORKERS,
+) -> List[Result]:
+    """
+    Register endpoints that are not monitored yet.
+
+    :param pmm: PMM client; its connection pool should hold ``max_workers``.
+    :param endpoints: Endpoints from :func:`load_manifest`.
+    :param get_credentials: Returns ``username`` and ``password`` of a secret.
+    :param max_workers: Concurrent registrations.
+    :return: One result per endpoint, in manifest order. ``status`` is
+        ``added``, ``exists`` or ``failed``; an endpoint whose secret cannot
+        be read or lacks ``username`` or ``password`` fails on its own.
+    """
+    services = pmm.services
+    results: List[Optional[Result]] = []
+    pending = []
+    for index, endpoint in enumerate(endpoints):
+        if is_registered(endpoint, services):
+            results.append(
+                Result(endpoint["address"], endpoint["service_name"], "exists")
+            )
+        else:
+            results.append(None)
+            pending.append(index)
+    if not pending:
+        return results
+
+    pmm_agent_id = server_agent_id(pmm)
+    credentials: Dict[str, Dict] = {}
+    secret_errors: Dict[str, str] = {}
+    payloads: Dict[int, Dict] = {}
+    for index in pending:
+        endpoint = endpoints[index]
+        secret = endpoint["credentials_secret"]
+        if secret not in credentials and secret not in secret_errors:
+            try:
+                credentials[secret] = read_credentials(get_credentials, secret)
+            except Exception as exc:  # pylint: disable=broad-except
+                secret_errors[secret] = f"{type(exc).__name__}: {exc}"
+        if secret in secret_errors:
+            results[index] = Result(
+                endpoint["address"],
+                endpoint["service_name"],
+                "failed",
+                detail=f"cannot read credentials: {secret_errors[secret]}",
+            )
+            continue
+        try:
+            payloads[index] = remote_service_payload(
+                engine=endpoint["engine"],
+                name=endpoint["service_name"],
+                address=endpoint["address"],
+                port=endpoint["port"],
+                credentials=credentials[secret],
+                pmm_agent_id=pmm_agent_id,
+                database=endpoint.get("database"),
+                query_analytics=endpoint["query_analytics"],
+                cluster=endpoint.get("cluster"),
+            )
+        except (KeyError, TypeError, ValueError) as exc:
+            results[index] = Result(
+                endpoint["address"],
+                endpoint["service_name"],
+                "failed",
+                detail=f"invalid endpoint: {type(exc).__name__}: {exc}",
+            )
+    if not payloads:
+        return results
+
+    def add(endpoint: Dict, payload: Dict) -> Result:
+        started = perf_counter()
+        try:
+            pmm.add_service(payload)
+        except requests.exceptions.RequestException as exc:
+            detail = str(exc)
+            if getattr(exc, "response", None) is not None:
+                detail = exc.response.text[:200] or detail
+            status = "failed"
+        else:
+            detail = ""
+            status = "added"
+        return Result(
+            endpoint["address"],
+            endpoint["service_name"],
+            status,
+            (perf_counter() - started) * 1000,
+            detail,
+        )
+
+    to_add = list(payloads)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(to_add))) as executor:
+        added = executor.map(
+            add,
+            [endpoints[index] for index in to_add],
+            [payloads[index] for index in to_add],
+        )
+        for index, result in zip(to_add, added):
+            results[index] = result
+    return results
+
+
+def format_table(results: List[Result]) -> str:
+    """
+    Summary table of the results.
+
+    :param results: Results from :func:`register`.
+    :return: Plain-text table, one row per endpoint.
+    """
+    rows = [("ENDPOINT", "SERVICE", "STATUS", "LATENCY", "DETAIL")] + [
+        (
+            result.endpoint,
+            result.service_name,
+            result.status,
+            f"{result.latency_ms:.0f} ms" if result.latency_ms is not None else "-",
+            result.detail,
+        )
+        for result in results
+    ]
+    widths = [max(len(row[column]) for row in rows) for column in range(4)]
+    return "\n".join(
+        "  ".join(
+            [cell.ljust(width) for cell, width in zip(row, widths)] + [row[4]]
+        ).rstrip()
+        for row in rows
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point. Exits with 1 if any endpoint failed."""
+    parser = argparse.ArgumentParser(
+        description="Register RDS/Aurora endpoints with PMM in bulk"
+    )
+    parser.add_argument(
+        "manifest", nargs="?", default="-", help="Manifest file, - for stdin"
+    )
+    parser.add_argument("--pmm-url", required=True, help="e.g. https://pmm.example.com")
+    parser.add_argument(
+        "--admin-secret",
+        help="Secret with the PMM admin password (admin_password_secret_arn); "
+        "defaults to the PMM_ADMIN_PASSWORD environment variable",
+    )
+    parser.add_argument("--region", help="AWS region of the secrets")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument(
+        "--insecure", action="store_true", help="Do not verify PMM's certificate"
+    )
+    args = parser.parse_args(argv)
+
+    if args.manifest == "-":
+        endpoints = load_manifest(sys.stdin)
+    else:
+        with open(args.manifest, encoding="utf-8") as fp:
+            endpoints = load_manifest(fp)
+
+    secrets = boto3.client("secretsmanager", region_name=args.region)
+
+    def secret_value(secret_id: str) -> str:
+        return secrets.get_secret_value(SecretId=secret_id)["SecretString"]
+
+    if args.admin_secret:
+        password = secret_value(args.admin_secret)
+    elif os.environ.get("PMM_ADMIN_PASSWORD"):
+        password = os.environ["PMM_ADMIN_PASSWORD"]
+    else:
+        parser.error("--admin-secret or PMM_ADMIN_PASSWORD is required")
+
+    pmm = PMMClient(
+        base_url=args.pmm_url,
+        username="admin",
+        password=password,
+        pool_size=args.workers,
+        verify=not args.insecure,
+    )
+    results = register(
+        pmm,
+        endpoints,
+        lambda secret_id: json.loads(secret_value(secret_id)),
+        max_workers=args.workers,
+    )
+    print(format_table(results))
+    counts = {
+        status: sum(1 for result in results if result.status == status)
+        for status in ("added", "exists", "failed")
+    }
+    print(", ".join(f"{count} {status}" for status, count in counts.items()))
+    for operation, stats in pmm.stats.summary().items():
+        print(
+            f"PMM {operation}: {stats['count']} requests, {stats['errors']} failed, "
+            f"mean {stats['mean_ms']:.0f} ms, p95 {stats['p95_ms']:.0f} ms, "
+            f"max {stats['max_ms']:.0f} ms"
+        )
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
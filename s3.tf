@@ -67,3 +67,114 @@ resource "aws_s3_bucket_lifecycle_configuration" "alb_logs" {
     }
   }
 }
+
+# S3 bucket for metrics exported by pmm_tools.metrics_archive
+module "metrics_archive_bucket" {
+  count   = var.metrics_archive.enabled ? 1 : 0
+  source  = "registry.infrahouse.com/infrahouse/s3-bucket/aws"
+  version = "0.3.0"
+
+  bucket_prefix = "${local.service_name}-metrics-archive-"
+  force_destroy = var.metrics_archive.force_destroy
+
+  tags = local.common_tags
+}
+
+# Archived shards are rarely read: move them to infrequent access, then expire
+resource "aws_s3_bucket_lifecycle_configuration" "metrics_archive" {
+  count  = var.metrics_archive.enabled ? 1 : 0
+  bucket = module.metrics_archive_bucket[0].bucket_name
+
+  rule {
+    id     = "archive-old-shards"
+    status = "Enabled"
+
+    filter {
+      suffix = ".parquet"
+    }
+
+    transition {
+      days          = var.metrics_archive.infrequent_access_days
+      storage_class = "STANDARD_IA"
+    }
+
+    expiration {
+      days = var.metrics_archive.retention_days
+    }
+  }
+
+  rule {
+    id     = "abort-incomplete-uploads"
+    status = "Enabled"
+
+    filter {}
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 7
+    }
+  }
+}
+
+# S3 bucket for the reconciler's inventory snapshots (see pmm_tools.churn)
+module "inventory_snapshots_bucket" {
+  count   = local.create_inventory ? 1 : 0
+  source  = "registry.infrahouse.com/infrahouse/s3-bucket/aws"
+  version = "0.3.0"
+
+  bucket_prefix = "${local.service_name}-inventory-"
+  force_destroy = var.reconciler_inventory_snapshots.force_destroy
+
+  tags = local.common_tags
+}
+
+resource "aws_s3_bucket_lifecycle_configuration" "inventory_snapshots" {
+  count  = local.create_inventory ? 1 : 0
+  bucket = module.inventory_snapshots_bucket[0].bucket_name
+
+  rule {
+    id     = "expire-old-snapshots"
+    status = "Enabled"
+
+    filter {}
+
+    expiration {
+      days = var.reconciler_inventory_snapshots.retention_days
+    }
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 7
+    }
+  }
+}
+
+# S3 bucket for the reconciler's run history (see pmm_tools.reconciler_history)
+module "reconciler_history_bucket" {
+  count   = local.create_history ? 1 : 0
+  source  = "registry.infrahouse.com/infrahouse/s3-bucket/aws"
+  version = "0.3.0"
+
+  bucket_prefix = "${local.service_name}-reconciler-history-"
+  force_destroy = var.reconciler_history.force_destroy
+
+  tags = local.common_tags
+}
+
+resource "aws_s3_bucket_lifecycle_configuration" "reconciler_history" {
+  count  = local.create_history ? 1 : 0
+  bucket = module.reconciler_history_bucket[0].bucket_name
+
+  rule {
+    id     = "expire-old-runs"
+    status = "Enabled"
+
+    filter {}
+
+    expiration {
+      days = var.reconciler_history.retention_days
+    }
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 7
+    }
+  }
+}
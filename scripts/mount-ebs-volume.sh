@@ -1,7 +1,16 @@
 #!/bin/bash
 set -e
 
+%{ if enable_self_monitoring ~}
+# Boot timeline marker, see scripts/pmm_boot_profile.py
+phase() { /usr/local/bin/pmm-boot-phase "$@" || true; }
+
+%{ endif ~}
 echo "Starting EBS volume setup..."
+%{ if enable_self_monitoring ~}
+phase ebs-volume start
+phase ebs-attach start
+%{ endif ~}
 
 # Wait for EBS volume to be attached
 # This module only supports NVMe-based instance types (t3, m5, m6i, c5, c6i, r5, r6i)
@@ -42,6 +51,9 @@ while [ -z "$DEVICE" ]; do
 done
 
 echo "EBS volume found at $DEVICE"
+%{ if enable_self_monitoring ~}
+phase ebs-attach end
+%{ endif ~}
 
 # Check if the volume needs formatting using blkid (more reliable than file -s)
 # blkid returns empty string only if no filesystem exists
@@ -72,4 +84,7 @@ echo "Setting permissions for PMM data volume..."
 chown 1000:1000 /srv
 chmod 755 /srv
 
+%{ if enable_self_monitoring ~}
+phase ebs-volume end
+%{ endif ~}
 echo "EBS volume setup completed successfully"
\ No newline at end of file
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Publish how long each phase of the PMM instance bootstrap took.
+
+The cloud-init scripts call ``pmm-boot-phase <phase> start|end``, which
+appends a timestamped marker to ``/var/log/pmm-boot-phases.log``. Once the
+bootstrap is done, this script runs once and:
+
+1. Builds the boot timeline: the offset of each phase from the kernel
+   boot and its duration.
+2. Compares it with the previous boots, kept in a history file on the
+   data volume (which outlives the instance), and flags the phases that
+   got notably slower when the AMI or the PMM version changed.
+3. Publishes ``BootPhaseDuration`` per phase, ``BootDuration`` (boot to
+   PMM ready) and ``BootRegressions`` to CloudWatch, with ``ImageId`` and
+   ``PMMVersion`` dimensions so versions can be compared side by side.
+
+Only the standard library and botocore (shipped with the awscli package)
+are used, so nothing extra has to be installed on the instance.
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+from typing import Dict, List, Optional, Tuple
+from urllib.request import Request, urlopen
+
+LOG = logging.getLogger("pmm-boot-profile")
+
+IMDS_URL = "http://169.254.169.254/latest"
+MARKERS_FILE = "/var/log/pmm-boot-phases.log"
+HISTORY_FILE = "/srv/.pmm-boot-history.json"
+
+# Phase whose end means PMM is serving; BootDuration is measured to it.
+READY_PHASE = "pmm-ready"
+
+# Boots kept in the history file.
+HISTORY_SIZE = 20
+
+# A phase regressed if it took this many times its usual duration...
+REGRESSION_FACTOR = 1.5
+# ...and at least this many seconds more.
+REGRESSION_MIN_SECONDS = 30
+
+# (time, phase, "start" or "end")
+Marker = Tuple[float, str, str]
+
+
+def boot_time(stat_file: str = "/proc/stat") -> float:
+    """
+    When the kernel booted.
+
+    :param stat_file: Path to ``/proc/stat``.
+    :return: Unix time.
+    """
+    with open(stat_file, encoding="utf-8") as fp:
+        for line in fp:
+            if line.startswith("btime "):
+                return float(line.split()[1])
+    raise KeyError(f"btime not found in {stat_file}")
+
+
+def read_markers(path: str, since: float) -> List[Marker]:
+    """
+    Phase markers written since a point in time.
+
+    :param path: Markers file.
+    :param since: Unix time; older markers (previous boots) are ignored.
+    :return: Markers in file order; malformed lines are skipped.
+    """
+    markers = []
+    with open(path, encoding="utf-8") as fp:
+        for line in fp:
+            fields = line.split()
+            if len(fields) != 3 or fields[2] not in ("start", "end"):
+                continue
+            try:
+                moment = float(fields[0])
+            except ValueError:
+                continue
+            if moment >= since:
+                markers.append((moment, fields[1], fields[2]))
+    return markers
+
+
+def build_timeline(markers: List[Marker], boot: float) -> List[Dict]:
+    """
+    Phases of one boot.
+
+    :param markers: From :func:`read_markers`.
+    :param boot: Kernel boot time, see :func:`boot_time`.
+    :return: ``phase``, ``start`` (seconds since boot) and ``duration``
+        (``None`` if the phase never ended) per phase, by start time.
+    """
+    phases: Dict[str, Dict] = {}
+    for moment, phase, event in markers:
+        if event == "start":
+            phases[phase] = {"phase": phase, "start": moment - boot, "duration": None}
+        elif phase in phases:
+            phases[phase]["duration"] = moment - boot - phases[phase]["start"]
+    return sorted(phases.values(), key=lambda entry: entry["start"])
+
+
+def boot_duration(timeline: List[Dict]) -> Optional[float]:
+    """
+    Seconds from the kernel boot until PMM was ready.
+
+    :param timeline: From :func:`build_timeline`.
+    :return: Seconds, or ``None`` if PMM never became ready.
+    """
+    for entry in timeline:
+        if entry["phase"] == READY_PHASE and entry["duration"] is not None:
+            return entry["start"] + entry["duration"]
+    return None
+
+
+def find_regressions(
+    durations: Dict[str, float],
+    history: List[Dict],
+    image_id: str,
+    pmm_version: str,
+    factor: float = REGRESSION_FACTOR,
+    min_seconds: float = REGRESSION_MIN_SECONDS,
+) -> List[Dict]:
+    """
+    Phases that got slower than on previous boots.
+
+    The baseline of a phase is its median over the boots of the previous
+    AMI and PMM version combination, so version changes are flagged, not
+    the noise between boots of the same versions.
+
+    :param durations: ``{phase: seconds}`` of this boot.
+    :param history: Previous boots, see :func:`load_history`.
+    :param image_id: AMI of this boot.
+    :param pmm_version: PMM version of this boot.
+    :param factor: Ratio to the baseline that counts as a regression.
+    :param min_seconds: Smallest increase that counts as a regression.
+    :return: ``phase``, ``seconds``, ``baseline`` and ``changed`` (which of
+        ``image_id``/``pmm_version`` differ from the baseline boots).
+    """
+    current = {"image_id": image_id, "pmm_version": pmm_version}
+    previous_versions = [
+        {key: boot[key] for key in current}
+        for boot in history
+        if any(boot[key] != value for key, value in current.items())
+    ]
+    if not previous_versions:
+        return []
+    versions = previous_versions[-1]
+    baseline_boots = [
+        boot for boot in history if all(boot[key] == versions[key] for key in versions)
+    ]
+    changed = [key for key in current if versions[key] != current[key]]
+    regressions = []
+    for phase, seconds in durations.items():
+        previous = [
+            boot["durations"][phase]
+            for boot in baseline_boots
+            if phase in boot["durations"]
+        ]
+        if not previous:
+            continue
+        baseline = statistics.median(previous)
+        if seconds > baseline * factor and seconds - baseline >= min_seconds:
+            regressions.append(
+                {
+                    "phase": phase,
+                    "seconds": seconds,
+                    "baseline": baseline,
+                    "changed": changed,
+                }
+            )
+    return regressions
+
+
+def load_history(path: str) -> List[Dict]:
+    """
+    Previous boots.
+
+    :param path: History file.
+    :return: ``image_id``, ``pmm_version``, ``boot_time`` and ``durations``
+        per boot, oldest first; empty if the file is missing or unreadable.
+    """
+    try:
+        with open(path, encoding="utf-8") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return []
+
+
+def save_history(path: str, history: List[Dict], size: int = HISTORY_SIZE) -> None:
+    """
+    Write the newest boots to the history file.
+
+    :param path: History file.
+    :param history: Boots, oldest first.
+    :param size: Boots to keep.
+    """
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as fp:
+        json.dump(history[-size:], fp, indent=2)
+    os.replace(temporary, path)
+
+
+def metric_data(
+    timeline: List[Dict], regressions: List[Dict], image_id: str, pmm_version: str
+) -> List[Dict]:
+    """
+    CloudWatch ``MetricData`` of one boot.
+
+    :param timeline: From :func:`build_timeline`.
+    :param regressions: From :func:`find_regressions`.
+    :param image_id: Value of the ``ImageId`` dimension.
+    :param pmm_version: Value of the ``PMMVersion`` dimension.
+    :return: Metric entries.
+    """
+    dimensions = [
+        {"Name": "ImageId", "Value": image_id},
+        {"Name": "PMMVersion", "Value": pmm_version},
+    ]
+    data = [
+        {
+            "MetricName": "BootPhaseDuration",
+            "Dimensions": [{"Name": "Phase", "Value": entry["phase"]}] + dimensions,
+            "Value": entry["duration"],
+            "Unit": "Seconds",
+        }
+        for entry in timeline
+        if entry["duration"] is not None
+    ]
+    total = boot_duration(timeline)
+    if total is not None:
+        data.append(
+            {
+                "MetricName": "BootDuration",
+                "Dimensions": dimensions,
+                "Value": total,
+                "Unit": "Seconds",
+            }
+        )
+    data.append(
+        {
+            "MetricName": "BootRegressions",
+            "Dimensions": dimensions,
+            "Value": len(regressions),
+            "Unit": "Count",
+        }
+    )
+    return data
+
+
+def format_timeline(timeline: List[Dict]) -> str:
+    """
+    Plain-text boot timeline for the journal.
+
+    :param timeline: From :func:`build_timeline`.
+    :return: One line per phase.
+    """
+    width = max((len(entry["phase"]) for entry in timeline), default=0)
+    return "\n".join(
+        f"{entry['phase']:<{width}}  +{entry['start']:7.1f}s  "
+        + (
+            "did not finish"
+            if entry["duration"] is None
+            else f"{entry['duration']:7.1f}s"
+        )
+        for entry in timeline
+    )
+
+
+def instance_metadata(path: str, timeout: int = 5) -> str:
+    """
+    Value from the instance metadata service (IMDSv2).
+
+    :param path: Path under ``meta-data/``, e.g. ``ami-id``.
+    :param timeout: HTTP timeout in seconds.
+    :return: Value.
+    """
+    token_request = Request(
+        f"{IMDS_URL}/api/token",
+        method="PUT",
+        headers={"X-aws-ec2-metadata-token-ttl-seconds": "60"},
+    )
+    with urlopen(token_request, timeout=timeout) as response:
+        token = response.read().decode()
+    request = Request(
+        f"{IMDS_URL}/meta-data/{path}",
+        headers={"X-aws-ec2-metadata-token": token},
+    )
+    with urlopen(request, timeout=timeout) as response:
+        return response.read().decode()
+
+
+def main() -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0].strip())
+    parser.add_argument("--region", required=True, help="AWS region")
+    parser.add_argument("--pmm-version", required=True, help="PMM image tag")
+    parser.add_argument("--namespace", default="PMM/Boot")
+    parser.add_argument("--markers", default=MARKERS_FILE)
+    parser.add_argument("--history", default=HISTORY_FILE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    boot = boot_time()
+    timeline = build_timeline(read_markers(args.markers, boot), boot)
+    if not timeline:
+        LOG.info("No boot phases recorded since %.0f; nothing to publish", boot)
+        return 0
+    LOG.info("Boot timeline:\n%s", format_timeline(timeline))
+
+    image_id = instance_metadata("ami-id")
+    durations = {
+        entry["phase"]: entry["duration"]
+        for entry in timeline
+        if entry["duration"] is not None
+    }
+    history = load_history(args.history)
+    regressions = find_regressions(durations, history, image_id, args.pmm_version)
+    for regression in regressions:
+        LOG.warning(
+            "Phase %s took %.0f s, usually %.0f s; changed: %s",
+            regression["phase"],
+            regression["seconds"],
+            regression["baseline"],
+            ", ".join(regression["changed"]),
+        )
+    history.append(
+        {
+            "image_id": image_id,
+            "pmm_version": args.pmm_version,
+            "boot_time": boot,
+            "durations": durations,
+        }
+    )
+    save_history(args.history, history)
+
+    # Imported here so the timeline logic can be used without botocore.
+    from botocore.session import get_session  # pylint: disable=import-outside-toplevel
+
+    get_session().create_client("cloudwatch", region_name=args.region).put_metric_data(
+        Namespace=args.namespace,
+        MetricData=metric_data(timeline, regressions, image_id, args.pmm_version),
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
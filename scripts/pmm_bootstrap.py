@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Start PMM on a fresh instance, as fast as its dependencies allow.
+
+Runs once from ``start-services.sh`` (cloud-init) after ``/srv`` is mounted,
+with ``enable_parallel_bootstrap``.
+The bootstrap is a graph of steps, each started as soon as the steps it
+depends on have finished, independent ones in parallel:
+
+* ``docker-start``: start Docker and wait until the daemon answers.
+* ``cloudwatch-agent``: start the CloudWatch agent.
+* ``pmm-image`` (after Docker): pull the PMM image. The image store is on
+  the root volume, so a new instance always pulls; the pull overlaps with
+  the CloudWatch agent start instead of running inside
+  ``pmm-server.service``.
+* ``pmm-server-start`` (after the image): start ``pmm-server.service``.
+* ``pmm-ready`` (after the server): wait until ``/v1/readyz`` answers.
+* ``set-pmm-password`` (after PMM is ready): set the admin password.
+
+Waits are probes with exponential backoff instead of fixed sleeps. Each
+step records boot phase markers for ``pmm-boot-profile``. If a step fails,
+the steps depending on it are skipped and the script exits with 1.
+"""
+
+import argparse
+import logging
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from graphlib import TopologicalSorter
+from time import monotonic, sleep
+from typing import Callable, Dict, List, NamedTuple, Sequence
+from urllib.error import URLError
+from urllib.request import urlopen
+
+LOG = logging.getLogger("pmm-bootstrap")
+
+PMM_URL = "http://127.0.0.1"
+PHASES_FILE = "/var/log/pmm-boot-phases.log"
+
+
+class Step(NamedTuple):
+    """One bootstrap step."""
+
+    name: str
+    action: Callable[[], None]
+    requires: Sequence[str] = ()
+
+
+def mark(phase: str, event: str, path: str = PHASES_FILE) -> None:
+    """
+    Record a boot phase marker, like ``pmm-boot-phase``.
+
+    :param phase: Phase name.
+    :param event: ``start`` or ``end``.
+    :param path: Markers file.
+    """
+    try:
+        with open(path, "a", encoding="utf-8") as fp:
+            fp.write(f"{time.time():.6f} {phase} {event}\n")
+    except OSError as exc:
+        LOG.debug("Cannot record %s %s: %s", phase, event, exc)
+
+
+def run(command: List[str], timeout: int = 600) -> str:
+    """
+    Run a command, raising on failure.
+
+    :param command: Command and arguments.
+    :param timeout: Seconds to wait for it.
+    :return: Standard output.
+    """
+    LOG.info("Running %s", " ".join(command))
+    return subprocess.run(
+        command, check=True, capture_output=True, text=True, timeout=timeout
+    ).stdout
+
+
+def wait_until(
+    probe: Callable[[], bool],
+    timeout: float,
+    initial_delay: float = 0.5,
+    max_delay: float = 10,
+) -> None:
+    """
+    Wait until a probe succeeds, backing off exponentially.
+
+    :param probe: Returns True when the condition is met.
+    :param timeout: Seconds to wait.
+    :param initial_delay: First delay between probes.
+    :param max_delay: Longest delay between probes.
+    :raise TimeoutError: If the probe did not succeed in time.
+    """
+    deadline = monotonic() + timeout
+    delay = initial_delay
+    while not probe():
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"not ready after {timeout:.0f} s")
+        sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+def succeeds(command: List[str]) -> bool:
+    """
+    Whether a command exits with 0.
+
+    :param command: Command and arguments.
+    """
+    try:
+        subprocess.run(command, check=True, capture_output=True, timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return True
+
+
+def pmm_ready(base_url: str = PMM_URL) -> bool:
+    """
+    Whether PMM answers its readiness endpoint.
+
+    :param base_url: PMM HTTP URL.
+    """
+    try:
+        with urlopen(f"{base_url}/v1/readyz", timeout=5) as response:
+            return response.status == 200
+    except (URLError, OSError):
+        return False
+
+
+def run_graph(steps: Sequence[Step], max_workers: int = 4) -> Dict[str, Dict]:
+    """
+    Run steps as soon as the steps they require have succeeded.
+
+    :param steps: Steps; requirements must name other steps.
+    :param max_workers: Steps running at the same time.
+    :return: ``{name: {"status": "ok"|"failed"|"skipped", "seconds": ...}}``.
+    :raise ValueError: If a step requires an unknown step, or steps
+        require each other.
+    """
+    names = {step.name for step in steps}
+    for step in steps:
+        unknown = set(step.requires) - names
+        if unknown:
+            raise ValueError(f"{step.name} requires unknown {sorted(unknown)}")
+    # Raises graphlib.CycleError, a ValueError, if steps require each other.
+    TopologicalSorter({step.name: step.requires for step in steps}).prepare()
+
+    results: Dict[str, Dict] = {}
+    pending = list(steps)
+    running: Dict[Future, Step] = {}
+
+    def timed(step: Step) -> float:
+        started = monotonic()
+        mark(step.name, "start")
+        step.action()
+        mark(step.name, "end")
+        return monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for step in list(pending):
+                statuses = [
+                    results.get(name, {}).get("status") for name in step.requires
+                ]
+                if any(status in ("failed", "skipped") for status in statuses):
+                    LOG.error("Skipping %s: a requirement failed", step.name)
+                    results[step.name] = {"status": "skipped", "seconds": 0.0}
+                    pending.remove(step)
+                elif all(status == "ok" for status in statuses):
+                    LOG.info("Starting %s", step.name)
+                    running[executor.submit(timed, step)] = step
+                    pending.remove(step)
+            if not running:
+                # Everything left depends on a step skipped in this pass.
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception as exc:  # pylint: disable=broad-except
+                    LOG.error("%s failed: %s", step.name, exc)
+                    results[step.name] = {"status": "failed", "seconds": 0.0}
+                else:
+                    LOG.info("%s done in %.1f s", step.name, seconds)
+                    results[step.name] = {"status": "ok", "seconds": seconds}
+    return results
+
+
+def bootstrap_steps(image: str, ready_timeout: float) -> List[Step]:
+    """
+    Steps that start PMM on the instance.
+
+    :param image: PMM image reference.
+    :param ready_timeout: Seconds to wait for Docker and for PMM each.
+    :return: Steps for :func:`run_graph`.
+    """
+
+    def start_docker() -> None:
+        run(["systemctl", "enable", "--now", "docker"])
+        wait_until(lambda: succeeds(["docker", "info"]), ready_timeout)
+
+    def start_cloudwatch_agent() -> None:
+        run(["systemctl", "enable", "amazon-cloudwatch-agent"])
+        run(
+            [
+                "/opt/aws/amazon-cloudwatch-agent/bin/amazon-cloudwatch-agent-ctl",
+                "-a",
+                "fetch-config",
+                "-m",
+                "ec2",
+                "-s",
+                "-c",
+                "file:/opt/aws/amazon-cloudwatch-agent/etc/amazon-cloudwatch-agent.json",
+            ]
+        )
+
+    def pull_image() -> None:
+        run(["docker", "pull", image], timeout=1800)
+
+    def start_pmm_server() -> None:
+        run(["systemctl", "daemon-reload"])
+        run(["systemctl", "enable", "--now", "pmm-server"])
+
+    def set_password() -> None:
+        run(["systemctl", "enable", "--now", "set-pmm-password"])
+
+    return [
+        Step("docker-start", start_docker),
+        Step("cloudwatch-agent", start_cloudwatch_agent),
+        Step("pmm-image", pull_image, ("docker-start",)),
+        Step("pmm-server-start", start_pmm_server, ("pmm-image",)),
+        Step(
+            "pmm-ready",
+            lambda: wait_until(pmm_ready, ready_timeout),
+            ("pmm-server-start",),
+        ),
+        Step("set-pmm-password", set_password, ("pmm-ready",)),
+    ]
+
+
+def main() -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0].strip())
+    parser.add_argument("--image", required=True, help="PMM image reference")
+    parser.add_argument(
+        "--ready-timeout",
+        type=float,
+        default=600,
+        help="Seconds to wait for Docker and for PMM to become ready",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    results = run_graph(bootstrap_steps(args.image, args.ready_timeout))
+    for name, result in results.items():
+        LOG.info("%-18s %-8s %6.1f s", name, result["status"], result["seconds"])
+    return 0 if all(result["status"] == "ok" for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Take an application-consistent EBS snapshot of the PMM data volume.
+
+Runs on the PMM EC2 instance from a systemd timer, in place of the daily
+rule of the module's backup plan. Each run:
+
+1. Flushes the datastores in the ``pmm-server`` container: VictoriaMetrics
+   writes its in-memory buffers, PostgreSQL checkpoints, ClickHouse stops
+   background merges (which rewrite parts).
+2. Freezes ``/srv`` (``fsfreeze``): dirty pages are written and further
+   writes block, so every datastore is paused at a consistent point.
+3. Creates an EBS snapshot of the volume (``ec2:CreateSnapshot``). Its
+   point in time is fixed when the call returns, while the snapshot
+   itself completes in the background.
+4. Thaws ``/srv`` and restarts merges right away, whatever happened before.
+5. Deletes the snapshots it took earlier than ``--retention-days`` ago.
+6. Publishes whether the run succeeded (``QuiesceSnapshotSuccess``, also
+   when it failed), how long writes were paused (``QuiescePause``) and
+   whether the snapshot was taken with all datastores paused
+   (``QuiesceConsistent``) to CloudWatch.
+
+Writes are paused for the duration of one ``CreateSnapshot`` call,
+normally a second or two; the call times out after ``--max-pause``
+seconds. The systemd unit thaws ``/srv`` again when the script exits, in
+case it was killed. Only the standard library and botocore (shipped with
+the awscli package) are used, so nothing extra has to be installed on
+the instance.
+"""
+
+import argparse
+import logging
+import subprocess
+import sys
+from base64 import b64encode
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.request import Request, urlopen
+
+LOG = logging.getLogger("pmm-consistent-snapshot")
+
+PMM_URL = "http://127.0.0.1"
+PMM_CONTAINER = "pmm-server"
+DATA_MOUNT = "/srv"
+
+# (name, pause, resume) of one datastore; resume is None if not needed.
+Step = Tuple[str, Callable[[], None], Optional[Callable[[], None]]]
+
+# Tag of the snapshots this script takes; its value is the volume ID.
+SNAPSHOT_TAG = "pmm-consistent-snapshot"
+
+
+def read_admin_password(env_file: str) -> str:
+    """
+    Read the PMM admin password written by ``get-pmm-password.sh``.
+
+    :param env_file: Path to the Docker env file with ``ADMIN_PASSWORD``.
+    :return: Admin password.
+    :raise KeyError: If the file has no ``ADMIN_PASSWORD`` line.
+    """
+    with open(env_file, encoding="utf-8") as fp:
+        for line in fp:
+            key, _, value = line.rstrip("\n").partition("=")
+            if key == "ADMIN_PASSWORD":
+                return value
+    raise KeyError(f"ADMIN_PASSWORD not found in {env_file}")
+
+
+def run(command: List[str], timeout: int = 60) -> None:
+    """
+    Run a command, raising on failure.
+
+    :param command: Command and arguments.
+    :param timeout: Seconds to wait for it.
+    """
+    LOG.info("Running %s", " ".join(command))
+    subprocess.run(command, check=True, capture_output=True, text=True, timeout=timeout)
+
+
+def flush_victoriametrics(password: str, base_url: str = PMM_URL) -> None:
+    """
+    Write VictoriaMetrics' in-memory buffers to disk.
+
+    :param password: PMM admin password.
+    :param base_url: PMM HTTP URL.
+    """
+    credentials = b64encode(f"admin:{password}".encode()).decode()
+    request = Request(
+        f"{base_url}/prometheus/internal/force_flush",
+        headers={"Authorization": f"Basic {credentials}"},
+    )
+    with urlopen(request, timeout=60):
+        pass
+
+
+def quiesce_steps(
+    password: str, container: str = PMM_CONTAINER, mount: str = DATA_MOUNT
+) -> List[Step]:
+    """
+    Steps that pause the datastores, in order.
+
+    :param password: PMM admin password.
+    :param container: Name of the PMM server container.
+    :param mount: Mount point of the data volume.
+    :return: Steps; the file system is frozen last.
+    """
+    docker_exec = ["docker", "exec", container]
+    clickhouse = docker_exec + ["clickhouse-client", "--query"]
+    return [
+        ("victoriametrics", lambda: flush_victoriametrics(password), None),
+        (
+            "postgresql",
+            lambda: run(docker_exec + ["psql", "-U", "postgres", "-c", "CHECKPOINT"]),
+            None,
+        ),
+        (
+            "clickhouse",
+            lambda: run(clickhouse + ["SYSTEM STOP MERGES"]),
+            lambda: run(clickhouse + ["SYSTEM START MERGES"]),
+        ),
+        (
+            "filesystem",
+            lambda: run(["fsfreeze", "--freeze", mount]),
+            lambda: run(["fsfreeze", "--unfreeze", mount]),
+        ),
+    ]
+
+
+def take_snapshot(ec2_client, volume_id: str, tags: Dict[str, str]) -> str:
+    """
+    Create an EBS snapshot of the volume, tagged with :data:`SNAPSHOT_TAG`.
+
+    :param ec2_client: botocore EC2 client.
+    :param volume_id: EBS volume ID.
+    :param tags: More snapshot tags.
+    :return: Snapshot ID.
+    """
+    tags = {**tags, SNAPSHOT_TAG: volume_id}
+    snapshot_id = ec2_client.create_snapshot(
+        VolumeId=volume_id,
+        Description=f"Application-consistent snapshot of {volume_id}",
+        TagSpecifications=[
+            {
+                "ResourceType": "snapshot",
+                "Tags": [{"Key": key, "Value": value} for key, value in tags.items()],
+            }
+        ],
+    )["SnapshotId"]
+    LOG.info("Snapshot %s of %s started", snapshot_id, volume_id)
+    return snapshot_id
+
+
+def expire_snapshots(
+    ec2_client, volume_id: str, retention_days: int, now: datetime
+) -> List[str]:
+    """
+    Delete the snapshots :func:`take_snapshot` took before the retention.
+
+    :param ec2_client: botocore EC2 client.
+    :param volume_id: EBS volume ID.
+    :param retention_days: Days to keep a snapshot.
+    :param now: Current time, timezone-aware.
+    :return: IDs of the deleted snapshots.
+    """
+    cutoff = now - timedelta(days=retention_days)
+    deleted = []
+    paginator = ec2_client.get_paginator("describe_snapshots")
+    for page in paginator.paginate(
+        OwnerIds=["self"],
+        Filters=[{"Name": f"tag:{SNAPSHOT_TAG}", "Values": [volume_id]}],
+    ):
+        for snapshot in page["Snapshots"]:
+            if snapshot["StartTime"] < cutoff:
+                ec2_client.delete_snapshot(SnapshotId=snapshot["SnapshotId"])
+                LOG.info("Deleted expired snapshot %s", snapshot["SnapshotId"])
+                deleted.append(snapshot["SnapshotId"])
+    return deleted
+
+
+def consistent_snapshot(steps: List[Step], snapshot: Callable[[], str]) -> Dict:
+    """
+    Pause the datastores, take the snapshot and resume them.
+
+    A step that fails to pause is logged and skipped; the snapshot is
+    still taken, but not reported consistent. Paused steps are resumed in
+    reverse order as soon as the snapshot call returns, even if it failed.
+
+    :param steps: From :func:`quiesce_steps`.
+    :param snapshot: Takes the snapshot and returns its ID, see
+        :func:`take_snapshot` (without the arguments).
+    :return: ``snapshot_id``, ``consistent`` and ``pause_seconds``, the
+        time from the last pause step to the first resume.
+    """
+    resumes = []
+    skipped = []
+    for name, pause, resume in steps:
+        LOG.info("Pausing %s", name)
+        try:
+            pause()
+        except (OSError, subprocess.SubprocessError) as exc:
+            LOG.warning("Cannot pause %s: %s", name, exc)
+            skipped.append(name)
+            continue
+        if resume:
+            resumes.append((name, resume))
+
+    result: Dict = {"snapshot_id": None}
+    paused_at = monotonic()
+    try:
+        result["snapshot_id"] = snapshot()
+    finally:
+        result["pause_seconds"] = monotonic() - paused_at
+        errors = []
+        for name, resume in reversed(resumes):
+            LOG.info("Resuming %s", name)
+            try:
+                resume()
+            except (OSError, subprocess.SubprocessError) as exc:
+                LOG.error("Cannot resume %s: %s", name, exc)
+                errors.append(exc)
+        if errors:
+            raise errors[0]
+    result["consistent"] = not skipped
+    return result
+
+
+def metric_data(volume_id: str, success: bool, result: Optional[Dict]) -> List[Dict]:
+    """
+    CloudWatch metrics of one run.
+
+    :param volume_id: EBS volume ID, the metrics' dimension.
+    :param success: Whether the whole run succeeded.
+    :param result: From :func:`consistent_snapshot`, or ``None`` if no
+        snapshot was taken.
+    :return: ``MetricData`` for ``PutMetricData``: ``QuiesceSnapshotSuccess``
+        always, the pause metrics only if a snapshot was taken.
+    """
+    dimensions = [{"Name": "VolumeId", "Value": volume_id}]
+    metrics = [
+        {
+            "MetricName": "QuiesceSnapshotSuccess",
+            "Value": 1 if success else 0,
+            "Unit": "Count",
+            "Dimensions": dimensions,
+        }
+    ]
+    if result is not None:
+        metrics += [
+            {
+                "MetricName": "QuiescePause",
+                "Value": result["pause_seconds"],
+                "Unit": "Seconds",
+                "Dimensions": dimensions,
+            },
+            {
+                "MetricName": "QuiesceConsistent",
+                "Value": 1 if result["consistent"] else 0,
+                "Unit": "Count",
+                "Dimensions": dimensions,
+            },
+        ]
+    return metrics
+
+
+def main() -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0].strip())
+    parser.add_argument("--region", required=True, help="AWS region")
+    parser.add_argument("--volume-id", required=True, help="ID of the data volume")
+    parser.add_argument("--retention-days", type=int, required=True)
+    parser.add_argument(
+        "--max-pause",
+        type=float,
+        default=30,
+        help="Seconds the snapshot call may keep writes paused",
+    )
+    parser.add_argument("--namespace", default="PMM/Backup")
+    parser.add_argument("--env-file", default="/etc/pmm-server.env")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    # Imported here so the quiesce logic can be used without botocore.
+    # pylint: disable=import-outside-toplevel
+    from botocore.config import Config
+    from botocore.exceptions import BotoCoreError, ClientError
+    from botocore.session import get_session
+
+    session = get_session()
+    # One attempt, bounded by --max-pause: retrying while /srv is frozen
+    # would only make the pause longer.
+    ec2_client = session.create_client(
+        "ec2",
+        region_name=args.region,
+        config=Config(
+            connect_timeout=args.max_pause,
+            read_timeout=args.max_pause,
+            retries={"total_max_attempts": 1},
+        ),
+    )
+    volume_id = args.volume_id
+
+    result = None
+    success = False
+    try:
+        result = consistent_snapshot(
+            quiesce_steps(read_admin_password(args.env_file)),
+            lambda: take_snapshot(
+                ec2_client,
+                volume_id,
+                {"Type": "daily-backup", "Consistency": "application"},
+            ),
+        )
+        LOG.info(
+            "Snapshot %s: writes paused for %.1f s",
+            result["snapshot_id"],
+            result["pause_seconds"],
+        )
+        if not result["consistent"]:
+            LOG.warning(
+                "Not all datastores were paused; the snapshot is crash-consistent"
+            )
+
+        expire_snapshots(
+            session.create_client("ec2", region_name=args.region),
+            volume_id,
+            args.retention_days,
+            datetime.now(timezone.utc),
+        )
+        success = True
+    finally:
+        # Published on failure too, so that a failed run raises the alarm
+        # without waiting for the missing daily data point.
+        try:
+            session.create_client(
+                "cloudwatch", region_name=args.region
+            ).put_metric_data(
+                Namespace=args.namespace,
+                MetricData=metric_data(volume_id, success, result),
+            )
+        except (BotoCoreError, ClientError) as exc:
+            LOG.error("Cannot publish metrics: %s", exc)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Pre-warm the PMM data volume after it was restored from a snapshot.
+
+A volume created from a snapshot (AWS Backup restore, the initial
+snapshot) fetches every block from S3 the first time it is read, so
+VictoriaMetrics and ClickHouse start very slowly. Started by
+``start-services.sh`` in the background, this script:
+
+1. Finds the volume ID from the NVMe serial and asks EC2 whether the
+   volume was created from a snapshot; if not, or if that snapshot was
+   already pre-warmed (marker file on the volume), it exits.
+2. Reads the files PMM needs first: PostgreSQL, the VictoriaMetrics
+   index, ClickHouse metadata, then the rest of the datastores, newest
+   files first.
+3. Reads the whole device, split into segments read in parallel with
+   large sequential reads, so every remaining block is fetched.
+
+Reads are throttled to ``--max-mbps``; that is the only limit, since EBS
+NVMe devices use the ``none`` I/O scheduler and ignore I/O priorities, so
+keep it below the volume's throughput. Progress and throughput are
+logged every ``--progress-interval`` seconds. Only the standard library
+and botocore (shipped with the awscli package) are used.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from stat import S_ISREG
+from time import monotonic, sleep
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+LOG = logging.getLogger("pmm-prewarm")
+
+DATA_MOUNT = "/srv"
+MARKER_FILE = ".pmm-prewarmed"
+
+# Directories under the mount point, hottest first.
+HOT_PATHS = (
+    "postgres14",
+    "victoriametrics/data/indexdb",
+    "clickhouse/metadata",
+    "victoriametrics",
+    "clickhouse",
+    "grafana",
+)
+
+BLOCK_SIZE = 1024 * 1024
+SEGMENT_SIZE = 256 * 1024 * 1024
+
+
+class Job(NamedTuple):
+    """A byte range of a file or device to read."""
+
+    path: str
+    offset: int
+    length: int
+
+
+class Throttle:
+    """
+    Token bucket shared by the reader threads.
+
+    :param rate: Bytes per second; 0 disables throttling.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.available = rate
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: int) -> None:
+        """Wait until ``amount`` bytes may be read."""
+        if not self.rate:
+            return
+        with self.lock:
+            now = monotonic()
+            self.available = min(
+                self.rate, self.available + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.available -= amount
+            delay = -self.available / self.rate if self.available < 0 else 0
+        if delay:
+            sleep(delay)
+
+
+class Progress:
+    """
+    Bytes read so far, logged periodically.
+
+    :param total: Bytes to read.
+    :param interval: Seconds between progress log lines.
+    """
+
+    def __init__(self, total: int, interval: float = 30):
+        self.total = total
+        self.done = 0
+        self.interval = interval
+        self.started = monotonic()
+        self.logged = self.started
+        self.lock = threading.Lock()
+
+    def add(self, amount: int) -> None:
+        """Count bytes read and log progress if it is time to."""
+        with self.lock:
+            self.done += amount
+            now = monotonic()
+            if now - self.logged < self.interval:
+                return
+            self.logged = now
+        LOG.info(
+            "%.1f%% (%d of %d MiB), %.1f MB/s",
+            100 * self.done / self.total if self.total else 100,
+            self.done // 2**20,
+            self.total // 2**20,
+            self.throughput(),
+        )
+
+    def throughput(self) -> float:
+        """Average MB/s since the start."""
+        elapsed = monotonic() - self.started
+        return self.done / elapsed / 1e6 if elapsed > 0 else 0.0
+
+    def summary(self) -> Dict:
+        """``bytes``, ``seconds`` and ``mbps`` so far."""
+        return {
+            "bytes": self.done,
+            "seconds": round(monotonic() - self.started, 1),
+            "mbps": round(self.throughput(), 1),
+        }
+
+
+def volume_id(device: str, sys_block: str = "/sys/block") -> str:
+    """
+    EBS volume ID of an NVMe device.
+
+    :param device: Device path, e.g. ``/dev/nvme1n1``.
+    :param sys_block: Path to ``/sys/block``.
+    :return: Volume ID, e.g. ``vol-0123456789abcdef0``.
+    """
+    name = os.path.basename(os.path.realpath(device))
+    with open(
+        os.path.join(sys_block, name, "device", "serial"), encoding="utf-8"
+    ) as fp:
+        serial = fp.read().strip()
+    return serial if serial.startswith("vol-") else serial.replace("vol", "vol-", 1)
+
+
+def source_snapshot(ec2_client, volume: str) -> Optional[str]:
+    """
+    Snapshot a volume was created from.
+
+    :param ec2_client: botocore EC2 client.
+    :param volume: Volume ID.
+    :return: Snapshot ID, or ``None`` for a volume created empty.
+    """
+    volumes = ec2_client.describe_volumes(VolumeIds=[volume])["Volumes"]
+    return volumes[0].get("SnapshotId") or None
+
+
+def already_warmed(mount: str, snapshot: str) -> bool:
+    """
+    Whether the volume was pre-warmed after being restored from a snapshot.
+
+    :param mount: Mount point of the volume.
+    :param snapshot: Snapshot ID.
+    """
+    try:
+        with open(os.path.join(mount, MARKER_FILE), encoding="utf-8") as fp:
+            return fp.read().strip() == snapshot
+    except OSError:
+        return False
+
+
+def file_jobs(mount: str, hot_paths: Sequence[str] = HOT_PATHS) -> List[Job]:
+    """
+    Files to read first, hottest directory first, newest file first.
+
+    :param mount: Mount point of the volume.
+    :param hot_paths: Directories under ``mount``; a file is read once,
+        for the first directory it is in.
+    :return: Jobs reading whole files.
+    """
+    jobs = []
+    seen = set()
+    for hot_path in hot_paths:
+        files = []
+        for root, _, names in os.walk(os.path.join(mount, hot_path)):
+            for name in names:
+                path = os.path.join(root, name)
+                if path in seen:
+                    continue
+                seen.add(path)
+                try:
+                    info = os.lstat(path)
+                except OSError:
+                    continue
+                if info.st_size and S_ISREG(info.st_mode):
+                    files.append((info.st_mtime, Job(path, 0, info.st_size)))
+        jobs.extend(job for _, job in sorted(files, key=lambda item: -item[0]))
+    return jobs
+
+
+def device_jobs(device: str, segment_size: int = SEGMENT_SIZE) -> List[Job]:
+    """
+    Segments covering the whole device.
+
+    :param device: Device path.
+    :param segment_size: Bytes per segment.
+    :return: Jobs in device order.
+    """
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        size = os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)
+    return [
+        Job(device, offset, min(segment_size, size - offset))
+        for offset in range(0, size, segment_size)
+    ]
+
+
+def read_job(
+    job: Job, throttle: Throttle, progress: Progress, block_size: int = BLOCK_SIZE
+) -> None:
+    """
+    Read a job's byte range and drop it from the page cache.
+
+    :param job: Range to read.
+    :param throttle: Shared throttle.
+    :param progress: Shared progress.
+    :param block_size: Bytes per read.
+    """
+    try:
+        fd = os.open(job.path, os.O_RDONLY)
+    except FileNotFoundError:
+        # Removed by PMM since it was listed.
+        progress.add(job.length)
+        return
+    try:
+        offset, end = job.offset, job.offset + job.length
+        while offset < end:
+            size = min(block_size, end - offset)
+            throttle.consume(size)
+            data = os.pread(fd, size, offset)
+            if not data:
+                break
+            offset += len(data)
+            progress.add(len(data))
+        progress.add(end - offset)
+        os.posix_fadvise(fd, job.offset, job.length, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def prewarm(
+    jobs: Sequence[Job], throttle: Throttle, progress: Progress, workers: int = 8
+) -> None:
+    """
+    Read jobs in parallel, in the given order.
+
+    :param jobs: Ranges to read; earlier ones are started first.
+    :param throttle: Shared throttle.
+    :param progress: Shared progress.
+    :param workers: Parallel readers.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [
+            executor.submit(read_job, job, throttle, progress) for job in jobs
+        ]:
+            future.result()
+
+
+def main() -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0].strip())
+    parser.add_argument("--device", required=True, help="Data volume device")
+    parser.add_argument("--mount", default=DATA_MOUNT, help="Its mount point")
+    parser.add_argument("--region", required=True, help="AWS region")
+    parser.add_argument("--max-mbps", type=float, default=100, help="0: unlimited")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--progress-interval", type=float, default=30)
+    parser.add_argument(
+        "--force", action="store_true", help="Pre-warm even if not from a snapshot"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    snapshot = "manual"
+    if not args.force:
+        # Imported here so the reader can be used without botocore.
+        from botocore.session import (  # pylint: disable=import-outside-toplevel
+            get_session,
+        )
+
+        volume = volume_id(args.device)
+        ec2_client = get_session().create_client("ec2", region_name=args.region)
+        snapshot = source_snapshot(ec2_client, volume)
+        if snapshot is None:
+            LOG.info("%s was not created from a snapshot; nothing to do", volume)
+            return 0
+        if already_warmed(args.mount, snapshot):
+            LOG.info("%s was already pre-warmed after %s", volume, snapshot)
+            return 0
+        LOG.info("%s was created from %s; pre-warming", volume, snapshot)
+
+    throttle = Throttle(args.max_mbps * 1e6)
+    for phase, jobs in (
+        ("files", file_jobs(args.mount)),
+        ("device", device_jobs(args.device)),
+    ):
+        progress = Progress(sum(job.length for job in jobs), args.progress_interval)
+        prewarm(jobs, throttle, progress, args.workers)
+        LOG.info("Pre-warmed %s: %s", phase, progress.summary())
+
+    with open(os.path.join(args.mount, MARKER_FILE), "w", encoding="utf-8") as fp:
+        fp.write(f"{snapshot}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
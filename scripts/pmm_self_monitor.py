@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Publish PMM server ingest-load metrics to CloudWatch.
+
+Runs on the PMM EC2 instance from a systemd timer. Each run:
+
+1. Queries PMM's own VictoriaMetrics (through the PMM HTTP port) for the
+   ingestion rate, active series and the slowest scrape.
+2. Asks ClickHouse (via ``docker exec``) how far behind the newest Query
+   Analytics bucket is.
+3. Publishes the results as CloudWatch metrics with an ``InstanceId``
+   dimension.
+
+A metric that cannot be read is skipped; the others are still published.
+Only the standard library and botocore (shipped with the awscli package)
+are used, so nothing extra has to be installed on the instance.
+"""
+
+import argparse
+import json
+import logging
+import subprocess
+import sys
+from base64 import b64encode
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+LOG = logging.getLogger("pmm-self-monitor")
+
+IMDS_URL = "http://169.254.169.254/latest"
+PMM_URL = "http://127.0.0.1"
+PMM_CONTAINER = "pmm-server"
+
+# CloudWatch metric name -> (PromQL query, CloudWatch unit).
+PROMQL_METRICS: Dict[str, Tuple[str, str]] = {
+    "IngestionRate": (
+        "sum(rate(vm_rows_inserted_total[5m]))",
+        "Count/Second",
+    ),
+    "ActiveSeries": (
+        'sum(vm_cache_entries{type="storage/hour_metric_ids"})',
+        "Count",
+    ),
+    "ScrapeDurationMax": (
+        "max(max_over_time(scrape_duration_seconds[5m]))",
+        "Seconds",
+    ),
+}
+
+# Seconds between now and the newest QAN bucket written in the last day,
+# or -1 if there is no recent QAN data at all (no QAN agents yet).
+QAN_LAG_QUERY = (
+    "SELECT if(count() = 0, -1, dateDiff('second', max(period_start), now())) "
+    "FROM pmm.metrics WHERE period_start > now() - INTERVAL 1 DAY"
+)
+
+
+def read_admin_password(env_file: str) -> str:
+    """
+    Read the PMM admin password written by ``get-pmm-password.sh``.
+
+    :param env_file: Path to the Docker env file with ``ADMIN_PASSWORD``.
+    :return: Admin password.
+    :raise KeyError: If the file has no ``ADMIN_PASSWORD`` line.
+    """
+    with open(env_file, encoding="utf-8") as fp:
+        for line in fp:
+            key, _, value = line.rstrip("\n").partition("=")
+            if key == "ADMIN_PASSWORD":
+                return value
+    raise KeyError(f"ADMIN_PASSWORD not found in {env_file}")
+
+
+def instance_id(timeout: int = 5) -> str:
+    """
+    EC2 instance ID from the instance metadata service (IMDSv2).
+
+    :param timeout: HTTP timeout in seconds.
+    :return: Instance ID, e.g. ``i-0123456789abcdef0``.
+    """
+    token_request = Request(
+        f"{IMDS_URL}/api/token",
+        method="PUT",
+        headers={"X-aws-ec2-metadata-token-ttl-seconds": "60"},
+    )
+    with urlopen(token_request, timeout=timeout) as response:
+        token = response.read().decode()
+    request = Request(
+        f"{IMDS_URL}/meta-data/instance-id",
+        headers={"X-aws-ec2-metadata-token": token},
+    )
+    with urlopen(request, timeout=timeout) as response:
+        return response.read().decode()
+
+
+def parse_instant_query(payload: Dict) -> Optional[float]:
+    """
+    Extract a scalar from a Prometheus instant-query response.
+
+    :param payload: Decoded ``/api/v1/query`` response.
+    :return: Value of the first sample, or ``None`` if there is none.
+    """
+    if payload.get("status") != "success":
+        return None
+    result = payload.get("data", {}).get("result", [])
+    if not result:
+        return None
+    return float(result[0]["value"][1])
+
+
+def query_victoriametrics(
+    query: str, password: str, base_url: str = PMM_URL, timeout: int = 10
+) -> Optional[float]:
+    """
+    Run an instant PromQL query against PMM's VictoriaMetrics.
+
+    :param query: PromQL expression returning one series.
+    :param password: PMM admin password.
+    :param base_url: PMM HTTP URL.
+    :param timeout: HTTP timeout in seconds.
+    :return: Query result, or ``None`` if it returned no data.
+    """
+    credentials = b64encode(f"admin:{password}".encode()).decode()
+    request = Request(
+        f"{base_url}/prometheus/api/v1/query?{urlencode({'query': query})}",
+        headers={"Authorization": f"Basic {credentials}"},
+    )
+    with urlopen(request, timeout=timeout) as response:
+        return parse_instant_query(json.load(response))
+
+
+def query_qan_lag(container: str = PMM_CONTAINER, timeout: int = 30) -> Optional[float]:
+    """
+    Seconds since the newest Query Analytics bucket was written.
+
+    :param container: Name of the PMM server container.
+    :param timeout: Command timeout in seconds.
+    :return: Lag in seconds, or ``None`` if there is no recent QAN data.
+    """
+    output = subprocess.run(
+        ["docker", "exec", container, "clickhouse-client", "--query", QAN_LAG_QUERY],
+        check=True,
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+    ).stdout.strip()
+    lag = float(output)
+    return None if lag < 0 else lag
+
+
+def collect(password: str) -> List[Dict]:
+    """
+    Collect all self-monitoring metrics.
+
+    :param password: PMM admin password.
+    :return: CloudWatch ``MetricData`` entries without dimensions.
+    """
+    metrics = []
+    for name, (query, unit) in PROMQL_METRICS.items():
+        try:
+            value = query_victoriametrics(query, password)
+        except (OSError, ValueError) as exc:
+            LOG.warning("Cannot read %s: %s", name, exc)
+            continue
+        if value is not None:
+            metrics.append({"MetricName": name, "Value": value, "Unit": unit})
+
+    try:
+        lag = query_qan_lag()
+    except (OSError, ValueError, subprocess.SubprocessError) as exc:
+        LOG.warning("Cannot read QANInsertLag: %s", exc)
+    else:
+        if lag is not None:
+            metrics.append(
+                {"MetricName": "QANInsertLag", "Value": lag, "Unit": "Seconds"}
+            )
+    return metrics
+
+
+def publish(metrics: List[Dict], namespace: str, region: str, dimension: str) -> None:
+    """
+    Publish metrics to CloudWatch.
+
+    :param metrics: ``MetricData`` entries from :func:`collect`.
+    :param namespace: CloudWatch namespace.
+    :param region: AWS region.
+    :param dimension: Value of the ``InstanceId`` dimension.
+    """
+    # Imported here so the collection logic can be used without botocore.
+    from botocore.session import get_session  # pylint: disable=import-outside-toplevel
+
+    client = get_session().create_client("cloudwatch", region_name=region)
+    client.put_metric_data(
+        Namespace=namespace,
+        MetricData=[
+            {**metric, "Dimensions": [{"Name": "InstanceId", "Value": dimension}]}
+            for metric in metrics
+        ],
+    )
+
+
+def main() -> int:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0].strip())
+    parser.add_argument("--region", required=True, help="AWS region")
+    parser.add_argument("--namespace", default="PMM/SelfMonitoring")
+    parser.add_argument("--env-file", default="/etc/pmm-server.env")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    metrics = collect(read_admin_password(args.env_file))
+    if not metrics:
+        LOG.error("No metrics collected; is PMM running?")
+        return 1
+    publish(metrics, args.namespace, args.region, instance_id())
+    LOG.info(
+        "Published %s",
+        ", ".join(f"{m['MetricName']}={m['Value']:g}" for m in metrics),
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -29,6 +29,81 @@ data "aws_iam_policy_document" "pmm_instance" {
     ]
     resources = ["*"]
   }
+
+  # Whether the data volume was restored from a snapshot (pmm-prewarm)
+  dynamic "statement" {
+    for_each = var.ebs_prewarm.enabled ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "ec2:DescribeVolumes",
+      ]
+      resources = ["*"]
+    }
+  }
+
+  # Daily application-consistent snapshot taken from the instance
+  dynamic "statement" {
+    for_each = var.backup_quiesce.enabled ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "ec2:CreateSnapshot",
+      ]
+      resources = [
+        aws_ebs_volume.pmm_data.arn,
+        "arn:aws:ec2:${data.aws_region.current.name}::snapshot/*",
+      ]
+    }
+  }
+
+  dynamic "statement" {
+    for_each = var.backup_quiesce.enabled ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "ec2:CreateTags",
+      ]
+      resources = [
+        "arn:aws:ec2:${data.aws_region.current.name}::snapshot/*",
+      ]
+      condition {
+        test     = "StringEquals"
+        variable = "ec2:CreateAction"
+        values   = ["CreateSnapshot"]
+      }
+    }
+  }
+
+  # Expire only the snapshots of the data volume taken by the instance
+  dynamic "statement" {
+    for_each = var.backup_quiesce.enabled ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "ec2:DeleteSnapshot",
+      ]
+      resources = [
+        "arn:aws:ec2:${data.aws_region.current.name}::snapshot/*",
+      ]
+      condition {
+        test     = "StringEquals"
+        variable = "aws:ResourceTag/pmm-consistent-snapshot"
+        values   = [aws_ebs_volume.pmm_data.id]
+      }
+    }
+  }
+
+  dynamic "statement" {
+    for_each = var.backup_quiesce.enabled ? [1] : []
+    content {
+      effect = "Allow"
+      actions = [
+        "ec2:DescribeSnapshots",
+      ]
+      resources = ["*"]
+    }
+  }
 }
 
 # IAM policy for EC2 instance
@@ -4,35 +4,187 @@ import json
 import logging
 import os
 import shutil
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from importlib.resources import as_file, files
 from os import path as osp
 from textwrap import dedent
+from typing import Any, Callable, Dict, Iterable, Optional
 
 import boto3
 import pytest
+from botocore.exceptions import ClientError, HTTPClientError
 from infrahouse_core.aws.asg import ASG
 from infrahouse_core.logging import setup_logging
-from infrahouse_core.timeout import timeout
 from pytest_infrahouse import terraform_apply
 
 LOG = logging.getLogger(__name__)
 TERRAFORM_ROOT_DIR = "test_data"
 
+# The reconciler Lambda is not a package ("lambda" is a Python keyword),
+# so make its modules importable for local unit tests.
+RECONCILER_SOURCE_DIR = osp.abspath(
+    osp.join(osp.dirname(__file__), "..", "lambda", "pmm_reconciler")
+)
+sys.path.insert(0, RECONCILER_SOURCE_DIR)
+
+# Python scripts shipped to the PMM instance (e.g., pmm_self_monitor.py).
+SCRIPTS_DIR = osp.abspath(osp.join(osp.dirname(__file__), "..", "scripts"))
+sys.path.insert(0, SCRIPTS_DIR)
+
 setup_logging(LOG, debug=True, debug_botocore=False)
 
+# AWS error codes of failed checks that are worth retrying.
+TRANSIENT_ERROR_CODES = {
+    "InternalError",
+    "RequestLimitExceeded",
+    "RequestTimeout",
+    "ServiceUnavailable",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+}
 
-@pytest.fixture(scope="session")
-def percona_server(request, service_network, keep_after, aws_region, test_role_arn):
+
+class CheckAborted(Exception):
+    """A check failed in a way that waiting longer will not fix."""
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Tell whether a failed check may succeed if retried.
+
+    :param error: Exception raised by the check.
+    :return: True for throttling, AWS server errors, timeouts and network
+        errors; False for anything else (access denied, a missing
+        resource, a bug in the check).
+    """
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in TRANSIENT_ERROR_CODES
+    return isinstance(error, (TimeoutError, ConnectionError, HTTPClientError))
+
+
+def wait_for_condition(
+    targets: Dict[str, Any],
+    check: Callable[[Dict[str, Any]], Iterable[str]],
+    deadline: float,
+    description: str,
+    initial_delay: float = 5,
+    max_delay: float = 30,
+) -> Dict[str, Optional[float]]:
+    """
+    Poll all targets until each is ready or a shared deadline passes.
+
+    Every round checks all still-pending targets at once, then sleeps with
+    exponential backoff (``initial_delay`` doubling up to ``max_delay``).
+    Total wait time is that of the slowest target, not the sum of all.
+
+    ``check`` runs in the calling thread, so it may use
+    ``infrahouse_core.timeout`` or ``execute_command()`` (both rely on
+    ``SIGALRM``). Wrap a thread-safe per-target predicate with
+    :func:`check_in_parallel`, or check many instances with one SSM call
+    (``fanout.run_on_instances``).
+
+    :param targets: Map of target name (used in logs) to target object.
+    :param check: Called with the pending targets; returns the names of
+        those that are ready now. An exception counts as "none ready",
+        except :class:`CheckAborted`, which stops waiting.
+    :param deadline: Seconds to wait for all targets.
+    :param description: What is being waited for, e.g. ``"Puppet"``.
+    :param initial_delay: Seconds to sleep after the first round.
+    :param max_delay: Upper bound of the sleep between rounds.
+    :return: Map of target name to seconds until it was ready, or ``None``
+        if it was not ready by the deadline.
+    """
+    started = time.monotonic()
+    readiness: Dict[str, Optional[float]] = {name: None for name in targets}
+    pending = dict(targets)
+    delay = initial_delay
+    while pending:
+        try:
+            ready = set(check(pending)) & set(pending)
+        except CheckAborted as e:
+            LOG.warning("Stopped waiting for %s: %s", description, e)
+            break
+        except Exception as e:
+            LOG.warning("Error checking %s: %s", description, e)
+            ready = set()
+        elapsed = time.monotonic() - started
+        for name in sorted(ready):
+            readiness[name] = elapsed
+            del pending[name]
+            LOG.info("%s ready on %s after %.0f s", description, name, elapsed)
+        remaining = deadline - elapsed
+        if not pending or remaining <= 0:
+            break
+        LOG.info(
+            "%s not ready on %s yet, checking again in %.0f s",
+            description,
+            ", ".join(sorted(pending)),
+            min(delay, remaining),
+        )
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+    LOG.info("%s readiness:", description)
+    for name, seconds in readiness.items():
+        if seconds is None:
+            LOG.warning("  %s: not ready after %.0f s", name, deadline)
+        else:
+            LOG.info("  %s: %.0f s", name, seconds)
+    return readiness
+
+
+def check_in_parallel(
+    predicate: Callable[[Any], bool],
+    max_workers: int = 16,
+    transient: Callable[[Exception], bool] = is_transient,
+) -> Callable[[Dict[str, Any]], Iterable[str]]:
+    """
+    Turn a per-target predicate into a ``check`` for :func:`wait_for_condition`.
+
+    The predicate runs in worker threads, one per pending target, so it must
+    be thread-safe and must not use ``SIGALRM`` (``infrahouse_core.timeout``,
+    ``execute_command()``). A predicate that raises a transient error counts
+    as "not ready"; any other error stops the wait (:class:`CheckAborted`).
+
+    :param predicate: Called with a target object; returns True when ready.
+    :param max_workers: Upper bound of concurrent predicate calls.
+    :param transient: Tells errors worth retrying from the rest.
+    :return: Function for the ``check`` argument.
+    """
+
+    def check(pending: Dict[str, Any]) -> Iterable[str]:
+        def ready(item):
+            name, target = item
+            try:
+                return name, predicate(target)
+            except Exception as e:
+                if not transient(e):
+                    raise CheckAborted(f"check on {name} failed: {e}") from e
+                LOG.warning("Check on %s failed, retrying: %s", name, e)
+                return name, False
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+            return [name for name, ok in executor.map(ready, pending.items()) if ok]
+
+    return check
+
+
+def prepare_percona_server(service_network, aws_region, test_role_arn):
     """
-    Deploy a Percona Server cluster for MySQL monitoring tests.
+    Write the Terraform configuration of the Percona Server test stack.
 
     Uses the infrahouse/percona-server/aws module to create a 3-node
     Percona XtraDB Cluster with NLB endpoints.
-    """
-    LOG.info("=" * 80)
-    LOG.info("Deploying Percona Server cluster for MySQL monitoring")
-    LOG.info("=" * 80)
 
+    :param service_network: Outputs of the ``service_network`` fixture
+    :param aws_region: AWS region
+    :param test_role_arn: IAM role ARN to assume (optional)
+    :return: Path to the Terraform module directory
+    """
     subnet_private_ids = service_network["subnet_private_ids"]["value"]
     terraform_module_dir = osp.join(TERRAFORM_ROOT_DIR, "percona_server")
 
@@ -101,18 +253,148 @@ def percona_server(request, service_network, keep_after, aws_region, test_role_a
         if test_role_arn:
             fp.write(f'role_arn = "{test_role_arn}"\n')
 
-    with terraform_apply(
-        terraform_module_dir,
-        destroy_after=not keep_after,
-        json_output=True,
-    ) as tf_output:
-        LOG.info("Percona Server cluster deployed successfully")
-        LOG.info("NLB DNS: %s", tf_output["nlb_dns_name"]["value"])
-        LOG.info(
-            "Writer endpoint: %s",
-            tf_output["writer_endpoint"]["value"],
+    return terraform_module_dir
+
+
+def prepare_postgres(request, service_network, aws_region, test_role_arn, module_dir):
+    """
+    Write ``terraform.tfvars`` of the pytest-infrahouse PostgreSQL RDS stack.
+
+    Same variables as the ``postgres`` fixture of pytest-infrahouse.
+
+    :param request: Pytest request of the calling fixture
+    :param service_network: Outputs of the ``service_network`` fixture
+    :param aws_region: AWS region
+    :param test_role_arn: IAM role ARN to assume (optional)
+    :param module_dir: Path to the ``data/postgres`` module of pytest-infrahouse
+    :return: ``module_dir``
+    """
+    with open(osp.join(module_dir, "terraform.tfvars"), "w") as fp:
+        fp.write(f'region = "{aws_region}"\n')
+        fp.write(f'calling_test = "{osp.basename(request.node.path)}"\n')
+        fp.write(
+            "subnet_private_ids = "
+            f'{json.dumps(service_network["subnet_private_ids"]["value"])}\n'
         )
-        yield tf_output
+        fp.write('environment = "test"\n')
+        if test_role_arn:
+            fp.write(f'role_arn = "{test_role_arn}"\n')
+    return module_dir
+
+
+@contextmanager
+def terraform_apply_concurrently(module_dirs, destroy_after=True):
+    """
+    Apply independent Terraform stacks at the same time.
+
+    Each stack is applied with ``terraform_apply()`` from its own working
+    directory, so every ``terraform`` run is a separate process with its
+    own state. The context is entered once all applies have finished, and
+    all stacks are destroyed concurrently when it exits. Setup takes as
+    long as the slowest stack rather than the sum of all of them.
+
+    :param module_dirs: Map of stack name to Terraform module directory.
+        The directories must not be shared between stacks.
+    :param destroy_after: Destroy the stacks when the context exits.
+    :return: Map of stack name to its ``terraform output`` dict.
+    :raise CalledProcessError: If a stack fails to apply. Stacks that were
+        applied are destroyed (if ``destroy_after``) before it is raised.
+    """
+    if len(set(module_dirs.values())) != len(module_dirs):
+        raise ValueError(f"Stacks must use separate directories: {module_dirs}")
+
+    contexts = {
+        name: terraform_apply(path, destroy_after=destroy_after, json_output=True)
+        for name, path in module_dirs.items()
+    }
+    started = time.monotonic()
+
+    def apply(name):
+        tf_output = contexts[name].__enter__()
+        LOG.info("Stack %s applied after %.0f s", name, time.monotonic() - started)
+        return tf_output
+
+    def destroy(name):
+        contexts[name].__exit__(None, None, None)
+        LOG.info("Stack %s destroyed", name)
+
+    outputs = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers=len(contexts)) as executor:
+        futures = {name: executor.submit(apply, name) for name in contexts}
+        for name, future in futures.items():
+            try:
+                outputs[name] = future.result()
+            except Exception as e:
+                LOG.error("Stack %s failed to apply: %s", name, e)
+                errors.append(e)
+    LOG.info(
+        "Applied %s in %.0f s", ", ".join(sorted(outputs)), time.monotonic() - started
+    )
+
+    try:
+        if errors:
+            raise errors[0]
+        yield outputs
+    finally:
+        with ThreadPoolExecutor(max_workers=max(len(outputs), 1)) as executor:
+            for future in [executor.submit(destroy, name) for name in outputs]:
+                future.result()
+
+
+@pytest.fixture(scope="session")
+def database_stacks(request, service_network, keep_after, aws_region, test_role_arn):
+    """
+    Deploy the Percona Server cluster and the PostgreSQL RDS instance.
+
+    The two stacks don't depend on each other, so they are applied
+    concurrently (see :func:`terraform_apply_concurrently`).
+    """
+    LOG.info("=" * 80)
+    LOG.info("Deploying Percona Server cluster and PostgreSQL RDS concurrently")
+    LOG.info("=" * 80)
+
+    with as_file(files("pytest_infrahouse").joinpath("data/postgres")) as pg_dir:
+        module_dirs = {
+            "percona_server": prepare_percona_server(
+                service_network, aws_region, test_role_arn
+            ),
+            "postgres": prepare_postgres(
+                request, service_network, aws_region, test_role_arn, pg_dir
+            ),
+        }
+        with terraform_apply_concurrently(
+            module_dirs, destroy_after=not keep_after
+        ) as outputs:
+            yield outputs
+
+
+@pytest.fixture(scope="session")
+def percona_server(database_stacks):
+    """
+    Percona Server cluster for MySQL monitoring tests.
+
+    Outputs of the ``percona_server`` stack from ``database_stacks``.
+    """
+    tf_output = database_stacks["percona_server"]
+    LOG.info("Percona Server cluster deployed successfully")
+    LOG.info("NLB DNS: %s", tf_output["nlb_dns_name"]["value"])
+    LOG.info(
+        "Writer endpoint: %s",
+        tf_output["writer_endpoint"]["value"],
+    )
+    return tf_output
+
+
+@pytest.fixture(scope="session")
+def postgres(database_stacks):
+    """
+    PostgreSQL RDS instance for PostgreSQL monitoring tests.
+
+    Overrides the pytest-infrahouse fixture of the same name so that the
+    instance is created concurrently with the Percona Server cluster.
+    """
+    return database_stacks["postgres"]
 
 
 @pytest.fixture(scope="session")
@@ -153,35 +435,27 @@ def percona_pmm(percona_server, boto3_session, aws_region, test_role_arn):
     # cloud-init touches /var/run/puppet-done as the last step after
     # ih-puppet apply completes (see terraform-aws-cloud-init module).
     LOG.info("Waiting for Puppet to complete on all Percona instances...")
-    for inst in instances:
-        LOG.info(
-            "Waiting for /var/run/puppet-done on %s (%s)...",
-            inst.instance_id,
-            inst.private_ip,
+
+    def puppet_done(pending):
+        from fanout import run_on_instances
+
+        results = run_on_instances(
+            list(pending.values()), "ls /var/run/puppet-done", execution_timeout=30
         )
-        try:
-            with timeout(seconds=900):  # 15 minutes
-                while True:
-                    exit_code, _, _ = inst.execute_command(
-                        "ls /var/run/puppet-done",
-                        execution_timeout=30,
-                    )
-                    if exit_code == 0:
-                        LOG.info(
-                            "Puppet done on %s",
-                            inst.instance_id,
-                        )
-                        break
-                    LOG.info(
-                        "Puppet not done on %s yet...",
-                        inst.instance_id,
-                    )
-                    time.sleep(30)
-        except TimeoutError:
-            LOG.warning(
-                "Timeout waiting for Puppet on %s",
-                inst.instance_id,
-            )
+        return [
+            instance_id
+            for instance_id, result in results.items()
+            if result is not None and result[0] == 0
+        ]
+
+    wait_for_condition(
+        {inst.instance_id: inst for inst in instances},
+        puppet_done,
+        deadline=900,  # 15 minutes
+        description="Puppet",
+        initial_delay=10,
+        max_delay=30,
+    )
 
     result = {
         "address": nlb_dns,
@@ -354,9 +628,24 @@ PYTHON_SCRIPT_EOF
     """
     ).strip()
 
-    exit_code, stdout, stderr = instance.execute_command(
-        config_cmd, execution_timeout=300
+    # The parameter group that loads pg_stat_statements may still be
+    # applying (RDS reboots the instance), so retry until it succeeds.
+    # A single target: the check runs in this thread, execute_command() is safe.
+    attempts = []
+
+    def postgres_configured(pending):
+        attempts.append(instance.execute_command(config_cmd, execution_timeout=300))
+        return [instance_id] if attempts[-1][0] == 0 else []
+
+    wait_for_condition(
+        {instance_id: instance},
+        postgres_configured,
+        deadline=900,
+        description="PostgreSQL configuration",
+        initial_delay=15,
+        max_delay=60,
     )
+    exit_code, stdout, stderr = attempts[-1]
 
     # Log the output
     if stdout:
@@ -371,7 +660,9 @@ PYTHON_SCRIPT_EOF
             LOG.error("Error output:")
             for line in stderr.strip().split("\n"):
                 LOG.error("  %s", line)
-        raise RuntimeError(f"PostgreSQL configuration failed with exit code {exit_code}")
+        raise RuntimeError(
+            f"PostgreSQL configuration failed with exit code {exit_code}"
+        )
 
     LOG.info("=" * 80)
     LOG.info("PostgreSQL successfully configured for PMM monitoring")
@@ -382,10 +673,13 @@ def wait_for_instance_refresh(asg_name, aws_region, test_role_arn, timeout=600):
     """
     Wait for any in-progress ASG instance refreshes to complete.
 
-    :param asg_name: Name of the Auto Scaling Group
+    :param asg_name: Name of the Auto Scaling Group, or a list of names
+        to wait for concurrently
     :param aws_region: AWS region
     :param test_role_arn: IAM role ARN to assume (optional)
     :param timeout: Maximum time to wait in seconds (default 600 = 10 minutes)
+    :return: Map of ASG name to seconds until its refreshes completed,
+        or None if they did not complete in time
     """
     LOG.info("=" * 80)
     LOG.info("Checking for in-progress ASG instance refreshes")
@@ -408,56 +702,40 @@ def wait_for_instance_refresh(asg_name, aws_region, test_role_arn, timeout=600):
     else:
         asg_client = boto3.client("autoscaling", region_name=aws_region)
 
-    start_time = time.time()
-    last_status = None
+    asg_names = [asg_name] if isinstance(asg_name, str) else list(asg_name)
+    last_status = {}
 
-    while time.time() - start_time < timeout:
-        try:
-            # Check for instance refreshes
-            response = asg_client.describe_instance_refreshes(
-                AutoScalingGroupName=asg_name, MaxRecords=10
+    def refresh_done(name):
+        response = asg_client.describe_instance_refreshes(
+            AutoScalingGroupName=name, MaxRecords=10
+        )
+        in_progress = [
+            ir
+            for ir in response.get("InstanceRefreshes", [])
+            if ir["Status"]
+            in ["Pending", "InProgress", "Cancelling", "RollbackInProgress"]
+        ]
+        for refresh in in_progress:
+            status_msg = (
+                f"Instance refresh {refresh['InstanceRefreshId']} on {name}: "
+                f"{refresh['Status']} ({refresh.get('PercentageComplete', 0)}% complete)"
             )
-
-            instance_refreshes = response.get("InstanceRefreshes", [])
-
-            # Filter for in-progress refreshes
-            in_progress = [
-                ir
-                for ir in instance_refreshes
-                if ir["Status"]
-                in ["Pending", "InProgress", "Cancelling", "RollbackInProgress"]
-            ]
-
-            if not in_progress:
-                if last_status is not None:
-                    LOG.info("All instance refreshes completed")
-                else:
-                    LOG.info("No in-progress instance refreshes found")
-                LOG.info("=" * 80)
-                return
-
-            # Log status of in-progress refreshes
-            for refresh in in_progress:
-                refresh_id = refresh["InstanceRefreshId"]
-                status = refresh["Status"]
-                percentage = refresh.get("PercentageComplete", 0)
-
-                status_msg = (
-                    f"Instance refresh {refresh_id}: {status} ({percentage}% complete)"
-                )
-                if status_msg != last_status:
-                    LOG.info(status_msg)
-                    last_status = status_msg
-
-            time.sleep(10)  # Check every 10 seconds
-
-        except Exception as e:
-            LOG.warning("Error checking instance refresh status: %s", e)
-            LOG.warning("Continuing anyway...")
-            break
-
-    if time.time() - start_time >= timeout:
-        LOG.warning("Timeout waiting for instance refresh to complete")
+            if status_msg != last_status.get(refresh["InstanceRefreshId"]):
+                LOG.info(status_msg)
+                last_status[refresh["InstanceRefreshId"]] = status_msg
+        return not in_progress
+
+    readiness = wait_for_condition(
+        {name: name for name in asg_names},
+        check_in_parallel(refresh_done),
+        deadline=timeout,
+        description="Instance refresh",
+        initial_delay=10,
+        max_delay=30,
+    )
+    if None in readiness.values():
+        LOG.warning("Instance refresh did not complete (timeout or check error)")
         LOG.warning("Continuing anyway...")
 
-    LOG.info("=" * 80)
\ No newline at end of file
+    LOG.info("=" * 80)
+    return readiness
@@ -0,0 +1,169 @@
+"""Tests for the ALB access log analyzer (pmm_tools.alb_logs)."""
+
+import gzip
+import io
+from datetime import datetime, timezone
+
+import pytest
+
+from pmm_tools import alb_logs
+
+
+def log_line(time, path, target_time, status="200"):
+    return (
+        f"h2 {time} app/pmm/abc 10.0.0.1:5555 10.0.1.2:80 0.000 {target_time} 0.000 "
+        f'{status} {status} 120 4500 "GET https://pmm.example.com:443{path} HTTP/2.0" '
+        '"Mozilla/5.0" ECDHE-RSA-AES128-GCM-SHA256 TLSv1.2 '
+        'arn:aws:elasticloadbalancing:us-west-2:123:targetgroup/pmm/1 "Root=1-abc" '
+        '"pmm.example.com" "arn:aws:acm:us-west-2:123:certificate/1" 0 '
+        f'{time} "forward" "-" "-" "10.0.1.2:80" "{status}" "-" "-" TID_1'
+    )
+
+
+LINES = [
+    log_line("2026-10-19T10:00:01.000000Z", "/graph/api/ds/query?ds_type=x", 0.200),
+    log_line("2026-10-19T10:00:02.000000Z", "/graph/api/ds/query", 0.400),
+    log_line("2026-10-19T10:00:03.000000Z", "/graph/api/ds/query", 2.000),
+    log_line("2026-10-19T10:00:04.000000Z", "/v1/qan/metrics:getReport", 1.500),
+    log_line("2026-10-19T10:00:05.000000Z", "/v1/inventory/nodes", 0.010),
+    log_line("2026-10-19T10:00:06.000000Z", "/graph/api/ds/query", -1, "504"),
+    log_line("2026-10-19T11:00:00.000000Z", "/favicon.ico", 0.001),
+    "not an ALB log line",
+]
+
+
+def test_parse_lines():
+    requests = list(alb_logs.parse_lines(LINES))
+
+    assert len(requests) == 7
+    assert requests[0].path == "/graph/api/ds/query"
+    assert requests[0].target_time == pytest.approx(0.2)
+    assert requests[0].time == datetime(2026, 10, 19, 10, 0, 1, tzinfo=timezone.utc)
+    assert requests[5].elb_status == "504"
+    assert requests[5].target_time is None
+
+
+@pytest.mark.parametrize(
+    "path, group",
+    [
+        ("/graph/api/ds/query", "/graph/api/ds/query"),
+        ("/graph/api/dashboards/uid/x", "/graph/api/"),
+        ("/graph/d/node-overview", "/graph/"),
+        ("/v1/qan/metrics:getReport", "/v1/qan"),
+        ("/v1/inventory/nodes", "/v1/"),
+        ("/favicon.ico", "other"),
+    ],
+)
+def test_path_group(path, group):
+    assert alb_logs.path_group(path) == group
+
+
+def test_histogram_percentiles_within_one_percent():
+    histogram = alb_logs.Histogram()
+    for value in range(1, 1001):
+        histogram.add(value / 1000)
+
+    assert histogram.count == 1000
+    for fraction in (0.5, 0.95, 0.99):
+        assert histogram.percentile(fraction) == pytest.approx(fraction, rel=0.01)
+    assert histogram.percentile(1) == 1.0
+    assert alb_logs.Histogram().percentile(0.5) is None
+
+
+def test_aggregate_and_report():
+    histograms = alb_logs.aggregate(
+        alb_logs.parse_lines(LINES),
+        end=datetime(2026, 10, 19, 10, 30, tzinfo=timezone.utc),
+    )
+    rows = {(row["group"], row["status"]): row for row in alb_logs.report(histograms)}
+
+    assert set(rows) == {
+        ("/graph/api/ds/query", "200"),
+        ("/graph/api/ds/query", "504"),
+        ("/v1/qan", "200"),
+        ("/v1/", "200"),
+    }
+    query = rows[("/graph/api/ds/query", "200")]
+    assert query["count"] == 3
+    assert query["p50"] == pytest.approx(0.4, rel=0.01)
+    assert query["p99"] == pytest.approx(2.0, rel=0.01)
+    # Not forwarded to PMM: counted, no latency.
+    assert rows[("/graph/api/ds/query", "504")]["count"] == 1
+    assert rows[("/graph/api/ds/query", "504")]["p50"] is None
+    # Slowest first.
+    assert alb_logs.report(histograms)[0]["group"] == "/graph/api/ds/query"
+    assert "P99 ms" in alb_logs.format_report(alb_logs.report(histograms))
+
+
+def test_local_lines_reads_plain_and_gzipped(tmp_path):
+    (tmp_path / "a.log").write_text("\n".join(LINES[:2]) + "\n")
+    with gzip.open(tmp_path / "b.log.gz", "wt") as fp:
+        fp.write("\n".join(LINES[2:4]) + "\n")
+    (tmp_path / "notes.txt").write_text("ignored")
+
+    assert list(alb_logs.local_lines([str(tmp_path)])) == LINES[:4]
+
+
+class FakeS3:
+    """Bucket with ALB log objects."""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.listed = []
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        self.listed.append(Prefix)
+        yield {
+            "Contents": [
+                {"Key": key} for key in sorted(self.objects) if key.startswith(Prefix)
+            ]
+        }
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+
+def log_key(day, written):
+    return (
+        f"pmm/AWSLogs/123/elasticloadbalancing/us-west-2/{day}/"
+        f"123_elasticloadbalancing_us-west-2_app.pmm.abc_{written}_10.0.0.1_x.log.gz"
+    )
+
+
+def test_log_keys_selects_objects_of_the_range():
+    keys = [
+        log_key("2026/10/19", "20261019T2350Z"),
+        log_key("2026/10/19", "20261019T2355Z"),
+        log_key("2026/10/20", "20261020T0000Z"),
+        log_key("2026/10/20", "20261020T0005Z"),
+        log_key("2026/10/20", "20261020T0010Z"),
+    ]
+    s3 = FakeS3(dict.fromkeys(keys, b""))
+
+    selected = list(
+        alb_logs.log_keys(
+            s3,
+            "logs",
+            "pmm",
+            "123",
+            "us-west-2",
+            datetime(2026, 10, 19, 23, 50, tzinfo=timezone.utc),
+            datetime(2026, 10, 20, 0, 0, tzinfo=timezone.utc),
+        )
+    )
+
+    assert selected == keys[1:4]
+    assert len(s3.listed) == 2
+
+
+def test_s3_lines_keeps_key_order():
+    keys = [f"k{i}" for i in range(5)]
+    s3 = FakeS3({key: gzip.compress(f"{key}-1\n{key}-2\n".encode()) for key in keys})
+
+    lines = list(alb_logs.s3_lines(s3, "logs", keys, max_workers=2))
+
+    assert lines == [f"{key}-{n}" for key in keys for n in (1, 2)]
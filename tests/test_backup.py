@@ -0,0 +1,270 @@
+"""Tests for the on-demand backup tool (pmm_tools.backup)."""
+
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from pmm_tools import backup
+
+ROLE_ARN = "arn:aws:iam::123456789012:role/pmm-backup-abc"
+T0 = datetime(2026, 10, 1, 5, 0, tzinfo=timezone.utc)
+
+
+class Clock:
+    """Replaces monotonic() and sleep() in pmm_tools.backup."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(backup, "monotonic", fake.monotonic)
+    monkeypatch.setattr(backup, "sleep", fake.sleep)
+    return fake
+
+
+class FakeBackup:
+    """AWS Backup client; a job finishes after ``polls`` describes."""
+
+    def __init__(self, clock, polls=3, failing=()):
+        self.clock = clock
+        self.polls = polls
+        self.failing = set(failing)
+        self.started = []
+        self.restores = []
+        self._describes = {}
+
+    def get_paginator(self, name):
+        assert name == "list_recovery_points_by_resource"
+        return self
+
+    def paginate(self, ResourceArn):
+        yield {
+            "RecoveryPoints": [
+                {"Status": "COMPLETED", "CreationDate": T0 - timedelta(hours=30)},
+                {"Status": "COMPLETED", "CreationDate": T0 - timedelta(hours=6)},
+                {"Status": "EXPIRED", "CreationDate": T0 - timedelta(hours=1)},
+            ]
+        }
+
+    def start_backup_job(self, **kwargs):
+        self.started.append(kwargs)
+        return {"BackupJobId": f"b-{kwargs['ResourceArn'].rsplit('/', 1)[-1]}"}
+
+    def describe_backup_job(self, BackupJobId):
+        count = self._describes[BackupJobId] = self._describes.get(BackupJobId, 0) + 1
+        volume_id = BackupJobId[2:]
+        if count < self.polls:
+            return {"BackupJobId": BackupJobId, "State": "RUNNING"}
+        if volume_id in self.failing:
+            return {"State": "FAILED", "StatusMessage": "snapshot limit exceeded"}
+        return {
+            "State": "COMPLETED",
+            "CreationDate": T0,
+            "CompletionDate": T0 + timedelta(minutes=12),
+            "BackupSizeInBytes": 100 * 2**30,
+            "RecoveryPointArn": f"arn:aws:ec2:us-west-2::snapshot/snap-{volume_id}",
+        }
+
+    def get_recovery_point_restore_metadata(self, BackupVaultName, RecoveryPointArn):
+        return {
+            "RestoreMetadata": {"availabilityZone": "us-west-2a", "volumeSize": "100"}
+        }
+
+    def start_restore_job(self, **kwargs):
+        self.restores.append(kwargs)
+        return {"RestoreJobId": f"r-{kwargs['RecoveryPointArn'].rsplit('-', 1)[-1]}"}
+
+    def describe_restore_job(self, RestoreJobId):
+        volume_id = f"vol-scratch{RestoreJobId[2:]}"
+        return {
+            "Status": "COMPLETED",
+            "CreationDate": T0,
+            "CompletionDate": T0 + timedelta(minutes=3),
+            "CreatedResourceArn": f"arn:aws:ec2:us-west-2:1:volume/{volume_id}",
+        }
+
+
+class FakeEC2:
+    """EC2 client; scratch volumes have ``scratch_size`` GiB, originals 100."""
+
+    def __init__(self, scratch_size=100, wait_error=None):
+        self.scratch_size = scratch_size
+        self.wait_error = wait_error
+        self.deleted = []
+
+    def describe_volumes(self, VolumeIds):
+        return {
+            "Volumes": [
+                {
+                    "VolumeId": volume_id,
+                    "Size": self.scratch_size if "scratch" in volume_id else 100,
+                }
+                for volume_id in VolumeIds
+            ]
+        }
+
+    def get_waiter(self, name):
+        assert name == "volume_available"
+        return self
+
+    def wait(self, VolumeIds):
+        if self.wait_error:
+            raise self.wait_error
+
+    def delete_volume(self, VolumeId):
+        self.deleted.append(VolumeId)
+
+
+def test_wait_for_jobs_backs_off_until_done(clock):
+    states = {"a": iter(["RUNNING"] * 5 + ["COMPLETED"]), "b": iter(["COMPLETED"])}
+
+    jobs = backup.wait_for_jobs(
+        lambda job_id: {"State": next(states[job_id])},
+        ["a", "b"],
+        "State",
+        backup.BACKUP_DONE,
+        timeout=3600,
+        initial_delay=10,
+        max_delay=60,
+    )
+
+    assert jobs == {"a": {"State": "COMPLETED"}, "b": {"State": "COMPLETED"}}
+    assert clock.sleeps == [10, 20, 40, 60, 60]
+
+
+def test_wait_for_jobs_stops_at_deadline(clock):
+    jobs = backup.wait_for_jobs(
+        lambda job_id: {"State": "RUNNING"},
+        ["a"],
+        "State",
+        backup.BACKUP_DONE,
+        timeout=100,
+        initial_delay=30,
+    )
+
+    assert jobs == {"a": {"State": "RUNNING"}}
+    assert clock.now == 100
+
+
+def test_back_up_starts_all_jobs_before_polling(clock, monkeypatch):
+    client = FakeBackup(clock, failing={"vol-root"})
+    monkeypatch.setattr(
+        backup, "datetime", type("FrozenDatetime", (), {"now": lambda tz: T0})
+    )
+
+    results = backup.back_up(
+        client, "pmm-vault", ROLE_ARN, ["vol-data", "vol-root"], "us-west-2"
+    )
+
+    assert [job["ResourceArn"] for job in client.started] == [
+        "arn:aws:ec2:us-west-2:123456789012:volume/vol-data",
+        "arn:aws:ec2:us-west-2:123456789012:volume/vol-root",
+    ]
+    assert {job["IamRoleArn"] for job in client.started} == {ROLE_ARN}
+    # Both jobs ran in parallel: three polls each, two sleeps in total.
+    assert len(clock.sleeps) == 2
+
+    data, root = results
+    assert data.ok
+    assert data.recovery_point_age == 6 * 3600
+    assert data.backup_seconds == 12 * 60
+    assert data.backup_size == 100 * 2**30
+    assert not root.ok
+    assert root.message == "snapshot limit exceeded"
+
+
+def test_verify_restore_times_and_cleans_up(clock):
+    client = FakeBackup(clock, polls=1)
+    ec2 = FakeEC2()
+    results = backup.back_up(client, "v", ROLE_ARN, ["vol-data"], "us-west-2")
+
+    backup.verify_restore(
+        client, ec2, "v", ROLE_ARN, results, availability_zone="us-west-2b"
+    )
+
+    (result,) = results
+    assert client.restores[0]["Metadata"]["availabilityZone"] == "us-west-2b"
+    assert client.restores[0]["ResourceType"] == "EBS"
+    assert result.ok
+    assert result.restore_seconds == 180
+    assert result.restored_volume_id == "vol-scratchdata"
+    assert ec2.deleted == ["vol-scratchdata"]
+
+
+def test_verify_restore_detects_wrong_size(clock):
+    client = FakeBackup(clock, polls=1)
+    ec2 = FakeEC2(scratch_size=8)
+    results = backup.back_up(client, "v", ROLE_ARN, ["vol-data"], "us-west-2")
+
+    backup.verify_restore(client, ec2, "v", ROLE_ARN, results, keep=True)
+
+    assert results[0].restore_state == "FAILED"
+    assert "8 GiB" in results[0].message
+    assert ec2.deleted == []
+
+
+def test_verify_restore_deletes_scratch_volumes_on_error(clock):
+    client = FakeBackup(clock, polls=1)
+    ec2 = FakeEC2(wait_error=RuntimeError("Max attempts exceeded"))
+    results = backup.back_up(client, "v", ROLE_ARN, ["vol-data"], "us-west-2")
+
+    with pytest.raises(RuntimeError):
+        backup.verify_restore(client, ec2, "v", ROLE_ARN, results)
+
+    assert ec2.deleted == ["vol-scratchdata"]
+
+
+def test_main_passes_restore_timeout(monkeypatch):
+    calls = {}
+
+    def fake_back_up(*args, timeout):
+        calls["backup"] = timeout
+        return []
+
+    def fake_verify_restore(*args, timeout, **kwargs):
+        calls["restore"] = timeout
+
+    monkeypatch.setattr(backup, "back_up", fake_back_up)
+    monkeypatch.setattr(backup, "verify_restore", fake_verify_restore)
+    session = SimpleNamespace(region_name="us-west-2", client=lambda name: None)
+    monkeypatch.setattr(
+        backup,
+        "boto3",
+        SimpleNamespace(session=SimpleNamespace(Session=lambda **_: session)),
+    )
+    argv = ["--vault", "v", "--role-arn", ROLE_ARN, "--volume-id", "vol-data"]
+
+    backup.main(argv + ["--test-restore"])
+    assert calls == {
+        "backup": backup.BACKUP_TIMEOUT,
+        "restore": backup.RESTORE_TIMEOUT,
+    }
+
+    backup.main(argv + ["--test-restore", "--timeout", "60", "--restore-timeout", "30"])
+    assert calls == {"backup": 60, "restore": 30}
+
+
+def test_metric_data_skips_unknown_values():
+    result = backup.VolumeBackup(
+        "vol-data", "b-1", "COMPLETED", backup_seconds=720.0, backup_size=10
+    )
+
+    metrics = backup.metric_data([result])
+
+    assert [(m["MetricName"], m["Value"], m["Unit"]) for m in metrics] == [
+        ("BackupDuration", 720.0, "Seconds"),
+        ("BackupSize", 10, "Bytes"),
+    ]
+    assert metrics[0]["Dimensions"] == [{"Name": "VolumeId", "Value": "vol-data"}]
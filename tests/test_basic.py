@@ -4,7 +4,6 @@ import json
 import os
 import shutil
 import time
-from base64 import b64encode
 from os import path as osp
 from textwrap import dedent
 
@@ -14,6 +13,8 @@ from infrahouse_core.timeout import timeout
 from pytest_infrahouse import terraform_apply
 
 from infrahouse_core.aws.asg import ASG
+from pmm_client import PMMClient
+from rds import remote_service_payload, server_agent_id
 
 from tests.conftest import (
     TERRAFORM_ROOT_DIR,
@@ -87,13 +88,6 @@ def validate_backup_creation(
         pytest.fail("Backup did not complete within 10 minutes")
 
 
-def get_pmm_auth_header(username, password):
-    """Generate Basic Auth header for PMM API."""
-    credentials = f"{username}:{password}"
-    encoded = b64encode(credentials.encode()).decode()
-    return {"Authorization": f"Basic {encoded}"}
-
-
 def get_pmm_version(pmm_url):
     """Get PMM server version to determine API paths."""
     try:
@@ -108,41 +102,14 @@ def get_pmm_version(pmm_url):
     return None
 
 
-def list_pmm_services(pmm_url, auth_header):
-    """List all services registered in PMM."""
-    # PMM 3 uses GET /v1/management/services
-    api_url = f"{pmm_url}/v1/management/services"
-    try:
-        LOG.debug("Fetching services from: %s", api_url)
-        response = requests.get(
-            api_url,
-            headers={**auth_header, "Content-Type": "application/json"},
-            timeout=30,
-        )
-        response.raise_for_status()
-        LOG.info("Successfully retrieved services list")
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        LOG.error("Failed to list PMM services: %s", e)
-        return None
-
-
-def check_postgres_in_pmm(pmm_url, auth_header, postgres_address):
+def check_postgres_in_pmm(pmm, postgres_address):
     """Check if PostgreSQL instance is already monitored in PMM."""
-    services = list_pmm_services(pmm_url, auth_header)
-    if not services:
-        return False
-
-    # Check if any PostgreSQL service matches our address
-    for service in services.get("services", []):
-        service_type = service.get("service_type", "").upper()
-        service_address = service.get("address", "")
-
-        # PMM 3 uses "POSTGRESQL_SERVICE" enum value
-        if (
-            service_type in ("POSTGRESQL_SERVICE", "POSTGRESQL")
-            and postgres_address in service_address
-        ):
+    # PMM 3 uses "POSTGRESQL_SERVICE" enum value
+    for service in pmm.services:
+        if service.get("service_type", "").upper() in (
+            "POSTGRESQL_SERVICE",
+            "POSTGRESQL",
+        ) and postgres_address in service.get("address", ""):
             LOG.info(
                 "PostgreSQL instance already registered: %s",
                 service.get("service_name"),
@@ -151,52 +118,8 @@ def check_postgres_in_pmm(pmm_url, auth_header, postgres_address):
     return False
 
 
-def get_pmm_server_agent_id(pmm_url, auth_header):
-    """Get the PMM server's agent ID."""
-    try:
-        # Use /v1/inventory/agents to list all PMM agents
-        # Filter for AGENT_TYPE_PMM_AGENT
-        agents_url = f"{pmm_url}/v1/inventory/agents"
-        params = {"agent_type": "AGENT_TYPE_PMM_AGENT"}
-
-        response = requests.get(
-            agents_url,
-            headers={**auth_header, "Content-Type": "application/json"},
-            params=params,
-            timeout=30,
-        )
-        response.raise_for_status()
-        agents_data = response.json()
-
-        # PMM agents are in the "pmm_agent" array (note: singular, not plural)
-        pmm_agents = agents_data.get("pmm_agent", [])
-
-        if pmm_agents:
-            # Get the first connected PMM agent
-            for agent in pmm_agents:
-                if agent.get("connected"):
-                    agent_id = agent.get("agent_id")
-                    LOG.info("Found connected PMM agent ID: %s", agent_id)
-                    return agent_id
-
-            # If no connected agents, use the first one
-            agent_id = pmm_agents[0].get("agent_id")
-            LOG.info("Using first PMM agent ID: %s", agent_id)
-            return agent_id
-
-        LOG.warning(
-            "No PMM agents found in response: %s", json.dumps(agents_data, indent=2)
-        )
-
-    except Exception as e:
-        LOG.warning("Could not get PMM agent ID: %s", e)
-
-    return None
-
-
 def add_postgres_to_pmm(
-    pmm_url,
-    auth_header,
+    pmm,
     postgres_address,
     postgres_port,
     postgres_database,
@@ -205,66 +128,32 @@ def add_postgres_to_pmm(
     service_name="test-postgres-rds",
 ):
     """Add PostgreSQL instance to PMM monitoring using PMM 3 API."""
-    # Get PMM agent ID (required for adding services)
-    pmm_agent_id = get_pmm_server_agent_id(pmm_url, auth_header)
-    if not pmm_agent_id:
-        raise RuntimeError("Could not find PMM agent ID")
-
-    # PMM 3 API: POST /v1/management/services with inline node creation
-    add_service_url = f"{pmm_url}/v1/management/services"
-
-    service_payload = {
-        "postgresql": {
-            "service_name": service_name,
-            "address": postgres_address,
-            "port": int(postgres_port),
-            "database": postgres_database,
-            "username": postgres_username,
-            "password": postgres_password,
-            "pmm_agent_id": pmm_agent_id,
-            "qan_postgresql_pgstatements_agent": True,
-            "skip_connection_check": False,
-            "tls": True,
-            "tls_skip_verify": True,
-            "add_node": {
-                "node_type": "NODE_TYPE_REMOTE_NODE",
-                "node_name": f"{service_name}-node",
-                "region": os.environ.get("AWS_DEFAULT_REGION", "us-west-2"),
-            },
-        }
-    }
-
-    LOG.info("Adding PostgreSQL service to PMM with inline remote node...")
-    LOG.debug("Payload: %s", json.dumps(service_payload, indent=2))
-
-    service_response = requests.post(
-        add_service_url,
-        headers={**auth_header, "Content-Type": "application/json"},
-        json=service_payload,
-        timeout=30,
+    payload = remote_service_payload(
+        engine="postgresql",
+        name=service_name,
+        address=postgres_address,
+        port=postgres_port,
+        credentials={"username": postgres_username, "password": postgres_password},
+        pmm_agent_id=server_agent_id(pmm),
+        database=postgres_database,
+        node={
+            "node_name": f"{service_name}-node",
+            "region": os.environ.get("AWS_DEFAULT_REGION", "us-west-2"),
+        },
     )
-
-    LOG.debug("Response status: %d", service_response.status_code)
-    LOG.debug("Response body: %s", service_response.text[:1000])
-
+    LOG.info("Adding PostgreSQL service to PMM with inline remote node...")
     try:
-        service_response.raise_for_status()
-        service_data = service_response.json()
-        LOG.info(
-            "PostgreSQL service added successfully: %s",
-            json.dumps(service_data, indent=2),
-        )
-        return service_data
+        service_data = pmm.add_service(payload)
     except requests.exceptions.HTTPError as e:
-        try:
-            error_detail = service_response.json()
-            LOG.error("PMM API error details: %s", json.dumps(error_detail, indent=2))
-        except Exception:
-            LOG.error("PMM API error response: %s", service_response.text)
         raise RuntimeError(
             f"Failed to add PostgreSQL service: {e}. "
-            f"Response: {service_response.text[:500]}"
-        )
+            f"Response: {e.response.text[:500]}"
+        ) from e
+    LOG.info(
+        "PostgreSQL service added successfully: %s",
+        json.dumps(service_data, indent=2),
+    )
+    return service_data
 
 
 @pytest.mark.parametrize(
@@ -464,17 +353,13 @@ def test_module(
         LOG.info("Checking PMM version...")
         get_pmm_version(pmm_url)
 
-        # Prepare PMM API authentication
-        auth_header = get_pmm_auth_header("admin", admin_password)
+        pmm = PMMClient(base_url=pmm_url, username="admin", password=admin_password)
 
         # Add PostgreSQL to PMM monitoring
-        if not check_postgres_in_pmm(
-            pmm_url, auth_header, postgres["address"]["value"]
-        ):
+        if not check_postgres_in_pmm(pmm, postgres["address"]["value"]):
             LOG.info("Adding PostgreSQL to PMM...")
             add_postgres_to_pmm(
-                pmm_url=pmm_url,
-                auth_header=auth_header,
+                pmm=pmm,
                 postgres_address=postgres["address"]["value"],
                 postgres_port=postgres["port"]["value"],
                 postgres_database=postgres["database_name"]["value"],
@@ -530,12 +415,9 @@ def test_module(
                 try:
                     with timeout(seconds=30):
                         while True:
-                            services = list_pmm_services(pmm_url, auth_header)
                             reconciler_services = [
                                 s
-                                for s in (
-                                    services.get("services", []) if services else []
-                                )
+                                for s in pmm.services
                                 if s.get("service_name", "").startswith(f"{asg_name}/")
                             ]
                             if len(reconciler_services) >= expected_count:
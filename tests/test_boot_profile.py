@@ -0,0 +1,130 @@
+"""Unit tests for the boot profiler (scripts/pmm_boot_profile.py)."""
+
+import pytest
+
+import pmm_boot_profile
+
+BOOT = 1792400000.0
+
+
+def history_entry(image_id, pmm_version, **durations):
+    return {
+        "image_id": image_id,
+        "pmm_version": pmm_version,
+        "boot_time": BOOT,
+        "durations": durations,
+    }
+
+
+def test_boot_time(tmp_path):
+    stat = tmp_path / "stat"
+    stat.write_text("cpu  1 2 3\nbtime 1792400000\nprocesses 42\n")
+
+    assert pmm_boot_profile.boot_time(str(stat)) == BOOT
+
+
+def test_timeline_of_current_boot(tmp_path):
+    markers = tmp_path / "phases.log"
+    markers.write_text(
+        f"{BOOT - 3600} ebs-volume start\n"
+        f"{BOOT - 3500} ebs-volume end\n"
+        f"{BOOT + 20.5} ebs-volume start\n"
+        f"{BOOT + 20.6} ebs-attach start\n"
+        f"{BOOT + 80.6} ebs-attach end\n"
+        f"{BOOT + 82.5} ebs-volume end\n"
+        "garbage\n"
+        f"{BOOT + 90} pmm-ready start\n"
+        f"{BOOT + 150} pmm-ready end\n"
+        f"{BOOT + 151} admin-password start\n"
+    )
+
+    timeline = pmm_boot_profile.build_timeline(
+        pmm_boot_profile.read_markers(str(markers), BOOT), BOOT
+    )
+
+    assert [entry["phase"] for entry in timeline] == [
+        "ebs-volume",
+        "ebs-attach",
+        "pmm-ready",
+        "admin-password",
+    ]
+    assert timeline[0]["start"] == pytest.approx(20.5)
+    assert timeline[0]["duration"] == pytest.approx(62)
+    assert timeline[1]["duration"] == pytest.approx(60)
+    assert timeline[3]["duration"] is None
+    assert pmm_boot_profile.boot_duration(timeline) == pytest.approx(150)
+    assert "did not finish" in pmm_boot_profile.format_timeline(timeline)
+
+
+def test_regression_against_previous_version():
+    history = [
+        history_entry("ami-old", "3.3", **{"install-docker": 100, "pmm-ready": 60}),
+        history_entry("ami-old", "3.4", **{"install-docker": 90, "pmm-ready": 40}),
+        history_entry("ami-old", "3.4", **{"install-docker": 110, "pmm-ready": 50}),
+    ]
+
+    regressions = pmm_boot_profile.find_regressions(
+        {"install-docker": 105, "pmm-ready": 120, "new-phase": 500},
+        history,
+        "ami-new",
+        "3.4",
+    )
+
+    assert regressions == [
+        {
+            "phase": "pmm-ready",
+            "seconds": 120,
+            "baseline": 45,
+            "changed": ["image_id"],
+        }
+    ]
+
+
+def test_no_regression_without_version_change():
+    history = [history_entry("ami-1", "3", **{"pmm-ready": 40})]
+
+    assert (
+        pmm_boot_profile.find_regressions({"pmm-ready": 400}, history, "ami-1", "3")
+        == []
+    )
+
+
+def test_small_increase_is_not_a_regression():
+    history = [history_entry("ami-1", "3", **{"configure-swap": 2})]
+
+    assert (
+        pmm_boot_profile.find_regressions({"configure-swap": 20}, history, "ami-2", "3")
+        == []
+    )
+
+
+def test_history_round_trip(tmp_path):
+    path = str(tmp_path / "history.json")
+    assert pmm_boot_profile.load_history(path) == []
+
+    history = [history_entry(f"ami-{n}", "3") for n in range(5)]
+    pmm_boot_profile.save_history(path, history, size=3)
+
+    assert pmm_boot_profile.load_history(path) == history[-3:]
+
+
+def test_metric_data():
+    timeline = [
+        {"phase": "ebs-attach", "start": 20.0, "duration": 60.0},
+        {"phase": "pmm-ready", "start": 90.0, "duration": 60.0},
+        {"phase": "admin-password", "start": 151.0, "duration": None},
+    ]
+
+    data = pmm_boot_profile.metric_data(timeline, [{"phase": "x"}], "ami-1", "3")
+
+    by_name = {}
+    for entry in data:
+        by_name.setdefault(entry["MetricName"], []).append(entry)
+    assert len(by_name["BootPhaseDuration"]) == 2
+    assert by_name["BootPhaseDuration"][0]["Dimensions"] == [
+        {"Name": "Phase", "Value": "ebs-attach"},
+        {"Name": "ImageId", "Value": "ami-1"},
+        {"Name": "PMMVersion", "Value": "3"},
+    ]
+    assert by_name["BootDuration"][0]["Value"] == 150.0
+    assert by_name["BootRegressions"][0]["Value"] == 1
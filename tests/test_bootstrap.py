@@ -0,0 +1,113 @@
+"""Unit tests for the bootstrap supervisor (scripts/pmm_bootstrap.py)."""
+
+import subprocess
+import threading
+
+import pytest
+
+import pmm_bootstrap
+from pmm_bootstrap import Step
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture(autouse=True)
+def no_markers(monkeypatch):
+    monkeypatch.setattr(pmm_bootstrap, "mark", lambda phase, event: None)
+
+
+def test_independent_steps_run_in_parallel():
+    both_running = threading.Barrier(2, timeout=5)
+    order = []
+
+    def parallel(name):
+        def action():
+            both_running.wait()
+            order.append(name)
+
+        return action
+
+    results = pmm_bootstrap.run_graph(
+        [
+            Step("docker-start", parallel("docker-start")),
+            Step("cloudwatch-agent", parallel("cloudwatch-agent")),
+            Step("pmm-image", lambda: order.append("pmm-image"), ("docker-start",)),
+        ]
+    )
+
+    assert {result["status"] for result in results.values()} == {"ok"}
+    assert order[-1] == "pmm-image"
+
+
+def test_failed_step_skips_dependents_only():
+    ran = []
+
+    def fail():
+        raise subprocess.CalledProcessError(1, "docker pull")
+
+    results = pmm_bootstrap.run_graph(
+        [
+            Step("pmm-image", fail),
+            Step("pmm-server-start", lambda: ran.append("server"), ("pmm-image",)),
+            Step("pmm-ready", lambda: ran.append("ready"), ("pmm-server-start",)),
+            Step("cloudwatch-agent", lambda: ran.append("cloudwatch")),
+        ]
+    )
+
+    assert ran == ["cloudwatch"]
+    assert {name: result["status"] for name, result in results.items()} == {
+        "pmm-image": "failed",
+        "pmm-server-start": "skipped",
+        "pmm-ready": "skipped",
+        "cloudwatch-agent": "ok",
+    }
+
+
+def test_graph_errors():
+    with pytest.raises(ValueError, match="unknown"):
+        pmm_bootstrap.run_graph([Step("a", lambda: None, ("b",))])
+    with pytest.raises(ValueError):
+        pmm_bootstrap.run_graph(
+            [Step("a", lambda: None, ("b",)), Step("b", lambda: None, ("a",))]
+        )
+
+
+def test_wait_until_backs_off(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(pmm_bootstrap, "monotonic", clock.monotonic)
+    monkeypatch.setattr(pmm_bootstrap, "sleep", clock.sleep)
+    answers = iter([False] * 6 + [True])
+
+    pmm_bootstrap.wait_until(lambda: next(answers), timeout=60, max_delay=4)
+
+    assert clock.sleeps == [0.5, 1, 2, 4, 4, 4]
+
+
+def test_wait_until_times_out(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(pmm_bootstrap, "monotonic", clock.monotonic)
+    monkeypatch.setattr(pmm_bootstrap, "sleep", clock.sleep)
+
+    with pytest.raises(TimeoutError):
+        pmm_bootstrap.wait_until(lambda: False, timeout=10)
+    assert clock.now == 10
+
+
+def test_bootstrap_steps_order():
+    steps = {step.name: step for step in pmm_bootstrap.bootstrap_steps("img", 600)}
+
+    assert steps["pmm-ready"].requires == ("pmm-server-start",)
+    assert steps["pmm-server-start"].requires == ("pmm-image",)
+    assert steps["set-pmm-password"].requires == ("pmm-ready",)
+    assert not steps["cloudwatch-agent"].requires
@@ -0,0 +1,152 @@
+"""Tests for the PMM capacity-planning calculator (pmm_tools.capacity)."""
+
+import os
+from os import path as osp
+
+import pytest
+import yaml
+from pmm_client import PMMClient
+
+from pmm_tools import capacity
+from pmm_tools.custom_queries import label_columns, load_custom_queries, value_columns
+
+QUERIES_DIR = osp.join(
+    osp.dirname(__file__), "..", "test_data", "test_basic", "queries"
+)
+
+
+def test_custom_query_columns():
+    queries = load_custom_queries(osp.join(QUERIES_DIR, "pg-low-res.yml"))
+    indexes = queries["pg_stat_user_indexes"]
+    assert label_columns(indexes) == ["datname", "schemaname", "tablename", "indexname"]
+    assert len(value_columns(indexes)) == 5
+
+
+def test_estimate_single_mysql_asg():
+    load = capacity.estimate(
+        {"monitored_asgs": [{"service_type": "mysql", "instances": 3, "tables": 100}]}
+    )
+    node, mysql = capacity.EXPORTER_SERIES["node"], capacity.EXPORTER_SERIES["mysql"]
+    assert load.series["high"] == 3 * (node["high"] + mysql["high"])
+    assert load.series["low"] == 3 * (
+        node["low"] + mysql["low"] + 100 * capacity.SERIES_PER_MYSQL_TABLE
+    )
+    assert load.qan_rows_per_second == pytest.approx(3 * 100 / 60)
+    assert load.samples_per_second == pytest.approx(
+        load.series["high"] / 5 + load.series["medium"] / 10 + load.series["low"] / 60
+    )
+
+
+def test_tablestats_limit_drops_table_series():
+    fleet = {
+        "monitored_asgs": [
+            {
+                "service_type": "mysql",
+                "tables": 5000,
+                "qan": {"disable_tablestats_limit": 1000, "query_source": "none"},
+            }
+        ]
+    }
+    load = capacity.estimate(fleet)
+    assert load.series["low"] == (
+        capacity.EXPORTER_SERIES["node"]["low"]
+        + capacity.EXPORTER_SERIES["mysql"]["low"]
+    )
+    assert load.qan_rows_per_second == 0
+
+
+def test_custom_queries_multiply_by_postgres_services():
+    fleet = {
+        "rds_instances": [{"engine": "postgres", "count": 2, "databases": 1}],
+        "custom_queries": {"low": "pg-low-res.yml", "rows_per_query": 10},
+    }
+    with_queries = capacity.estimate(fleet, base_dir=QUERIES_DIR)
+    without = capacity.estimate({"rds_instances": fleet["rds_instances"]})
+    assert with_queries.series["low"] - without.series["low"] == 2 * 5 * 10
+
+
+@pytest.mark.parametrize(
+    "instances, instance_type",
+    [(1, "m5.large"), (300, "m5.xlarge"), (600, "m5.2xlarge")],
+)
+def test_recommend_instance_type(instances, instance_type):
+    load = capacity.estimate(
+        {"monitored_asgs": [{"service_type": "mysql", "instances": instances}]}
+    )
+    recommendation = capacity.recommend(load)
+    assert recommendation.instance_type == instance_type
+    assert recommendation.ebs_volume_size >= 100
+    assert 125 <= recommendation.ebs_throughput <= 1000
+
+
+def test_recommend_warns_when_fleet_is_too_big():
+    load = capacity.estimate(
+        {"monitored_asgs": [{"service_type": "mysql", "instances": 5000}]}
+    )
+    assert capacity.recommend(load).warnings
+
+
+def test_validate_reports_relative_error():
+    load = capacity.Estimate(series={"high": 1000, "medium": 0, "low": 0})
+    load.samples_per_second = 200
+    report = capacity.validate(
+        load, {"active_series": 800, "samples_per_second": 100}, tolerance=0.5
+    )
+    assert report["active_series"]["error"] == pytest.approx(0.25)
+    assert report["active_series"]["ok"] == 1.0
+    assert report["samples_per_second"]["ok"] == 0.0
+
+
+def test_measure_reads_self_monitoring_queries():
+    class FakePMM:
+        def __init__(self):
+            self.queries = []
+
+        def query(self, query):
+            self.queries.append(query)
+            if "hour_metric_ids" in query:
+                return [{"metric": {}, "value": [1792368000, "1234"]}]
+            return []
+
+    pmm = FakePMM()
+
+    assert capacity.measure(pmm) == {
+        "active_series": 1234.0,
+        "samples_per_second": 0.0,
+    }
+    assert len(pmm.queries) == 2
+
+
+def test_validation_needs_the_admin_password(tmp_path, monkeypatch, capsys):
+    monkeypatch.delenv("PMM_ADMIN_PASSWORD", raising=False)
+    fleet = tmp_path / "fleet.yaml"
+    fleet.write_text("monitored_asgs: [{service_type: mysql, instances: 1}]\n")
+
+    with pytest.raises(SystemExit):
+        capacity.main([str(fleet), "--validate-url", "http://127.0.0.1"])
+
+    assert "--admin-secret or PMM_ADMIN_PASSWORD" in capsys.readouterr().err
+
+
+@pytest.mark.skipif(
+    not os.environ.get("PMM_URL") or not os.environ.get("PMM_FLEET"),
+    reason="set PMM_URL and PMM_FLEET to validate against a running PMM",
+)
+def test_estimate_matches_local_pmm():
+    """
+    Validation benchmark: compare the estimate for PMM_FLEET with what the
+    PMM server at PMM_URL (e.g. a local ``percona/pmm-server:3`` container
+    monitoring that fleet) actually ingests.
+    """
+    with open(os.environ["PMM_FLEET"], encoding="utf-8") as fp:
+        fleet = yaml.safe_load(fp)
+    load = capacity.estimate(fleet, base_dir=osp.dirname(os.environ["PMM_FLEET"]))
+    measured = capacity.measure(
+        PMMClient(
+            os.environ["PMM_URL"],
+            "admin",
+            os.environ.get("PMM_ADMIN_PASSWORD", "admin"),
+        )
+    )
+    report = capacity.validate(load, measured)
+    assert all(item["ok"] for item in report.values()), report
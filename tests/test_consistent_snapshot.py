@@ -0,0 +1,170 @@
+"""Unit tests for the consistent snapshot hook (scripts/pmm_consistent_snapshot.py)."""
+
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import pmm_consistent_snapshot
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(pmm_consistent_snapshot, "monotonic", fake.monotonic)
+    return fake
+
+
+def recording_steps(events, fail_pause=()):
+    def step(name, resumable=True):
+        def pause():
+            if name in fail_pause:
+                raise subprocess.CalledProcessError(1, name)
+            events.append(("pause", name))
+
+        def resume():
+            events.append(("resume", name))
+
+        return (name, pause, resume if resumable else None)
+
+    return [
+        step("victoriametrics", resumable=False),
+        step("clickhouse"),
+        step("filesystem"),
+    ]
+
+
+def test_snapshot_taken_while_paused_and_resumes_in_reverse(clock):
+    events = []
+
+    def snapshot():
+        events.append(("snapshot", None))
+        clock.now += 2
+        return "snap-1"
+
+    result = pmm_consistent_snapshot.consistent_snapshot(
+        recording_steps(events), snapshot
+    )
+
+    assert events == [
+        ("pause", "victoriametrics"),
+        ("pause", "clickhouse"),
+        ("pause", "filesystem"),
+        ("snapshot", None),
+        ("resume", "filesystem"),
+        ("resume", "clickhouse"),
+    ]
+    assert result == {"snapshot_id": "snap-1", "pause_seconds": 2, "consistent": True}
+
+
+def test_failed_pause_still_snapshots_but_not_consistent(clock):
+    events = []
+
+    result = pmm_consistent_snapshot.consistent_snapshot(
+        recording_steps(events, fail_pause={"clickhouse"}), lambda: "snap-1"
+    )
+
+    assert ("resume", "clickhouse") not in events
+    assert ("resume", "filesystem") in events
+    assert result["snapshot_id"] == "snap-1"
+    assert result["consistent"] is False
+
+
+def test_resumes_when_snapshot_fails(clock):
+    events = []
+
+    def snapshot():
+        raise RuntimeError("AccessDenied")
+
+    with pytest.raises(RuntimeError):
+        pmm_consistent_snapshot.consistent_snapshot(recording_steps(events), snapshot)
+
+    assert events[-2:] == [("resume", "filesystem"), ("resume", "clickhouse")]
+
+
+class FakeEC2:
+    """EC2 client with one old and one recent snapshot of the script."""
+
+    def __init__(self, now):
+        self.now = now
+        self.created = []
+        self.deleted = []
+
+    def create_snapshot(self, **kwargs):
+        self.created.append(kwargs)
+        return {"SnapshotId": "snap-new"}
+
+    def get_paginator(self, name):
+        assert name == "describe_snapshots"
+        return self
+
+    def paginate(self, OwnerIds, Filters):
+        assert Filters == [{"Name": "tag:pmm-consistent-snapshot", "Values": ["vol-1"]}]
+        yield {
+            "Snapshots": [
+                {"SnapshotId": "snap-old", "StartTime": self.now - timedelta(days=8)},
+                {
+                    "SnapshotId": "snap-recent",
+                    "StartTime": self.now - timedelta(days=6),
+                },
+            ]
+        }
+
+    def delete_snapshot(self, SnapshotId):
+        self.deleted.append(SnapshotId)
+
+
+def test_take_snapshot_tags_it():
+    ec2 = FakeEC2(datetime(2026, 10, 1, 5, tzinfo=timezone.utc))
+
+    assert (
+        pmm_consistent_snapshot.take_snapshot(ec2, "vol-1", {"Type": "daily-backup"})
+        == "snap-new"
+    )
+    (request,) = ec2.created
+    assert request["VolumeId"] == "vol-1"
+    assert request["TagSpecifications"] == [
+        {
+            "ResourceType": "snapshot",
+            "Tags": [
+                {"Key": "Type", "Value": "daily-backup"},
+                {"Key": "pmm-consistent-snapshot", "Value": "vol-1"},
+            ],
+        }
+    ]
+
+
+def test_expire_snapshots():
+    now = datetime(2026, 10, 1, 5, tzinfo=timezone.utc)
+    ec2 = FakeEC2(now)
+
+    assert pmm_consistent_snapshot.expire_snapshots(ec2, "vol-1", 7, now) == [
+        "snap-old"
+    ]
+    assert ec2.deleted == ["snap-old"]
+
+
+def test_metric_data_reports_failed_runs():
+    (failed,) = pmm_consistent_snapshot.metric_data("vol-1", False, None)
+    assert failed["MetricName"] == "QuiesceSnapshotSuccess"
+    assert failed["Value"] == 0
+    assert failed["Dimensions"] == [{"Name": "VolumeId", "Value": "vol-1"}]
+
+    metrics = pmm_consistent_snapshot.metric_data(
+        "vol-1",
+        True,
+        {"snapshot_id": "snap-1", "pause_seconds": 1.5, "consistent": True},
+    )
+    assert {m["MetricName"]: m["Value"] for m in metrics} == {
+        "QuiesceSnapshotSuccess": 1,
+        "QuiescePause": 1.5,
+        "QuiesceConsistent": 1,
+    }
@@ -0,0 +1,61 @@
+"""Unit tests for day-partitioned S3 keys (lambda/pmm_reconciler/daykeys.py)."""
+
+from datetime import datetime, timedelta, timezone
+
+from daykeys import day_keys, parse_time
+
+
+class FakeS3:
+    """Lists ``keys``, recording the prefixes it was asked for."""
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.prefixes = []
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        self.prefixes.append(Prefix)
+        yield {
+            "Contents": [{"Key": key} for key in self.keys if key.startswith(Prefix)]
+        }
+
+
+def test_day_keys_lists_only_the_days_of_the_range():
+    s3 = FakeS3(
+        [
+            "logs/2026/10/17/b",
+            "logs/2026/10/17/a",
+            "logs/2026/10/18/skip",
+            "logs/2026/10/18/c",
+            "logs/2026/10/19/d",
+        ]
+    )
+    start = datetime(2026, 10, 17, 23, 0, tzinfo=timezone.utc)
+    # 2026-10-18 in UTC.
+    end = datetime(2026, 10, 18, 20, 0, tzinfo=timezone(timedelta(hours=-2)))
+
+    keys = day_keys(s3, "bucket", start, end, lambda key: "skip" not in key, "logs/")
+
+    assert list(keys) == ["logs/2026/10/17/a", "logs/2026/10/17/b", "logs/2026/10/18/c"]
+    assert s3.prefixes == ["logs/2026/10/17/", "logs/2026/10/18/"]
+
+
+def test_day_keys_formats_the_day():
+    s3 = FakeS3(["archive/date=2026-10-18/a"])
+    moment = datetime(2026, 10, 18, tzinfo=timezone.utc)
+
+    keys = day_keys(
+        s3, "bucket", moment, moment, bool, "archive/", day_format="date=%Y-%m-%d/"
+    )
+
+    assert list(keys) == ["archive/date=2026-10-18/a"]
+
+
+def test_parse_time_defaults_to_utc():
+    assert parse_time("2026-10-18T12:00") == datetime(
+        2026, 10, 18, 12, 0, tzinfo=timezone.utc
+    )
+    assert parse_time("2026-10-18T12:00+02:00").utcoffset() == timedelta(hours=2)
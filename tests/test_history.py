@@ -0,0 +1,194 @@
+"""Unit tests for the reconciler run history (lambda/pmm_reconciler/history.py)."""
+
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import history
+from history import FileHistoryStore, PhaseTimer, S3HistoryStore
+from pmm_tools import reconciler_history
+
+T0 = datetime(2026, 10, 18, 12, 0, tzinfo=timezone.utc)
+
+
+def record(started_at, duration, checked, failures=0, ssm_p95=None):
+    return {
+        "version": 1,
+        "started_at": started_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "duration": duration,
+        "timeout": 300,
+        "phases": {"setup": 1.0, "asg:db": duration - 1.0},
+        "counts": {"checked": checked, "added": 1, "removed": 0},
+        "failures": failures,
+        "ssm": (
+            {"probe": {"count": checked, "errors": 0, "p95_ms": ssm_p95}}
+            if ssm_p95 is not None
+            else {}
+        ),
+        "pmm_api": {},
+    }
+
+
+def test_phase_timer_and_make_record(monkeypatch):
+    ticks = iter([0.0, 2.0, 5.0, 6.0, 7.5])
+    monkeypatch.setattr(history, "perf_counter", lambda: next(ticks))
+    timer = PhaseTimer()
+    timer.lap("setup")
+    timer.lap("asg:db")
+    timer.lap("setup")
+
+    rec = history.make_record(
+        timer, 300, {"checked": 3}, ["db: boom"], {"probe": {}}, {}
+    )
+
+    assert rec["phases"] == {"setup": 3.0, "asg:db": 3.0}
+    assert rec["duration"] == 7.5
+    assert rec["failures"] == 1
+    assert rec["counts"] == {"checked": 3}
+
+
+def test_file_store_round_trip(tmp_path):
+    store = FileHistoryStore(str(tmp_path / "history.jsonl"))
+    assert store.query(T0, T0 + timedelta(days=1)) == []
+    runs = [record(T0 + timedelta(minutes=5 * n), 10.0 + n, 10) for n in range(3)]
+    for run in reversed(runs):
+        store.append(run)
+
+    assert store.query(T0 + timedelta(minutes=1), T0 + timedelta(days=1)) == runs[1:]
+
+    store.append({**runs[0], "version": 99})
+    with pytest.raises(ValueError, match="version"):
+        store.query(T0, T0 + timedelta(days=1))
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        return {"Body": type("B", (), {"read": lambda _: self.objects[Key]})()}
+
+    def get_paginator(self, name):
+        s3 = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {
+                    "Contents": [
+                        {"Key": key}
+                        for key in sorted(s3.objects)
+                        if key.startswith(Prefix)
+                    ]
+                }
+
+        return Paginator()
+
+
+def test_s3_store_queries_across_days():
+    store = S3HistoryStore(FakeS3(), "bucket", workers=2)
+    runs = [record(T0 + timedelta(hours=6 * n), 10.0, 10) for n in range(5)]
+    keys = [store.append(run) for run in runs]
+
+    assert keys[0] == "2026/10/18/2026-10-18T12:00:00Z.json"
+    assert store.query(T0 + timedelta(hours=1), T0 + timedelta(hours=18)) == runs[1:4]
+
+
+def test_trends():
+    runs = [
+        record(T0, 20.0, 100, ssm_p95=800.0),
+        record(T0 + timedelta(minutes=5), 30.0, 100, failures=1, ssm_p95=1200.0),
+        record(T0 + timedelta(days=1), 60.0, 200),
+    ]
+
+    rows = history.trends(runs)
+
+    assert rows == [
+        {
+            "start": "2026-10-18T00:00:00Z",
+            "runs": 2,
+            "failures": 1,
+            "duration_p50": 20.0,
+            "duration_p95": 20.0,
+            "duration_max": 30.0,
+            "timeout_usage": 10.0,
+            "instances": 100,
+            "ssm_p95_ms": 1200.0,
+        },
+        {
+            "start": "2026-10-19T00:00:00Z",
+            "runs": 1,
+            "failures": 0,
+            "duration_p50": 60.0,
+            "duration_p95": 60.0,
+            "duration_max": 60.0,
+            "timeout_usage": 20.0,
+            "instances": 200,
+            "ssm_p95_ms": None,
+        },
+    ]
+
+
+def test_forecast():
+    runs = [
+        record(T0 + timedelta(days=n), 10.0 + 0.2 * checked, checked)
+        for n, checked in enumerate((100, 200, 300))
+    ]
+
+    result = history.forecast(runs)
+
+    assert result["seconds_per_instance"] == pytest.approx(0.2)
+    assert result["base_seconds"] == pytest.approx(10.0)
+    assert result["instances"] == 300
+    # 0.8 * 300 s = 10 s + 0.2 s * 1150 instances
+    assert result["max_instances"] == 1150
+    assert history.forecast(runs[:1]) is None
+    assert history.forecast([record(T0, 50.0, 100), record(T0, 10.0, 200)]) is None
+
+
+def test_metric_data():
+    metrics = history.metric_data(record(T0, 30.0, 100, ssm_p95=900.0), "fn")
+
+    by_name = {(m["MetricName"], len(m["Dimensions"])): m for m in metrics}
+    assert by_name[("TimeoutUsage", 1)]["Value"] == 10.0
+    assert by_name[("InstancesChecked", 1)]["Value"] == 100
+    assert by_name[("SSMLatencyP95", 2)]["Dimensions"][1] == {
+        "Name": "Operation",
+        "Value": "probe",
+    }
+    assert json.dumps(metrics)
+    assert sorted(
+        m["Dimensions"][1]["Value"]
+        for m in metrics
+        if m["MetricName"] == "PhaseDuration"
+    ) == ["asg", "setup"]
+
+
+def test_metric_data_adds_up_asg_phases():
+    run = record(T0, 30.0, 100)
+    run["phases"] = {"setup": 1.0, "asg:db1": 2.0, "asg:db2": 3.5, "rds": 1.0}
+
+    phases = {
+        m["Dimensions"][1]["Value"]: m["Value"]
+        for m in history.metric_data(run, "fn")
+        if m["MetricName"] == "PhaseDuration"
+    }
+
+    assert phases == {"setup": 1.0, "asg": 5.5, "rds": 1.0}
+
+
+def test_reconciler_history_report(tmp_path, capsys):
+    path = tmp_path / "history.jsonl"
+    store = FileHistoryStore(str(path))
+    for n, checked in enumerate((100, 200)):
+        store.append(record(T0 + timedelta(days=n), 10.0 + 0.2 * checked, checked))
+
+    argv = ["--file", str(path), "--start", "2026-10-18", "--end", "2026-10-20"]
+    assert reconciler_history.main(argv) == 0
+
+    report = capsys.readouterr().out
+    assert "2026-10-19T00:00:00Z" in report
+    assert "80% of the timeout at 1150 instances" in report
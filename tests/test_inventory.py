@@ -0,0 +1,186 @@
+"""Unit tests for inventory snapshots (lambda/pmm_reconciler/inventory.py)."""
+
+from datetime import datetime, timezone
+
+import pytest
+
+import inventory
+from pmm_tools import churn
+
+T0 = datetime(2026, 10, 18, 12, 0, tzinfo=timezone.utc)
+T1 = datetime(2026, 10, 18, 12, 5, tzinfo=timezone.utc)
+
+
+def service(service_id, name, node_id="n1", port=3306):
+    return {
+        "service_id": service_id,
+        "service_name": name,
+        "service_type": "MYSQL_SERVICE",
+        "node_id": node_id,
+        "address": "10.0.0.1",
+        "port": port,
+        "cluster": "",
+        "custom_labels": {"ignored": "yes"},
+    }
+
+
+def snapshot(services, asgs=None, taken_at=T0, agents=None):
+    return inventory.take_snapshot(
+        services,
+        [{"node_id": "n1", "node_name": "db-node", "node_type": "GENERIC_NODE"}],
+        agents or {"mysqld_exporter": [{"agent_id": "a1", "service_id": "s1"}]},
+        asgs or {},
+        taken_at=taken_at,
+    )
+
+
+def test_take_snapshot_is_compact_and_keyed_by_id():
+    snap = snapshot([service("s1", "db/ip-1")], {"db": {"i-1": "ip-1"}})
+
+    assert snap == {
+        "version": 1,
+        "taken_at": "2026-10-18T12:00:00Z",
+        "services": {
+            "s1": {
+                "name": "db/ip-1",
+                "type": "MYSQL_SERVICE",
+                "node_id": "n1",
+                "address": "10.0.0.1",
+                "port": 3306,
+            }
+        },
+        "nodes": {"n1": {"name": "db-node", "type": "GENERIC_NODE"}},
+        "agents": {"a1": {"type": "mysqld_exporter", "service_id": "s1"}},
+        "asgs": {"db": {"i-1": "ip-1"}},
+    }
+
+
+def test_diff_finds_every_kind_of_change():
+    old = snapshot(
+        [
+            service("s1", "db/ip-1"),
+            service("s2", "db/ip-2"),
+            service("s3", "db/ip-3"),
+        ],
+        {"db": {"i-1": "ip-1", "i-2": "ip-2", "i-3": "ip-3"}},
+    )
+    new = snapshot(
+        [
+            service("s1", "db/ip-1", port=3307),
+            service("s4", "db/ip-2"),
+            service("s5", "db/ip-5"),
+        ],
+        {"db": {"i-1": "ip-1", "i-2": "ip-2", "i-5": "ip-5"}, "new": {"i-9": "ip-9"}},
+        taken_at=T1,
+    )
+
+    changes = inventory.diff(old, new)
+
+    assert [item["id"] for item in changes["services"]["added"]] == ["s5"]
+    assert [item["id"] for item in changes["services"]["removed"]] == ["s3"]
+    assert changes["services"]["changed"] == [
+        {"id": "s1", "changes": {"port": [3306, 3307]}}
+    ]
+    assert changes["services"]["replaced"] == [
+        {"name": "db/ip-2", "old_id": "s2", "new_id": "s4"}
+    ]
+    assert changes["asgs"] == {
+        "db": {"launched": ["i-5"], "terminated": ["i-3"]},
+        "new": {"launched": ["i-9"], "terminated": []},
+    }
+    assert inventory.summarize(changes) == {
+        "services_added": 1,
+        "services_removed": 1,
+        "services_changed": 1,
+        "services_replaced": 1,
+        "instances_launched": 2,
+        "instances_terminated": 1,
+    }
+    assert inventory.summarize(inventory.diff(new, new)) == {}
+
+
+def test_group_by_asg():
+    services = [
+        service("s1", "db/ip-1"),
+        service("s2", "team/db/ip-2"),
+        service("s3", "rds/orders/orders-1"),
+        service("s4", "standalone"),
+    ]
+
+    groups = inventory.group_by_asg(services, ["db", "team/db", "empty"])
+
+    assert {name: [s["service_id"] for s in svcs] for name, svcs in groups.items()} == {
+        "db": ["s1"],
+        "team/db": ["s2"],
+        "empty": [],
+    }
+
+
+def test_round_trip_and_version_check():
+    snap = snapshot([service("s1", "db/ip-1")])
+
+    assert inventory.loads(inventory.dumps(snap)) == snap
+    assert inventory.snapshot_key(snap) == "2026/10/18/2026-10-18T12:00:00Z.json.gz"
+    with pytest.raises(ValueError, match="version"):
+        inventory.loads(inventory.dumps({**snap, "version": 99}))
+
+
+class FakeS3:
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {"Body": type("B", (), {"read": lambda _: self.objects[Key]})()}
+
+    def get_paginator(self, name):
+        s3 = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {
+                    "Contents": [
+                        {"Key": key}
+                        for key in sorted(s3.objects, reverse=True)
+                        if key.startswith(Prefix)
+                    ]
+                }
+
+        return Paginator()
+
+
+def test_save_and_history():
+    s3 = FakeS3()
+    assert inventory.load_latest(s3, "bucket") is None
+    runs = [
+        snapshot([service("s1", "db/ip-1")], taken_at=T0),
+        snapshot([service("s2", "db/ip-1")], taken_at=T1),
+        snapshot(
+            [service("s2", "db/ip-1")],
+            taken_at=datetime(2026, 10, 19, 0, 0, tzinfo=timezone.utc),
+        ),
+    ]
+    for run in runs:
+        inventory.save(s3, "bucket", run)
+
+    assert inventory.load_latest(s3, "bucket") == runs[-1]
+    keys = list(
+        churn.snapshot_keys(
+            s3, "bucket", T0, datetime(2026, 10, 19, 1, tzinfo=timezone.utc)
+        )
+    )
+    assert keys == [inventory.snapshot_key(run) for run in runs]
+
+    rows, services = churn.history(churn.s3_snapshots(s3, "bucket", keys, workers=1))
+
+    assert rows == [("2026-10-18T12:05:00Z", {"services_replaced": 1})]
+    assert services == {"db/ip-1": 1}
+    assert "TOTAL  services_replaced=1" in churn.format_history(rows, services)
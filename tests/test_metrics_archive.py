@@ -0,0 +1,202 @@
+"""Tests for the S3 metrics archive (pmm_tools.metrics_archive)."""
+
+import io
+import json
+from base64 import b64encode
+from datetime import datetime, timezone
+
+import pyarrow.parquet as pq
+import pytest
+import requests
+from botocore.exceptions import ClientError
+
+from pmm_client import PMMClient
+from pmm_tools import metrics_archive
+
+HOUR = 3600
+# 2026-10-19 00:00:00 UTC
+DAY = 1792368000
+
+
+class FakeS3:
+    """In-memory S3 bucket."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body
+
+    def upload_file(self, Filename, Bucket, Key):
+        with open(Filename, "rb") as fp:
+            self.objects[(Bucket, Key)] = fp.read()
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        yield {
+            "Contents": [
+                {"Key": key}
+                for bucket, key in sorted(self.objects)
+                if bucket == Bucket and key.startswith(Prefix)
+            ]
+        }
+
+
+class FakeVictoriaMetrics:
+    """Export API with two series sampled every 15 minutes.
+
+    Replaces the ``requests.Session`` of a :class:`PMMClient`.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, headers, timeout, params, stream):
+        assert (method, url) == (
+            "GET",
+            "https://pmm.example.com/prometheus/api/v1/export",
+        )
+        assert headers["Authorization"] == "Basic " + b64encode(b"admin:pw").decode()
+        assert stream
+        self.requests.append(params)
+        start = int(params["start"])
+        end = float(params["end"])
+        times = [t for t in range(start, int(end) + 1, 900) if t <= end]
+        lines = [
+            json.dumps(
+                {
+                    "metric": {"__name__": name, "instance": "db-1", "job": "node"},
+                    "values": [value] * len(times),
+                    "timestamps": [t * 1000 for t in times],
+                }
+            )
+            for name, value in (("node_load1", 0.5), ("up", 1))
+        ]
+        response = requests.Response()
+        response.status_code = 200
+        response._content = ("\n".join(lines) + "\n").encode()
+        response._content_consumed = True
+        return response
+
+
+def make_pmm(vm):
+    pmm = PMMClient("https://pmm.example.com", "admin", "pw")
+    pmm._session = vm
+    return pmm
+
+
+def run_export(s3, vm, now, **kwargs):
+    return metrics_archive.export(make_pmm(vm), s3, "archive", now=now, **kwargs)
+
+
+def test_shards_are_aligned_and_complete():
+    assert metrics_archive.shards(DAY + 1800, DAY + 3 * HOUR + 10) == [
+        (DAY, DAY + HOUR),
+        (DAY + HOUR, DAY + 2 * HOUR),
+        (DAY + 2 * HOUR, DAY + 3 * HOUR),
+    ]
+    assert metrics_archive.shards(DAY, DAY + HOUR - 1) == []
+
+
+def test_shard_key_round_trip():
+    key = metrics_archive.shard_key("metrics", DAY + 13 * HOUR, HOUR)
+
+    assert key == "metrics/date=2026-10-19/130000-3600s.parquet"
+    assert metrics_archive.parse_shard_key(key) == (DAY + 13 * HOUR, DAY + 14 * HOUR)
+
+
+def test_export_is_incremental():
+    s3, vm = FakeS3(), FakeVictoriaMetrics()
+
+    first = run_export(s3, vm, now=DAY + 3 * HOUR + 300, initial_lookback=2 * HOUR)
+    # The next shard is not complete yet.
+    assert run_export(s3, vm, now=DAY + 3 * HOUR + 900) == []
+    second = run_export(s3, vm, now=DAY + 4 * HOUR + 600)
+
+    assert [shard["key"] for shard in first] == [
+        "metrics/date=2026-10-19/010000-3600s.parquet",
+        "metrics/date=2026-10-19/020000-3600s.parquet",
+    ]
+    assert [shard["key"] for shard in second] == [
+        "metrics/date=2026-10-19/030000-3600s.parquet"
+    ]
+    # Four samples per series and hour; the shard end is exclusive.
+    assert {shard["rows"] for shard in first + second} == {8}
+    assert first[0]["bytes"] == len(s3.objects[("archive", first[0]["key"])])
+    assert vm.requests[0]["start"] == str(DAY + HOUR)
+    assert vm.requests[0]["end"] == f"{DAY + 2 * HOUR - 0.001:.3f}"
+    assert metrics_archive.read_watermark(s3, "archive", "metrics") == DAY + 4 * HOUR
+
+
+def test_fetch_shard_writes_a_batch_per_series_group():
+    sink = io.BytesIO()
+
+    rows = metrics_archive.fetch_shard(
+        make_pmm(FakeVictoriaMetrics()),
+        [metrics_archive.DEFAULT_MATCH],
+        DAY,
+        DAY + HOUR,
+        sink,
+        batch_series=1,
+    )
+
+    parquet = pq.ParquetFile(io.BytesIO(sink.getvalue()))
+    assert rows == 8
+    assert parquet.metadata.num_row_groups == 2
+    assert parquet.schema_arrow == metrics_archive.SCHEMA
+    assert [row["metric"] for row in parquet.read().to_pylist()] == [
+        "node_load1"
+    ] * 4 + ["up"] * 4
+
+
+def test_read_archive_filters_time_and_metric():
+    s3, vm = FakeS3(), FakeVictoriaMetrics()
+    run_export(s3, vm, now=DAY + 4 * HOUR + 300, initial_lookback=4 * HOUR)
+
+    table = metrics_archive.read_archive(
+        s3,
+        "archive",
+        datetime.fromtimestamp(DAY + HOUR + 1800, timezone.utc),
+        datetime.fromtimestamp(DAY + 3 * HOUR, timezone.utc),
+        metrics=["node_load1"],
+    )
+
+    rows = table.to_pylist()
+    assert len(rows) == 6
+    assert {row["metric"] for row in rows} == {"node_load1"}
+    assert rows[0]["labels"] == [("instance", "db-1"), ("job", "node")]
+    assert rows[0]["timestamp"] == datetime.fromtimestamp(
+        DAY + HOUR + 1800, timezone.utc
+    )
+    assert rows[0]["value"] == pytest.approx(0.5)
+
+
+def test_read_archive_empty_range():
+    table = metrics_archive.read_archive(
+        FakeS3(),
+        "archive",
+        datetime(2026, 1, 1, tzinfo=timezone.utc),
+        datetime(2026, 1, 2, tzinfo=timezone.utc),
+    )
+
+    assert table.num_rows == 0
+    assert table.schema == metrics_archive.SCHEMA
+
+
+def test_export_needs_the_admin_password(monkeypatch, capsys):
+    monkeypatch.delenv("PMM_ADMIN_PASSWORD", raising=False)
+
+    with pytest.raises(SystemExit):
+        metrics_archive.main(
+            ["export", "--pmm-url", "https://pmm.example.com", "--bucket", "b"]
+        )
+
+    assert "--admin-secret or PMM_ADMIN_PASSWORD" in capsys.readouterr().err
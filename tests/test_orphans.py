@@ -0,0 +1,177 @@
+"""Unit tests for orphaned node collection (lambda/pmm_reconciler/orphans.py)."""
+
+import pytest
+import requests
+
+import orphans
+from orphans import Orphan, OrphanCollector
+
+NODES = [
+    {"node_id": "pmm-server", "node_name": "pmm-server", "address": "127.0.0.1"},
+    {"node_id": "n-live", "node_name": "ip-10-0-0-1", "address": "10.0.0.1"},
+    {"node_id": "n-gone", "node_name": "ip-10-0-0-2", "address": "10.0.0.2"},
+    {"node_id": "n-empty", "node_name": "ip-10-0-0-3", "address": "10.0.0.3"},
+    {"node_id": "n-rds", "node_name": "rds/orders/orders-1", "address": ""},
+    {"node_id": "n-manual", "node_name": "backup-host", "address": "10.9.0.1"},
+]
+SERVICES = [
+    {"service_id": "s-live", "service_name": "db/ip-10-0-0-1", "node_id": "n-live"},
+    {"service_id": "s-gone", "service_name": "db/ip-10-0-0-2", "node_id": "n-gone"},
+    {"service_id": "s-rds", "service_name": "rds/orders/orders-1", "node_id": "n-rds"},
+    {"service_id": "s-manual", "service_name": "backup-db", "node_id": "n-manual"},
+]
+AGENTS = {
+    "pmm_agent": [
+        {"agent_id": "pa-server", "runs_on_node_id": "pmm-server", "connected": True},
+        {"agent_id": "pa-live", "runs_on_node_id": "n-live", "connected": True},
+        {"agent_id": "pa-gone", "runs_on_node_id": "n-gone", "connected": False},
+        {"agent_id": "pa-dangling", "runs_on_node_id": "n-deleted"},
+    ],
+    "node_exporter": [
+        {"agent_id": "ne-live", "pmm_agent_id": "pa-live", "node_id": "n-live"},
+        {"agent_id": "ne-gone", "pmm_agent_id": "pa-gone", "node_id": "n-gone"},
+        {"agent_id": "ne-dangling", "pmm_agent_id": "pa-dangling"},
+    ],
+    "mysqld_exporter": [
+        {"agent_id": "me-gone", "pmm_agent_id": "pa-gone", "service_id": "s-gone"},
+        {"agent_id": "me-manual", "pmm_agent_id": "pa-x", "service_id": "s-manual"},
+    ],
+    "qan_mysql_perfschema_agent": [
+        {"agent_id": "qan-gone", "pmm_agent_id": "pa-gone", "service_id": "s-gone"}
+    ],
+}
+
+
+def test_find_orphans():
+    managed = orphans.managed_nodes(SERVICES, ["db"])
+
+    found = orphans.find_orphans(NODES, AGENTS, SERVICES, managed, {"10.0.0.1"})
+
+    assert managed == {"n-live", "n-gone"}
+    # The RDS and manually added nodes have services and are not managed;
+    # the server node is never an orphan.
+    assert found == [
+        Orphan("n-gone", "ip-10-0-0-2", "instance-gone"),
+        Orphan("n-empty", "ip-10-0-0-3", "unused"),
+    ]
+    assert orphans.dangling_agents(NODES, AGENTS) == ["pa-dangling"]
+
+
+def test_select_due_waits_for_min_age_and_caps_deletions():
+    found = [Orphan("a", "a", "unused"), Orphan("b", "b", "unused")]
+
+    due, seen = orphans.select_due(found, {}, 1000, 600, 10)
+    assert due == [] and seen == {"a": 1000, "b": 1000}
+
+    due, seen = orphans.select_due(found, {"a": 100, "b": 500, "c": 1}, 1000, 600, 1)
+    # "c" is no longer orphaned and forgotten; "b" is not old enough.
+    assert due == [Orphan("a", "a", "unused")]
+    assert seen == {"a": 100, "b": 500}
+
+
+def test_select_due_tracks_oldest(monkeypatch):
+    monkeypatch.setattr(orphans, "MAX_TRACKED", 2)
+    found = [Orphan(name, name, "unused") for name in "abc"]
+
+    _, seen = orphans.select_due(found, {"c": 1, "b": 2}, 1000, 600, 10)
+
+    assert seen == {"c": 1, "b": 2}
+
+
+class FakePMM:
+    def __init__(self, fail=()):
+        self.agents = AGENTS
+        self.services = SERVICES
+        self.nodes = NODES
+        self.fail = set(fail)
+        self.removed = []
+
+    def _remove(self, ids):
+        results = []
+        for item in ids:
+            if item in self.fail:
+                results.append(requests.exceptions.HTTPError(item))
+            else:
+                self.removed.append(item)
+                results.append(None)
+        return results
+
+    remove_nodes = _remove
+    remove_agents = _remove
+
+
+class FakeEC2:
+    def get_paginator(self, name):
+        class Paginator:
+            def paginate(self, Filters):
+                assert Filters[0]["Values"] == ["10.0.0.1", "10.0.0.2"]
+                yield {
+                    "Reservations": [{"Instances": [{"PrivateIpAddress": "10.0.0.1"}]}]
+                }
+
+        return Paginator()
+
+
+@pytest.fixture
+def collector(monkeypatch):
+    monkeypatch.setattr(orphans.time, "time", lambda: 10_000)
+
+    def make(pmm, first_seen):
+        monkeypatch.setattr(orphans.boto3, "client", lambda *args, **kwargs: None)
+        gc = OrphanCollector(pmm, "param", "us-west-2", min_age=3600, max_deletions=5)
+        gc._ec2 = FakeEC2()
+        gc._first_seen = first_seen
+        return gc
+
+    return make
+
+
+def test_run_removes_due_orphans_and_reports(collector):
+    pmm = FakePMM()
+    gc = collector(pmm, {"n-gone": 1000, "n-empty": 9000, "agent:pa-dangling": 2000})
+
+    report = gc.run(["db"])
+
+    assert pmm.removed == ["n-gone", "pa-dangling"]
+    assert gc._first_seen == {"n-empty": 9000}
+    assert report == {
+        "orphans": 3,
+        "nodes_removed": 1,
+        # pa-gone, ne-gone, me-gone, qan-gone; pa-dangling, ne-dangling
+        "agents_removed": 6,
+        "scrape_targets_removed": 3,
+        "failed": 0,
+        "before": {"nodes": 6, "agents": 10, "services": 4, "scrape_targets": 5},
+        "after": {"nodes": 5, "agents": 4, "services": 3, "scrape_targets": 2},
+    }
+
+
+def test_run_keeps_failed_nodes_for_next_run(collector):
+    pmm = FakePMM(fail={"n-gone"})
+    gc = collector(pmm, {"n-gone": 1000})
+
+    report = gc.run(["db"])
+
+    assert report["nodes_removed"] == 0
+    assert report["failed"] == 1
+    assert gc._first_seen["n-gone"] == 1000
+
+
+def test_run_waits_for_dangling_agents_like_nodes(collector):
+    pmm = FakePMM()
+    gc = collector(pmm, {"n-gone": 1000})
+    gc._max_deletions = 1
+
+    report = gc.run(["db"])
+
+    # Found for the first time, and the deletion budget is used up anyway.
+    assert pmm.removed == ["n-gone"]
+    assert report["agents_removed"] == 4
+    assert gc._first_seen == {"n-empty": 10_000, "agent:pa-dangling": 10_000}
+
+    gc._first_seen["agent:pa-dangling"] = 1000
+
+    gc.run(["db"])
+
+    assert pmm.removed == ["n-gone", "pa-dangling"]
+    assert "agent:pa-dangling" not in gc._first_seen
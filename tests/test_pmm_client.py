@@ -0,0 +1,186 @@
+"""Unit tests for the shared PMM API client (lambda/pmm_reconciler/pmm_client.py)."""
+
+import asyncio
+import json
+import threading
+
+import pytest
+import requests
+
+from pmm_client import AsyncPMMClient, PMMClient, RequestStats
+
+
+class FakeSession:
+    """``requests.Session.request`` replacement serving canned responses."""
+
+    def __init__(self, routes, barrier=None):
+        self.routes = routes
+        self.barrier = barrier
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, headers=None, timeout=None, **kwargs):
+        with self.lock:
+            self.calls.append((method, url, kwargs))
+        if self.barrier is not None:
+            self.barrier.wait()
+        status, body = self.routes.get((method, url.split("10.0.0.5")[1]), (404, {}))
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode()
+        response.url = url
+        return response
+
+
+def make_client(routes, barrier=None, pool_size=10):
+    pmm = PMMClient("http://10.0.0.5/", "admin", "secret", pool_size=pool_size)
+    pmm._session = FakeSession(routes, barrier)
+    return pmm
+
+
+def test_requests_and_latency_stats():
+    pmm = make_client(
+        {
+            ("GET", "/v1/management/services"): (200, {"services": [{"id": 1}]}),
+            ("GET", "/v1/inventory/nodes"): (
+                200,
+                {"generic": [{"node_id": "a"}], "remote": [{"node_id": "b"}]},
+            ),
+        }
+    )
+
+    assert pmm.services == [{"id": 1}]
+    assert pmm.services == [{"id": 1}]
+    assert [node["node_id"] for node in pmm.nodes] == ["a", "b"]
+    with pytest.raises(requests.exceptions.HTTPError):
+        pmm.remove_node("gone")
+
+    summary = pmm.stats.summary()
+    assert {name: (s["count"], s["errors"]) for name, s in summary.items()} == {
+        "list_nodes": (1, 0),
+        "list_services": (2, 0),
+        "remove_node": (1, 1),
+    }
+    assert summary["list_services"]["max_ms"] >= summary["list_services"]["mean_ms"]
+
+
+def test_request_stats_percentiles():
+    stats = RequestStats()
+    for millis in range(1, 101):
+        stats.record("add_service", millis / 1000)
+
+    assert stats.summary() == {
+        "add_service": {
+            "count": 100,
+            "errors": 0,
+            "mean_ms": 50.5,
+            "p95_ms": 95.0,
+            "max_ms": 100.0,
+        }
+    }
+
+
+def test_bulk_helpers_run_concurrently_and_keep_order():
+    # Both removals must be in flight at once to pass the barrier.
+    pmm = make_client(
+        {
+            ("DELETE", "/v1/inventory/services/s1"): (200, {}),
+            ("DELETE", "/v1/inventory/services/s2"): (200, {}),
+        },
+        barrier=threading.Barrier(2, timeout=5),
+    )
+
+    assert pmm.remove_services(["s1", "s2"]) == [None, None]
+    assert pmm.remove_services([]) == []
+
+
+def test_add_services_returns_failures():
+    pmm = make_client({("POST", "/v1/management/services"): (200, {"ok": True})})
+
+    results = pmm.add_services([{"postgresql": {}}, {"mysql": {}}], max_workers=1)
+
+    assert results == [{"ok": True}, {"ok": True}]
+    pmm._session.routes.clear()
+    [error] = pmm.add_services([{"mysql": {}}])
+    assert isinstance(error, requests.exceptions.HTTPError)
+
+
+def test_async_client_shares_pool_and_stats():
+    pmm = make_client(
+        {
+            ("GET", "/v1/server/version"): (200, {"version": "3.1.0"}),
+            ("DELETE", "/v1/inventory/services/s1"): (200, {}),
+        },
+        pool_size=2,
+    )
+    client = AsyncPMMClient(pmm)
+
+    async def scenario():
+        version = await client.server_version()
+        removed = await client.remove_services(["s1", "s2", "s1"])
+        return version, removed
+
+    version, removed = asyncio.run(scenario())
+
+    assert version == "3.1.0"
+    assert removed[0] is None and removed[2] is None
+    assert isinstance(removed[1], requests.exceptions.HTTPError)
+    assert client.stats.summary()["remove_service"]["errors"] == 1
+
+
+def test_query_returns_result_vector():
+    pmm = make_client(
+        {
+            ("GET", "/prometheus/api/v1/query"): (
+                200,
+                {"data": {"result": [{"metric": {}, "value": [1, "42"]}]}},
+            )
+        }
+    )
+
+    assert pmm.query("up") == [{"metric": {}, "value": [1, "42"]}]
+    assert pmm._session.calls[0][2] == {"params": {"query": "up"}}
+    assert pmm.stats.summary()["query"]["count"] == 1
+
+
+def test_async_client_changes_and_removes_agents():
+    pmm = make_client(
+        {
+            ("PUT", "/v1/inventory/agents/e1"): (200, {"mysqld_exporter": {}}),
+            ("DELETE", "/v1/inventory/agents/a1"): (200, {}),
+            ("DELETE", "/v1/inventory/nodes/n1"): (200, {}),
+        }
+    )
+    client = AsyncPMMClient(pmm)
+
+    async def scenario():
+        changed = await client.change_agent(
+            "e1", "mysqld_exporter", {"metrics_resolutions": {"hr": "15s"}}
+        )
+        agents = await client.remove_agents(["a1", "a2"])
+        nodes = await client.remove_nodes(["n1"])
+        return changed, agents, nodes
+
+    changed, agents, nodes = asyncio.run(scenario())
+
+    assert changed == {"mysqld_exporter": {}}
+    assert agents[0] is None
+    assert isinstance(agents[1], requests.exceptions.HTTPError)
+    assert nodes == [None]
+    assert client.stats.summary()["remove_agent"]["errors"] == 1
+
+
+def test_change_agent():
+    pmm = make_client(
+        {("PUT", "/v1/inventory/agents/e1"): (200, {"mysqld_exporter": {}})}
+    )
+
+    pmm.change_agent("e1", "mysqld_exporter", {"metrics_resolutions": {"hr": "15s"}})
+
+    assert pmm._session.calls == [
+        (
+            "PUT",
+            "http://10.0.0.5/v1/inventory/agents/e1",
+            {"json": {"mysqld_exporter": {"metrics_resolutions": {"hr": "15s"}}}},
+        )
+    ]
@@ -0,0 +1,140 @@
+"""Unit tests for the data volume pre-warm (scripts/pmm_prewarm.py)."""
+
+import os
+
+import pytest
+
+import pmm_prewarm
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(pmm_prewarm, "monotonic", fake.monotonic)
+    monkeypatch.setattr(pmm_prewarm, "sleep", fake.sleep)
+    return fake
+
+
+def write(path, size, mtime):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    os.utime(path, (mtime, mtime))
+
+
+def test_volume_id_from_nvme_serial(tmp_path):
+    serial = tmp_path / "nvme1n1" / "device" / "serial"
+    serial.parent.mkdir(parents=True)
+    serial.write_text("vol0123456789abcdef0 \n")
+
+    assert (
+        pmm_prewarm.volume_id("/dev/nvme1n1", str(tmp_path)) == "vol-0123456789abcdef0"
+    )
+
+
+class FakeEC2:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def describe_volumes(self, VolumeIds):
+        volume = {"VolumeId": VolumeIds[0]}
+        if self.snapshot is not None:
+            volume["SnapshotId"] = self.snapshot
+        return {"Volumes": [volume]}
+
+
+@pytest.mark.parametrize(
+    "snapshot, expected", [("snap-1", "snap-1"), ("", None), (None, None)]
+)
+def test_source_snapshot(snapshot, expected):
+    assert pmm_prewarm.source_snapshot(FakeEC2(snapshot), "vol-1") == expected
+
+
+def test_already_warmed(tmp_path):
+    assert not pmm_prewarm.already_warmed(str(tmp_path), "snap-1")
+
+    (tmp_path / pmm_prewarm.MARKER_FILE).write_text("snap-1\n")
+
+    assert pmm_prewarm.already_warmed(str(tmp_path), "snap-1")
+    assert not pmm_prewarm.already_warmed(str(tmp_path), "snap-2")
+
+
+def test_file_jobs_hot_directories_and_newest_first(tmp_path):
+    write(tmp_path / "clickhouse" / "data" / "old.bin", 10, 1000)
+    write(tmp_path / "clickhouse" / "data" / "new.bin", 20, 2000)
+    write(tmp_path / "clickhouse" / "metadata" / "pmm.sql", 5, 500)
+    write(tmp_path / "postgres14" / "base" / "1", 30, 100)
+    write(tmp_path / "postgres14" / "empty", 0, 100)
+    write(tmp_path / "logs" / "pmm.log", 40, 3000)
+
+    jobs = pmm_prewarm.file_jobs(
+        str(tmp_path), ("postgres14", "clickhouse/metadata", "clickhouse", "missing")
+    )
+
+    assert [os.path.relpath(job.path, tmp_path) for job in jobs] == [
+        "postgres14/base/1",
+        "clickhouse/metadata/pmm.sql",
+        "clickhouse/data/new.bin",
+        "clickhouse/data/old.bin",
+    ]
+    assert jobs[0] == pmm_prewarm.Job(
+        str(tmp_path / "postgres14" / "base" / "1"), 0, 30
+    )
+
+
+def test_device_jobs_cover_the_device(tmp_path):
+    device = tmp_path / "device"
+    device.write_bytes(b"\0" * 1000)
+
+    jobs = pmm_prewarm.device_jobs(str(device), segment_size=300)
+
+    assert [(job.offset, job.length) for job in jobs] == [
+        (0, 300),
+        (300, 300),
+        (600, 300),
+        (900, 100),
+    ]
+
+
+def test_prewarm_reads_everything(tmp_path, clock):
+    device = tmp_path / "device"
+    device.write_bytes(os.urandom(10000))
+    jobs = pmm_prewarm.device_jobs(str(device), segment_size=3000)
+    jobs.append(pmm_prewarm.Job(str(tmp_path / "deleted"), 0, 500))
+    progress = pmm_prewarm.Progress(10500)
+
+    pmm_prewarm.prewarm(jobs, pmm_prewarm.Throttle(0), progress, workers=3)
+
+    assert progress.done == 10500
+
+
+def test_throttle_limits_rate(clock):
+    throttle = pmm_prewarm.Throttle(rate=1000)
+
+    # The first second's worth is available at once...
+    throttle.consume(1000)
+    assert clock.now == 0
+    # ...then reads wait for their share.
+    for _ in range(5):
+        throttle.consume(500)
+
+    assert clock.now == pytest.approx(2.5)
+
+
+def test_progress_summary(clock):
+    progress = pmm_prewarm.Progress(total=4_000_000, interval=10)
+    progress.add(1_000_000)
+    clock.now = 2
+    progress.add(1_000_000)
+
+    assert progress.summary() == {"bytes": 2_000_000, "seconds": 2, "mbps": 1.0}
@@ -0,0 +1,300 @@
+"""Unit tests for Query Analytics tuning in the reconciler Lambda."""
+
+import json
+from base64 import b64decode
+
+import pytest
+
+import fanout
+import main as reconciler
+from qan import (
+    agents_by_service,
+    qan_drift,
+    qan_flags,
+    rate_limit_drift,
+    slow_log_rate_limit_sql,
+)
+
+EXPORTER = {"agent_id": "e1", "service_id": "s1", "tablestats_group_table_limit": 1000}
+PERFSCHEMA = {
+    "agent_id": "q1",
+    "service_id": "s1",
+    "max_query_length": 0,
+    "query_examples_disabled": False,
+}
+
+
+def test_qan_flags_defaults_to_perfschema():
+    assert qan_flags({}) == ["--query-source=perfschema"]
+
+
+def test_qan_flags_all_options():
+    assert qan_flags(
+        {
+            "query_source": "slowlog",
+            "slow_log_max_size_mb": 512,
+            "disable_tablestats_limit": 2000,
+            "max_query_length": 1024,
+            "disable_query_examples": True,
+        }
+    ) == [
+        "--query-source=slowlog",
+        "--size-slow-logs=512MiB",
+        "--disable-tablestats-limit=2000",
+        "--max-query-length=1024",
+        "--disable-queryexamples",
+    ]
+
+
+def test_slow_log_rate_limit_sql():
+    assert slow_log_rate_limit_sql({}) == ""
+    assert "log_slow_rate_limit=100" in slow_log_rate_limit_sql(
+        {"slow_log_rate_limit": 100}
+    )
+
+
+@pytest.mark.parametrize(
+    "qan, status, drifted",
+    [
+        ({}, {"slow_log_rate_limit": None}, False),
+        ({"slow_log_rate_limit": 100}, {"slow_log_rate_limit": 100}, False),
+        ({"slow_log_rate_limit": 100}, {"slow_log_rate_limit": 50}, True),
+        # Never set on this server.
+        ({"slow_log_rate_limit": 100}, {"slow_log_rate_limit": None}, True),
+        # No probe answer.
+        ({"slow_log_rate_limit": 100}, None, False),
+    ],
+)
+def test_rate_limit_drift(qan, status, drifted):
+    assert bool(rate_limit_drift(qan, status)) is drifted
+
+
+def test_agents_by_service():
+    index = agents_by_service(
+        {
+            "mysqld_exporter": [EXPORTER],
+            "qan_mysql_perfschema_agent": [PERFSCHEMA],
+            "pmm_agent": [{"agent_id": "p1"}],
+            "totalCount": 3,
+        }
+    )
+    assert index == {
+        "s1": {
+            "mysqld_exporter": [EXPORTER],
+            "qan_mysql_perfschema_agent": [PERFSCHEMA],
+        }
+    }
+
+
+@pytest.mark.parametrize(
+    "qan, agents, drifted",
+    [
+        (
+            {},
+            {"mysqld_exporter": [EXPORTER], "qan_mysql_perfschema_agent": [PERFSCHEMA]},
+            False,
+        ),
+        (
+            {"query_source": "slowlog"},
+            {"mysqld_exporter": [EXPORTER], "qan_mysql_perfschema_agent": [PERFSCHEMA]},
+            True,
+        ),
+        ({"query_source": "none"}, {"mysqld_exporter": [EXPORTER]}, False),
+        (
+            {"max_query_length": 1024},
+            {"mysqld_exporter": [EXPORTER], "qan_mysql_perfschema_agent": [PERFSCHEMA]},
+            True,
+        ),
+        (
+            {"disable_tablestats_limit": 1000},
+            {"mysqld_exporter": [EXPORTER], "qan_mysql_perfschema_agent": [PERFSCHEMA]},
+            False,
+        ),
+        (
+            {"disable_tablestats_limit": 500},
+            {"mysqld_exporter": [EXPORTER], "qan_mysql_perfschema_agent": [PERFSCHEMA]},
+            True,
+        ),
+        (
+            {"disable_query_examples": True},
+            {"mysqld_exporter": [EXPORTER], "qan_mysql_perfschema_agent": [PERFSCHEMA]},
+            True,
+        ),
+        # Agents not visible in the inventory are never reported as drifted.
+        ({"query_source": "slowlog"}, {}, False),
+    ],
+)
+def test_qan_drift(qan, agents, drifted):
+    assert bool(qan_drift(qan, agents)) is drifted
+
+
+def test_qan_drift_slowlog_rotation_size():
+    slowlog = {"service_id": "s1", "max_slowlog_file_size": str(512 * 1024 * 1024)}
+    agents = {"mysqld_exporter": [EXPORTER], "qan_mysql_slowlog_agent": [slowlog]}
+    qan = {"query_source": "slowlog", "slow_log_max_size_mb": 512}
+    assert qan_drift(qan, agents) == []
+    assert qan_drift({**qan, "slow_log_max_size_mb": 1024}, agents)
+
+
+def decode_config(config):
+    """Settings in a config of :func:`main.setup_config`."""
+    return json.loads(b64decode(config))
+
+
+def test_setup_config_passes_qan_settings():
+    config = decode_config(
+        reconciler.setup_config(
+            pmm_host="10.0.0.5",
+            pmm_password="secret",
+            db_username="monitor",
+            port=3306,
+            asg_name="db",
+            qan={"query_source": "slowlog", "slow_log_rate_limit": 50},
+            reregister=True,
+        )
+    )
+    assert "--query-source=slowlog" in config["add_args"]
+    assert config["reregister"] is True
+    assert "log_slow_rate_limit=50" in config["rate_limit_sql"]
+
+
+def probed_instances(monkeypatch, status, instance_ids=("i-1", "i-2")):
+    """ASG instances whose probe reports ``status``; returns the setup calls."""
+    monkeypatch.setattr(fanout, "sleep", lambda _: None)
+    output = json.dumps(status)
+
+    class SSM:
+        def send_command(self, InstanceIds, DocumentName, Parameters):
+            self.ids = InstanceIds
+            return {"Command": {"CommandId": "c"}}
+
+        def get_paginator(self, name):
+            ssm = self
+
+            class Paginator:
+                def paginate(self, CommandId, Details):
+                    yield {
+                        "CommandInvocations": [
+                            {
+                                "InstanceId": iid,
+                                "Status": "Success",
+                                "CommandPlugins": [
+                                    {"Output": output, "ResponseCode": 0}
+                                ],
+                            }
+                            for iid in ssm.ids
+                        ]
+                    }
+
+            return Paginator()
+
+    ssm = SSM()
+    instances = [
+        type(
+            "I",
+            (),
+            {
+                "instance_id": iid,
+                "hostname": f"ip-{iid}",
+                "private_ip": "10.0.0.1",
+                "ssm_client": ssm,
+            },
+        )()
+        for iid in instance_ids
+    ]
+    monkeypatch.setattr(
+        reconciler,
+        "ASG",
+        lambda *args, **kwargs: type("A", (), {"instances": instances}),
+    )
+    calls = []
+
+    def ensure_pmm_clients(**kwargs):
+        calls.append(kwargs)
+        return {
+            inst.instance_id: None
+            for instances in kwargs["groups"].values()
+            for inst in instances
+        }
+
+    monkeypatch.setattr(reconciler, "ensure_pmm_clients", ensure_pmm_clients)
+    return calls
+
+
+HEALTHY = {
+    "installed": True,
+    "connected": True,
+    "version": "3.1.0",
+    "agents": {"mysqld_exporter": "Running"},
+}
+
+
+def test_reconcile_asg_reregisters_drifted_services(monkeypatch):
+    calls = probed_instances(monkeypatch, HEALTHY)
+    existing = [
+        {"service_name": "db/ip-i-1", "service_id": "s1"},
+        {"service_name": "db/ip-i-2", "service_id": "s2"},
+    ]
+    service_agents = {
+        "s1": {
+            "mysqld_exporter": [EXPORTER],
+            "qan_mysql_perfschema_agent": [PERFSCHEMA],
+        },
+        "s2": {"mysqld_exporter": [EXPORTER], "qan_mysql_slowlog_agent": [{}]},
+    }
+
+    counts = reconciler.reconcile_asg(
+        {
+            "asg_name": "db",
+            "service_type": "mysql",
+            "port": 3306,
+            "username": "m",
+            "qan": {"query_source": "slowlog"},
+        },
+        None,
+        pmm_host="10.0.0.5",
+        pmm_password="secret",
+        existing_services=existing,
+        service_agents=service_agents,
+    )
+
+    assert len(calls) == 1
+    ((config, instances),) = calls[0]["groups"].items()
+    assert [inst.instance_id for inst in instances] == ["i-1"]
+    assert decode_config(config)["reregister"] is True
+    assert counts["retuned"] == 1
+    assert counts["skipped"] == 1
+
+
+def test_reconcile_asg_applies_changed_rate_limit(monkeypatch):
+    # Registered with limit 50; the ASG now wants 100.
+    calls = probed_instances(
+        monkeypatch, {**HEALTHY, "slow_log_rate_limit": 50}, instance_ids=["i-1"]
+    )
+
+    counts = reconciler.reconcile_asg(
+        {
+            "asg_name": "db",
+            "service_type": "mysql",
+            "port": 3306,
+            "username": "m",
+            "qan": {"slow_log_rate_limit": 100},
+        },
+        None,
+        pmm_host="10.0.0.5",
+        pmm_password="secret",
+        existing_services=[{"service_name": "db/ip-i-1", "service_id": "s1"}],
+        service_agents={
+            "s1": {
+                "mysqld_exporter": [EXPORTER],
+                "qan_mysql_perfschema_agent": [PERFSCHEMA],
+            }
+        },
+    )
+
+    assert len(calls) == 1
+    (config,) = map(decode_config, calls[0]["groups"])
+    assert "log_slow_rate_limit=100" in config["rate_limit_sql"]
+    assert config["reregister"] is False
+    assert counts["retuned"] == 1
+    assert counts["skipped"] == 0
@@ -0,0 +1,144 @@
+"""Tests for the custom query cardinality and cost analyzer (pmm_tools.query_cost)."""
+
+from os import path as osp
+
+import pytest
+
+from pmm_tools import query_cost
+from pmm_tools.custom_queries import load_custom_queries
+from pmm_tools.query_cost import QueryCost, affordable_tier, analyze, check
+
+QUERIES_DIR = osp.join(
+    osp.dirname(__file__), "..", "test_data", "test_basic", "queries"
+)
+LOW_RES = osp.join(QUERIES_DIR, "pg-low-res.yml")
+MED_RES = osp.join(QUERIES_DIR, "pg-med-res.yml")
+
+
+class FakeCursor:
+    """DB-API cursor returning a fixed plan and result set."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+        self._result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, sql):
+        self.executed.append(sql)
+        if sql.startswith("EXPLAIN"):
+            self._result = [([{"Plan": {"Total Cost": 42.5}}],)]
+        else:
+            self._result = [(n,) for n in range(self.rows)]
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchall(self):
+        return self._result
+
+
+class FakeDatabaseError(Exception):
+    def __init__(self, message, pgcode):
+        super().__init__(message)
+        self.pgcode = pgcode
+
+
+class FailingCursor(FakeCursor):
+    """Cursor whose queries, but not their plans, fail."""
+
+    def __init__(self, error):
+        super().__init__(rows=0)
+        self.error = error
+
+    def execute(self, sql):
+        super().execute(sql)
+        if not sql.startswith(("SET", "EXPLAIN")):
+            raise self.error
+
+
+class FakeConnection:
+    Error = FakeDatabaseError
+
+    def __init__(self, rows, cursor=None):
+        self.cursor_obj = cursor or FakeCursor(rows)
+
+    def cursor(self):
+        return self.cursor_obj
+
+
+def test_analyze_static_flags_high_cardinality_labels():
+    results = analyze({"high": LOW_RES, "medium": MED_RES}, default_rows=5)
+
+    by_name = {cost.name: cost for cost in results}
+    indexes = by_name["pg_stat_user_indexes"]
+    assert indexes.tier == "high"
+    assert len(indexes.labels) == 4 and len(indexes.values) == 5
+    assert indexes.series == 25
+    assert any("indexname" in problem for problem in indexes.problems)
+    assert by_name["pg_activity"].problems == []
+
+
+def test_analyze_measures_on_database():
+    conn = FakeConnection(rows=300)
+
+    results = analyze({"high": LOW_RES}, conn=conn, repeats=2)
+
+    cost = results[0]
+    assert cost.measured
+    assert cost.rows == 300
+    assert cost.plan_cost == 42.5
+    assert cost.series == 1500
+    assert any("series exceed the high tier" in p for p in cost.problems)
+    explained = [sql for sql in conn.cursor_obj.executed if sql.startswith("EXPLAIN")]
+    assert len(explained) == 1
+
+
+@pytest.mark.parametrize(
+    "pgcode, problem",
+    [
+        ("57014", "exceeded 30 s statement timeout"),
+        ("42P01", "failed on the database: relation does not exist"),
+    ],
+)
+def test_analyze_reports_failing_queries(pgcode, problem):
+    error = FakeDatabaseError("relation does not exist\n", pgcode)
+    conn = FakeConnection(rows=0, cursor=FailingCursor(error))
+
+    results = analyze({"high": LOW_RES}, conn=conn)
+
+    assert len(results) == len(load_custom_queries(LOW_RES))
+    assert all(not cost.measured for cost in results)
+    assert all(problem in cost.problems for cost in results)
+
+
+@pytest.mark.parametrize(
+    "rows, exec_ms, tier",
+    [
+        (2, 1.0, "high"),
+        (100, 1.0, "medium"),
+        (2, 400.0, "medium"),
+        (5000, 1.0, "low"),
+        (5000, 9000.0, None),
+    ],
+)
+def test_affordable_tier(rows, exec_ms, tier):
+    cost = QueryCost("q", "high", ["datname"], ["a", "b"], rows=rows, exec_ms=exec_ms)
+    assert affordable_tier(cost) == tier
+
+
+def test_check_exec_time_budget():
+    cost = QueryCost("q", "medium", [], ["a"], rows=1, exec_ms=900.0, measured=True)
+    assert check(cost) == ["900 ms exceeds the medium tier budget of 500 ms"]
+    assert cost.db_load(10) == pytest.approx(0.09)
+
+
+def test_connect_without_psycopg2(monkeypatch):
+    monkeypatch.setitem(__import__("sys").modules, "psycopg2", None)
+    with pytest.raises(RuntimeError):
+        query_cost.connect("postgresql://localhost/db")
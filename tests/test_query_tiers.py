@@ -0,0 +1,88 @@
+"""Tests for automatic resolution-tier placement (pmm_tools.query_tiers)."""
+
+from os import path as osp
+
+import pytest
+
+from pmm_tools import query_tiers
+from pmm_tools.custom_queries import load_custom_queries
+from pmm_tools.query_cost import QueryCost
+
+QUERIES_DIR = osp.join(
+    osp.dirname(__file__), "..", "test_data", "test_basic", "queries"
+)
+POOL = [
+    osp.join(QUERIES_DIR, "pg-low-res.yml"),
+    osp.join(QUERIES_DIR, "pg-med-res.yml"),
+]
+
+
+def cost(name, rows, values=1, exec_ms=1.0):
+    return QueryCost(name, "low", [], [f"v{n}" for n in range(values)], rows, exec_ms)
+
+
+def test_place_prefers_fastest_affordable_tier():
+    placement, unplaced = query_tiers.place(
+        [
+            cost("cheap", 5),
+            cost("wide", 500),
+            cost("slow", 5, exec_ms=1000.0),
+            cost("huge", 20000),
+        ]
+    )
+    assert placement == {"high": ["cheap"], "medium": ["wide"], "low": ["slow"]}
+    assert unplaced == ["huge"]
+
+
+def test_place_respects_tier_totals():
+    budgets = {
+        "high": {"series": 10, "exec_ms": 500},
+        "medium": {"series": 10000, "exec_ms": 2000},
+        "low": {"series": 100000, "exec_ms": 30000},
+    }
+    placement, _ = query_tiers.place(
+        [cost("a", 4), cost("b", 4), cost("c", 4)], total_budgets=budgets
+    )
+    assert placement["high"] == ["a", "b"]
+    assert placement["medium"] == ["c"]
+
+
+def test_place_skips_failed_queries():
+    failed = cost("broken", 1)
+    failed.error = "failed on the database: relation does not exist"
+
+    placement, unplaced = query_tiers.place([cost("cheap", 5), failed])
+
+    assert placement["high"] == ["cheap"]
+    assert unplaced == ["broken"]
+
+
+def test_load_pool_rejects_duplicates():
+    with pytest.raises(ValueError):
+        query_tiers.load_pool(POOL + POOL[:1])
+
+
+def test_main_writes_loadable_tier_files(tmp_path):
+    status = query_tiers.main(POOL + ["--rows", "5", "--output-dir", str(tmp_path)])
+
+    assert status == 0
+    high = load_custom_queries(str(tmp_path / "high-resolution.yml"))
+    # Both queries are cheap with 5 rows, so both land in the high tier,
+    # and the SQL round-trips unchanged.
+    original = query_tiers.load_pool(POOL)
+    assert high == original
+    assert "query: |" in (tmp_path / "high-resolution.yml").read_text()
+    assert load_custom_queries(str(tmp_path / "low-resolution.yml")) == {}
+
+
+def test_main_empties_stale_tier_files(tmp_path):
+    # With many rows both queries only fit the low tier.
+    query_tiers.main(POOL + ["--rows", "1000", "--output-dir", str(tmp_path)])
+    assert (tmp_path / "low-resolution.yml").exists()
+
+    status = query_tiers.main(POOL + ["--rows", "5", "--output-dir", str(tmp_path)])
+
+    assert status == 0
+    assert (tmp_path / "high-resolution.yml").exists()
+    # Still there for file() in Terraform, but without the moved queries.
+    assert load_custom_queries(str(tmp_path / "low-resolution.yml")) == {}
@@ -0,0 +1,308 @@
+"""Unit tests for RDS/Aurora auto-discovery in the reconciler Lambda."""
+
+import threading
+
+import pytest
+import requests
+
+import rds
+
+ORDERS = {
+    "name": "orders",
+    "engine": "postgresql",
+    "tags": {"pmm": "true", "team": "orders"},
+    "credentials_secret_arn": "arn:aws:secretsmanager:us-west-2:1:secret:orders",
+    "database": "orders",
+    "query_analytics": True,
+}
+BILLING = {
+    "name": "billing",
+    "engine": "mysql",
+    "tags": {"pmm": "true"},
+    "credentials_secret_arn": "arn:aws:secretsmanager:us-west-2:1:secret:billing",
+    "query_analytics": False,
+}
+
+
+def db_instance(identifier, engine, tags, status="available", cluster=None):
+    instance = {
+        "DBInstanceIdentifier": identifier,
+        "Engine": engine,
+        "DBInstanceStatus": status,
+        "DBInstanceClass": "db.r6g.large",
+        "AvailabilityZone": "us-west-2a",
+        "TagList": [{"Key": key, "Value": value} for key, value in tags.items()],
+        "Endpoint": {"Address": f"{identifier}.rds.amazonaws.com", "Port": 5432},
+    }
+    if cluster:
+        instance["DBClusterIdentifier"] = cluster
+    if status == "creating":
+        del instance["Endpoint"]
+    return instance
+
+
+class FakeRDS:
+    """RDS client returning DB instances in pages of two."""
+
+    def __init__(self, instances):
+        self.instances = instances
+        self.calls = 0
+
+    def get_paginator(self, name):
+        assert name == "describe_db_instances"
+        return self
+
+    def paginate(self):
+        self.calls += 1
+        for start in range(0, len(self.instances), 2):
+            yield {"DBInstances": self.instances[start : start + 2]}
+
+
+class FakePMM:
+    """PMM client recording changes; add_service blocks until all run."""
+
+    def __init__(self, parallel=1, fail=()):
+        self.added = []
+        self.removed_services = []
+        self.removed_nodes = []
+        self.fail = set(fail)
+        self._barrier = threading.Barrier(parallel, timeout=5)
+        self.pmm_agents = [
+            {"agent_id": "a-client", "runs_on_node_id": "n-1"},
+            {"agent_id": "a-server", "runs_on_node_id": "pmm-server"},
+        ]
+
+    def add_service(self, payload):
+        self._barrier.wait()
+        (service,) = payload.values()
+        if service["service_name"] in self.fail:
+            raise requests.exceptions.HTTPError("409 Conflict")
+        self.added.append(payload)
+        return {}
+
+    def remove_service(self, service_id):
+        self.removed_services.append(service_id)
+
+    def remove_node(self, node_id):
+        self.removed_nodes.append(node_id)
+
+
+FLEET = [
+    db_instance("orders-1", "postgres", {"pmm": "true", "team": "orders"}),
+    db_instance(
+        "orders-aurora-1",
+        "aurora-postgresql",
+        {"pmm": "true", "team": "orders"},
+        cluster="orders-aurora",
+    ),
+    db_instance(
+        "orders-new", "postgres", {"pmm": "true", "team": "orders"}, "creating"
+    ),
+    db_instance(
+        "orders-gone", "postgres", {"pmm": "true", "team": "orders"}, "deleting"
+    ),
+    db_instance("untagged", "postgres", {"team": "orders"}),
+    db_instance("billing-1", "mysql", {"pmm": "true"}),
+    db_instance("billing-2", "aurora-mysql", {"pmm": "true"}, cluster="billing"),
+]
+
+
+def test_discover_matches_engine_and_all_tags():
+    client = FakeRDS(FLEET)
+
+    found = rds.discover(client, [ORDERS, BILLING])
+
+    assert client.calls == 1
+    assert sorted(found["orders"]) == [
+        "rds/orders/orders-1",
+        "rds/orders/orders-aurora-1",
+        "rds/orders/orders-new",
+    ]
+    assert sorted(found["billing"]) == [
+        "rds/billing/billing-1",
+        "rds/billing/billing-2",
+    ]
+
+
+def test_plan_adds_available_and_removes_unmatched():
+    discovered = rds.discover(FakeRDS(FLEET), [ORDERS])["orders"]
+    existing = [
+        {"service_name": "rds/orders/orders-1", "service_id": "s1"},
+        {"service_name": "rds/orders/orders-gone", "service_id": "s2"},
+        {"service_name": "rds/orders-eu/other", "service_id": "s3"},
+        {"service_name": "db-asg/ip-10-0-0-1", "service_id": "s4"},
+    ]
+
+    to_add, to_remove = rds.plan(ORDERS, discovered, existing)
+
+    assert [i["DBInstanceIdentifier"] for i in to_add] == ["orders-aurora-1"]
+    assert [svc["service_id"] for svc in to_remove] == ["s2"]
+
+
+def test_service_payload():
+    credentials = {"username": "pmm", "password": "pw"}
+    aurora = FLEET[1]
+
+    payload = rds.service_payload(ORDERS, aurora, credentials, "a-server", "us-west-2")
+
+    service = payload["postgresql"]
+    assert service["service_name"] == "rds/orders/orders-aurora-1"
+    assert service["address"] == "orders-aurora-1.rds.amazonaws.com"
+    assert service["database"] == "orders"
+    assert service["cluster"] == "orders-aurora"
+    assert service["pmm_agent_id"] == "a-server"
+    assert service["qan_postgresql_pgstatements_agent"] is True
+    assert service["add_node"]["node_type"] == "NODE_TYPE_REMOTE_NODE"
+    assert service["add_node"]["node_name"] == "rds/orders/orders-aurora-1"
+
+    payload = rds.service_payload(BILLING, FLEET[5], credentials, "a", "us-west-2")
+    assert payload["mysql"]["qan_mysql_perfschema"] is False
+    assert "database" not in payload["mysql"]
+    assert "cluster" not in payload["mysql"]
+
+
+def test_reconcile_rds_applies_changes_concurrently():
+    # Four additions; each blocks until all four are in flight.
+    pmm = FakePMM(parallel=4)
+    existing = [
+        {"service_name": "rds/billing/retired", "service_id": "s9", "node_id": "n9"},
+    ]
+    secrets = []
+
+    def get_credentials(arn):
+        secrets.append(arn)
+        return {"username": "pmm", "password": "pw"}
+
+    counts, errors = rds.reconcile_rds(
+        [ORDERS, BILLING],
+        pmm,
+        FakeRDS(FLEET),
+        existing,
+        get_credentials,
+        region="us-west-2",
+    )
+
+    assert errors == []
+    assert counts == {"rds_added": 4, "rds_removed": 1}
+    assert sorted(secrets) == sorted(
+        [ORDERS["credentials_secret_arn"], BILLING["credentials_secret_arn"]]
+    )
+    assert {
+        service["pmm_agent_id"] for payload in pmm.added for service in payload.values()
+    } == {"a-server"}
+    # Removing the node removes its service, so nothing is left orphaned.
+    assert pmm.removed_services == []
+    assert pmm.removed_nodes == ["n9"]
+
+
+def test_reconcile_rds_reports_failed_changes():
+    pmm = FakePMM(fail={"rds/billing/billing-1"})
+
+    counts, errors = rds.reconcile_rds(
+        [BILLING],
+        pmm,
+        FakeRDS(FLEET),
+        [],
+        lambda arn: {"username": "pmm", "password": "pw"},
+        region="us-west-2",
+        max_workers=1,
+    )
+
+    assert counts == {"rds_added": 1, "rds_removed": 0}
+    assert len(errors) == 1
+    assert errors[0].startswith("rds/billing/billing-1: add failed")
+
+
+@pytest.mark.parametrize(
+    "secret",
+    [
+        KeyError("secret not found"),
+        "not-json",
+        {"password": "pw"},
+    ],
+    ids=["missing", "not-json", "no-username"],
+)
+def test_reconcile_rds_reports_unreadable_secret_per_selector(secret):
+    def get_credentials(arn):
+        if arn != BILLING["credentials_secret_arn"]:
+            return {"username": "pmm", "password": "pw"}
+        if isinstance(secret, Exception):
+            raise secret
+        return secret
+
+    pmm = FakePMM()
+    counts, errors = rds.reconcile_rds(
+        [ORDERS, BILLING],
+        pmm,
+        FakeRDS(FLEET),
+        [],
+        get_credentials,
+        region="us-west-2",
+        max_workers=1,
+    )
+
+    assert counts == {"rds_added": 2, "rds_removed": 0}
+    assert [service["service_name"] for p in pmm.added for service in p.values()] == [
+        "rds/orders/orders-1",
+        "rds/orders/orders-aurora-1",
+    ]
+    assert len(errors) == 1
+    assert errors[0].startswith("rds/billing/*: cannot read credentials")
+
+
+def test_reconcile_rds_reports_unexpected_errors_per_change():
+    def remove_node(node_id):
+        raise ValueError("boom")
+
+    pmm = FakePMM()
+    pmm.remove_node = remove_node
+
+    counts, errors = rds.reconcile_rds(
+        [],
+        pmm,
+        FakeRDS(FLEET),
+        [{"service_name": "rds/old/db-1", "service_id": "s1", "node_id": "n1"}],
+        lambda arn: pytest.fail("secret read although nothing is added"),
+        region="us-west-2",
+    )
+
+    assert counts == {"rds_added": 0, "rds_removed": 0}
+    assert errors == ["rds/old/db-1: remove failed: boom"]
+
+
+def test_reconcile_rds_removes_services_of_dropped_selectors():
+    pmm = FakePMM()
+    client = FakeRDS(FLEET)
+    existing = [
+        {"service_name": "rds/retired/db-1", "service_id": "s1", "node_id": "n1"},
+        {"service_name": "rds/retired/db-2", "service_id": "s2"},
+        {"service_name": "db-asg/ip-10-0-0-1", "service_id": "s3", "node_id": "n3"},
+    ]
+
+    counts, errors = rds.reconcile_rds(
+        [], pmm, client, existing, lambda arn: {}, region="us-west-2"
+    )
+
+    assert errors == []
+    assert counts == {"rds_added": 0, "rds_removed": 2}
+    assert pmm.removed_nodes == ["n1"]
+    assert pmm.removed_services == ["s2"]
+    # Nothing to discover without selectors.
+    assert client.calls == 0
+
+
+def test_reconcile_rds_in_sync_reads_no_secrets():
+    discovered = rds.discover(FakeRDS(FLEET), [BILLING])["billing"]
+    existing = [{"service_name": name, "service_id": name} for name in discovered]
+
+    counts, errors = rds.reconcile_rds(
+        [BILLING],
+        FakePMM(),
+        FakeRDS(FLEET),
+        existing,
+        lambda arn: pytest.fail("secret read although nothing changes"),
+        region="us-west-2",
+    )
+
+    assert counts == {"rds_added": 0, "rds_removed": 0}
+    assert errors == []
@@ -0,0 +1,622 @@
+"""Unit tests for the PMM ASG reconciler Lambda (no AWS resources needed)."""
+
+import json
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+import fanout
+import main as reconciler
+from pmm_client import RequestStats
+
+HEALTHY = {
+    "installed": True,
+    "connected": True,
+    "version": "3.1.0-1.noble",
+    "agents": {"node_exporter": "Running", "mysqld_exporter": "Running"},
+}
+
+
+class FakePaginator:
+    """Paginator over a fake SSM client's command invocations."""
+
+    def __init__(self, ssm):
+        self._ssm = ssm
+
+    def paginate(self, CommandId, Details):
+        assert Details is True
+        yield {"CommandInvocations": self._ssm.invocations[CommandId]}
+
+
+class FakeSSM:
+    """
+    Minimal SSM client: every instance answers the probe immediately
+    with the output registered in ``outputs``; the command cannot be
+    delivered to the others.
+    """
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.invocations = {}
+        self.send_calls = []
+
+    def send_command(self, InstanceIds, DocumentName, Parameters):
+        command_id = f"cmd-{len(self.send_calls)}"
+        self.send_calls.append(InstanceIds)
+        self.invocations[command_id] = [
+            {
+                "InstanceId": instance_id,
+                "Status": (
+                    "Success" if instance_id in self.outputs else "Undeliverable"
+                ),
+                "CommandPlugins": [
+                    {
+                        "Output": self.outputs.get(instance_id, ""),
+                        "ResponseCode": 0 if instance_id in self.outputs else -1,
+                    }
+                ],
+            }
+            for instance_id in InstanceIds
+        ]
+        return {"Command": {"CommandId": command_id}}
+
+    def get_paginator(self, name):
+        assert name == "list_command_invocations"
+        return FakePaginator(self)
+
+
+class FakeInstance:
+    """Stand-in for ``ASGInstance``."""
+
+    def __init__(self, instance_id, ssm):
+        self.instance_id = instance_id
+        self.hostname = f"ip-{instance_id}"
+        self.private_ip = "10.0.0.1"
+        self.ssm_client = ssm
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(fanout, "sleep", lambda _: None)
+
+
+def test_parse_probe_output_skips_noise():
+    stdout = "WARNING: something\n" + json.dumps(HEALTHY) + "\n"
+    assert reconciler._parse_probe_output(stdout) == HEALTHY
+    assert reconciler._parse_probe_output("not json") is None
+    assert reconciler._parse_probe_output("") is None
+
+
+PMM_ADMIN_STATUS = """\
+PMM Client:
+  Connected        : true
+Agents:
+  /agent_id/a node_exporter Running 42000
+  /agent_id/b mysqld_exporter Running 42001
+"""
+
+
+def test_probe_script_needs_no_jq(tmp_path):
+    stubs = {
+        "dpkg-query": "case \"$*\" in *Status*) echo 'install ok installed';; "
+        "*) echo 3.1.0-1.noble;; esac",
+        "pmm-admin": f"cat <<'EOF'\n{PMM_ADMIN_STATUS}EOF",
+        "my_print_defaults": f"echo --datadir={tmp_path}",
+        "jq": "exit 127",
+    }
+    for name, body in stubs.items():
+        stub = tmp_path / name
+        stub.write_text(f"#!/bin/bash\n{body}\n")
+        stub.chmod(0o755)
+    (tmp_path / "mysqld-auto.cnf").write_text(
+        json.dumps(
+            {
+                "Version": 2,
+                "mysql_server": {
+                    "log_slow_rate_limit": {
+                        "Value": "100",
+                        "Metadata": {"User": "root"},
+                    }
+                },
+            }
+        )
+    )
+    script = reconciler.PROBE_SCRIPT.replace("PATH=", f"PATH={tmp_path}:", 1)
+
+    result = subprocess.run(
+        ["bash", "-c", script], capture_output=True, text=True, check=True
+    )
+
+    assert reconciler._parse_probe_output(result.stdout) == {
+        **HEALTHY,
+        "slow_log_rate_limit": 100,
+    }
+
+
+@pytest.mark.parametrize(
+    "status, expected",
+    [
+        (None, True),
+        (HEALTHY, False),
+        ({**HEALTHY, "installed": False}, True),
+        ({**HEALTHY, "connected": False}, True),
+        ({**HEALTHY, "agents": {"node_exporter": "Running"}}, True),
+        ({**HEALTHY, "agents": {"mysqld_exporter": "Waiting"}}, True),
+    ],
+)
+def test_needs_configure(status, expected):
+    assert reconciler.needs_configure(status, "mysqld_exporter") is expected
+
+
+def test_probe_instances_batches_and_collects():
+    outputs = {f"i-{n}": json.dumps(HEALTHY) for n in range(60)}
+    ssm = FakeSSM(outputs)
+    instances = [FakeInstance(f"i-{n}", ssm) for n in range(61)]
+
+    stats = RequestStats()
+
+    statuses = reconciler.probe_instances(instances, stats=stats)
+
+    assert [len(batch) for batch in ssm.send_calls] == [50, 11]
+    assert statuses["i-0"] == HEALTHY
+    assert statuses["i-60"] is None
+    assert stats.summary()["probe"]["count"] == 61
+    assert stats.summary()["probe"]["errors"] == 1
+
+
+def test_probe_instances_resends_around_unregistered_instance():
+    outputs = {f"i-{n}": json.dumps(HEALTHY) for n in range(8)}
+
+    class BootingSSM(FakeSSM):
+        def send_command(self, InstanceIds, DocumentName, Parameters):
+            if "i-booting" in InstanceIds:
+                self.send_calls.append(InstanceIds)
+                raise ClientError(
+                    {"Error": {"Code": "InvalidInstanceId"}}, "SendCommand"
+                )
+            return super().send_command(InstanceIds, DocumentName, Parameters)
+
+    ssm = BootingSSM(outputs)
+    instances = [FakeInstance(f"i-{n}", ssm) for n in range(8)]
+    instances.insert(3, FakeInstance("i-booting", ssm))
+    stats = RequestStats()
+
+    statuses = reconciler.probe_instances(instances, stats=stats)
+
+    assert all(statuses[f"i-{n}"] == HEALTHY for n in range(8))
+    assert statuses["i-booting"] is None
+    assert ["i-booting"] in ssm.send_calls
+    assert stats.summary()["probe"]["count"] == 9
+    assert stats.summary()["probe"]["errors"] == 1
+
+
+@pytest.mark.parametrize("code", ["ThrottlingException", "AccessDeniedException"])
+def test_probe_instances_does_not_split_on_other_errors(code):
+    class FailingSSM(FakeSSM):
+        def send_command(self, InstanceIds, DocumentName, Parameters):
+            self.send_calls.append(InstanceIds)
+            raise ClientError({"Error": {"Code": code}}, "SendCommand")
+
+    ssm = FailingSSM({})
+    instances = [FakeInstance(f"i-{n}", ssm) for n in range(50)]
+
+    with pytest.raises(ClientError):
+        reconciler.probe_instances(instances)
+
+    assert len(ssm.send_calls) == 1
+
+
+def test_reconcile_asg_configures_only_unhealthy(monkeypatch):
+    ssm = FakeSSM(
+        {
+            "i-healthy": json.dumps(HEALTHY),
+            "i-broken": json.dumps({**HEALTHY, "connected": False}),
+            "i-new": json.dumps(HEALTHY),
+        }
+    )
+    instances = [
+        FakeInstance(instance_id, ssm)
+        for instance_id in ("i-healthy", "i-broken", "i-new", "i-silent")
+    ]
+    monkeypatch.setattr(
+        reconciler,
+        "ASG",
+        lambda *args, **kwargs: type("A", (), {"instances": instances}),
+    )
+    configured = []
+
+    def ensure_pmm_clients(**kwargs):
+        (instances,) = kwargs["groups"].values()
+        configured.append([inst.instance_id for inst in instances])
+        assert kwargs["existing_service_ids"] == {"i-broken": "s2"}
+        return {inst.instance_id: None for inst in instances}
+
+    monkeypatch.setattr(reconciler, "ensure_pmm_clients", ensure_pmm_clients)
+    existing = [
+        {"service_name": "db/ip-i-healthy", "service_id": "s1"},
+        {"service_name": "db/ip-i-broken", "service_id": "s2"},
+        {"service_name": "db/ip-i-gone", "service_id": "s3"},
+    ]
+    removed = []
+
+    class FakePMM:
+        def remove_services(self, service_ids):
+            removed.extend(service_ids)
+            return [None] * len(service_ids)
+
+    pmm = FakePMM()
+
+    counts = reconciler.reconcile_asg(
+        {"asg_name": "db", "service_type": "mysql", "port": 3306, "username": "m"},
+        pmm,
+        pmm_host="10.0.0.5",
+        pmm_password="secret",
+        existing_services=existing,
+    )
+
+    # One parallel setup; the instance that did not answer the probe is
+    # left alone.
+    assert configured == [["i-broken", "i-new"]]
+    assert counts == {
+        "added": 1,
+        "removed": 1,
+        "skipped": 1,
+        "retuned": 0,
+        "upgraded": 0,
+        "unreachable": 1,
+        "deferred": 0,
+    }
+    assert removed == ["s3"]
+
+
+def test_reconcile_asg_defers_setup_near_deadline(monkeypatch):
+    ssm = FakeSSM({"i-new": json.dumps(HEALTHY)})
+    monkeypatch.setattr(
+        reconciler,
+        "ensure_pmm_clients",
+        lambda **kwargs: pytest.fail("setup started without time to finish"),
+    )
+
+    counts = reconciler.reconcile_asg(
+        {"asg_name": "db", "service_type": "mysql", "port": 3306, "username": "m"},
+        None,
+        pmm_host="10.0.0.5",
+        pmm_password="secret",
+        existing_services=[],
+        instances=[FakeInstance("i-new", ssm)],
+        deadline=reconciler.monotonic() + reconciler.SETUP_MIN_SECONDS - 1,
+    )
+
+    assert counts["deferred"] == 1
+    assert counts["added"] == 0
+
+
+def test_reconcile_asg_reports_setup_failures(monkeypatch):
+    ssm = FakeSSM({"i-new": json.dumps(HEALTHY)})
+    monkeypatch.setattr(
+        reconciler,
+        "ensure_pmm_clients",
+        lambda **kwargs: {"i-new": "exit_code=1"},
+    )
+    kwargs = {
+        "asg_config": {
+            "asg_name": "db",
+            "service_type": "mysql",
+            "port": 3306,
+            "username": "m",
+        },
+        "pmm": None,
+        "pmm_host": "10.0.0.5",
+        "pmm_password": "secret",
+        "existing_services": [],
+        "instances": [FakeInstance("i-new", ssm)],
+    }
+    errors = []
+
+    counts = reconciler.reconcile_asg(**kwargs, errors=errors)
+
+    assert errors == ["db: pmm-client setup failed on i-new: exit_code=1"]
+    assert counts["added"] == 0
+    with pytest.raises(RuntimeError, match="i-new"):
+        reconciler.reconcile_asg(**kwargs)
+
+
+def test_configure_asgs_sets_up_all_asgs_at_once(monkeypatch):
+    ssm = FakeSSM({"i-1": json.dumps(HEALTHY), "i-2": json.dumps(HEALTHY)})
+    calls = []
+
+    def ensure_pmm_clients(**kwargs):
+        calls.append(
+            sorted(
+                [inst.instance_id for inst in instances]
+                for instances in kwargs["groups"].values()
+            )
+        )
+        return {
+            inst.instance_id: None
+            for instances in kwargs["groups"].values()
+            for inst in instances
+        }
+
+    monkeypatch.setattr(reconciler, "ensure_pmm_clients", ensure_pmm_clients)
+    plans = [
+        reconciler.plan_asg(
+            {"asg_name": name, "service_type": "mysql", "port": 3306, "username": "m"},
+            None,
+            existing_services=[],
+            instances=[FakeInstance(instance_id, ssm)],
+        )
+        for name, instance_id in (("db1", "i-1"), ("db2", "i-2"))
+    ]
+
+    failures = reconciler.configure_asgs(
+        plans, None, pmm_host="10.0.0.5", pmm_password="secret"
+    )
+
+    # One fan-out; each ASG has its own config, so its own command.
+    assert calls == [[["i-1"], ["i-2"]]]
+    assert [reconciler.finish_asg(plan, failures, None)["added"] for plan in plans] == [
+        1,
+        1,
+    ]
+
+
+class SetupSSM(FakeSSM):
+    """Records setup commands; ``exit_codes`` are their exit codes."""
+
+    def __init__(self, exit_codes, output=""):
+        super().__init__({})
+        self.exit_codes = exit_codes
+        self.output = output
+        self.parameters = []
+
+    def send_command(self, InstanceIds, DocumentName, Parameters):
+        self.parameters.append(Parameters)
+        command_id = super().send_command(InstanceIds, DocumentName, Parameters)
+        self.invocations[command_id["Command"]["CommandId"]] = [
+            {
+                "InstanceId": instance_id,
+                "Status": "Success" if self.exit_codes[instance_id] == 0 else "Failed",
+                "CommandPlugins": [
+                    {
+                        "Output": self.output,
+                        "ResponseCode": self.exit_codes[instance_id],
+                    }
+                ],
+            }
+            for instance_id in InstanceIds
+        ]
+        return command_id
+
+
+def test_ensure_pmm_clients_sends_one_command_per_config():
+    ssm = SetupSSM({"i-1": 0, "i-2": 1, "i-3": 0})
+    instances = [
+        FakeInstance(instance_id, ssm) for instance_id in ("i-1", "i-2", "i-3")
+    ]
+    stats = RequestStats()
+
+    failures = reconciler.ensure_pmm_clients(
+        groups={"Y29uZmln": instances[:2], "cmVyZWdpc3Rlcg==": instances[2:]},
+        pmm=None,
+        stats=stats,
+    )
+
+    assert failures == {"i-1": None, "i-2": "exit_code=1", "i-3": None}
+    assert ssm.send_calls == [["i-1", "i-2"], ["i-3"]]
+    assert ssm.parameters[0]["executionTimeout"] == ["300"]
+    assert stats.summary()["setup"]["count"] == 3
+    assert stats.summary()["setup"]["errors"] == 1
+
+
+def test_probe_instances_sends_failed_probes_to_setup():
+    # i-failed ran the probe, which failed (e.g. a dpkg lock); i-gone never
+    # got it.
+    ssm = SetupSSM({"i-ok": 0, "i-failed": 1, "i-gone": -1}, output=json.dumps(HEALTHY))
+    instances = [
+        FakeInstance(instance_id, ssm) for instance_id in ("i-ok", "i-failed", "i-gone")
+    ]
+
+    statuses = reconciler.probe_instances(instances)
+
+    assert statuses == {"i-ok": HEALTHY, "i-failed": {}, "i-gone": None}
+    plan = reconciler.plan_asg(
+        {"asg_name": "db", "service_type": "mysql", "port": 3306, "username": "m"},
+        None,
+        existing_services=[
+            {
+                "service_name": f"db/ip-{inst.instance_id}",
+                "service_id": inst.instance_id,
+            }
+            for inst in instances
+        ],
+        instances=instances,
+        statuses=statuses,
+    )
+    assert sorted(plan.to_configure) == ["db/ip-i-failed"]
+    assert plan.counts["unreachable"] == 1
+
+
+def test_ensure_pmm_clients_removes_stale_service_and_retries():
+    ssm = SetupSSM({"i-1": 1}, output="Service with name db/ip-i-1 already exists")
+    removed = []
+
+    class FakePMM:
+        def remove_service(self, service_id):
+            removed.append(service_id)
+            ssm.exit_codes["i-1"] = 0
+
+    failures = reconciler.ensure_pmm_clients(
+        groups={"Y29uZmln": [FakeInstance("i-1", ssm)]},
+        pmm=FakePMM(),
+        existing_service_ids={"i-1": "s1"},
+    )
+
+    assert failures == {"i-1": None}
+    assert removed == ["s1"]
+    assert ssm.send_calls == [["i-1"], ["i-1"]]
+
+
+def test_record_inventory_snapshots_the_planned_nodes(monkeypatch):
+    saved = []
+    monkeypatch.setattr(reconciler.boto3, "client", lambda *args, **kwargs: None)
+    monkeypatch.setattr(reconciler, "load_latest", lambda s3_client, bucket: None)
+    monkeypatch.setattr(
+        reconciler,
+        "save",
+        lambda s3_client, bucket, snapshot: saved.append(snapshot) or "key",
+    )
+
+    changes = reconciler.record_inventory(
+        [{"service_id": "s1", "service_name": "db/ip-1", "node_id": "n1"}],
+        [{"node_id": "n1", "node_name": "ip-1"}],
+        {"mysqld_exporter": [{"agent_id": "e1", "service_id": "s1"}]},
+        {"db": {"i-1": "ip-1"}},
+    )
+
+    assert changes == {}
+    assert saved[0]["nodes"] == {"n1": {"name": "ip-1"}}
+
+
+def test_lambda_handler_records_history_when_an_error_escapes(monkeypatch):
+    monkeypatch.setattr(
+        reconciler,
+        "MONITORED_ASGS_CONFIG",
+        json.dumps([{"asg_name": "db", "service_type": "mysql"}]),
+    )
+    monkeypatch.setattr(reconciler, "HISTORY_BUCKET", "history")
+    monkeypatch.setattr(
+        reconciler, "Secret", lambda *args, **kwargs: SimpleNamespace(value="pw")
+    )
+    monkeypatch.setattr(
+        reconciler,
+        "PMMClient",
+        lambda **kwargs: SimpleNamespace(services=[], agents={}, stats=RequestStats()),
+    )
+
+    class BrokenASG:
+        def __init__(self, name, region):
+            pass
+
+        @property
+        def instances(self):
+            raise ClientError(
+                {"Error": {"Code": "AccessDenied"}}, "DescribeAutoScalingGroups"
+            )
+
+    monkeypatch.setattr(reconciler, "ASG", BrokenASG)
+    records = []
+    monkeypatch.setattr(
+        reconciler,
+        "record_history",
+        lambda record, function_name: records.append(record),
+    )
+
+    with pytest.raises(ClientError):
+        reconciler.lambda_handler({}, None)
+
+    assert [record["failures"] for record in records] == [1]
+    assert "setup" in records[0]["phases"]
+
+
+def test_lambda_handler_keeps_the_error_when_history_fails(monkeypatch):
+    monkeypatch.setattr(
+        reconciler,
+        "MONITORED_ASGS_CONFIG",
+        json.dumps([{"asg_name": "db", "service_type": "mysql"}]),
+    )
+    monkeypatch.setattr(reconciler, "HISTORY_BUCKET", "history")
+    monkeypatch.setattr(
+        reconciler, "Secret", lambda *args, **kwargs: SimpleNamespace(value="pw")
+    )
+
+    class BrokenPMM:
+        stats = RequestStats()
+
+        @property
+        def services(self):
+            raise RuntimeError("PMM is down")
+
+    monkeypatch.setattr(reconciler, "PMMClient", lambda **kwargs: BrokenPMM())
+
+    def record_history(record, function_name):
+        raise EndpointConnectionError(endpoint_url="https://s3.amazonaws.com")
+
+    monkeypatch.setattr(reconciler, "record_history", record_history)
+
+    with pytest.raises(RuntimeError, match="PMM is down"):
+        reconciler.lambda_handler({}, None)
+
+
+def test_lambda_handler_records_history_when_the_secret_fails(monkeypatch):
+    monkeypatch.setattr(
+        reconciler,
+        "MONITORED_ASGS_CONFIG",
+        json.dumps([{"asg_name": "db", "service_type": "mysql"}]),
+    )
+    monkeypatch.setattr(reconciler, "HISTORY_BUCKET", "history")
+
+    def secret(*args, **kwargs):
+        raise ClientError(
+            {"Error": {"Code": "AccessDeniedException"}}, "GetSecretValue"
+        )
+
+    monkeypatch.setattr(reconciler, "Secret", secret)
+    records = []
+    monkeypatch.setattr(
+        reconciler,
+        "record_history",
+        lambda record, function_name: records.append(record),
+    )
+
+    with pytest.raises(ClientError):
+        reconciler.lambda_handler({}, None)
+
+    assert [record["failures"] for record in records] == [1]
+    assert records[0]["pmm_api"] == {}
+
+
+def test_lambda_handler_skips_tail_phases_near_the_timeout(monkeypatch):
+    monkeypatch.setattr(
+        reconciler,
+        "MONITORED_ASGS_CONFIG",
+        json.dumps([{"asg_name": "db", "service_type": "mysql"}]),
+    )
+    monkeypatch.setattr(reconciler, "HISTORY_BUCKET", "history")
+    monkeypatch.setattr(reconciler, "GC_ENABLED", True)
+    monkeypatch.setattr(
+        reconciler, "Secret", lambda *args, **kwargs: SimpleNamespace(value="pw")
+    )
+    monkeypatch.setattr(
+        reconciler,
+        "PMMClient",
+        lambda **kwargs: SimpleNamespace(services=[], agents={}, stats=RequestStats()),
+    )
+    monkeypatch.setattr(
+        reconciler, "ASG", lambda *args, **kwargs: SimpleNamespace(instances=[])
+    )
+    monkeypatch.setattr(
+        reconciler,
+        "OrphanCollector",
+        lambda *args, **kwargs: pytest.fail("orphan collection started too late"),
+    )
+    records = []
+    monkeypatch.setattr(
+        reconciler,
+        "record_history",
+        lambda record, function_name: records.append(record),
+    )
+    context = SimpleNamespace(
+        function_name="pmm-reconciler",
+        get_remaining_time_in_millis=lambda: (
+            reconciler.TAIL_PHASE_SECONDS + reconciler.HISTORY_SECONDS - 1
+        )
+        * 1000,
+    )
+
+    with pytest.raises(RuntimeError, match="gc: skipped"):
+        reconciler.lambda_handler({}, context)
+
+    assert [record["failures"] for record in records] == [1]
@@ -0,0 +1,374 @@
+"""
+Load tests for the PMM ASG reconciler against synthetic fleets.
+
+``lambda_handler`` runs end to end against in-memory fakes of the PMM
+server, the ASGs and SSM while the tests sweep fleet size, SSM latency
+distribution and the share of instances that never answer SSM. Waiting
+on SSM is simulated: a virtual clock replaces ``sleep()`` and
+``monotonic()`` in :mod:`fanout` and :mod:`main`, and the pmm-client
+setup document "takes" :data:`CONFIGURE_SECONDS`. A run therefore costs a
+second of CPU but reports the wall time the Lambda would need.
+
+Besides the steady state, where only a scale-out of
+:data:`NEW_INSTANCES` needs the setup script, the tests cover a mass
+scale-out and a cold start, where half or all of the fleet does.
+
+SLOs checked for every scenario:
+
+- simulated wall time fits the Lambda timeout (``lambda.tf``),
+- AWS and PMM API calls per instance,
+- peak Python memory of one run (``tracemalloc``),
+- CPU time of the reconciler itself (pytest-benchmark).
+
+Run with ``make test-load``.
+"""
+
+import json
+import logging
+import math
+import random
+import tracemalloc
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+import fanout
+import main as reconciler
+from pmm_client import RequestStats
+
+# Lambda timeout and memory size from lambda.tf.
+LAMBDA_TIMEOUT = 300
+LAMBDA_MEMORY = 512 * 1024 * 1024
+
+WALL_TIME_SLO = LAMBDA_TIMEOUT - 30
+API_CALLS_PER_INSTANCE_SLO = 1.0
+PEAK_MEMORY_SLO = LAMBDA_MEMORY // 4
+CPU_TIME_SLO = 10
+
+# Simulated run time of the pmm-client setup script on one instance.
+CONFIGURE_SECONDS = 60
+
+# New, not yet registered instances of the first ASG (a scale-out).
+NEW_INSTANCES = 4
+
+# SSM document of the setup script, as lambda.tf configures it.
+SETUP_DOCUMENT = "pmm-setup"
+
+HEALTHY = {
+    "installed": True,
+    "connected": True,
+    "version": "3.1.0-1.noble",
+    "agents": {"node_exporter": "Running", "mysqld_exporter": "Running"},
+}
+
+# Fleet: (ASGs, instances per ASG, PMM services in total).
+FLEETS = {
+    "small": (5, 40, 1000),
+    "large": (50, 40, 10000),
+}
+
+# SSM latency: log-normal with (median seconds, sigma).
+LATENCIES = {
+    "fast": (1.0, 0.5),
+    "heavy_tail": (2.0, 1.2),
+}
+
+# Share of instances that never answer SSM (stopped agent, full disk, ...).
+FAILURE_RATES = {
+    "no_failures": 0.0,
+    "2pct_silent": 0.02,
+}
+
+# Share of each ASG's instances already registered in PMM; the others need
+# the setup script.
+REGISTERED = {
+    "steady": 1.0,
+    "mass_scale_out": 0.5,
+    "cold_start": 0.0,
+}
+
+
+class VirtualClock:
+    """Clock that only moves when something sleeps or "runs"."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeSSM:
+    """
+    SSM client whose invocations finish after a sampled latency.
+
+    Silent instances stay ``InProgress`` forever.
+    """
+
+    def __init__(self, fleet):
+        self._fleet = fleet
+        self._invocations = {}
+
+    def send_command(self, InstanceIds, DocumentName, Parameters, **kwargs):
+        fleet = self._fleet
+        fleet.calls["ssm:SendCommand"] += 1
+        command_id = f"cmd-{fleet.calls['ssm:SendCommand']}"
+        if DocumentName == SETUP_DOCUMENT:
+            fleet.configured.extend(InstanceIds)
+            run_time, output = CONFIGURE_SECONDS, "pmm-client setup complete"
+        else:
+            run_time, output = 0, json.dumps(HEALTHY)
+        self._invocations[command_id] = (
+            output,
+            {
+                instance_id: (
+                    math.inf
+                    if instance_id in fleet.silent
+                    else fleet.clock.now
+                    + run_time
+                    + fleet.rng.lognormvariate(*fleet.latency)
+                )
+                for instance_id in InstanceIds
+            },
+        )
+        return {"Command": {"CommandId": command_id}}
+
+    def get_paginator(self, name):
+        assert name == "list_command_invocations"
+        return self
+
+    def paginate(self, CommandId, Details):
+        self._fleet.calls["ssm:ListCommandInvocations"] += 1
+        now = self._fleet.clock.now
+        output, invocations = self._invocations[CommandId]
+        yield {
+            "CommandInvocations": [
+                {
+                    "InstanceId": instance_id,
+                    "Status": "Success" if now >= done_at else "InProgress",
+                    "CommandPlugins": [{"Output": output, "ResponseCode": 0}],
+                }
+                for instance_id, done_at in invocations.items()
+            ]
+        }
+
+
+class FakeInstance:
+    """Stand-in for ``ASGInstance``."""
+
+    def __init__(self, instance_id, fleet):
+        self.instance_id = instance_id
+        self.hostname = f"ip-{instance_id}"
+        self.private_ip = "10.0.0.1"
+        self._fleet = fleet
+
+    @property
+    def ssm_client(self):
+        return self._fleet.ssm
+
+
+class FakePMM:
+    """PMM client serving a pre-built inventory as JSON, like the API."""
+
+    def __init__(self, fleet, services, agents):
+        self._fleet = fleet
+        self._services = json.dumps(services)
+        self._agents = json.dumps(agents)
+        self.stats = RequestStats()
+
+    @property
+    def services(self):
+        self._fleet.calls["pmm:ListServices"] += 1
+        return json.loads(self._services)
+
+    @property
+    def agents(self):
+        self._fleet.calls["pmm:ListAgents"] += 1
+        return json.loads(self._agents)
+
+    def remove_service(self, service_id):
+        self._fleet.calls["pmm:RemoveService"] += 1
+
+    def remove_services(self, service_ids):
+        for service_id in service_ids:
+            self.remove_service(service_id)
+        return [None] * len(service_ids)
+
+
+class Fleet:
+    """
+    Synthetic fleet: ASGs of instances, the PMM services of the
+    ``registered`` share of them plus unrelated ones, one terminated
+    instance per ASG still registered in PMM (none on a cold start), and
+    :data:`NEW_INSTANCES` unregistered ones in the first ASG.
+    """
+
+    def __init__(
+        self, asg_count, per_asg, service_count, latency, failure_rate, registered
+    ):
+        self.latency = (math.log(latency[0]), latency[1])
+        self.clock = VirtualClock()
+        self.calls = Counter()
+        self.configured = []
+        self.rng = random.Random(0)
+        self.ssm = FakeSSM(self)
+        self.asgs = {
+            f"db-{a}": [FakeInstance(f"i-{a:03d}{n:04d}", self) for n in range(per_asg)]
+            for a in range(asg_count)
+        }
+        services = [
+            {
+                "service_name": f"{asg_name}/{inst.hostname}",
+                "service_id": f"s-{inst.instance_id}",
+            }
+            for asg_name, members in self.asgs.items()
+            for inst in members[: round(per_asg * registered)]
+        ]
+        self.terminated = [] if registered == 0 else list(self.asgs)
+        services += [
+            {"service_name": f"{asg_name}/ip-terminated", "service_id": f"t-{asg_name}"}
+            for asg_name in self.terminated
+        ]
+        services += [
+            {"service_name": f"other/ip-{n}", "service_id": f"o-{n}"}
+            for n in range(max(service_count - len(services), 0))
+        ]
+        self.asgs["db-0"] += [
+            FakeInstance(f"i-new{n:04d}", self) for n in range(NEW_INSTANCES)
+        ]
+        instances = [inst for members in self.asgs.values() for inst in members]
+        self.silent = {
+            inst.instance_id
+            for inst in random.Random(1).sample(
+                instances, round(len(instances) * failure_rate)
+            )
+        }
+        agents = {
+            "mysqld_exporter": [
+                {"agent_id": f"e-{svc['service_id']}", "service_id": svc["service_id"]}
+                for svc in services
+            ],
+            "qan_mysql_perfschema_agent": [
+                {"agent_id": f"q-{svc['service_id']}", "service_id": svc["service_id"]}
+                for svc in services
+            ],
+        }
+        self.pmm = FakePMM(self, services, agents)
+        self.instance_count = len(instances)
+
+    @property
+    def config(self):
+        return [
+            {"asg_name": name, "service_type": "mysql", "port": 3306, "username": "m"}
+            for name in self.asgs
+        ]
+
+    def run(self):
+        """Run the Lambda once from a clean clock and call counter."""
+        self.clock.now = 0.0
+        self.calls.clear()
+        self.configured.clear()
+        self.rng.seed(0)
+        return reconciler.lambda_handler({}, None)
+
+
+def _scenarios():
+    for fleet in FLEETS:
+        for latency in LATENCIES:
+            for failures in FAILURE_RATES:
+                for registered in REGISTERED:
+                    yield pytest.param(
+                        FLEETS[fleet],
+                        LATENCIES[latency],
+                        FAILURE_RATES[failures],
+                        REGISTERED[registered],
+                        id=f"{fleet}-{latency}-{failures}-{registered}",
+                    )
+
+
+@pytest.fixture
+def make_fleet(monkeypatch, caplog):
+    """Build a fleet and point the reconciler at its fakes."""
+    # Per-instance INFO logs would dominate time and memory in the capture.
+    caplog.set_level(logging.WARNING, logger=reconciler.LOG.name)
+    caplog.set_level(logging.WARNING, logger=fanout.LOG.name)
+
+    def make(fleet_size, latency, failure_rate, registered):
+        fleet = Fleet(*fleet_size, latency, failure_rate, registered)
+        monkeypatch.setattr(fanout, "monotonic", fleet.clock.monotonic)
+        monkeypatch.setattr(fanout, "sleep", fleet.clock.sleep)
+        monkeypatch.setattr(reconciler, "monotonic", fleet.clock.monotonic)
+        monkeypatch.setattr(reconciler, "SETUP_DOCUMENT", SETUP_DOCUMENT)
+        monkeypatch.setattr(reconciler, "SETUP_DOCUMENT_VERSION", "1")
+        monkeypatch.setattr(
+            reconciler, "MONITORED_ASGS_CONFIG", json.dumps(fleet.config)
+        )
+        monkeypatch.setattr(reconciler, "PMM_HOST", "10.0.0.5")
+        monkeypatch.setattr(reconciler, "PMM_CLIENT_UPGRADE_ENABLED", False)
+        monkeypatch.setattr(
+            reconciler, "Secret", lambda *args, **kwargs: SimpleNamespace(value="pw")
+        )
+        monkeypatch.setattr(reconciler, "PMMClient", lambda **kwargs: fleet.pmm)
+        monkeypatch.setattr(
+            reconciler,
+            "ASG",
+            lambda name, **kwargs: SimpleNamespace(instances=fleet.asgs[name]),
+        )
+        return fleet
+
+    return make
+
+
+@pytest.mark.parametrize(
+    "fleet_size, latency, failure_rate, registered", list(_scenarios())
+)
+def test_reconcile_fleet_slo(
+    benchmark, make_fleet, fleet_size, latency, failure_rate, registered
+):
+    fleet = make_fleet(fleet_size, latency, failure_rate, registered)
+
+    result = benchmark.pedantic(fleet.run, rounds=3, iterations=1)
+
+    # Correctness first: every instance is skipped, configured once, or
+    # reported as unreachable, and none is deferred to the next run, even
+    # on a cold start; every terminated instance is removed.
+    assert result["status"] == "ok"
+    assert len(fleet.configured) == len(set(fleet.configured)) == result["added"]
+    assert (
+        result["skipped"] + result["added"] + result["unreachable"] + result["deferred"]
+        == fleet.instance_count
+    )
+    assert result["unreachable"] >= len(fleet.silent)
+    assert result["deferred"] == 0
+    assert result["removed"] == len(fleet.terminated)
+
+    api_calls = sum(fleet.calls.values())
+    benchmark.extra_info.update(
+        {
+            "instances": fleet.instance_count,
+            "simulated_wall_time": fleet.clock.now,
+            "api_calls_per_instance": api_calls / fleet.instance_count,
+            "calls": dict(fleet.calls),
+        }
+    )
+
+    tracemalloc.start()
+    try:
+        fleet.run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info["peak_memory"] = peak
+
+    assert api_calls / fleet.instance_count <= API_CALLS_PER_INSTANCE_SLO
+    assert peak <= PEAK_MEMORY_SLO
+    if benchmark.stats:
+        assert benchmark.stats.stats.max <= CPU_TIME_SLO
+    assert fleet.clock.now <= WALL_TIME_SLO, (
+        f"{fleet.instance_count} instances need {fleet.clock.now:.0f} s "
+        f"(Lambda timeout {LAMBDA_TIMEOUT} s)"
+    )
@@ -0,0 +1,181 @@
+"""Tests for bulk RDS registration (pmm_tools.register_rds)."""
+
+import io
+import threading
+
+import pytest
+import requests
+
+from pmm_tools import register_rds
+
+MANIFEST = """
+- address: orders.rds.amazonaws.com
+  database: orders
+  credentials_secret: secret-orders
+- address: billing.rds.amazonaws.com
+  engine: mysql
+  service_name: billing-db
+  credentials_secret: secret-billing
+  query_analytics: false
+- address: legacy.rds.amazonaws.com
+  credentials_secret: secret-orders
+- address: reports.rds.amazonaws.com
+  port: 5433
+  credentials_secret: secret-orders
+"""
+
+
+class FakePMM:
+    """PMM client; add_service blocks until ``parallel`` calls are in flight."""
+
+    def __init__(self, services=(), parallel=1, fail=()):
+        self.services = list(services)
+        self.pmm_agents = [{"agent_id": "a-server", "runs_on_node_id": "pmm-server"}]
+        self.added = []
+        self.fail = set(fail)
+        self._barrier = threading.Barrier(parallel, timeout=5)
+
+    def add_service(self, payload):
+        self._barrier.wait()
+        (service,) = payload.values()
+        if service["service_name"] in self.fail:
+            raise requests.exceptions.ConnectionError("connection refused")
+        self.added.append(payload)
+        return {}
+
+
+def test_load_manifest_fills_defaults():
+    endpoints = register_rds.load_manifest(io.StringIO(MANIFEST))
+
+    assert [(e["engine"], e["port"], e["service_name"]) for e in endpoints] == [
+        ("postgresql", 5432, "postgresql-orders.rds.amazonaws.com"),
+        ("mysql", 3306, "billing-db"),
+        ("postgresql", 5432, "postgresql-legacy.rds.amazonaws.com"),
+        ("postgresql", 5433, "postgresql-reports.rds.amazonaws.com"),
+    ]
+    assert endpoints[1]["query_analytics"] is False
+
+    wrapped = register_rds.load_manifest(
+        io.StringIO('{"endpoints": [{"address": "a", "credentials_secret": "s"}]}')
+    )
+    assert wrapped[0]["address"] == "a"
+
+
+@pytest.mark.parametrize(
+    "manifest",
+    [
+        "- engine: postgresql\n  credentials_secret: s",
+        "- address: a\n  engine: oracle\n  credentials_secret: s",
+        "- address: a",
+        "address: a",
+    ],
+)
+def test_load_manifest_rejects_invalid(manifest):
+    with pytest.raises(ValueError):
+        register_rds.load_manifest(io.StringIO(manifest))
+
+
+def test_register_skips_existing_and_adds_concurrently():
+    existing = [
+        # Same service name.
+        {"service_name": "billing-db", "address": "10.0.0.9", "port": 3306},
+        # Same address and port, other name.
+        {"service_name": "legacy", "address": "legacy.rds.amazonaws.com", "port": 5432},
+        # Same address, other port: not the same database.
+        {"service_name": "r", "address": "reports.rds.amazonaws.com", "port": 5432},
+    ]
+    pmm = FakePMM(existing, parallel=2)
+    secrets = []
+
+    def get_credentials(secret):
+        secrets.append(secret)
+        return {"username": "pmm", "password": "pw"}
+
+    results = register_rds.register(
+        pmm, register_rds.load_manifest(io.StringIO(MANIFEST)), get_credentials
+    )
+
+    assert [result.status for result in results] == [
+        "added",
+        "exists",
+        "exists",
+        "added",
+    ]
+    assert secrets == ["secret-orders"]
+    assert all(result.latency_ms is not None for result in results[::3])
+    added = {
+        payload["postgresql"]["service_name"]: payload["postgresql"]
+        for payload in pmm.added
+    }
+    orders = added["postgresql-orders.rds.amazonaws.com"]
+    assert orders["pmm_agent_id"] == "a-server"
+    assert orders["database"] == "orders"
+    assert added["postgresql-reports.rds.amazonaws.com"]["port"] == 5433
+
+
+def test_register_reports_failures():
+    pmm = FakePMM(fail={"billing-db"})
+
+    results = register_rds.register(
+        pmm,
+        register_rds.load_manifest(io.StringIO(MANIFEST))[:2],
+        lambda secret: {"username": "pmm", "password": "pw"},
+        max_workers=1,
+    )
+
+    assert [result.status for result in results] == ["added", "failed"]
+    assert "connection refused" in results[1].detail
+
+
+def test_register_fails_endpoints_with_bad_secrets():
+    pmm = FakePMM()
+    secrets = {
+        # No password.
+        "secret-orders": {"username": "pmm"},
+        "ok": {"username": "pmm", "password": "pw"},
+    }
+
+    def get_credentials(secret):
+        if secret not in secrets:
+            raise RuntimeError("AccessDeniedException")
+        return secrets[secret]
+
+    manifest = MANIFEST + "- address: ok.rds.amazonaws.com\n  credentials_secret: ok\n"
+    results = register_rds.register(
+        pmm, register_rds.load_manifest(io.StringIO(manifest)), get_credentials
+    )
+
+    # Each bad secret fails its own endpoints, the others are still added.
+    assert [result.status for result in results] == ["failed"] * 4 + ["added"]
+    assert "username and password" in results[0].detail
+    assert "AccessDeniedException" in results[1].detail
+    assert [payload["postgresql"]["address"] for payload in pmm.added] == [
+        "ok.rds.amazonaws.com"
+    ]
+
+
+def test_register_all_existing_reads_no_secrets():
+    endpoints = register_rds.load_manifest(io.StringIO(MANIFEST))
+    pmm = FakePMM([{"service_name": e["service_name"]} for e in endpoints])
+
+    results = register_rds.register(
+        pmm, endpoints, lambda secret: pytest.fail("secret read")
+    )
+
+    assert {result.status for result in results} == {"exists"}
+
+
+def test_format_table():
+    table = register_rds.format_table(
+        [
+            register_rds.Result("orders.rds", "orders", "added", 123.4),
+            register_rds.Result("b.rds", "billing-db", "failed", 5.0, "refused"),
+            register_rds.Result("c.rds", "c", "exists"),
+        ]
+    )
+
+    lines = table.splitlines()
+    assert lines[0].split() == ["ENDPOINT", "SERVICE", "STATUS", "LATENCY", "DETAIL"]
+    assert lines[1].split() == ["orders.rds", "orders", "added", "123", "ms"]
+    assert lines[2].endswith("refused")
+    assert lines[3].split() == ["c.rds", "c", "exists", "-"]
@@ -0,0 +1,110 @@
+"""Unit tests for metrics resolution and collector tuning (lambda/pmm_reconciler/scrape.py)."""
+
+import pytest
+
+import main as reconciler
+from scrape import collectors_drift, resolution_drift, scrape_flags
+from tests.test_qan import decode_config
+
+EXPORTER = {
+    "agent_id": "e1",
+    "service_id": "s1",
+    "disabled_collectors": ["perf_schema.eventsstatements", "info_schema.tables"],
+    "metrics_resolutions": {"hr": "15s", "mr": "30s", "lr": "120s"},
+}
+
+
+def test_scrape_flags():
+    assert scrape_flags({}) == []
+    assert scrape_flags(
+        {"disable_collectors": ["perf_schema.eventsstatements", "info_schema.tables"]}
+    ) == ["--disable-collectors=info_schema.tables,perf_schema.eventsstatements"]
+
+
+@pytest.mark.parametrize(
+    "collectors, drifted",
+    [
+        (["info_schema.tables", "perf_schema.eventsstatements"], False),
+        (["info_schema.tables"], True),
+        ([], True),
+    ],
+)
+def test_collectors_drift(collectors, drifted):
+    agents = {"mysqld_exporter": [EXPORTER]}
+    assert bool(collectors_drift({"disable_collectors": collectors}, agents)) is drifted
+
+
+def test_collectors_drift_without_exporter():
+    assert collectors_drift({"disable_collectors": ["x"]}, {}) == []
+
+
+def test_resolution_drift():
+    agents = {"mysqld_exporter": [EXPORTER]}
+
+    assert resolution_drift({}, agents) is None
+    assert resolution_drift({"resolution": "reduced"}, agents) is None
+    assert resolution_drift({"resolution": "minimal"}, agents) == {
+        "hr": "60s",
+        "mr": "120s",
+        "lr": "300s",
+    }
+    # An exporter at the server resolution reports no resolutions.
+    assert resolution_drift({"resolution": "standard"}, {"mysqld_exporter": [{}]})
+    assert resolution_drift({"resolution": "minimal"}, {}) is None
+
+
+def test_setup_config_passes_disabled_collectors():
+    config = decode_config(
+        reconciler.setup_config(
+            pmm_host="10.0.0.5",
+            pmm_password="secret",
+            db_username="monitor",
+            port=3306,
+            asg_name="db",
+            metrics={"disable_collectors": ["info_schema.tables"]},
+        )
+    )
+
+    assert "--disable-collectors=info_schema.tables" in config["add_args"]
+
+
+def test_apply_resolutions_sets_preset_on_added_services():
+    class FakePMM:
+        services = [
+            {"service_name": "db/ip-1", "service_id": "s1"},
+            {"service_name": "db/ip-2", "service_id": "s2"},
+        ]
+        agents = {
+            "mysqld_exporter": [
+                {"agent_id": "e1", "service_id": "s1"},
+                {**EXPORTER, "agent_id": "e2", "service_id": "s2"},
+            ]
+        }
+
+        def __init__(self):
+            self.changes = []
+
+        def change_agent(self, agent_id, agent_type, changes):
+            self.changes.append((agent_id, agent_type, changes))
+
+    pmm = FakePMM()
+
+    reconciler.apply_resolutions(
+        pmm, {"resolution": "reduced"}, ["db/ip-1", "db/ip-2", "db/ip-missing"]
+    )
+
+    # ip-2 already has the preset; ip-missing did not register.
+    assert pmm.changes == [
+        (
+            "e1",
+            "mysqld_exporter",
+            {"metrics_resolutions": {"hr": "15s", "mr": "30s", "lr": "120s"}},
+        )
+    ]
+
+
+def test_apply_resolutions_without_preset_does_not_list():
+    class NoCalls:
+        pass
+
+    reconciler.apply_resolutions(NoCalls(), {}, ["db/ip-1"])
@@ -0,0 +1,58 @@
+"""Unit tests for the PMM self-monitoring collector (scripts/pmm_self_monitor.py)."""
+
+import subprocess
+
+import pytest
+
+import pmm_self_monitor
+
+
+def test_read_admin_password(tmp_path):
+    env_file = tmp_path / "pmm-server.env"
+    env_file.write_text("FOO=bar\nADMIN_PASSWORD=s3cr=t\n")
+    assert pmm_self_monitor.read_admin_password(str(env_file)) == "s3cr=t"
+
+    env_file.write_text("FOO=bar\n")
+    with pytest.raises(KeyError):
+        pmm_self_monitor.read_admin_password(str(env_file))
+
+
+@pytest.mark.parametrize(
+    "payload, expected",
+    [
+        ({"status": "success", "data": {"result": [{"value": [1, "42.5"]}]}}, 42.5),
+        ({"status": "success", "data": {"result": []}}, None),
+        ({"status": "error", "error": "bad query"}, None),
+    ],
+)
+def test_parse_instant_query(payload, expected):
+    assert pmm_self_monitor.parse_instant_query(payload) == expected
+
+
+def test_collect_skips_unreadable_metrics(monkeypatch):
+    def fake_query(query, password):
+        if "scrape_duration" in query:
+            raise OSError("connection refused")
+        if "hour_metric_ids" in query:
+            return None
+        return 1000.0
+
+    monkeypatch.setattr(pmm_self_monitor, "query_victoriametrics", fake_query)
+    monkeypatch.setattr(pmm_self_monitor, "query_qan_lag", lambda: 75.0)
+
+    metrics = pmm_self_monitor.collect("secret")
+
+    assert metrics == [
+        {"MetricName": "IngestionRate", "Value": 1000.0, "Unit": "Count/Second"},
+        {"MetricName": "QANInsertLag", "Value": 75.0, "Unit": "Seconds"},
+    ]
+
+
+@pytest.mark.parametrize("output, expected", [("120\n", 120.0), ("-1\n", None)])
+def test_query_qan_lag(monkeypatch, output, expected):
+    monkeypatch.setattr(
+        subprocess,
+        "run",
+        lambda *args, **kwargs: subprocess.CompletedProcess(args, 0, stdout=output),
+    )
+    assert pmm_self_monitor.query_qan_lag() == expected
@@ -0,0 +1,158 @@
+"""Unit tests for the pmm-client setup runner (lambda/pmm_reconciler/setup_script.py)."""
+
+import json
+import subprocess
+from base64 import b64decode
+
+import pytest
+from botocore.exceptions import ClientError
+
+import fanout
+import setup_script
+from pmm_client import RequestStats
+from setup_script import SetupRunner, encode_config, inline_command
+
+CONFIG = encode_config(
+    pmm_host="10.0.0.5",
+    pmm_password="it's secret",
+    db_username="monitor",
+    port=3306,
+    asg_name="db",
+    add_args=["--query-source=perfschema"],
+)
+
+
+def test_script_is_valid_bash_without_ssm_placeholders():
+    subprocess.run(["bash", "-n", setup_script.SCRIPT_PATH], check=True)
+    # SSM would substitute "{{ ... }}" in the document.
+    assert "{{" not in setup_script.load_script()
+
+
+def test_encode_config():
+    assert json.loads(b64decode(CONFIG)) == {
+        "pmm_host": "10.0.0.5",
+        "pmm_password": "it's secret",
+        "db_username": "monitor",
+        "port": 3306,
+        "asg_name": "db",
+        "add_args": ["--query-source=perfschema"],
+        "rate_limit_sql": "",
+        "reregister": False,
+    }
+
+
+def test_inline_command_ships_script_and_config():
+    command = inline_command(CONFIG)
+
+    script, config = [part.split(" ", 1)[0] for part in command.split("echo ")[1:]]
+    assert b64decode(script).decode() == setup_script.load_script()
+    assert config == CONFIG
+    assert "rm -f /tmp/pmm-setup.sh /tmp/pmm-setup.conf" in command
+
+
+class FakeSSM:
+    """Every command succeeds at once."""
+
+    def __init__(self, unknown=()):
+        self.sent = []
+        self.unknown = set(unknown)
+
+    def send_command(self, **kwargs):
+        if self.unknown & set(kwargs["InstanceIds"]):
+            raise ClientError({"Error": {"Code": "InvalidInstanceId"}}, "SendCommand")
+        self.sent.append(kwargs)
+        return {"Command": {"CommandId": f"c-{len(self.sent)}"}}
+
+    def get_paginator(self, name):
+        assert name == "list_command_invocations"
+        return self
+
+    def paginate(self, CommandId, Details):
+        yield {
+            "CommandInvocations": [
+                {
+                    "InstanceId": instance_id,
+                    "Status": "Success",
+                    "CommandPlugins": [
+                        {"Output": "pmm-client setup complete\n", "ResponseCode": 0}
+                    ],
+                }
+                for instance_id in self.sent[int(CommandId[2:]) - 1]["InstanceIds"]
+            ]
+        }
+
+
+class Instance:
+    def __init__(self, instance_id, ssm):
+        self.instance_id = instance_id
+        self.ssm_client = ssm
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(fanout, "sleep", lambda _: None)
+
+
+def test_runner_sends_document_reference():
+    ssm = FakeSSM()
+    runner = SetupRunner("pmm-setup", "3")
+
+    results = runner.run(
+        {
+            CONFIG: [Instance("i-1", ssm), Instance("i-2", ssm)],
+            "b3RoZXI=": [Instance("i-3", ssm)],
+        },
+        execution_timeout=120,
+    )
+
+    assert results == {
+        "i-1": (0, "pmm-client setup complete\n"),
+        "i-2": (0, "pmm-client setup complete\n"),
+        "i-3": (0, "pmm-client setup complete\n"),
+    }
+    # One multi-target command per config.
+    assert ssm.sent == [
+        {
+            "InstanceIds": ["i-1", "i-2"],
+            "DocumentName": "pmm-setup",
+            "DocumentVersion": "3",
+            "Parameters": {"config": [CONFIG], "executionTimeout": ["120"]},
+        },
+        {
+            "InstanceIds": ["i-3"],
+            "DocumentName": "pmm-setup",
+            "DocumentVersion": "3",
+            "Parameters": {"config": ["b3RoZXI="], "executionTimeout": ["120"]},
+        },
+    ]
+
+
+def test_runner_ships_script_inline_without_document():
+    ssm = FakeSSM()
+
+    SetupRunner().run({CONFIG: [Instance("i-1", ssm)]}, execution_timeout=120)
+
+    assert ssm.sent == [
+        {
+            "InstanceIds": ["i-1"],
+            "DocumentName": "AWS-RunShellScript",
+            "Parameters": {
+                "commands": [inline_command(CONFIG)],
+                "executionTimeout": ["120"],
+            },
+        }
+    ]
+
+
+def test_runner_reports_instances_ssm_does_not_know():
+    # E.g. an instance still registering with SSM.
+    ssm = FakeSSM(unknown={"i-1"})
+    stats = RequestStats()
+
+    results = SetupRunner("pmm-setup").run(
+        {CONFIG: [Instance("i-1", ssm), Instance("i-2", ssm)]},
+        stats=stats,
+    )
+
+    assert results == {"i-1": None, "i-2": (0, "pmm-client setup complete\n")}
+    assert stats.summary()["setup"]["errors"] == 1
@@ -0,0 +1,76 @@
+"""Unit tests for terraform_apply_concurrently() in tests/conftest.py."""
+
+import threading
+from contextlib import contextmanager
+from subprocess import CalledProcessError
+
+import pytest
+
+from tests import conftest
+from tests.conftest import terraform_apply_concurrently
+
+
+@pytest.fixture
+def fake_apply(monkeypatch):
+    """Replace terraform_apply() with a fake that records what it does."""
+    events = []
+    failing = set()
+    # Both applies must be in progress at the same time to get past it.
+    barrier = threading.Barrier(2, timeout=5)
+
+    @contextmanager
+    def terraform_apply(path, destroy_after=True, json_output=True):
+        events.append(("apply", path))
+        barrier.wait()
+        try:
+            if path in failing:
+                raise CalledProcessError(1, "terraform apply")
+            yield {"path": {"value": path}}
+        finally:
+            if destroy_after:
+                events.append(("destroy", path))
+
+    monkeypatch.setattr(conftest, "terraform_apply", terraform_apply)
+    return events, failing
+
+
+def test_applies_concurrently_and_destroys_all(fake_apply):
+    events, _ = fake_apply
+    dirs = {"percona_server": "test_data/percona_server", "postgres": "/pg"}
+
+    with terraform_apply_concurrently(dirs) as outputs:
+        assert outputs == {
+            "percona_server": {"path": {"value": "test_data/percona_server"}},
+            "postgres": {"path": {"value": "/pg"}},
+        }
+        assert not [event for event in events if event[0] == "destroy"]
+
+    assert sorted(events) == sorted(
+        [("apply", path) for path in dirs.values()]
+        + [("destroy", path) for path in dirs.values()]
+    )
+
+
+def test_keep_after(fake_apply):
+    events, _ = fake_apply
+    with terraform_apply_concurrently({"a": "/a", "b": "/b"}, destroy_after=False):
+        pass
+    assert sorted(events) == [("apply", "/a"), ("apply", "/b")]
+
+
+def test_failed_apply_destroys_the_other_stack(fake_apply):
+    events, failing = fake_apply
+    failing.add("/b")
+
+    with pytest.raises(CalledProcessError):
+        with terraform_apply_concurrently({"a": "/a", "b": "/b"}):
+            pytest.fail("must not be entered")
+
+    assert ("destroy", "/a") in events
+    assert ("destroy", "/b") in events
+
+
+def test_shared_directory_is_rejected():
+    with pytest.raises(ValueError):
+        with terraform_apply_concurrently({"a": "/same", "b": "/same"}):
+            pass
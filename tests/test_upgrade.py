@@ -0,0 +1,226 @@
+"""Unit tests for rolling pmm-client upgrades in the reconciler Lambda."""
+
+import re
+import subprocess
+
+import pytest
+
+import upgrade
+from upgrade import RollingUpgrade, is_older, version_tuple
+
+
+class FakeInstance:
+    """Stand-in for ``ASGInstance``."""
+
+    def __init__(self, instance_id):
+        self.instance_id = instance_id
+        self.hostname = f"ip-{instance_id}"
+        self.private_ip = f"10.0.0.{instance_id[2:]}"
+
+
+class FakePMM:
+    """
+    PMM inventory where every node runs one pmm-agent, keyed by address.
+    Node names are OS hostnames, unlike the instances' ``hostname``.
+    """
+
+    def __init__(self, addresses, connected=True, version=None):
+        self.connected = {address: connected for address in addresses}
+        self.version = version
+
+    @property
+    def nodes(self):
+        return [
+            {"node_id": f"n-{h}", "node_name": f"db-{h}", "address": h}
+            for h in self.connected
+        ]
+
+    @property
+    def pmm_agents(self):
+        return [
+            {
+                "agent_id": f"a-{h}",
+                "runs_on_node_id": f"n-{h}",
+                "connected": c,
+                "version": self.version,
+            }
+            for h, c in self.connected.items()
+        ]
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(upgrade, "sleep", lambda _: None)
+
+
+@pytest.mark.parametrize(
+    "version, expected",
+    [("3.1.0-7.noble", (3, 1, 0)), ("3", (3,)), ("", ()), (None, ())],
+)
+def test_version_tuple(version, expected):
+    assert version_tuple(version) == expected
+
+
+@pytest.mark.parametrize(
+    "installed, target, expected",
+    [
+        ("3.0.0-1.noble", "3.1.0", True),
+        ("3.1.0-1.noble", "3.1.0", False),
+        ("3.2.0-1.noble", "3.1.0", False),
+        ("2.44.0", "3", True),
+        ("3.0.0", "3", False),
+        (None, "3.1.0", False),
+    ],
+)
+def test_is_older(installed, target, expected):
+    assert is_older(installed, target) is expected
+
+
+def test_upgrade_script_rejects_bad_version():
+    with pytest.raises(ValueError):
+        upgrade.upgrade_script("3.1.0; rm -rf /")
+    assert "'3.1.0'" in upgrade.upgrade_script("3.1.0")
+
+
+MADISON = """\
+pmm-client | 3.10.0-1.noble | http://repo.percona.com/pmm3-client/apt noble/main amd64 Packages
+pmm-client | 3.1.2-1.noble | http://repo.percona.com/pmm3-client/apt noble/main amd64 Packages
+pmm-client | 3.1.0-1.noble | http://repo.percona.com/pmm3-client/apt noble/main amd64 Packages
+"""
+
+
+@pytest.mark.parametrize(
+    "target, expected",
+    [
+        ("3.1", "3.1.2-1.noble"),
+        ("3.10", "3.10.0-1.noble"),
+        ("3.1.0", "3.1.0-1.noble"),
+        ("3.1.0-1.noble", "3.1.0-1.noble"),
+        ("3.2", ""),
+    ],
+)
+def test_upgrade_script_matches_whole_version_components(target, expected):
+    script = upgrade.upgrade_script(target)
+    awk = re.search(r"\| (awk .*?')\)", script, re.DOTALL).group(1)
+
+    candidate = subprocess.run(
+        ["bash", "-c", awk], input=MADISON, capture_output=True, text=True, check=True
+    ).stdout
+
+    assert candidate.strip() == expected
+
+
+def make_upgrade(pmm, batch_size=2, max_unavailable=2):
+    rolling = RollingUpgrade(
+        pmm=pmm,
+        target_version="3.1.0",
+        batch_size=batch_size,
+        max_unavailable=max_unavailable,
+        parameter_name="/test/upgrade-state",
+        region="us-east-1",
+        deadline=float("inf"),
+    )
+    rolling._progress = {"target_version": "3.1.0", "asgs": {}}
+    return rolling
+
+
+def test_run_upgrades_in_batches(monkeypatch):
+    instances = [FakeInstance(f"i-{n}") for n in range(5)]
+    statuses = {inst.instance_id: {"version": "3.0.0-1"} for inst in instances}
+    statuses["i-4"] = {"version": "3.1.0-1"}
+    batches = []
+    monkeypatch.setattr(
+        upgrade,
+        "run_on_instances",
+        lambda batch, command, timeout: batches.append(
+            [inst.instance_id for inst in batch]
+        )
+        or {inst.instance_id: (0, "3.1.0-1") for inst in batch},
+    )
+    rolling = make_upgrade(FakePMM([inst.private_ip for inst in instances]))
+
+    assert rolling.run("db", instances, statuses) == 4
+    assert batches == [["i-0", "i-1"], ["i-2", "i-3"]]
+    assert rolling._progress["asgs"]["db"]["in_progress"] == {}
+    assert rolling._progress["asgs"]["db"]["upgraded"] == 4
+
+
+def test_run_stops_when_agent_does_not_reconnect(monkeypatch):
+    instances = [FakeInstance(f"i-{n}") for n in range(4)]
+    statuses = {inst.instance_id: {"version": "3.0.0-1"} for inst in instances}
+    batches = []
+    monkeypatch.setattr(
+        upgrade,
+        "run_on_instances",
+        lambda batch, command, timeout: batches.append(batch)
+        or {inst.instance_id: (0, "") for inst in batch},
+    )
+    monkeypatch.setattr(upgrade, "RECONNECT_TIMEOUT", 0)
+    pmm = FakePMM([inst.private_ip for inst in instances], connected=False)
+    rolling = make_upgrade(pmm, batch_size=1, max_unavailable=1)
+
+    assert rolling.run("db", instances, statuses) == 0
+    assert len(batches) == 1
+    assert list(rolling._progress["asgs"]["db"]["in_progress"]) == ["i-0"]
+
+    # Next run: the agent reconnected with the new version, so the
+    # pending upgrade is verified and the rollout moves on.
+    pmm.connected["10.0.0.0"] = True
+    statuses["i-0"] = {"version": "3.1.0-1"}
+    rolling.run("db", instances, statuses)
+    assert rolling._progress["asgs"]["db"]["upgraded"] == 1
+    assert len(batches) == 2
+
+
+def test_run_records_failures(monkeypatch):
+    instances = [FakeInstance("i-0")]
+    monkeypatch.setattr(
+        upgrade,
+        "run_on_instances",
+        lambda batch, command, timeout: {"i-0": (1, "apt failed")},
+    )
+    rolling = make_upgrade(FakePMM(["10.0.0.0"]))
+
+    for _ in range(upgrade.MAX_UPGRADE_ATTEMPTS + 1):
+        rolling.run("db", instances, {"i-0": {"version": "3.0.0"}})
+
+    assert (
+        rolling._progress["asgs"]["db"]["failures"]["i-0"]
+        == upgrade.MAX_UPGRADE_ATTEMPTS
+    )
+
+
+def test_run_waits_for_the_target_version(monkeypatch):
+    # The agent reconnects, but still reports the old version.
+    instances = [FakeInstance("i-0")]
+    monkeypatch.setattr(
+        upgrade,
+        "run_on_instances",
+        lambda batch, command, timeout: {"i-0": (0, "3.1.0-1")},
+    )
+    monkeypatch.setattr(upgrade, "RECONNECT_TIMEOUT", 0)
+    pmm = FakePMM(["10.0.0.0"], version="3.0.0")
+    rolling = make_upgrade(pmm)
+
+    assert rolling.run("db", instances, {"i-0": {"version": "3.0.0"}}) == 0
+    assert list(rolling._progress["asgs"]["db"]["in_progress"]) == ["i-0"]
+
+    pmm.version = "3.1.0"
+    assert rolling.run("db", instances, {"i-0": {"version": "3.1.0-1"}}) == 1
+
+
+def test_run_matches_nodes_by_address(monkeypatch):
+    # The OS hostname PMM registered differs from the instance's hostname;
+    # the current agent is still found, so nothing is upgraded again.
+    instances = [FakeInstance("i-0")]
+    monkeypatch.setattr(
+        upgrade,
+        "run_on_instances",
+        lambda *args, **kwargs: pytest.fail("current agent upgraded again"),
+    )
+    pmm = FakePMM(["10.0.0.0"], version="3.1.0-1")
+    assert pmm.nodes[0]["node_name"] != instances[0].hostname
+    rolling = make_upgrade(pmm)
+
+    assert rolling.run("db", instances, {"i-0": {"version": "3.1.0-1"}}) == 0
+    assert rolling._progress["asgs"]["db"]["in_progress"] == {}
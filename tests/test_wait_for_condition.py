@@ -0,0 +1,123 @@
+"""Unit tests for the concurrent wait helpers in tests/conftest.py."""
+
+import threading
+
+import pytest
+
+from tests import conftest
+from botocore.exceptions import ClientError
+
+from tests.conftest import CheckAborted, check_in_parallel, wait_for_condition
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock advanced by time.sleep()."""
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(conftest.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(conftest.time, "sleep", sleep)
+    return sleeps
+
+
+def test_wait_for_condition_polls_pending_targets_together(clock):
+    # Node "a" becomes ready on the 2nd round, "b" on the 4th.
+    ready_after = {"a": 2, "b": 4}
+    calls = []
+
+    def check(pending):
+        calls.append(sorted(pending))
+        return [name for name in pending if len(calls) >= ready_after[name]]
+
+    readiness = wait_for_condition(
+        {"a": 1, "b": 2}, check, deadline=600, description="test", initial_delay=5
+    )
+
+    assert calls == [["a", "b"], ["a", "b"], ["b"], ["b"]]
+    assert clock == [5, 10, 20]
+    assert readiness == {"a": 5, "b": 35}
+
+
+def test_wait_for_condition_shared_deadline(clock):
+    readiness = wait_for_condition(
+        {"a": 1, "b": 2},
+        lambda pending: ["a"],
+        deadline=60,
+        description="test",
+        initial_delay=10,
+        max_delay=30,
+    )
+    assert readiness == {"a": 0, "b": None}
+    # Backoff is capped and the last sleep is cut short at the deadline.
+    assert clock == [10, 20, 30]
+    assert sum(clock) == 60
+
+
+def test_wait_for_condition_check_error_is_not_ready(clock):
+    calls = []
+
+    def check(pending):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("SSM throttled")
+        return list(pending)
+
+    assert wait_for_condition({"a": 1}, check, 60, "test") == {"a": 5}
+
+
+def test_check_in_parallel_runs_predicates_concurrently():
+    targets = {f"i-{n}": n for n in range(4)}
+    barrier = threading.Barrier(len(targets), timeout=5)
+
+    def predicate(n):
+        # Only passes if all four predicates run at the same time.
+        barrier.wait()
+        if n == 3:
+            raise TimeoutError("unreachable")
+        return n % 2 == 0
+
+    assert sorted(check_in_parallel(predicate)(targets)) == ["i-0", "i-2"]
+
+
+@pytest.mark.parametrize(
+    "error, retried",
+    [
+        (
+            ClientError({"Error": {"Code": "Throttling"}}, "DescribeInstanceRefreshes"),
+            True,
+        ),
+        (
+            ClientError(
+                {"Error": {"Code": "AccessDenied"}}, "DescribeInstanceRefreshes"
+            ),
+            False,
+        ),
+        (KeyError("Status"), False),
+    ],
+)
+def test_check_in_parallel_stops_on_permanent_errors(clock, error, retried):
+    calls = []
+
+    def predicate(target):
+        calls.append(target)
+        raise error
+
+    readiness = wait_for_condition(
+        {"a": 1}, check_in_parallel(predicate), deadline=60, description="test"
+    )
+
+    assert readiness == {"a": None}
+    assert (len(calls) > 1) is retried
+
+
+def test_check_in_parallel_raises_check_aborted():
+    def predicate(target):
+        raise ValueError("bad response")
+
+    with pytest.raises(CheckAborted, match="check on a failed: bad response"):
+        check_in_parallel(predicate)({"a": 1})
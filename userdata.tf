@@ -6,14 +6,17 @@ data "cloudinit_config" "pmm_persistent" {
   # Part 1: Bash script to handle EBS volume mounting
   part {
     content_type = "text/x-shellscript"
-    content      = templatefile("${path.module}/scripts/mount-ebs-volume.sh", {})
+    content = templatefile("${path.module}/scripts/mount-ebs-volume.sh", {
+      enable_self_monitoring = var.enable_self_monitoring
+    })
   }
 
   # Part 2: Install Docker and repositories
   part {
     content_type = "text/x-shellscript"
     content = templatefile("${path.module}/templates/install-docker.sh.tftpl", {
-      ubuntu_codename = local.ubuntu_codename
+      ubuntu_codename        = local.ubuntu_codename
+      enable_self_monitoring = var.enable_self_monitoring
     })
   }
 
@@ -21,7 +24,8 @@ data "cloudinit_config" "pmm_persistent" {
   part {
     content_type = "text/x-shellscript"
     content = templatefile("${path.module}/templates/configure-swap.sh.tftpl", {
-      instance_ram_mb = data.aws_ec2_instance_type.pmm.memory_size
+      instance_ram_mb        = data.aws_ec2_instance_type.pmm.memory_size
+      enable_self_monitoring = var.enable_self_monitoring
     })
   }
 
@@ -47,7 +51,10 @@ data "cloudinit_config" "pmm_persistent" {
                 {
                   path : "/usr/local/bin/set-pmm-password.sh"
                   permissions : "0755"
-                  content : file("${path.module}/templates/set-pmm-password.sh.tftpl")
+                  content : templatefile("${path.module}/templates/set-pmm-password.sh.tftpl", {
+                    enable_self_monitoring    = var.enable_self_monitoring
+                    enable_parallel_bootstrap = var.enable_parallel_bootstrap
+                  })
                 },
                 {
                   path : "/etc/systemd/system/pmm-server.service"
@@ -57,6 +64,7 @@ data "cloudinit_config" "pmm_persistent" {
                     disable_telemetry          = var.disable_telemetry
                     custom_query_volume_mounts = local.custom_query_volume_mounts
                     pmm_public_address         = "${var.dns_names[0]}.${data.aws_route53_zone.selected.name}"
+                    enable_parallel_bootstrap  = var.enable_parallel_bootstrap
                   })
                 },
                 {
@@ -124,6 +132,10 @@ data "cloudinit_config" "pmm_persistent" {
                   })
                 }
               ],
+              local.parallel_bootstrap_files,
+              local.self_monitoring_files,
+              local.backup_quiesce_files,
+              local.ebs_prewarm_files,
               local.custom_query_files
             )
           }
@@ -135,6 +147,12 @@ data "cloudinit_config" "pmm_persistent" {
   # Part 5: Start all services
   part {
     content_type = "text/x-shellscript"
-    content      = templatefile("${path.module}/templates/start-services.sh.tftpl", {})
+    content = templatefile("${path.module}/templates/start-services.sh.tftpl", {
+      docker_image              = local.docker_image
+      enable_parallel_bootstrap = var.enable_parallel_bootstrap
+      enable_prewarm            = var.ebs_prewarm.enabled
+      enable_self_monitoring    = var.enable_self_monitoring
+      enable_backup_quiesce     = var.backup_quiesce.enabled
+    })
   }
 }
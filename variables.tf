@@ -188,6 +188,31 @@ variable "create_initial_snapshot" {
   default     = false
 }
 
+variable "ebs_prewarm" {
+  description = <<-EOF
+    Read every block of the data volume in the background when it was created
+    from a snapshot (a restore), so PMM does not wait for blocks lazily loaded
+    from S3. The PMM data directories are read first.
+    - enabled: pre-warm restored volumes. Changing it changes the instance
+      user data, which replaces the PMM instance on the next apply (the data
+      volume is kept).
+    - max_mbps: read throughput limit, the only limit on the pre-warm reads;
+      PMM gets the rest of the volume's throughput. 0 means unlimited
+    - workers: parallel readers
+  EOF
+  type = object({
+    enabled  = optional(bool, false)
+    max_mbps = optional(number, 100)
+    workers  = optional(number, 8)
+  })
+  default = {}
+
+  validation {
+    condition     = var.ebs_prewarm.max_mbps >= 0 && var.ebs_prewarm.workers >= 1
+    error_message = "ebs_prewarm.max_mbps must be >= 0 and ebs_prewarm.workers >= 1"
+  }
+}
+
 # EC2 Configuration
 variable "enable_auto_recovery" {
   description = <<-EOF
@@ -205,6 +230,50 @@ variable "enable_detailed_monitoring" {
   default     = true
 }
 
+variable "enable_parallel_bootstrap" {
+  description = <<-EOF
+    Start Docker, the CloudWatch agent and PMM with scripts/pmm_bootstrap.py,
+    which runs each step as soon as its dependencies are ready instead of in
+    sequence with fixed sleeps. pmm-server then no longer pulls the image on
+    every restart.
+    Changing it changes the instance user data, which replaces the PMM
+    instance on the next apply (the data volume is kept).
+  EOF
+  type        = bool
+  default     = false
+}
+
+variable "enable_self_monitoring" {
+  description = <<-EOF
+    Publish PMM's own ingest load (VictoriaMetrics ingestion rate, active series,
+    slowest scrape, Query Analytics insert lag) to CloudWatch every minute and
+    alarm when it approaches the limits of the instance.
+    Also publishes the duration of each instance bootstrap phase (PMM/Boot).
+    Turning it on changes the instance user data, which replaces the PMM
+    instance on the next apply (the data volume is kept).
+  EOF
+  type        = bool
+  default     = false
+}
+
+variable "self_monitoring_thresholds" {
+  description = <<-EOF
+    Alarm thresholds for PMM self-monitoring metrics:
+    - ingestion_rate: samples per second written to VictoriaMetrics
+    - active_series: time series that received samples in the last hour
+    - scrape_duration_seconds: slowest exporter scrape in the last 5 minutes
+    - qan_insert_lag_seconds: age of the newest Query Analytics bucket
+    The defaults suit the default m5.large; raise them with instance_type.
+  EOF
+  type = object({
+    ingestion_rate          = optional(number, 50000)
+    active_series           = optional(number, 1000000)
+    scrape_duration_seconds = optional(number, 10)
+    qan_insert_lag_seconds  = optional(number, 600)
+  })
+  default = {}
+}
+
 # ALB Configuration
 variable "certificate_issuers" {
   description = <<-EOF
@@ -248,6 +317,29 @@ variable "alb_logs_bucket_force_destroy" {
   default     = false
 }
 
+variable "metrics_archive" {
+  description = <<-EOF
+    S3 bucket for long-term PMM metrics exported as Parquet with
+    pmm_tools.metrics_archive (see output metrics_archive_bucket_name):
+    - enabled: create the bucket
+    - retention_days: delete archived shards after this many days
+    - infrequent_access_days: move shards to STANDARD_IA after this many days
+    - force_destroy: allow deleting the bucket with objects (test environments)
+  EOF
+  type = object({
+    enabled                = optional(bool, false)
+    retention_days         = optional(number, 730)
+    infrequent_access_days = optional(number, 30)
+    force_destroy          = optional(bool, false)
+  })
+  default = {}
+
+  validation {
+    condition     = var.metrics_archive.infrequent_access_days >= 30 && var.metrics_archive.retention_days > var.metrics_archive.infrequent_access_days
+    error_message = "metrics_archive.infrequent_access_days must be at least 30 (S3 limit) and less than retention_days"
+  }
+}
+
 # Monitoring
 variable "alarm_emails" {
   description = <<-EOF
@@ -352,6 +444,33 @@ variable "backup_root_volume" {
   default     = false
 }
 
+variable "backup_quiesce" {
+  description = <<-EOF
+    Take the daily backup of the data volume from the PMM instance instead of
+    the backup plan: an EBS snapshot taken with the datastores flushed and
+    /srv frozen for the duration of the CreateSnapshot call
+    (application-consistent). The snapshots are kept backup_retention_days
+    days; they are EBS snapshots, not recovery points in the backup vault.
+    - enabled: replace the daily rule of the backup plan; the weekly rule stays
+    - schedule: systemd OnCalendar expression of the daily backup
+    - max_pause_seconds: timeout of the CreateSnapshot call, the longest time
+      writes are paused; the run fails without a snapshot if it expires
+    The pause is published as the PMM/Backup QuiescePause metric. With
+    enable_backup_alarms an alarm fires if a run fails or none ran for 26 hours.
+  EOF
+  type = object({
+    enabled           = optional(bool, false)
+    schedule          = optional(string, "*-*-* 05:00:00 UTC")
+    max_pause_seconds = optional(number, 30)
+  })
+  default = {}
+
+  validation {
+    condition     = var.backup_quiesce.max_pause_seconds >= 5 && var.backup_quiesce.max_pause_seconds <= 300
+    error_message = "backup_quiesce.max_pause_seconds must be between 5 and 300"
+  }
+}
+
 variable "enable_backup_alarms" {
   description = <<-EOF
     Enable CloudWatch alarms for backup failures
@@ -426,6 +545,30 @@ variable "monitored_asgs" {
     - security_group_id: Security group ID of the ASG instances (used to
       create ingress rules allowing pmm-agent to reach the PMM server
       on port 443 for gRPC)
+
+    Optional Query Analytics (QAN) tuning, under qan:
+    - query_source: "perfschema" (default), "slowlog" or "none"
+    - slow_log_rate_limit: log only 1 of every N queries to the slow log
+      (Percona Server log_slow_rate_limit; the monitoring user needs
+      SYSTEM_VARIABLES_ADMIN)
+    - slow_log_max_size_mb: slow log size at which pmm-agent rotates it
+    - disable_tablestats_limit: disable per-table statistics when the
+      server has more tables than this
+    - max_query_length: truncate query texts in QAN to this many characters
+    - disable_query_examples: do not collect query examples
+    Already registered services whose QAN settings differ are re-added
+    with the new settings on the next reconciler run; a changed
+    slow_log_rate_limit is set on their servers without re-adding them.
+
+    Optional metrics tuning, under metrics, to cut the series count and
+    PMM server CPU of large fleets:
+    - resolution: mysqld_exporter scrape intervals (high/medium/low),
+      "standard" (5s/10s/60s), "reduced" (15s/30s/120s) or "minimal"
+      (60s/120s/300s); unset keeps the PMM server's resolution
+    - disable_collectors: mysqld_exporter collectors to disable, e.g.
+      ["info_schema.tables", "perf_schema.eventsstatements"]
+    Resolutions of registered services are changed in place; services
+    whose disabled collectors differ are re-added.
   EOF
   type = list(object({
     asg_name          = string
@@ -433,6 +576,18 @@ variable "monitored_asgs" {
     port              = number
     username          = string
     security_group_id = string
+    qan = optional(object({
+      query_source             = optional(string, "perfschema")
+      slow_log_rate_limit      = optional(number)
+      slow_log_max_size_mb     = optional(number)
+      disable_tablestats_limit = optional(number)
+      max_query_length         = optional(number)
+      disable_query_examples   = optional(bool, false)
+    }), {})
+    metrics = optional(object({
+      resolution         = optional(string)
+      disable_collectors = optional(list(string), [])
+    }), {})
   }))
   default = []
 
@@ -449,6 +604,235 @@ variable "monitored_asgs" {
     ])
     error_message = "port must be between 1 and 65535"
   }
+
+  validation {
+    condition = alltrue([
+      for asg in var.monitored_asgs : contains(["perfschema", "slowlog", "none"], asg.qan.query_source)
+    ])
+    error_message = "qan.query_source must be one of: perfschema, slowlog, none"
+  }
+
+  validation {
+    condition = alltrue([
+      for asg in var.monitored_asgs : alltrue([
+        for value in [
+          asg.qan.slow_log_rate_limit,
+          asg.qan.slow_log_max_size_mb,
+          asg.qan.disable_tablestats_limit,
+          asg.qan.max_query_length,
+        ] : value == null ? true : value >= 1
+      ])
+    ])
+    error_message = "qan numeric settings must be at least 1"
+  }
+
+  validation {
+    condition = alltrue([
+      for asg in var.monitored_asgs :
+      asg.metrics.resolution == null ? true : contains(["standard", "reduced", "minimal"], asg.metrics.resolution)
+    ])
+    error_message = "metrics.resolution must be one of: standard, reduced, minimal"
+  }
+}
+
+variable "monitored_rds" {
+  description = <<-EOF
+    RDS and Aurora databases to monitor in PMM, selected by tags.
+    When non-empty, the reconciler Lambda (see monitored_asgs) lists all DB
+    instances, including Aurora cluster members, on every run and registers
+    matching ones as remote services named "rds/<name>/<db-instance-id>".
+    Services of databases that are deleted or no longer match are removed.
+
+    Each entry requires:
+    - name: Short name of the selector (lowercase letters, digits, hyphens)
+    - engine: "postgresql" (RDS PostgreSQL, Aurora PostgreSQL) or
+      "mysql" (RDS MySQL, MariaDB, Aurora MySQL)
+    - tags: Tags a DB instance must have (all of them) to be monitored
+    - credentials_secret_arn: Secrets Manager secret with "username" and
+      "password" keys, e.g. an RDS-managed master user secret. Secrets
+      encrypted with a customer managed KMS key must allow kms:Decrypt to
+      the reconciler role (output reconciler_lambda_role_arn)
+
+    Optional:
+    - database: PostgreSQL database to connect to (default "postgres")
+    - query_analytics: Enable Query Analytics via pg_stat_statements or
+      performance_schema (default true)
+
+    The PMM server connects to the databases itself; list their security
+    groups in rds_security_group_ids.
+  EOF
+  type = list(object({
+    name                   = string
+    engine                 = string
+    tags                   = map(string)
+    credentials_secret_arn = string
+    database               = optional(string, "postgres")
+    query_analytics        = optional(bool, true)
+  }))
+  default = []
+
+  validation {
+    condition = alltrue([
+      for selector in var.monitored_rds : can(regex("^[a-z0-9-]+$", selector.name))
+    ])
+    error_message = "monitored_rds name must contain only lowercase letters, digits and hyphens"
+  }
+
+  validation {
+    condition     = length(distinct([for selector in var.monitored_rds : selector.name])) == length(var.monitored_rds)
+    error_message = "monitored_rds names must be unique"
+  }
+
+  validation {
+    condition = alltrue([
+      for selector in var.monitored_rds : contains(["postgresql", "mysql"], selector.engine)
+    ])
+    error_message = "monitored_rds engine must be one of: postgresql, mysql"
+  }
+
+  validation {
+    condition = alltrue([
+      for selector in var.monitored_rds : length(selector.tags) > 0
+    ])
+    error_message = "monitored_rds tags must not be empty; an empty selector would match every database"
+  }
+}
+
+variable "pmm_client_rolling_upgrade" {
+  description = <<-EOF
+    Upgrade pmm-client on monitored ASG instances whose agent is older than
+    pmm_client_target_version, in rolling batches.
+    Progress is stored in an SSM parameter, so a rollout that does not fit into
+    one reconciler run continues on the next one.
+  EOF
+  type        = bool
+  default     = false
+}
+
+variable "pmm_client_target_version" {
+  description = <<-EOF
+    pmm-client version to keep monitored ASG instances on (e.g., "3.1.0").
+    A shorter prefix such as "3" accepts any 3.x agent.
+    If null, the PMM server version is used.
+  EOF
+  type        = string
+  default     = null
+
+  validation {
+    condition     = var.pmm_client_target_version == null ? true : can(regex("^[0-9][0-9A-Za-z.+~-]*$", var.pmm_client_target_version))
+    error_message = "pmm_client_target_version must be a version string such as 3.1.0"
+  }
+}
+
+variable "pmm_client_upgrade_batch_size" {
+  description = <<-EOF
+    Maximum number of instances upgraded at once during a rolling pmm-client upgrade
+  EOF
+  type        = number
+  default     = 1
+
+  validation {
+    condition     = var.pmm_client_upgrade_batch_size >= 1
+    error_message = "pmm_client_upgrade_batch_size must be at least 1"
+  }
+}
+
+variable "pmm_client_upgrade_max_unavailable" {
+  description = <<-EOF
+    Maximum number of upgraded agents that may be waiting to reconnect to PMM at any time.
+    No new batch starts while this many upgrades are unverified.
+  EOF
+  type        = number
+  default     = 1
+
+  validation {
+    condition     = var.pmm_client_upgrade_max_unavailable >= 1
+    error_message = "pmm_client_upgrade_max_unavailable must be at least 1"
+  }
+}
+
+variable "reconciler_gc" {
+  description = <<-EOF
+    Garbage-collect PMM nodes and pmm-agents left behind by terminated hosts
+    after every reconciler run (needs monitored_asgs or monitored_rds). A node
+    is removed with everything on it when it has no services and no connected
+    pmm-agent, or when it runs services of a monitored ASG and no EC2 instance
+    has its address any more:
+    - enabled: run the collection
+    - min_age_minutes: how long a node or pmm-agent must stay orphaned before
+      it is removed
+    - max_deletions: maximum nodes and pmm-agents removed per run
+  EOF
+  type = object({
+    enabled         = optional(bool, false)
+    min_age_minutes = optional(number, 60)
+    max_deletions   = optional(number, 50)
+  })
+  default = {}
+
+  validation {
+    condition     = var.reconciler_gc.min_age_minutes >= 10 && var.reconciler_gc.max_deletions >= 1
+    error_message = "reconciler_gc.min_age_minutes must be at least 10 and max_deletions at least 1"
+  }
+}
+
+variable "reconciler_inventory_snapshots" {
+  description = <<-EOF
+    Store a snapshot of the PMM inventory (services, nodes, agents) and of the
+    monitored ASGs' instances on every reconciler run, and log the changes since
+    the previous run. Read them with pmm_tools.churn
+    (see output inventory_snapshots_bucket_name):
+    - enabled: create the bucket and take snapshots (needs monitored_asgs or monitored_rds)
+    - retention_days: delete snapshots after this many days
+    - force_destroy: allow deleting the bucket with objects (test environments)
+  EOF
+  type = object({
+    enabled        = optional(bool, false)
+    retention_days = optional(number, 90)
+    force_destroy  = optional(bool, false)
+  })
+  default = {}
+
+  validation {
+    condition     = var.reconciler_inventory_snapshots.retention_days >= 1
+    error_message = "reconciler_inventory_snapshots.retention_days must be at least 1"
+  }
+}
+
+variable "reconciler_history" {
+  description = <<-EOF
+    Keep a history of reconciler runs (duration, per-phase timings, instances
+    checked, services added/removed, failures, SSM latency percentiles) and
+    publish it as CloudWatch metrics in the PMM/Reconciler namespace. Read the
+    trends with pmm_tools.reconciler_history (see output
+    reconciler_history_bucket_name):
+    - enabled: create the bucket, record runs and publish metrics (needs
+      monitored_asgs or monitored_rds)
+    - retention_days: delete run records after this many days
+    - timeout_alarm_percent: alarm when runs use more than this share of the
+      Lambda timeout for an hour
+    - force_destroy: allow deleting the bucket with objects (test environments)
+  EOF
+  type = object({
+    enabled               = optional(bool, false)
+    retention_days        = optional(number, 400)
+    timeout_alarm_percent = optional(number, 80)
+    force_destroy         = optional(bool, false)
+  })
+  default = {}
+
+  validation {
+    condition     = var.reconciler_history.retention_days >= 1
+    error_message = "reconciler_history.retention_days must be at least 1"
+  }
+
+  validation {
+    condition = (
+      var.reconciler_history.timeout_alarm_percent > 0
+      && var.reconciler_history.timeout_alarm_percent <= 100
+    )
+    error_message = "reconciler_history.timeout_alarm_percent must be between 1 and 100"
+  }
 }
 
 # Tags